@@ -0,0 +1,54 @@
+import argparse
+import json
+import sys
+import barcodeutils as bu
+
+#
+# Write a JSON report on how well the barcodes of whitelist files can be
+# corrected, to check new barcode sets before they are used.
+#
+# Notes:
+#   o  the whitelist files are read with load_whitelist, so they have a
+#      barcode, or an id and a barcode separated by a tab, on each line.
+#   o  the report for each file is the analyze_whitelist dict. With
+#      --matrix, it also has the barcodes and their pairwise Hamming
+#      distance matrix, which has the square of the number of barcodes
+#      entries. With --histogram_only, it has only the number of
+#      barcode pairs at each distance, which uses little memory for
+#      large whitelists.
+#
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a JSON report of the Hamming distances, correction conflicts, and expected correction yield of whitelists.')
+    parser.add_argument('whitelists', nargs='+', help='Whitelist files.')
+    parser.add_argument('--edit_distance', type=int, default=2, help='Maximum number of mismatches corrected. Default is 2.')
+    parser.add_argument('--error_rate', type=float, default=0.01, help='Substitution probability at each base for the expected yield. Default is 0.01.')
+    parser.add_argument('--max_neighbor_distance', type=int, default=3, help='Largest distance for which the neighbors of each barcode are counted. Default is 3.')
+    parser.add_argument('--matrix', action='store_true', help='Include the pairwise distance matrix (flag).')
+    parser.add_argument('--histogram_only', action='store_true', help='Report only the number of barcode pairs at each distance (flag).')
+    parser.add_argument('--output', default=None, help='Output JSON file. Default is stdout.')
+    args = parser.parse_args()
+
+    reports = {}
+    for whitelist_file in args.whitelists:
+        whitelist = bu.load_whitelist(whitelist_file)
+        if isinstance(whitelist, dict):
+            whitelist = set(whitelist.keys())
+        if args.histogram_only:
+            histogram = bu.hamming_distance_histogram(whitelist)
+            report = {'num_barcodes': len(whitelist),
+                      'distance_histogram': dict([(str(d), count) for d, count in enumerate(histogram) if count > 0])}
+        else:
+            report = bu.analyze_whitelist(whitelist, args.edit_distance, args.error_rate, args.max_neighbor_distance)
+        if args.matrix:
+            barcodes, distances = bu.pairwise_hamming_distances(whitelist)
+            report['matrix_barcodes'] = barcodes
+            report['matrix'] = distances.tolist()
+        reports[whitelist_file] = report
+
+    if args.output is None:
+        json.dump(reports, sys.stdout, indent=4)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=4)
@@ -11,6 +11,20 @@ import copy
 import math
 import re
 import glob
+import multiprocessing
+import struct
+import threading
+import zlib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 revcomp = None
@@ -32,6 +46,41 @@ BC_END = 'end'
 BC_WHITELIST = 'whitelist'
 BC_CORRECTION_MAP = 'correction_map'
 
+# correct_many encodes each base of a barcode as a base-5 digit so that a
+# barcode of up to 27 bp fits in a 64-bit integer. Barcodes of up to 11 bp
+# without N bases are looked up directly in tables indexed by the 2-bit
+# encoded barcode, which have 4^length entries.
+BATCH_BASES = 'ACGTN'
+BATCH_INVALID_CODE = 5
+BATCH_MAX_BARCODE_LENGTH = 27
+BATCH_DIRECT_MAX_BARCODE_LENGTH = 11
+
+# BarcodeCorrecter uses a split-seed index rather than the mismatch map when
+# the estimated size of the mismatch map is more than MISMATCH_MAP_MAX_BYTES.
+# A map entry takes about MISMATCH_MAP_ENTRY_BYTES plus the barcode length.
+MISMATCH_MAP = 'mismatch_map'
+SPLIT_SEED = 'split_seed'
+MISMATCH_MAP_MAX_BYTES = 1 << 30
+MISMATCH_MAP_ENTRY_BYTES = 72
+
+# IndelIndex rejects an indel candidate when the sequence is within
+# INDEL_MAX_SUBSTITUTIONS mismatches of another whitelist barcode.
+INDEL_MAX_SUBSTITUTIONS = 3
+
+# BackgroundWriter hands its buffer to the background thread when it has
+# WRITE_BUFFER_BYTES of text. Without a WriteMemoryBudget at most
+# WRITE_QUEUE_BLOCKS buffers are waiting for each writer. BGZF blocks hold
+# BGZF_BLOCK_DATA_BYTES of data, as in htslib.
+WRITE_BUFFER_BYTES = 1 << 20
+WRITE_QUEUE_BLOCKS = 4
+WRITE_MIN_BUFFER_BYTES = 1 << 16
+BGZF_BLOCK_DATA_BYTES = 65280
+BGZF_EOF = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+# Whitelist analysis computes pairwise Hamming distances in blocks of rows
+# of about HAMMING_BLOCK_BYTES.
+HAMMING_BLOCK_BYTES = 1 << 26
+
 NEXTSEQ = 'NextSeq'
 MISEQ = 'MiSeq'
 NOVASEQ = 'NovaSeq'
@@ -217,6 +266,169 @@ def construct_mismatch_to_whitelist_map(whitelist, edit_distance, allow_n=True):
 
     return mismatch_to_whitelist_map
 
+def _choose(n, k):
+    return math.factorial(n) // (math.factorial(k) * math.factorial(n - k))
+
+def estimate_mismatch_map_bytes(whitelist, edit_distance, allow_n=True):
+    """
+    Estimate the memory used by the construct_mismatch_to_whitelist_map map of a whitelist.
+
+    Args:
+        whitelist (set of str): set of whitelist sequences
+        edit_distance (int): max edit distance to consider
+        allow_n (bool): True to allow N bases and False if not
+
+    Returns:
+        int: estimated bytes
+    """
+    substitutions = 4 if allow_n else 3
+    length_counts = collections.Counter([len(sequence) for sequence in whitelist])
+    total_bytes = 0
+    for length, count in length_counts.items():
+        entries = sum([_choose(length, d) * substitutions ** d for d in range(1, min(edit_distance, length) + 1)])
+        total_bytes += count * entries * (MISMATCH_MAP_ENTRY_BYTES + length)
+    return total_bytes
+
+class SplitSeedIndex(object):
+    """
+    Whitelist index for correcting sequences without a precomputed map of all mismatches, so that its size scales with the whitelist size.
+
+    A barcode of length L is split into edit_distance + 1 segments. A sequence within edit_distance mismatches of a barcode matches at
+    least one of its segments exactly (pigeonhole principle), so the candidates are the barcodes that share a segment with the sequence.
+    The candidates are verified with hamming_distance. The results are the same as those of the construct_mismatch_to_whitelist_map map.
+    """
+    def __init__(self, whitelist, edit_distance):
+        self.whitelist = set(whitelist)
+        self.edit_distance = edit_distance
+
+        length_barcodes = {}
+        for barcode in self.whitelist:
+            length_barcodes.setdefault(len(barcode), []).append(barcode.upper())
+
+        # Barcodes no longer than the edit distance are all candidates.
+        self.groups = {}
+        for length, barcodes in length_barcodes.items():
+            barcodes = sorted(barcodes)
+            num_segments = min(edit_distance + 1, length)
+            bounds = [(length * i // num_segments, length * (i + 1) // num_segments) for i in range(num_segments)]
+            segment_maps = []
+            for start, end in bounds:
+                segment_map = {}
+                for i, barcode in enumerate(barcodes):
+                    segment_map.setdefault(barcode[start:end], []).append(i)
+                segment_maps.append(segment_map)
+            self.groups[length] = (barcodes, bounds, segment_maps, length <= edit_distance)
+
+    def correct(self, seq):
+        """
+        Returns the corrected sequence and the number of mismatches, or None and -1.
+        """
+        if seq in self.whitelist:
+            return seq, 0
+
+        group = self.groups.get(len(seq), None)
+        if group is None:
+            return None, -1
+
+        # The mismatch map has only mismatches to A, C, G, T, and N.
+        if seq.strip('ACGTN'):
+            return None, -1
+
+        barcodes, candidates = self._candidates(group, seq)
+
+        # A sequence is corrected to the barcode at the smallest distance
+        # if no other barcode is at that distance.
+        best_barcode = None
+        best_distance = self.edit_distance + 1
+        num_best = 0
+        for i in candidates:
+            distance = hamming_distance(seq, barcodes[i], capdistance=best_distance + 1)
+            if distance == 0:
+                continue
+            if distance < best_distance:
+                best_barcode = barcodes[i]
+                best_distance = distance
+                num_best = 1
+            elif distance == best_distance:
+                num_best += 1
+
+        if best_barcode is None or num_best > 1:
+            return None, -1
+        return best_barcode, best_distance
+
+    def has_neighbor(self, seq, exclude=None):
+        """
+        Returns True when seq is within edit_distance mismatches of a whitelist barcode other than exclude.
+        """
+        group = self.groups.get(len(seq), None)
+        if group is None:
+            return False
+        barcodes, candidates = self._candidates(group, seq)
+        for i in candidates:
+            if barcodes[i] != exclude and hamming_distance(seq, barcodes[i], capdistance=self.edit_distance + 1) <= self.edit_distance:
+                return True
+        return False
+
+    def _candidates(self, group, seq):
+        """
+        Returns the barcodes of the group and the indexes of those that share a segment with seq.
+        """
+        barcodes, bounds, segment_maps, all_candidates = group
+        if all_candidates:
+            return barcodes, range(len(barcodes))
+        candidates = set()
+        for (start, end), segment_map in zip(bounds, segment_maps):
+            segment_candidates = segment_map.get(seq[start:end], None)
+            if segment_candidates is not None:
+                candidates.update(segment_candidates)
+        return barcodes, candidates
+
+class IndelIndex(object):
+    """
+    Whitelist index for correcting sequences with a single-base insertion or deletion, such as index reads with phasing errors.
+
+    The sequence is read in a fixed number of cycles, so after a deletion it ends with the base that follows the barcode and after an
+    insertion the last barcode base is pushed out. Deletions are found by looking up the sequence without its last base in an index of
+    the single-base deletion variants of the whitelist (SymSpell), and insertions by looking up the single-base deletions of the sequence
+    in an index of the whitelist barcodes without their last base. When given, the flank, which is the base that follows the sequence in
+    the read, must be the last base of an insertion candidate. A sequence is corrected only when it has one candidate barcode.
+
+    A sequence with several substitutions can be a single-base indel of an unrelated barcode, so the candidate is also rejected when the
+    sequence is within max_substitutions mismatches of another whitelist barcode. These barcodes are found with a SplitSeedIndex. A
+    max_substitutions of 0 turns the check off.
+    """
+    def __init__(self, whitelist, max_substitutions=INDEL_MAX_SUBSTITUTIONS):
+        if max_substitutions < 0:
+            raise ValueError('max_substitutions must be a non-negative integer, but %s found.' % max_substitutions)
+        whitelist = list(whitelist)
+        self.substitution_index = SplitSeedIndex(whitelist, max_substitutions) if max_substitutions > 0 else None
+        self.deletion_index = {}
+        self.prefix_index = {}
+        for barcode in whitelist:
+            for i in range(len(barcode)):
+                self.deletion_index.setdefault(barcode[:i] + barcode[i + 1:], set()).add(barcode)
+            self.prefix_index.setdefault(barcode[:-1], set()).add(barcode)
+
+    def correct(self, seq, flank=None):
+        """
+        Returns the corrected sequence and 'deletion' or 'insertion', or None and None.
+        """
+        if flank == 'N':
+            flank = None
+        candidates = {}
+        for barcode in self.deletion_index.get(seq[:-1], ()):
+            candidates[barcode] = 'deletion'
+        for i in range(len(seq)):
+            for barcode in self.prefix_index.get(seq[:i] + seq[i + 1:], ()):
+                if flank is None or barcode[-1] == flank:
+                    candidates.setdefault(barcode, 'insertion')
+        if len(candidates) != 1:
+            return None, None
+        barcode, indel = list(candidates.items())[0]
+        if self.substitution_index is not None and self.substitution_index.has_neighbor(seq, barcode):
+            return None, None
+        return barcode, indel
+
 def is_dna(seq):
     """
     Tests for valid DNA sequence w.r.t. the functionality of this tool (A, T, G, C, N).
@@ -249,6 +461,159 @@ def hamming_distance(str1, str2, capdistance=None):
                 return diffs
     return diffs
 
+def _encode_barcodes(barcodes):
+    """
+    Returns a uint8 matrix of the BATCH_BASES codes of equal length barcodes.
+    """
+    lengths = set([len(barcode) for barcode in barcodes])
+    if len(lengths) != 1:
+        raise ValueError('Barcodes must have one length, but found lengths %s.' % ', '.join([str(x) for x in sorted(lengths)]))
+    barcode_length = lengths.pop()
+    table = np.full(256, BATCH_INVALID_CODE, dtype=np.uint8)
+    for code, base in enumerate(BATCH_BASES):
+        table[ord(base)] = code
+        table[ord(base.lower())] = code
+    data = np.frombuffer(''.join(barcodes).encode('ascii'), dtype=np.uint8)
+    return table[data].reshape(len(barcodes), barcode_length)
+
+def _hamming_distance_blocks(codes):
+    """
+    Yields the start row and the int32 Hamming distances of blocks of rows of the pairwise distance matrix of encoded barcodes.
+
+    The distances are the barcode length minus the number of matching bases, which are the products of one-hot encodings.
+    """
+    num_barcodes, barcode_length = codes.shape
+    num_codes = len(BATCH_BASES) + 1
+    one_hot = np.zeros((num_barcodes, barcode_length * num_codes), dtype=np.float32)
+    columns = (np.arange(barcode_length) * num_codes)[np.newaxis, :] + codes
+    one_hot[np.arange(num_barcodes)[:, np.newaxis], columns] = 1
+    block_rows = max(1, HAMMING_BLOCK_BYTES // (4 * num_barcodes))
+    for start in range(0, num_barcodes, block_rows):
+        matches = one_hot[start:start + block_rows].dot(one_hot.T)
+        yield start, barcode_length - np.rint(matches).astype(np.int32)
+
+def pairwise_hamming_distances(whitelist):
+    """
+    Compute the matrix of Hamming distances between whitelist barcodes. Requires numpy.
+
+    Args:
+        whitelist (set of str): set of whitelist sequences of one length
+
+    Returns:
+        tuple: sorted list of barcodes and int32 numpy matrix of distances in that order
+    """
+    if np is None:
+        raise ImportError('pairwise_hamming_distances requires numpy.')
+    barcodes = sorted([barcode.upper() for barcode in whitelist])
+    distances = np.empty((len(barcodes), len(barcodes)), dtype=np.int32)
+    for start, block in _hamming_distance_blocks(_encode_barcodes(barcodes)):
+        distances[start:start + len(block)] = block
+    return barcodes, distances
+
+def hamming_distance_histogram(whitelist):
+    """
+    Count the pairs of whitelist barcodes at each Hamming distance without keeping the distance matrix. Requires numpy.
+
+    Args:
+        whitelist (set of str): set of whitelist sequences of one length
+
+    Returns:
+        list of int: number of pairs at each distance from 0 to the barcode length
+    """
+    if np is None:
+        raise ImportError('hamming_distance_histogram requires numpy.')
+    codes = _encode_barcodes(sorted([barcode.upper() for barcode in whitelist]))
+    histogram = np.zeros(codes.shape[1] + 1, dtype=np.int64)
+    for start, block in _hamming_distance_blocks(codes):
+        # Count each pair once, from the row of its first barcode.
+        upper = np.arange(codes.shape[0])[np.newaxis, :] > np.arange(start, start + len(block))[:, np.newaxis]
+        histogram += np.bincount(block[upper], minlength=len(histogram))
+    return [int(count) for count in histogram]
+
+def _mismatch_templates(barcode_length, num_mismatches):
+    """
+    Returns the positions and base code offsets of the mismatches made by generate_mismatches with allow_n=True.
+    """
+    positions = np.array(list(itertools.combinations(range(barcode_length), num_mismatches)), dtype=np.intp)
+    offsets = np.array(list(itertools.product(range(1, len(BATCH_BASES)), repeat=num_mismatches)), dtype=np.uint8)
+    return np.repeat(positions, len(offsets), axis=0), np.tile(offsets, (len(positions), 1))
+
+def analyze_whitelist(whitelist, edit_distance=2, error_rate=0.01, max_neighbor_distance=3):
+    """
+    Describe how well a whitelist can be corrected. Requires numpy.
+
+    Args:
+        whitelist (set of str): set of whitelist sequences of one length
+        edit_distance (int): max edit distance of correction
+        error_rate (float): probability of a substitution at each base, to one of the three other bases
+        max_neighbor_distance (int): largest distance for which the neighbors of each barcode are counted
+
+    Returns:
+        dict: whitelist summary with the pair distance histogram and the expected yield, and a list of per-barcode dicts with
+              the number of other barcodes at each distance up to max_neighbor_distance (neighbors), the number of the
+              mismatch sequences within edit_distance of the barcode that are not corrected to it because another barcode
+              is as close or closer (conflicting_mismatches), which construct_mismatch_to_whitelist_map drops or maps to the
+              other barcode, and the expected fraction of reads of the barcode corrected to it (expected_yield).
+    """
+    if np is None:
+        raise ImportError('analyze_whitelist requires numpy.')
+    if not 0 <= error_rate <= 1:
+        raise ValueError('Error rate must be between 0 and 1, but %s found.' % error_rate)
+
+    barcodes = sorted(set([barcode.upper() for barcode in whitelist]))
+    codes = _encode_barcodes(barcodes)
+    num_barcodes, barcode_length = codes.shape
+    max_level = min(edit_distance, barcode_length)
+    templates = [_mismatch_templates(barcode_length, level) for level in range(1, max_level + 1)]
+    # Probability of each read sequence with a given number of substitutions.
+    sequence_probabilities = [(1 - error_rate) ** (barcode_length - level) * (error_rate / 3.0) ** level for level in range(max_level + 1)]
+
+    histogram = np.zeros(barcode_length + 1, dtype=np.int64)
+    barcode_reports = []
+    for start, block in _hamming_distance_blocks(codes):
+        upper = np.arange(num_barcodes)[np.newaxis, :] > np.arange(start, start + len(block))[:, np.newaxis]
+        histogram += np.bincount(block[upper], minlength=len(histogram))
+        for row, distances in enumerate(block):
+            i = start + row
+            counts = np.bincount(distances, minlength=barcode_length + 1)
+            counts[0] -= 1
+            # Only barcodes within twice the edit distance share mismatch sequences.
+            close = np.flatnonzero(distances <= 2 * max_level)
+            others = codes[close[close != i]]
+
+            conflicting_mismatches = {}
+            expected_yield = sequence_probabilities[0]
+            for level, (positions, offsets) in enumerate(templates, 1):
+                rows = np.arange(len(positions))[:, np.newaxis]
+                variants = np.repeat(codes[i][np.newaxis, :], len(positions), axis=0)
+                variants[rows, positions] = (variants[rows, positions] + offsets) % len(BATCH_BASES)
+                if len(others) > 0:
+                    kept = ((variants[:, np.newaxis, :] != others[np.newaxis, :, :]).sum(axis=2) > level).all(axis=1)
+                else:
+                    kept = np.ones(len(variants), dtype=bool)
+                no_n = (variants[rows, positions] != BATCH_BASES.index('N')).all(axis=1)
+                conflicting_mismatches[str(level)] = int(len(variants) - kept.sum())
+                expected_yield += sequence_probabilities[level] * int((kept & no_n).sum())
+
+            nonzero = np.flatnonzero(counts[1:])
+            barcode_reports.append({'barcode': barcodes[i],
+                                    'min_distance': int(nonzero[0] + 1) if len(nonzero) > 0 else None,
+                                    'neighbors': dict([(str(d), int(counts[d])) for d in range(1, min(max_neighbor_distance, barcode_length) + 1)]),
+                                    'conflicting_mismatches': conflicting_mismatches,
+                                    'expected_yield': expected_yield})
+
+    nonzero = np.flatnonzero(histogram[1:])
+    max_yield = sum([_choose(barcode_length, level) * 3 ** level * sequence_probabilities[level] for level in range(max_level + 1)])
+    return {'num_barcodes': num_barcodes,
+            'barcode_length': barcode_length,
+            'edit_distance': edit_distance,
+            'error_rate': error_rate,
+            'min_distance': int(nonzero[0] + 1) if len(nonzero) > 0 else None,
+            'distance_histogram': dict([(str(d), int(count)) for d, count in enumerate(histogram) if count > 0]),
+            'expected_yield': sum([report['expected_yield'] for report in barcode_reports]) / max(num_barcodes, 1),
+            'max_expected_yield': max_yield,
+            'barcodes': barcode_reports}
+
 def reverse_complement(seq):
     return seq.translate(revcomp)[::-1]
 
@@ -405,11 +770,10 @@ class WriteBuffer:
         self.buffer_size = buffer_size
         self.lines = []
     def write(self, text):
+        self.lines.append(text)
         if len(self.lines) >= self.buffer_size:
             self.file_handle.write(''.join(self.lines))
             self.lines = []
-        else:
-            self.lines.append(text)
     def __enter__(self):
         return self
     def __exit__(self, type, value, traceback):
@@ -417,8 +781,187 @@ class WriteBuffer:
             self.file_handle.write(''.join(self.lines))
         self.file_handle.close()
 
+def bgzf_compress(data, compresslevel=6):
+    """
+    Compress data as BGZF blocks, which are gzip members that can be read by gzip and indexed by htslib.
+
+    Args:
+        data (bytes): data to compress
+        compresslevel (int): zlib compression level
+
+    Returns:
+        bytes: BGZF blocks without the BGZF end of file block
+    """
+    blocks = []
+    for start in range(0, len(data), BGZF_BLOCK_DATA_BYTES):
+        block_data = data[start:start + BGZF_BLOCK_DATA_BYTES]
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+        compressed = compressor.compress(block_data) + compressor.flush()
+        # The BSIZE field is the block size minus one: an 18 byte header,
+        # the compressed data, and an 8 byte CRC32 and data size trailer.
+        blocks.append(struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2, len(compressed) + 25))
+        blocks.append(compressed)
+        blocks.append(struct.pack('<II', zlib.crc32(block_data) & 0xffffffff, len(block_data)))
+    return b''.join(blocks)
+
+class WriteMemoryBudget(object):
+    """
+    Memory budget shared by BackgroundWriters.
+
+    Half of the budget is divided among the open writers for their buffers, and the other half limits the buffers that are
+    waiting for or in the background threads. A writer waits for the background threads when the budget is used up.
+    """
+    def __init__(self, max_bytes):
+        if max_bytes <= 0:
+            raise ValueError('Memory budget must be a positive number of bytes, but %s found.' % max_bytes)
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.num_writers = 0
+        self.writer_buffer_bytes = WRITE_BUFFER_BYTES
+        self.condition = threading.Condition()
+
+    def register(self):
+        with self.condition:
+            self.num_writers += 1
+            self._set_writer_buffer_bytes()
+
+    def unregister(self):
+        with self.condition:
+            self.num_writers -= 1
+            self._set_writer_buffer_bytes()
+
+    def _set_writer_buffer_bytes(self):
+        self.writer_buffer_bytes = max(WRITE_MIN_BUFFER_BYTES, min(WRITE_BUFFER_BYTES, self.max_bytes // (2 * max(self.num_writers, 1))))
+
+    def acquire(self, num_bytes):
+        """
+        Wait until num_bytes more of the budget are free and take them. A buffer larger than the budget waits until no others are in use.
+        """
+        with self.condition:
+            while self.used_bytes > 0 and self.used_bytes + num_bytes > self.max_bytes // 2:
+                self.condition.wait()
+            self.used_bytes += num_bytes
+
+    def release(self, num_bytes):
+        with self.condition:
+            self.used_bytes -= num_bytes
+            self.condition.notify_all()
+
+class BackgroundWriter(object):
+    """
+    Buffered text file writer that compresses and writes full buffers in a background thread, so that compression overlaps with the caller.
+
+    The buffer size is counted in bytes of text. Writes are never dropped. An error in the background thread is raised by the next call
+    to write, flush, or close. The compression is 'gzip', 'bgzf', or 'none', and the default is 'gzip' for file names that end in .gz
+    and 'none' otherwise. With a WriteMemoryBudget, the buffer size and the buffers waiting for the background threads of all writers
+    that share the budget are limited by the budget.
+    """
+    def __init__(self, file_name, compression=None, buffer_bytes=WRITE_BUFFER_BYTES, compresslevel=6, budget=None):
+        if compression is None:
+            compression = 'gzip' if file_name.endswith('.gz') else 'none'
+        if compression not in ('gzip', 'bgzf', 'none'):
+            raise ValueError('Compression must be gzip, bgzf, or none, but %s found.' % compression)
+        if buffer_bytes <= 0:
+            raise ValueError('Buffer size must be a positive number of bytes, but %s found.' % buffer_bytes)
+
+        self.file_name = file_name
+        self.compression = compression
+        self.buffer_bytes = buffer_bytes
+        self.compresslevel = compresslevel
+        self.budget = budget
+        self.lines = []
+        self.buffered_bytes = 0
+        self.queue = None
+        self.thread = None
+        self.error = None
+        self.compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 31) if compression == 'gzip' else None
+        self.file_handle = open(file_name, 'wb')
+        if budget is not None:
+            budget.register()
+
+    def write(self, text):
+        self.lines.append(text)
+        self.buffered_bytes += len(text)
+        if self.buffered_bytes >= (self.budget.writer_buffer_bytes if self.budget is not None else self.buffer_bytes):
+            self.flush()
+
+    def flush(self):
+        """
+        Hand the buffered text to the background thread.
+        """
+        if self.error is not None:
+            raise self.error
+        if len(self.lines) == 0:
+            return
+        data = ''.join(self.lines).encode('utf-8')
+        self.lines = []
+        self.buffered_bytes = 0
+
+        if self.thread is None:
+            self.queue = queue.Queue(maxsize=0 if self.budget is not None else WRITE_QUEUE_BLOCKS)
+            self.thread = threading.Thread(target=self._write_blocks)
+            self.thread.daemon = True
+            self.thread.start()
+        if self.budget is not None:
+            self.budget.acquire(len(data))
+        self.queue.put(data)
+
+    def _compress(self, data):
+        if self.compression == 'gzip':
+            return self.compressor.compress(data)
+        if self.compression == 'bgzf':
+            return bgzf_compress(data, self.compresslevel)
+        return data
+
+    def _write_blocks(self):
+        """
+        Background thread loop, which ends at a None block.
+        """
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            try:
+                # After an error, the blocks are dropped so that the
+                # writer does not wait for the thread.
+                if self.error is None:
+                    self.file_handle.write(self._compress(data))
+            except Exception as error:
+                self.error = error
+            finally:
+                if self.budget is not None:
+                    self.budget.release(len(data))
+
+    def close(self):
+        if self.file_handle.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            if self.thread is not None:
+                self.queue.put(None)
+                self.thread.join()
+            try:
+                if self.error is None:
+                    if self.compression == 'gzip':
+                        self.file_handle.write(self.compressor.flush())
+                    elif self.compression == 'bgzf':
+                        self.file_handle.write(BGZF_EOF)
+            finally:
+                self.file_handle.close()
+                if self.budget is not None:
+                    self.budget.unregister()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
 class BarcodeCorrecter:
-    def __init__(self, whitelist, edit_distance=1, variable_lengths=False):
+    def __init__(self, whitelist, edit_distance=1, variable_lengths=False, backend=None, indels=False):
         if not isinstance(whitelist, set) and not isinstance(whitelist, dict) and not isinstance(whitelist, list) and not isinstance(whitelist, str):
             raise ValueError('Whitelist argument must be a list, a set, a string, or a dict.')
 
@@ -447,19 +990,296 @@ class BarcodeCorrecter:
 
         self.whitelist = whitelist
         self.edit_distance = edit_distance
-        self.mismatch_map = construct_mismatch_to_whitelist_map(self.whitelist, self.edit_distance)
 
-    def correct(self, seq):
-        for i in range(0, self.edit_distance + 1):
-            corrected = self.mismatch_map[i].get(seq, None)
+        # The mismatch map is used unless it would be too large.
+        if backend is None:
+            if estimate_mismatch_map_bytes(self.whitelist, self.edit_distance) <= MISMATCH_MAP_MAX_BYTES:
+                backend = MISMATCH_MAP
+            else:
+                backend = SPLIT_SEED
+        if backend not in (MISMATCH_MAP, SPLIT_SEED):
+            raise ValueError('Backend must be %s, %s, or None, but %s found.' % (MISMATCH_MAP, SPLIT_SEED, backend))
+        self.backend = backend
+        self.mismatch_map = None
+        self.split_seed_index = None
+        if backend == MISMATCH_MAP:
+            self.mismatch_map = construct_mismatch_to_whitelist_map(self.whitelist, self.edit_distance)
+        else:
+            self.split_seed_index = SplitSeedIndex(self.whitelist, self.edit_distance)
+
+        # Sequences that fail mismatch correction are corrected for a
+        # single-base indel when indels is True.
+        self.indel_index = IndelIndex(self.whitelist) if indels else None
+
+    def correct(self, seq, flank=None):
+        if self.mismatch_map is None:
+            corrected = self.split_seed_index.correct(seq)[0]
+        else:
+            for i in range(0, self.edit_distance + 1):
+                corrected = self.mismatch_map[i].get(seq, None)
+                if corrected is not None:
+                    break
+
+        if corrected is None and self.indel_index is not None:
+            corrected = self.indel_index.correct(seq, flank)[0]
+
+        if corrected is not None and self.id_lookup:
+            return self.id_lookup[corrected]
+        return corrected
 
+    def _correct_with_distance(self, seq, flank=None):
+        """
+        Returns the corrected sequence and the number of mismatches, or None and -1. An indel correction has distance 1.
+        """
+        if self.mismatch_map is None:
+            corrected, distance = self.split_seed_index.correct(seq)
+        else:
+            corrected, distance = None, -1
+            for i in range(0, self.edit_distance + 1):
+                corrected = self.mismatch_map[i].get(seq, None)
+                if corrected is not None:
+                    distance = i
+                    break
+        if corrected is None and self.indel_index is not None:
+            corrected = self.indel_index.correct(seq, flank)[0]
             if corrected is not None:
-                if self.id_lookup:
-                    return self.id_lookup[corrected]
-                else:
-                    return corrected
+                distance = 1
+        return corrected, distance
+
+    def _build_batch_tables(self):
+        """
+        Build the integer-encoded tables used by correct_many.
+        """
+        if np is None:
+            raise ImportError('correct_many requires numpy.')
+
+        lengths = set([len(barcode) for barcode in self.whitelist])
+        if len(lengths) != 1:
+            raise ValueError('correct_many requires a whitelist with barcodes of one length, but found lengths %s.' % ', '.join([str(x) for x in sorted(lengths)]))
+        barcode_length = lengths.pop()
+        if barcode_length > BATCH_MAX_BARCODE_LENGTH:
+            raise ValueError('correct_many supports barcodes up to %s bp, but found %s bp barcodes.' % (BATCH_MAX_BARCODE_LENGTH, barcode_length))
+
+        # Lower edit distances take priority, as in correct.
+        whitelist = sorted(self.whitelist)
+        whitelist_ids = dict([(barcode, i) for i, barcode in enumerate(whitelist)])
+        combined = {}
+        for i in range(self.edit_distance, -1, -1):
+            for mismatch, corrected in self.mismatch_map[i].items():
+                combined[mismatch] = (whitelist_ids[corrected], i)
+
+        # Sequences with bases other than ACGTN, such as lower case bases,
+        # are never in the encoded tables. They are corrected one at a time.
+        mismatches = sorted([mismatch for mismatch in combined if is_dna(mismatch) and mismatch == mismatch.upper()])
+        ids = np.array([combined[mismatch][0] for mismatch in mismatches], dtype=np.int32)
+        distances = np.array([combined[mismatch][1] for mismatch in mismatches], dtype=np.int8)
+
+        base_codes = np.full(256, BATCH_INVALID_CODE, dtype=np.uint8)
+        for code, base in enumerate(BATCH_BASES):
+            base_codes[ord(base)] = code
+        encoded = base_codes[np.frombuffer(''.join(mismatches).encode('ascii'), dtype=np.uint8).reshape(len(mismatches), barcode_length)]
+        powers = len(BATCH_BASES) ** np.arange(barcode_length - 1, -1, -1, dtype=np.int64)
+        keys = encoded.astype(np.int64).dot(powers)
+        order = np.argsort(keys)
+
+        tables = {
+            'barcode_length': barcode_length,
+            'whitelist': whitelist,
+            'base_codes': base_codes,
+            'powers': powers,
+            'keys': keys[order],
+            'ids': ids[order],
+            'distances': distances[order],
+            'direct_ids': None,
+            'direct_distances': None
+        }
+
+        if barcode_length <= BATCH_DIRECT_MAX_BARCODE_LENGTH:
+            # The direct tables are indexed by 2 bits for each base. Two
+            # bases are encoded at a time from the 16-bit value of a pair
+            # of bytes, with 0xff for a pair with a base other than ACGT.
+            pair_codes = np.full(65536, 0xff, dtype=np.uint8)
+            for code_1, base_1 in enumerate(BATCH_BASES[:4]):
+                for code_2, base_2 in enumerate(BATCH_BASES[:4]):
+                    pair_codes[np.frombuffer((base_1 + base_2).encode('ascii'), dtype=np.uint16)[0]] = code_1 * 4 + code_2
+            tables['pair_codes'] = pair_codes
+
+            acgt = (encoded < 4).all(axis=1)
+            direct_keys = self._pack_2bit(np.ascontiguousarray(np.frombuffer(''.join(mismatches).encode('ascii'), dtype=np.uint8).reshape(len(mismatches), barcode_length)[acgt]), tables)[0]
+            tables['direct_ids'] = np.full(4 ** barcode_length, -1, dtype=np.int32)
+            tables['direct_distances'] = np.full(4 ** barcode_length, -1, dtype=np.int8)
+            tables['direct_ids'][direct_keys] = ids[acgt]
+            tables['direct_distances'][direct_keys] = distances[acgt]
+
+        if self.id_lookup:
+            values = [self.id_lookup[barcode] for barcode in whitelist]
+        else:
+            values = whitelist
+        tables['corrected_values'] = np.empty(len(whitelist) + 1, dtype=object)
+        tables['corrected_values'][:len(whitelist)] = values
+        tables['corrected_values'][len(whitelist)] = None
 
-        return None
+        self._batch_tables = tables
+        return tables
+
+    @staticmethod
+    def _pack_2bit(matrix, tables):
+        """
+        Returns the 2-bit encoded keys of the rows of a uint8 base matrix
+        and a bool array that is True for rows with a base other than ACGT.
+        """
+        num_rows, barcode_length = matrix.shape
+        num_pairs = barcode_length // 2
+        keys = np.zeros(num_rows, dtype=np.uint32)
+        flags = np.zeros(num_rows, dtype=np.uint8)
+        if num_pairs > 0:
+            pair_matrix = matrix
+            if barcode_length % 2 == 1:
+                pair_matrix = np.ascontiguousarray(matrix[:, :barcode_length - 1])
+            elif not pair_matrix.flags['C_CONTIGUOUS']:
+                pair_matrix = np.ascontiguousarray(pair_matrix)
+            pairs = pair_matrix.reshape(-1).view(np.uint16).reshape(num_rows, num_pairs)
+            for column in range(num_pairs):
+                codes = tables['pair_codes'][pairs[:, column]]
+                keys <<= 4
+                keys |= codes & 0xf
+                flags |= codes
+        if barcode_length % 2 == 1:
+            codes = tables['base_codes'][matrix[:, barcode_length - 1]]
+            keys <<= 2
+            keys |= codes & 0x3
+            flags |= np.where(codes < 4, 0, 0xff).astype(np.uint8)
+        return keys, flags == 0xff
+
+    def _encode_batch(self, seqs, barcode_length):
+        """
+        Returns a uint8 matrix with one row of bases for each sequence and
+        a bool array that is True for sequences of the wrong length.
+        """
+        if isinstance(seqs, (bytes, bytearray, memoryview)):
+            matrix = np.frombuffer(seqs, dtype=np.uint8)
+            if len(matrix) % barcode_length != 0:
+                raise ValueError('Buffer length %s is not a multiple of the barcode length %s.' % (len(matrix), barcode_length))
+            matrix = matrix.reshape(-1, barcode_length)
+            return matrix, np.zeros(len(matrix), dtype=bool)
+
+        if isinstance(seqs, np.ndarray) and seqs.dtype == np.uint8 and seqs.ndim == 2:
+            if seqs.shape[1] != barcode_length:
+                raise ValueError('Array has %s columns, but the barcode length is %s.' % (seqs.shape[1], barcode_length))
+            return seqs, np.zeros(len(seqs), dtype=bool)
+
+        if isinstance(seqs, np.ndarray) and seqs.dtype.kind == 'S' and seqs.dtype.itemsize == barcode_length:
+            matrix = np.ascontiguousarray(seqs).reshape(-1).view(np.uint8).reshape(-1, barcode_length)
+            # Shorter sequences are padded with null bytes.
+            return matrix, matrix[:, barcode_length - 1] == 0
+
+        # One extra column shows sequences that are too long.
+        matrix = np.asarray(seqs, dtype='S%d' % (barcode_length + 1)).reshape(-1).view(np.uint8).reshape(-1, barcode_length + 1)
+        wrong_length = (matrix[:, barcode_length] != 0) | (matrix[:, barcode_length - 1] == 0)
+        return matrix[:, :barcode_length], wrong_length
+
+    def _correct_many_loop(self, seqs, return_ids):
+        """
+        correct_many for the split-seed backend and indel correction, which correct the sequences one at a time.
+        """
+        if np is None:
+            raise ImportError('correct_many requires numpy.')
+
+        if isinstance(seqs, (bytes, bytearray, memoryview)):
+            barcode_length = self.get_barcode_length()
+            data = bytes(seqs)
+            if len(data) % barcode_length != 0:
+                raise ValueError('Buffer length %s is not a multiple of the barcode length %s.' % (len(data), barcode_length))
+            seqs = [data[i:i + barcode_length].decode('ascii', 'replace') for i in range(0, len(data), barcode_length)]
+        elif isinstance(seqs, np.ndarray) and seqs.dtype == np.uint8 and seqs.ndim == 2:
+            seqs = [row.tobytes().decode('ascii', 'replace') for row in seqs]
+        elif isinstance(seqs, np.ndarray) and seqs.dtype.kind == 'S':
+            seqs = [seq.decode('ascii', 'replace') for seq in seqs.reshape(-1)]
+        else:
+            seqs = [str(seq) for seq in seqs]
+
+        whitelist = sorted(self.whitelist)
+        whitelist_ids = dict([(barcode, i) for i, barcode in enumerate(whitelist)])
+        ids = np.full(len(seqs), -1, dtype=np.int32)
+        distances = np.full(len(seqs), -1, dtype=np.int8)
+        for i, seq in enumerate(seqs):
+            corrected, distance = self._correct_with_distance(seq)
+            if corrected is not None:
+                ids[i] = whitelist_ids[corrected]
+                distances[i] = distance
+        if return_ids:
+            return ids, distances
+
+        if self.id_lookup:
+            values = [self.id_lookup[barcode] for barcode in whitelist]
+        else:
+            values = whitelist
+        corrected_values = np.empty(len(whitelist) + 1, dtype=object)
+        corrected_values[:len(whitelist)] = values
+        corrected_values[len(whitelist)] = None
+        return corrected_values[ids], distances
+
+    def correct_many(self, seqs, return_ids=False):
+        """
+        Correct many sequences at once with vectorized table lookups. Requires numpy.
+
+        Args:
+            seqs: list of str, numpy array of fixed-width bytes (dtype S<barcode length>) or of uint8 base rows, or a bytes buffer of concatenated fixed-width sequences
+            return_ids (bool): True to return whitelist ids, which index sorted(self.whitelist), rather than corrected barcodes
+
+        Returns:
+            numpy.ndarray: corrected barcodes (object array, None for sequences that are not corrected, id_lookup values if the whitelist has ids) or int32 whitelist ids (-1 for sequences that are not corrected)
+            numpy.ndarray: int8 mismatch distances (-1 for sequences that are not corrected)
+        """
+        if self.mismatch_map is None or self.indel_index is not None:
+            return self._correct_many_loop(seqs, return_ids)
+
+        tables = getattr(self, '_batch_tables', None)
+        if tables is None:
+            tables = self._build_batch_tables()
+        barcode_length = tables['barcode_length']
+
+        matrix, wrong_length = self._encode_batch(seqs, barcode_length)
+        ids = np.full(len(matrix), -1, dtype=np.int32)
+        distances = np.full(len(matrix), -1, dtype=np.int8)
+
+        # Sequences of ACGT bases are looked up in the direct tables when
+        # they exist. The other sequences are looked up in the sorted
+        # base-5 keys or, when they have other bases, one at a time.
+        if tables['direct_ids'] is not None:
+            keys, other_rows = self._pack_2bit(matrix, tables)
+            other_rows |= wrong_length
+            ids = tables['direct_ids'][keys]
+            distances = tables['direct_distances'][keys]
+            other_rows = np.nonzero(other_rows)[0]
+            ids[other_rows] = -1
+            distances[other_rows] = -1
+        else:
+            other_rows = np.arange(len(matrix))
+        other_rows = other_rows[~wrong_length[other_rows]]
+
+        if len(other_rows) > 0:
+            codes = tables['base_codes'][matrix[other_rows]]
+            other_bases = (codes == BATCH_INVALID_CODE).any(axis=1)
+            sorted_rows = other_rows[~other_bases]
+            keys = codes[~other_bases].astype(np.int64).dot(tables['powers'])
+            positions = np.searchsorted(tables['keys'], keys)
+            positions[positions == len(tables['keys'])] = 0
+            found = tables['keys'][positions] == keys
+            ids[sorted_rows] = np.where(found, tables['ids'][positions], -1)
+            distances[sorted_rows] = np.where(found, tables['distances'][positions], -1)
+
+            if other_bases.any():
+                whitelist_ids = dict([(barcode, i) for i, barcode in enumerate(tables['whitelist'])])
+                for row in other_rows[other_bases]:
+                    corrected, distance = self._correct_with_distance(matrix[row].tobytes().decode('ascii', 'replace'))
+                    if corrected is not None:
+                        ids[row] = whitelist_ids[corrected]
+                        distances[row] = distance
+
+        if return_ids:
+            return ids, distances
+        return tables['corrected_values'][ids], distances
 
     def get_min_hamming(self, n=1):
         """
@@ -470,17 +1290,15 @@ class BarcodeCorrecter:
         if n <= 0:
              raise ValueError('n argument must be a positive int, but %s found.' % n)
 
-        hamming_distances = []
-        observed_pairs = set()
-        for barcode in self.whitelist:
-            for other_barcode in self.whitelist:
-                pair = tuple(sorted([barcode, other_barcode]))
-
-                if barcode == other_barcode or pair in observed_pairs:
-                    continue
-                observed_pairs.add(pair)
-                hamming_distances.append(hamming_distance(barcode, other_barcode))
+        # The numpy histogram does not distinguish lower and upper case bases.
+        lengths = set([len(barcode) for barcode in self.whitelist])
+        if np is not None and len(lengths) == 1 and all([barcode == barcode.upper() for barcode in self.whitelist]):
+            hamming_distances = []
+            for distance, count in enumerate(hamming_distance_histogram(self.whitelist)):
+                hamming_distances.extend([distance] * min(count, n - len(hamming_distances)))
+            return hamming_distances
 
+        hamming_distances = [hamming_distance(barcode, other_barcode) for barcode, other_barcode in itertools.combinations(self.whitelist, 2)]
         return sorted(hamming_distances)[0:n]
 
     def get_barcode_length(self):
@@ -520,9 +1338,57 @@ def _validate_barcode_read_pair(read_seq, bc_end):
     if bc_end > len(read_seq):
         raise ValueError('Requested region extends beyond end of %s bp long read.' % (len(read_seq)))
 
-def parse_fastq_barcodes(r1, r2=None, spec=None, reverse_i5=False, edit_distance=2):
-    spec = copy.deepcopy(spec)
+class BarcodeRecord(object):
+    """
+    Barcodes and reads of one read (pair) from parse_fastq_barcodes.
+    Values are accessed by key like a dict, for example record['umi'] or record['r1_seq'].
+    """
+    __slots__ = ('_fields', '_values')
+
+    def __init__(self, fields, values):
+        self._fields = fields
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._fields[key]]
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def get(self, key, default=None):
+        index = self._fields.get(key)
+        if index is None:
+            return default
+        return self._values[index]
+
+    def keys(self):
+        return list(self._fields)
+
+    def values(self):
+        return list(self._values)
 
+    def items(self):
+        return list(zip(self._fields, self._values))
+
+    def to_dict(self):
+        return dict(zip(self._fields, self._values))
+
+    def __repr__(self):
+        return 'BarcodeRecord(%s)' % self.to_dict()
+
+def _compile_barcode_spec(spec, r2_provided, edit_distance):
+    """
+    Validate a spec and set up the correcters for barcodes with whitelists.
+
+    Returns:
+        list: (barcode, read, start, end, correct) tuples in spec order, where correct is the bound BarcodeCorrecter.correct method or None
+    """
     if not spec:
         raise ValueError('spec is a required argument and may not be None.')
     valid_spec, error = validate_barcode_spec(spec)
@@ -530,118 +1396,365 @@ def parse_fastq_barcodes(r1, r2=None, spec=None, reverse_i5=False, edit_distance
     if not valid_spec:
         raise ValueError(error)
 
-    # Validate requested reads    
+    # Validate requested reads
     requested_reads = set([spec[barcode][BC_READ] for barcode in spec])
 
-    if not r2 and R2 in requested_reads:
+    if not r2_provided and R2 in requested_reads:
         raise ValueError('%s requested but r2 not provided as an argument to parser...' % R2)
 
     # Spec is valid and r1/r2 valid, set up any whitelists
+    compiled_spec = []
     for barcode in spec:
+        correct = None
         if BC_WHITELIST in spec[barcode]:
-            spec[barcode][BC_CORRECTION_MAP] = BarcodeCorrecter(spec[barcode][BC_WHITELIST], edit_distance=edit_distance)
+            correcter = BarcodeCorrecter(spec[barcode][BC_WHITELIST], edit_distance=edit_distance)
 
             # Also, make sure requested length is in-line with their specified start and end 
             barcode_length = (spec[barcode][BC_END] - spec[barcode][BC_START] + 1)
-            whitelist_length = spec[barcode][BC_CORRECTION_MAP].get_barcode_length()
+            whitelist_length = correcter.get_barcode_length()
             if barcode_length != whitelist_length:
                 raise ValueError('The barcodes specified in your whitelist are not the same length as the requested region for barcode %s, %s to %s (length: %s; whitelist length: %s).' % (barcode, BC_START, BC_END, barcode_length, whitelist_length))
+            correct = correcter.correct
+        compiled_spec.append((barcode, spec[barcode][BC_READ], spec[barcode][BC_START], spec[barcode][BC_END], correct))
+    return compiled_spec
+
+def _name_slice(start, end):
+    """
+    Slice of the read name from negative start and end offsets, where an end of 0 is the end of the name.
+    """
+    return slice(start, end if end < 0 else None)
+
+def _compile_extractors(compiled_spec, r1_name, r1_seq, r2_seq, reverse_i5, i1_seq=None, i2_seq=None):
+    """
+    Compile the extractor operations from the first read, which sets the index coordinates and read lengths that are checked.
+    With index reads, the i7 and i5 barcodes are sliced from the I1 and I2 sequences rather than from the R1 name.
+
+    Returns:
+        tuple: (source, slice, reverse, correct) tuples in spec order, where source is 0 for the R1 name, 1 for the R1 sequence,
+               2 for the R2 sequence, 3 for the I1 sequence, and 4 for the I2 sequence
+    """
+    index_reads = i1_seq is not None or i2_seq is not None
+    requested_reads = set([bc_read for barcode, bc_read, bc_start, bc_end, correct in compiled_spec])
+    index_start, i7_start, i7_end, i5_start, i5_end = None, None, None, None, None
+    if not index_reads and (I7 in requested_reads or I5 in requested_reads):
+        index_start, i7_start, i7_end, i5_start, i5_end = _get_index_coords(r1_name)
+
+    extractors = []
+    for barcode, bc_read, bc_start, bc_end, correct in compiled_spec:
+        bc_start = bc_start - 1
+        reverse = False
+
+        if index_reads and bc_read in (I5, I7):
+            index_seq = i2_seq if bc_read == I5 else i1_seq
+            if index_seq is None:
+                raise ValueError('Spec requests %s read in barcode %s, but the %s index read file is not provided.' % (bc_read.upper(), barcode, 'I2' if bc_read == I5 else 'I1'))
+            _validate_barcode_read_pair(index_seq, bc_end)
+            source = 4 if bc_read == I5 else 3
+            if bc_read == I5 and reverse_i5:
+                barcode_slice, reverse = _name_slice(-bc_end, -bc_start), True
+            else:
+                barcode_slice = slice(bc_start, bc_end)
+
+        elif bc_read == I5:
+            if i5_start is None or i5_end is None:
+                raise ValueError('Spec requests I5 read in barcode %s, but i5 index not found in r1 name %s.' % (barcode, r1_name))
+            _validate_barcode_read_pair(r1_name[index_start:][i5_start:i5_end], bc_end)
+
+            # The i5 index is at the end of the name so the reverse
+            # complemented barcode is the reverse complement of the bases
+            # at the same offsets from the end of the name.
+            if reverse_i5:
+                source, barcode_slice, reverse = 0, _name_slice(-bc_end, -bc_start), True
+            else:
+                offset = index_start + i5_start
+                source, barcode_slice = 0, _name_slice(offset + bc_start, offset + bc_end)
+
+        elif bc_read == I7:
+            if i7_start is None or i7_end is None:
+                raise ValueError('Spec requests I7 read in barcode %s, but no index is found in the r1 name %s.' % (barcode, r1_name))
+            _validate_barcode_read_pair(r1_name[index_start:][i7_start:i7_end], bc_end)
+            offset = index_start + i7_start
+            source, barcode_slice = 0, _name_slice(offset + bc_start, offset + bc_end)
+
+        elif bc_read == R1:
+            _validate_barcode_read_pair(r1_seq, bc_end)
+            source, barcode_slice = 1, slice(bc_start, bc_end)
+
+        elif bc_read == R2:
+            _validate_barcode_read_pair(r2_seq, bc_end)
+            source, barcode_slice = 2, slice(bc_start, bc_end)
+
+        extractors.append((source, barcode_slice, reverse, correct))
+    return tuple(extractors)
+
+def _open_fastq_iterator(f):
+    if not hasattr(f, 'read'):
+        return FastqGeneralIterator(open_file(f))
+    return FastqGeneralIterator(f)
+
+def _get_record_fields(compiled_spec, read_keys):
+    fields = []
+    for read_key in read_keys:
+        fields.extend([read_key + '_name', read_key + '_seq', read_key + '_qual'])
+    fields.extend([barcode for barcode, bc_read, bc_start, bc_end, correct in compiled_spec])
+    return dict([(field, i) for i, field in enumerate(fields)])
+
+def _get_read_files(r1, r2, i1, i2):
+    """
+    Returns the (read key, file) pairs of the given fastq files in R1, R2, I1, I2 order.
+    """
+    return [(read_key, f) for read_key, f in [('r1', r1), ('r2', r2), ('i1', i1), ('i2', i2)] if f is not None]
+
+def parse_fastq_barcodes(r1, r2=None, spec=None, reverse_i5=False, edit_distance=2, i1=None, i2=None):
+    """
+    Extract and correct the barcodes in spec from each read (pair).
+
+    Args:
+        r1 (str or file): R1 fastq file name or file handle
+        r2 (str or file): R2 fastq file name or file handle, or None for single end reads
+        spec (dict): barcode spec
+        reverse_i5 (bool): True to reverse complement the i5 index before extracting barcodes
+        edit_distance (int): edit distance for barcodes with whitelists
+        i1 (str or file): I1 (i7 index read) fastq file name or file handle, or None to read the i7 index from the R1 name
+        i2 (str or file): I2 (i5 index read) fastq file name or file handle, or None to read the i5 index from the R1 name
+
+    Yields:
+        BarcodeRecord: r1_name, r1_seq, r1_qual, the r2, i1, and i2 equivalents for the given files, and the spec barcodes
+
+    The index read files are those of bcl2fastq --create-fastq-for-index-reads. When either is given, the i7 and i5 barcodes
+    are read from the index reads, whose qualities are in the records, and the R1 names are not parsed.
+    """
+    compiled_spec = _compile_barcode_spec(spec, r2 is not None, edit_distance)
 
     # Now set up file handles
-    if r1:
-        if not hasattr(r1, 'read'):
-            r1_handle = FastqGeneralIterator(open_file(r1))
-        else:
-            r1_handle = FastqGeneralIterator(r1)
-    if r2:
-        if not hasattr(r1, 'read'):
-            r2_handle = FastqGeneralIterator(open_file(r2))
-        else:
-            r2_handle = FastqGeneralIterator(r2)
+    read_files = _get_read_files(r1, r2, i1, i2)
+    read_keys = [read_key for read_key, f in read_files]
+    fastq_iterator = zip(*[_open_fastq_iterator(f) for read_key, f in read_files])
 
-    if r1 is not None and r2 is not None:
-        fastq_iterator = zip(r1_handle, r2_handle)
-        paired_end = True
-    else:
-        fastq_iterator = r1_handle
-        paired_end = False
+    fields = _get_record_fields(compiled_spec, read_keys)
+    extractors = None
+
+    # Positions of the R2, I1, and I2 records in the zipped records.
+    r2_index, i1_index, i2_index = [read_keys.index(read_key) if read_key in read_keys else None for read_key in ['r2', 'i1', 'i2']]
 
     # Iterate
-    barcodes_dict = dict()
-
-    index_start = None
-    i5_start = None
-    i5_end = None
-    i7_start = None
-    i7_end = None
-    read_lengths_checked = False
-    index_reads_checked = False
-
-    for r in fastq_iterator:
-        # Get seqs and store
-        if paired_end:
-            (r1_name, r1_seq, r1_qual), (r2_name, r2_seq, r2_qual) = r
-            barcodes_dict['r1_name'] = r1_name
-            barcodes_dict['r1_seq'] = r1_seq
-            barcodes_dict['r1_qual'] = r1_qual
-
-            barcodes_dict['r2_name'] = r2_name
-            barcodes_dict['r2_seq'] = r2_seq
-            barcodes_dict['r2_qual'] = r2_qual            
-        else:
-            r1_name, r1_seq, r1_qual = r
-            barcodes_dict['r1_name'] = r1_name
-            barcodes_dict['r1_seq'] = r1_seq
-            barcodes_dict['r1_qual'] = r1_qual
-
-        # Find index coords given first read
-        if not index_reads_checked:
-            if (index_start is None and i7_start is None and i7_end is None) and (I7 in requested_reads or I5 in requested_reads):
-                index_start, i7_start, i7_end, i5_start, i5_end = _get_index_coords(r1_name)
-                if (i5_start is None or i5_end is None) and I5 in requested_reads:
-                    raise ValueError('Spec requests I5 read in barcode %s, but i5 index not found in r1 name %s.' % (barcode, r1_name))
-                if (i7_start is None or i7_end is None) and I7 in requested_reads:
-                    raise ValueError('Spec requests I7 read in barcode %s, but no index is found in the r1 name %s.' % (barcode, r1_name))
-            index_reads_checked = True
-
-        # Get all barcode seqs
-        for barcode in spec:
-            bc_read = spec[barcode][BC_READ]
-            bc_start = spec[barcode][BC_START] - 1
-            bc_end = spec[barcode][BC_END]
-
-
-            if bc_read == I5:
-                read_seq = r1_name[index_start:][i5_start:i5_end]
-                if not read_lengths_checked:
-                    _validate_barcode_read_pair(read_seq, bc_end)
-
-                if reverse_i5:
-                    bc_seq = reverse_complement(read_seq)[bc_start:bc_end]
-                else:
-                    bc_seq = read_seq[bc_start:bc_end]
- 
-            elif bc_read == I7:
-                read_seq = r1_name[index_start:][i7_start:i7_end]
-                if not read_lengths_checked:
-                    _validate_barcode_read_pair(read_seq, bc_end)
-     
-                bc_seq = read_seq[bc_start:bc_end]
-
-            elif bc_read == R1:
-                if not read_lengths_checked:
-                    _validate_barcode_read_pair(r1_seq, bc_end)
-                bc_seq = r1_seq[bc_start:bc_end]
-                
-            elif bc_read == R2:
-                if not read_lengths_checked:
-                    _validate_barcode_read_pair(r2_seq, bc_end)
-                bc_seq = r2_seq[bc_start:bc_end]
-
-            if BC_WHITELIST in spec[barcode]:
-                bc_seq = spec[barcode][BC_CORRECTION_MAP].correct(bc_seq)
-
-            barcodes_dict[barcode] = bc_seq
-
-        read_lengths_checked = True
-        yield barcodes_dict
\ No newline at end of file
+    for records in fastq_iterator:
+        r1_name, r1_seq, r1_qual = records[0]
+        values = [r1_name, r1_seq, r1_qual]
+        for record in records[1:]:
+            values.extend(record)
+        r2_seq = records[r2_index][1] if r2_index is not None else None
+        i1_seq = records[i1_index][1] if i1_index is not None else None
+        i2_seq = records[i2_index][1] if i2_index is not None else None
+
+        # Find index coords and check read lengths given first read
+        if extractors is None:
+            extractors = _compile_extractors(compiled_spec, r1_name, r1_seq, r2_seq, reverse_i5, i1_seq, i2_seq)
+
+        sources = (r1_name, r1_seq, r2_seq, i1_seq, i2_seq)
+        for source, barcode_slice, reverse, correct in extractors:
+            bc_seq = sources[source][barcode_slice]
+            if reverse:
+                bc_seq = bc_seq.translate(revcomp)[::-1]
+            if correct is not None:
+                bc_seq = correct(bc_seq)
+            values.append(bc_seq)
+
+        yield BarcodeRecord(fields, values)
+
+class _FastqChunkReader(object):
+    """
+    Read text chunks of whole four-line fastq records from a file handle.
+    """
+    def __init__(self, handle, block_size=1048576):
+        self.handle = handle
+        self.block_size = block_size
+        self.buffer = ''
+
+    def read_records(self, num_records):
+        """
+        Returns the text of the next num_records records, or of the remaining records at the end of the file.
+        """
+        target = 4 * num_records
+        blocks = [self.buffer]
+        text_length = len(self.buffer)
+        lines = self.buffer.count('\n')
+        while lines < target:
+            # Read about the number of bytes needed for the missing lines.
+            if lines > 0:
+                read_size = max(65536, (text_length // lines + 1) * (target - lines))
+            else:
+                read_size = self.block_size
+            block = self.handle.read(read_size)
+            if not block:
+                break
+            blocks.append(block)
+            text_length += len(block)
+            lines += block.count('\n')
+        text = ''.join(blocks)
+
+        if lines < target or (lines == target and text.endswith('\n')):
+            self.buffer = ''
+            if text and not text.endswith('\n'):
+                text += '\n'
+            return text
+
+        # Cut the text after the target-th newline.
+        position = len(text)
+        for i in range(lines - target + 1):
+            position = text.rfind('\n', 0, position)
+        self.buffer = text[position + 1:]
+        return text[:position + 1]
+
+def _split_fastq_text(text):
+    """
+    Returns the lists of names, sequences, and qualities of the four-line fastq records in text.
+    """
+    lines = text.split('\n')
+    lines.pop()
+    if len(lines) % 4 != 0:
+        raise ValueError('Fastq file ends with a partial record.')
+    names = lines[0::4]
+    for name in names:
+        if not name.startswith('@'):
+            raise ValueError('Fastq record name line does not start with @: %s' % name.rstrip())
+    return [name[1:].rstrip() for name in names], [seq.rstrip() for seq in lines[1::4]], [qual.rstrip() for qual in lines[3::4]]
+
+def _extract_chunk_barcodes(extractors, r1_names, r1_seqs, r2_seqs, i1_seqs=None, i2_seqs=None):
+    """
+    Run the extractor operations on the lists of reads in a chunk and return a list of barcode lists in spec order.
+    """
+    sources = (r1_names, r1_seqs, r2_seqs, i1_seqs, i2_seqs)
+    barcode_columns = []
+    for source, barcode_slice, reverse, correct in extractors:
+        column = [seq[barcode_slice] for seq in sources[source]]
+        if reverse:
+            column = [seq.translate(revcomp)[::-1] for seq in column]
+        if correct is not None:
+            column = list(map(correct, column))
+        barcode_columns.append(column)
+    return barcode_columns
+
+def _parse_chunk_text(barcodes, extractors, read_keys, read_texts):
+    """
+    Returns the columns of a chunk given the text of its records for each read key, where the first read key is r1.
+    """
+    columns = {}
+    for read_key, read_text in zip(read_keys, read_texts):
+        columns[read_key + '_name'], columns[read_key + '_seq'], columns[read_key + '_qual'] = _split_fastq_text(read_text)
+        if len(columns[read_key + '_name']) != len(columns['r1_name']):
+            raise ValueError('R1 and %s fastq files have different numbers of reads.' % read_key.upper())
+    barcode_columns = _extract_chunk_barcodes(extractors, columns['r1_name'], columns['r1_seq'], columns.get('r2_seq'), columns.get('i1_seq'), columns.get('i2_seq'))
+    for barcode, column in zip(barcodes, barcode_columns):
+        columns[barcode] = column
+    return columns
+
+# Spec barcodes, extractor operations, and read keys of a
+# parse_fastq_barcodes_chunked worker process.
+_chunk_barcodes = None
+_chunk_extractors = None
+_chunk_read_keys = None
+
+def _init_chunk_worker(spec, r2_provided, edit_distance, extractor_slices, read_keys):
+    global _chunk_barcodes, _chunk_extractors, _chunk_read_keys
+    compiled_spec = _compile_barcode_spec(spec, r2_provided, edit_distance)
+    _chunk_barcodes = [entry[0] for entry in compiled_spec]
+    _chunk_extractors = tuple([(source, barcode_slice, reverse, entry[4]) for (source, barcode_slice, reverse), entry in zip(extractor_slices, compiled_spec)])
+    _chunk_read_keys = read_keys
+
+def _parse_chunk(task):
+    chunk_index, read_texts = task
+    return chunk_index, _parse_chunk_text(_chunk_barcodes, _chunk_extractors, _chunk_read_keys, read_texts)
+
+def _next_chunk_result(pending, preserve_order):
+    if preserve_order:
+        return pending.popleft().get()
+    while True:
+        for result in pending:
+            if result.ready():
+                pending.remove(result)
+                return result.get()
+        pending[0].wait(0.01)
+
+def parse_fastq_barcodes_chunked(r1, r2=None, spec=None, reverse_i5=False, edit_distance=2, chunk_size=100000, workers=None, preserve_order=True, i1=None, i2=None):
+    """
+    Extract and correct the barcodes in spec from chunks of reads, spreading the chunks over a process pool.
+
+    Args:
+        r1 (str or file): R1 fastq file name or text file handle
+        r2 (str or file): R2 fastq file name or text file handle, or None for single end reads
+        spec (dict): barcode spec
+        reverse_i5 (bool): True to reverse complement the i5 index before extracting barcodes
+        edit_distance (int): edit distance for barcodes with whitelists
+        chunk_size (int): number of reads (pairs) in a chunk
+        workers (int): number of worker processes, None for the number of CPUs, or 1 to process the chunks in this process
+        preserve_order (bool): True to yield the chunks in input order and False to yield them as they are finished
+        i1 (str or file): I1 (i7 index read) fastq file name or text file handle, or None to read the i7 index from the R1 name
+        i2 (str or file): I2 (i5 index read) fastq file name or text file handle, or None to read the i5 index from the R1 name
+
+    Yields:
+        int: 0-based chunk number
+        dict: lists of the r1_name, r1_seq, r1_qual, the r2, i1, and i2 equivalents for the given files, and the spec barcodes for the reads in the chunk
+
+    The fastq files must have four-line records. The barcodes are the same as those of parse_fastq_barcodes.
+    The reading process only cuts the files into chunks of record text; the workers split the records and extract the barcodes.
+    """
+    if not isinstance(chunk_size, int) or chunk_size <= 0:
+        raise ValueError('chunk_size must be a positive int, but %s found.' % chunk_size)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if not isinstance(workers, int) or workers <= 0:
+        raise ValueError('workers must be a positive int, but %s found.' % workers)
+
+    spec = copy.deepcopy(spec)
+    compiled_spec = _compile_barcode_spec(spec, r2 is not None, edit_distance)
+    barcodes = [entry[0] for entry in compiled_spec]
+
+    read_files = _get_read_files(r1, r2, i1, i2)
+    read_keys = [read_key for read_key, f in read_files]
+    readers = [_FastqChunkReader(f if hasattr(f, 'read') else open_file(f)) for read_key, f in read_files]
+
+    def read_chunks():
+        chunk_index = 0
+        while True:
+            r1_text = readers[0].read_records(chunk_size)
+            if not r1_text:
+                for read_key, reader in zip(read_keys[1:], readers[1:]):
+                    if reader.read_records(1):
+                        raise ValueError('R1 and %s fastq files have different numbers of reads.' % read_key.upper())
+                return
+            num_records = r1_text.count('\n') // 4
+            yield chunk_index, [r1_text] + [reader.read_records(num_records) for reader in readers[1:]]
+            chunk_index += 1
+
+    chunks = read_chunks()
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        return
+
+    # The first read sets the index coordinates and checks the read lengths.
+    first_records = dict([(read_key, _split_fastq_text('\n'.join(read_text.split('\n', 4)[:4]) + '\n')) for read_key, read_text in zip(read_keys, first_chunk[1])])
+    first_seqs = dict([(read_key, first_records[read_key][1][0]) for read_key in read_keys])
+    extractors = _compile_extractors(compiled_spec, first_records['r1'][0][0], first_seqs['r1'], first_seqs.get('r2'), reverse_i5, first_seqs.get('i1'), first_seqs.get('i2'))
+    chunks = itertools.chain([first_chunk], chunks)
+
+    if workers == 1:
+        for chunk_index, read_texts in chunks:
+            yield chunk_index, _parse_chunk_text(barcodes, extractors, read_keys, read_texts)
+        return
+
+    # The workers build their own correcters from the spec. At most two
+    # chunks for each worker are read ahead of the results.
+    extractor_slices = [(source, barcode_slice, reverse) for source, barcode_slice, reverse, correct in extractors]
+    pool = multiprocessing.Pool(workers, _init_chunk_worker, (spec, r2 is not None, edit_distance, extractor_slices, read_keys))
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_parse_chunk, (chunk,)))
+            while len(pending) >= 2 * workers:
+                yield _next_chunk_result(pending, preserve_order)
+        while pending:
+            yield _next_chunk_result(pending, preserve_order)
+    finally:
+        pool.terminate()
+        pool.join()
@@ -1,5 +1,9 @@
 from barcodeutils import *
 import barcodeutils as bu
+import gzip
+import os
+import shutil
+import tempfile
 from nose.tools import assert_raises
 
 def test_is_dna():
@@ -273,6 +277,114 @@ def test_barcode_correcter():
     correcter = BarcodeCorrecter(whitelist=['ATAA', 'AGAA', 'AACA'], edit_distance=1)
     assert 4 == correcter.get_barcode_length()
 
+def test_barcode_correcter_correct_many():
+    if bu.np is None:
+        return
+    correcter = BarcodeCorrecter(whitelist=['ATACA', 'TATAC', 'ATACT'], edit_distance=1)
+    seqs = ['TTACA', 'TTGCN', 'ATACA', 'TATAN', 'ATACG', 'atacA', 'ATAC', 'ATACAA']
+    corrected, distances = correcter.correct_many(seqs)
+    assert [correcter.correct(seq) for seq in seqs] == list(corrected)
+    assert [1, -1, 0, 1, -1, -1, -1, -1] == list(distances)
+
+    # Whitelist ids index the sorted whitelist
+    ids, distances = correcter.correct_many(bu.np.array(seqs[:5], dtype='S5'), return_ids=True)
+    assert [0, -1, 0, 2, -1] == list(ids)
+
+    # Buffer of fixed-width sequences
+    corrected, distances = correcter.correct_many(b'TTACATATAC')
+    assert ['ATACA', 'TATAC'] == list(corrected)
+    assert_raises(ValueError, correcter.correct_many, b'TTACATATA')
+
+    # Whitelist with ids and a barcode length without direct tables
+    correcter = BarcodeCorrecter(whitelist={'AAAAAAAAAAAAAAAA': 'bc1', 'CCCCCCCCCCCCCCCC': 'bc2'}, edit_distance=2)
+    corrected, distances = correcter.correct_many(['AAAAAAAAAAAAAANT', 'CCCCCCCCCCCCCCCC', 'GGGGGGGGGGGGGGGG'])
+    assert ['bc1', 'bc2', None] == list(corrected)
+    assert [2, 0, -1] == list(distances)
+
+
+def test_barcode_correcter_split_seed():
+    whitelist = ['ATACA', 'TATAC', 'ATACT', 'GGCCA', 'CCCGG', 'GAGAG']
+    seqs = ['TTACA', 'TTGCN', 'ATACA', 'TATAN', 'ATACG', 'atacA', 'ATAC', 'ATACAA', 'GGCCC', 'CACGG', 'GTGTG', 'AAAAA', 'NNNNN']
+    for edit_distance in [1, 2, 3]:
+        mismatch_map_correcter = BarcodeCorrecter(whitelist=whitelist, edit_distance=edit_distance, backend='mismatch_map')
+        split_seed_correcter = BarcodeCorrecter(whitelist=whitelist, edit_distance=edit_distance, backend='split_seed')
+        assert split_seed_correcter.mismatch_map is None
+        for seq in seqs:
+            assert mismatch_map_correcter.correct(seq) == split_seed_correcter.correct(seq)
+            assert mismatch_map_correcter._correct_with_distance(seq) == split_seed_correcter._correct_with_distance(seq)
+
+    # Whitelist with ids
+    correcter = BarcodeCorrecter(whitelist={'AAAAAAAAAAAAAAAA': 'bc1', 'CCCCCCCCCCCCCCCC': 'bc2'}, edit_distance=2, backend='split_seed')
+    assert correcter.correct('AAAAAAAAAAAAAANT') == 'bc1'
+    assert correcter.correct('AAAAAAAAAAAAANNT') is None
+    if bu.np is not None:
+        corrected, distances = correcter.correct_many(['AAAAAAAAAAAAAANT', 'CCCCCCCCCCCCCCCC', 'GGGGGGGGGGGGGGGG'])
+        assert ['bc1', 'bc2', None] == list(corrected)
+        assert [2, 0, -1] == list(distances)
+
+    # The backend is chosen from the estimated mismatch map size
+    assert bu.estimate_mismatch_map_bytes(['ACGTACGTAC'], 1) == 40 * (bu.MISMATCH_MAP_ENTRY_BYTES + 10)
+    assert BarcodeCorrecter(whitelist=whitelist, edit_distance=1).backend == 'mismatch_map'
+    assert_raises(ValueError, BarcodeCorrecter, whitelist, 1, False, 'trie')
+
+
+def test_barcode_correcter_indels():
+    whitelist = ['ACGTACGTAC', 'TTGGCCAATT', 'GATTACAGAT']
+    correcter = BarcodeCorrecter(whitelist=whitelist, edit_distance=1, indels=True)
+    # Deletion of the fourth base, followed by the flank base G
+    assert correcter.correct('ACGACGTACG') == 'ACGTACGTAC'
+    assert correcter._correct_with_distance('ACGACGTACG') == ('ACGTACGTAC', 1)
+    # Insertion after the third base, which pushes out the last base T
+    assert correcter.correct('GATTTACAGA') == 'GATTACAGAT'
+    assert correcter.correct('GATTTACAGA', flank='T') == 'GATTACAGAT'
+    assert correcter.correct('GATTTACAGA', flank='C') is None
+    # Mismatches are corrected first
+    assert correcter.correct('ACGTACGTAA') == 'ACGTACGTAC'
+    assert BarcodeCorrecter(whitelist=whitelist, edit_distance=1).correct('ACGACGTACG') is None
+    # Ambiguous indels are not corrected
+    assert BarcodeCorrecter(whitelist=['AAAACCCC', 'AAACCCCA', 'AAACCCCT'], indels=True).correct('AAACCCCG') is None
+    if bu.np is not None:
+        corrected, distances = correcter.correct_many(['ACGACGTACG', 'GATTTACAGA', 'ACGTACGTAC', 'CCCCCCCCCC'])
+        assert ['ACGTACGTAC', 'GATTACAGAT', 'ACGTACGTAC', None] == list(corrected)
+        assert [1, 1, 0, -1] == list(distances)
+
+def test_indel_index_near_substitution():
+    # AAAACCCCGG is AAACCCCGGT with an A inserted, and it is three
+    # substitutions from AAAAGCCTCG.
+    whitelist = ['AAACCCCGGT', 'AAAAGCCTCG']
+    assert IndelIndex(whitelist).correct('AAAACCCCGG') == (None, None)
+    assert IndelIndex(whitelist, max_substitutions=0).correct('AAAACCCCGG') == ('AAACCCCGGT', 'insertion')
+    assert IndelIndex(whitelist, max_substitutions=2).correct('AAAACCCCGG') == ('AAACCCCGGT', 'insertion')
+    assert_raises(ValueError, IndelIndex, whitelist, -1)
+
+
+def test_analyze_whitelist():
+    if bu.np is None:
+        return
+    whitelist = ['AAAAA', 'AAAAT', 'CCCCC', 'CCGGC']
+    barcodes, distances = bu.pairwise_hamming_distances(whitelist)
+    assert barcodes == sorted(whitelist)
+    for i, barcode in enumerate(barcodes):
+        for j, other_barcode in enumerate(barcodes):
+            assert distances[i][j] == hamming_distance(barcode, other_barcode)
+    assert bu.hamming_distance_histogram(whitelist) == [0, 1, 1, 0, 0, 4]
+    assert_raises(ValueError, bu.hamming_distance_histogram, ['AAAA', 'AAAAA'])
+
+    report = bu.analyze_whitelist(whitelist, edit_distance=1, error_rate=0.01)
+    assert report['min_distance'] == 1
+    assert report['distance_histogram'] == {'1': 1, '2': 1, '5': 4}
+    reports = dict([(barcode_report['barcode'], barcode_report) for barcode_report in report['barcodes']])
+    assert reports['AAAAA']['neighbors'] == {'1': 1, '2': 0, '3': 0}
+    assert reports['CCCCC']['neighbors'] == {'1': 0, '2': 1, '3': 0}
+
+    # Compare the conflicts and yield to the mismatch map.
+    correcter = BarcodeCorrecter(whitelist=whitelist, edit_distance=1)
+    for barcode in whitelist:
+        mismatches = generate_mismatches(barcode, 1)
+        assert reports[barcode]['conflicting_mismatches'] == {'1': len([seq for seq in mismatches if correcter.correct(seq) != barcode])}
+        kept = len([seq for seq in mismatches if 'N' not in seq and correcter.correct(seq) == barcode])
+        assert abs(reports[barcode]['expected_yield'] - (0.99 ** 5 + kept * 0.99 ** 4 * (0.01 / 3))) < 1e-12
+
 
 def test_get_index_coords():
     # Paired end
@@ -378,6 +490,29 @@ def test_parse_fastq_barcodes():
     assert reads[1]['p7'] == 'TCGGATTCGG'
     assert reads[1]['p5'] == 'CTCCATCGAG'
 
+    # Each read has its own record
+    assert reads[0]['r1_name'] != reads[1]['r1_name']
+    assert reads[0]['r1_name'].startswith('NS500272:546:H3FLHBGX9:1:11101:10770:2577')
+    assert reads[1].keys() == ['r1_name', 'r1_seq', 'r1_qual', 'r2_name', 'r2_seq', 'r2_qual', 'p5', 'p7']
+    assert reads[1].to_dict()['p5'] == 'CTCCATCGAG'
+    assert 'p5' in reads[1] and 'umi' not in reads[1]
+    assert reads[1].get('umi') is None
+    assert not hasattr(reads[1], '__dict__')
+
+    # Single end reads with barcodes from the end of the i5 index
+    spec = {
+        'p5': {
+            BC_START: 3,
+            BC_END: 10,
+            BC_READ: I5
+        }
+    }
+    reads = [x for x in parse_fastq_barcodes(r1, spec=spec, reverse_i5=True)]
+    assert reads[0]['p5'] == reverse_complement(reads[0]['r1_name'].split('+')[1])[2:10]
+    assert 'r2_seq' not in reads[0]
+    reads = [x for x in parse_fastq_barcodes(r1, spec=spec, reverse_i5=False)]
+    assert reads[0]['p5'] == reads[0]['r1_name'].split('+')[1][2:10]
+
     # BC length doesn't match the whitelist length
     spec = {
         'p5': {
@@ -416,6 +551,153 @@ def test_parse_fastq_barcodes():
     }
     assert_raises(ValueError, run_parse_fastq_barcodes, r1, r2, spec, reverse_i5=True, edit_distance=1)
 
+def test_parse_fastq_barcodes_chunked():
+    r1 = 'example.1.fastq.gz'
+    r2 = 'example.2.fastq.gz'
+    i7_barcodes = ["TCGGATTCGG", "TCCGGCTTAT", "TCGCCGCCGG", "TTGGCAAGCC", "CAGCTAGCGG", "GTAGGATAAG", "AAGTAGCTCA", "TAAGTCCTGA", "GCGGCTGCGG", "ACCAGGCGCA", "CCGTATGATT", "TTGATTGGCG"]
+    i5_barcodes = ["CTCCATCGAG", "TTGGTAGTCG", "GGCCGTCAAC", "CCTAGACGAG", "TCGTTAGAGC", "CGTTCTATCA", "CGGAATCTAA", "ATGACTGATC"]
+    spec = {
+        'umi': {
+            BC_START: 1,
+            BC_END: 8,
+            BC_READ: R1
+        },
+        'p5': {
+            BC_START: 1,
+            BC_END: 10,
+            BC_READ: I5,
+            BC_WHITELIST: i5_barcodes
+        },
+        'p7': {
+            BC_START: 1,
+            BC_END: 10,
+            BC_READ: I7,
+            BC_WHITELIST: i7_barcodes
+        }
+    }
+    expected = [x.to_dict() for x in parse_fastq_barcodes(r1, r2, spec=spec, reverse_i5=True, edit_distance=1)]
+
+    # In this process and in a pool of two workers, one read pair per chunk
+    for workers in [1, 2]:
+        chunks = [x for x in parse_fastq_barcodes_chunked(r1, r2, spec=spec, reverse_i5=True, edit_distance=1, chunk_size=1, workers=workers)]
+        assert [0, 1] == [chunk_index for chunk_index, columns in chunks]
+        for (chunk_index, columns), read in zip(chunks, expected):
+            assert sorted(columns.keys()) == sorted(read.keys())
+            assert all([columns[key] == [read[key]] for key in read])
+
+    chunks = [x for x in parse_fastq_barcodes_chunked(r1, spec=spec, reverse_i5=True, edit_distance=1, chunk_size=10, workers=1)]
+    assert 1 == len(chunks)
+    assert chunks[0][1]['p5'] == [read['p5'] for read in expected]
+    assert 'r2_seq' not in chunks[0][1]
+
+    assert_raises(ValueError, lambda: list(parse_fastq_barcodes_chunked(r1, r2, spec=spec, chunk_size=0)))
+
+def test_write_buffer():
+    output_dir = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(output_dir, 'lines.txt')
+        lines = ['line%d\n' % i for i in range(10)]
+        with WriteBuffer(file_name, buffer_size=3) as f:
+            for line in lines:
+                f.write(line)
+        assert open(file_name).read() == ''.join(lines)
+    finally:
+        shutil.rmtree(output_dir)
+
+def test_background_writer():
+    output_dir = tempfile.mkdtemp()
+    try:
+        lines = ['@read%d\nACGTACGTAC\n+\nIIIIIIIIII\n' % i for i in range(1000)]
+        for compression in ['none', 'gzip', 'bgzf']:
+            file_name = os.path.join(output_dir, 'reads.%s' % compression)
+            with BackgroundWriter(file_name, compression=compression, buffer_bytes=100) as f:
+                for line in lines:
+                    f.write(line)
+            if compression == 'none':
+                assert open(file_name).read() == ''.join(lines)
+            else:
+                assert gzip.open(file_name, 'rb').read().decode('utf-8') == ''.join(lines)
+        assert open(os.path.join(output_dir, 'reads.bgzf'), 'rb').read()[-28:] == BGZF_EOF
+
+        # BGZF blocks hold at most BGZF_BLOCK_DATA_BYTES
+        data = b'ACGT' * BGZF_BLOCK_DATA_BYTES
+        compressed = bgzf_compress(data)
+        assert compressed[:4] == b'\x1f\x8b\x08\x04'
+        file_name = os.path.join(output_dir, 'data.bgzf')
+        with open(file_name, 'wb') as f:
+            f.write(compressed + BGZF_EOF)
+        assert gzip.open(file_name, 'rb').read() == data
+
+        # Writers that share a budget
+        budget = WriteMemoryBudget(1 << 17)
+        writers = [BackgroundWriter(os.path.join(output_dir, 'shared%d.gz' % i), budget=budget) for i in range(4)]
+        assert budget.num_writers == 4
+        assert budget.writer_buffer_bytes == WRITE_MIN_BUFFER_BYTES
+        for i, line in enumerate(lines * 100):
+            writers[i % 4].write(line)
+        for writer in writers:
+            writer.close()
+        assert budget.num_writers == 0
+        assert budget.used_bytes == 0
+        assert sum([len(gzip.open(os.path.join(output_dir, 'shared%d.gz' % i), 'rb').read()) for i in range(4)]) == len(''.join(lines * 100))
+
+        assert_raises(ValueError, BackgroundWriter, os.path.join(output_dir, 'x.txt'), 'zip')
+        assert_raises(ValueError, WriteMemoryBudget, 0)
+    finally:
+        shutil.rmtree(output_dir)
+
+def test_parse_fastq_barcodes_index_reads():
+    r1 = 'example.1.fastq.gz'
+    r2 = 'example.2.fastq.gz'
+    i7_barcodes = ["TCGGATTCGG", "TCCGGCTTAT", "TCGCCGCCGG", "TTGGCAAGCC", "CAGCTAGCGG", "GTAGGATAAG", "AAGTAGCTCA", "TAAGTCCTGA", "GCGGCTGCGG", "ACCAGGCGCA", "CCGTATGATT", "TTGATTGGCG"]
+    i5_barcodes = ["CTCCATCGAG", "TTGGTAGTCG", "GGCCGTCAAC", "CCTAGACGAG", "TCGTTAGAGC", "CGTTCTATCA", "CGGAATCTAA", "ATGACTGATC"]
+    spec = {
+        'p5': {
+            BC_START: 1,
+            BC_END: 10,
+            BC_READ: I5,
+            BC_WHITELIST: i5_barcodes
+        },
+        'p7': {
+            BC_START: 1,
+            BC_END: 10,
+            BC_READ: I7,
+            BC_WHITELIST: i7_barcodes
+        }
+    }
+
+    # Index read files with the index sequences of the R1 names
+    output_dir = tempfile.mkdtemp()
+    try:
+        i1 = os.path.join(output_dir, 'example.i1.fastq')
+        i2 = os.path.join(output_dir, 'example.i2.fastq')
+        i1_short = os.path.join(output_dir, 'example.i1_short.fastq')
+        i1_records = []
+        i2_records = []
+        for name, seq, qual in FastqGeneralIterator(open_file(r1)):
+            i7_seq, i5_seq = name[name.rfind(':') + 1:].split('+')
+            i1_records.append('@%s\n%s\n+\n%s\n' % (name, i7_seq, 'F' * len(i7_seq)))
+            i2_records.append('@%s\n%s\n+\n%s\n' % (name, i5_seq, 'F' * len(i5_seq)))
+        for file_name, records in [(i1, i1_records), (i2, i2_records), (i1_short, i1_records[:-1])]:
+            with open(file_name, 'w') as f:
+                f.write(''.join(records))
+
+        for reverse_i5 in [False, True]:
+            expected = [x.to_dict() for x in parse_fastq_barcodes(r1, r2, spec=spec, reverse_i5=reverse_i5, edit_distance=1)]
+            output = [x.to_dict() for x in parse_fastq_barcodes(r1, r2, spec=spec, reverse_i5=reverse_i5, edit_distance=1, i1=i1, i2=i2)]
+            assert [(read['p5'], read['p7']) for read in output] == [(read['p5'], read['p7']) for read in expected]
+            assert output[0]['i1_qual'] == 'F' * 10
+            assert output[0]['r2_seq'] == expected[0]['r2_seq']
+
+            chunks = list(parse_fastq_barcodes_chunked(r1, r2, spec=spec, reverse_i5=reverse_i5, edit_distance=1, workers=1, i1=i1, i2=i2))
+            assert chunks[0][1]['p5'] == [read['p5'] for read in expected]
+            assert chunks[0][1]['i2_seq'] == [read['i2_seq'] for read in output]
+
+        assert_raises(ValueError, lambda: list(parse_fastq_barcodes(r1, r2, spec=spec, i1=i1)))
+        assert_raises(ValueError, lambda: list(parse_fastq_barcodes_chunked(r1, r2, spec=spec, workers=1, i1=i1_short, i2=i2)))
+    finally:
+        shutil.rmtree(output_dir)
+
 def test_get_run_info():
     run_info = get_run_info('.')
     expected_output = {'instrument_type': 'NextSeq', 'lanes': 4, 'instrument': 'NS500488', 'p5_index_length': 0, 'p7_index_length': 6, 'flow_cell_id': 'HKFWJBGXX', 'r2_length': 151, 'r1_length': 151, 'date': '151117'}
@@ -0,0 +1,72 @@
+import argparse
+import random
+import time
+import numpy as np
+import barcodeutils as bu
+
+#
+# Compare the throughput of BarcodeCorrecter.correct_many to a loop of
+# BarcodeCorrecter.correct calls.
+#
+# Notes:
+#   o  the whitelist is random barcodes and the sequences are whitelist
+#      barcodes with zero to three substitutions. One percent of the
+#      sequences have an N.
+#   o  correct_many is timed for a list of str and for a numpy array of
+#      fixed-width bytes. The table build time is reported separately
+#      because it is paid once for each BarcodeCorrecter.
+#
+
+def random_barcode(length):
+    return ''.join([random.choice('ACGT') for i in range(length)])
+
+def mutate(seq):
+    seq = list(seq)
+    for position in random.sample(range(len(seq)), random.choice([0, 0, 1, 1, 2, 3])):
+        seq[position] = random.choice([base for base in 'ACGT' if base != seq[position]])
+    if random.random() < 0.01:
+        seq[random.randrange(len(seq))] = 'N'
+    return ''.join(seq)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark BarcodeCorrecter.correct_many against BarcodeCorrecter.correct.')
+    parser.add_argument('--num_seqs', type=int, default=1000000, help='Number of sequences to correct.')
+    parser.add_argument('--whitelist_size', type=int, default=384, help='Number of whitelist barcodes.')
+    parser.add_argument('--barcode_length', type=int, default=10, help='Barcode length.')
+    parser.add_argument('--edit_distance', type=int, default=2, help='Edit distance.')
+    args = parser.parse_args()
+
+    random.seed(0)
+    whitelist = set()
+    while len(whitelist) < args.whitelist_size:
+        whitelist.add(random_barcode(args.barcode_length))
+    whitelist = sorted(whitelist)
+    seqs = [mutate(random.choice(whitelist)) for i in range(args.num_seqs)]
+    seq_array = np.array(seqs, dtype='S%d' % args.barcode_length)
+
+    correcter = bu.BarcodeCorrecter(whitelist, edit_distance=args.edit_distance)
+
+    start = time.time()
+    expected = [correcter.correct(seq) for seq in seqs]
+    loop_seconds = time.time() - start
+
+    start = time.time()
+    correcter.correct_many(seqs[:1])
+    build_seconds = time.time() - start
+
+    start = time.time()
+    corrected, distances = correcter.correct_many(seqs)
+    list_seconds = time.time() - start
+
+    start = time.time()
+    ids, distances = correcter.correct_many(seq_array, return_ids=True)
+    array_seconds = time.time() - start
+
+    if list(corrected) != expected:
+        raise ValueError('correct_many and correct results differ.')
+
+    print('Sequences: %s; corrected: %s' % (args.num_seqs, sum([1 for seq in expected if seq is not None])))
+    print('correct loop: %.3f s (%.0f seqs/s)' % (loop_seconds, args.num_seqs / loop_seconds))
+    print('correct_many table build: %.3f s' % build_seconds)
+    print('correct_many list: %.3f s (%.0f seqs/s, %.1fx)' % (list_seconds, args.num_seqs / list_seconds, loop_seconds / list_seconds))
+    print('correct_many array: %.3f s (%.0f seqs/s, %.1fx)' % (array_seconds, args.num_seqs / array_seconds, loop_seconds / array_seconds))
@@ -99,6 +99,21 @@ params.bcl2fastq_cpus = 6
 params.max_mem_bcl2fastq = 40
 params.demux_buffer_blocks = 8192
 params.index_recipe = 0
+params.demux_qc_metrics = false
+params.demux_qc_sample_interval = 100
+params.demux_trim_adapters = false
+params.demux_trim_quality = 0
+params.demux_cell_counts = false
+params.demux_barcode_sidecar = false
+params.demux_rescue = false
+params.demux_indel_correction = null
+params.demux_index_reads = false
+params.demux_quality_correction = null
+params.demux_hash_reads = false
+params.demux_subsample = null
+params.demux_chunk_bytes = 0
+params.demux_max_chunks = 64
+params.bcl2fastq_tile_groups = 0
 
 /*
 ** Initialize optional parameters to null.
@@ -231,6 +246,119 @@ if( params.index_recipe > 0 ) {
   options_barcode_correct += sprintf(" --index_recipe %d", params.index_recipe)
 }
 
+/*
+** Collect sample fastq quality metrics in barcode_correct. This
+** replaces the fastqc_samples process, which re-reads the fastq
+** files.
+*/
+if( params.demux_qc_metrics ) {
+  options_barcode_correct += sprintf(" --qc_metrics --qc_sample_interval %d", params.demux_qc_sample_interval)
+}
+
+/*
+** Trim Nextera adapters in barcode_correct. The trimmed fastq files
+** are published to the sample fastqs_trim directories so that the
+** separate Trimmomatic pass is not needed.
+*/
+if( params.demux_trim_adapters ) {
+  options_barcode_correct += sprintf(" --trim_adapters --adapter_file ${script_dir}/Trimmomatic-0.36/adapters/NexteraPE-PE.fa --trim_quality %d", params.demux_trim_quality)
+}
+def sample_fastq_subdir = ( params.demux_trim_adapters ) ? "fastqs_trim" : "fastqs_barcode"
+
+/*
+** Count the reads for each cell barcode in barcode_correct so that
+** the downstream analysis does not need to rescan the fastq files.
+*/
+if( params.demux_cell_counts ) {
+  options_barcode_correct += " --cell_counts"
+}
+
+/*
+** Write the per-read barcode sidecar, which resplit_sciatac.py uses to
+** re-split a lane after a samplesheet correction.
+*/
+if( params.demux_barcode_sidecar ) {
+  options_barcode_correct += " --barcode_sidecar"
+}
+
+/*
+** Rescue read pairs that fail barcode correction in a second pass.
+*/
+if( params.demux_rescue ) {
+  options_barcode_correct += " --rescue"
+}
+
+/*
+** Correct single-base indels in the index sequences that fail mismatch
+** correction for the given barcode types, for example,
+** params.demux_indel_correction = 'pcr_i7,pcr_i5'.
+*/
+if( params.demux_indel_correction ) {
+  options_barcode_correct += " --indel_correction ${params.demux_indel_correction.tokenize(',').join(' ')}"
+}
+
+/*
+** Write the index reads to I1 and I2 fastq files in bcl2fastq and read
+** the index sequences from them in barcode_correct rather than from the
+** R1 read names.
+*/
+def bcl2fastq_index_reads_option = params.demux_index_reads ? '--create-fastq-for-index-reads' : ''
+
+/*
+** Correct the index sequences that fail mismatch correction using the
+** index read base qualities for the given barcode types, for example,
+** params.demux_quality_correction = 'pcr_i7,pcr_i5'. The qualities are
+** in the index read fastqs so this requires params.demux_index_reads.
+*/
+if( params.demux_quality_correction ) {
+  if( !params.demux_index_reads ) {
+    println "Error: params.demux_quality_correction requires params.demux_index_reads."
+    System.exit( -1 )
+  }
+  options_barcode_correct += " --quality_correction ${params.demux_quality_correction.tokenize(',').join(' ')}"
+}
+
+/*
+** Count sciPlex hash reads by cell in barcode_correct. The hash index
+** file is the samplesheet hash_file.
+*/
+if( params.demux_hash_reads ) {
+  options_barcode_correct += " --hash_reads"
+}
+
+/*
+** Write subsampled sample fastq files in barcode_correct, for example,
+** params.demux_subsample = '0.01,0.1'. The files are published to the
+** sample fastqs_subsample_<fraction> directories.
+*/
+if( params.demux_subsample ) {
+  options_barcode_correct += " --subsample ${params.demux_subsample}"
+}
+
+/*
+** Split each lane into chunks of about params.demux_chunk_bytes
+** compressed R1 bytes for barcode_correct. The per-cell counts, hash
+** counts, and quality metrics cannot be gathered from chunks so they
+** use one chunk per lane. A lane converted in tile groups has at least
+** one chunk for each tile group, so these outputs cannot be used with
+** params.bcl2fastq_tile_groups.
+*/
+if( params.bcl2fastq_tile_groups > 0 && ( params.demux_cell_counts || params.demux_hash_reads || params.demux_qc_metrics ) ) {
+  println "Error: params.demux_cell_counts, params.demux_hash_reads, and params.demux_qc_metrics cannot be used with params.bcl2fastq_tile_groups."
+  System.exit( -1 )
+}
+def demux_chunk_bytes = ( params.demux_cell_counts || params.demux_hash_reads || params.demux_qc_metrics ) ? 0 : params.demux_chunk_bytes
+
+/*
+** Return true when a lane is demultiplexed in one chunk, which is the
+** default. fastq_chunker.py makes one chunk when the R1 file is no
+** larger than demux_chunk_bytes or params.demux_max_chunks is one. The
+** barcode_correct task of a one chunk lane reads the lane files with
+** zcat and publishes its outputs so the lane skips demux_chunk_index
+** and gather_demux_chunks.
+*/
+def demux_single_chunk = { r1 -> params.bcl2fastq_tile_groups == 0 && ( demux_chunk_bytes == 0 || params.demux_max_chunks <= 1 || r1.size() <= demux_chunk_bytes ) }
+
 /*
 ** Use well ids as read names. This is required for downstream
 ** quality control evaluation.
@@ -255,6 +383,21 @@ if( num_threads_bcl2fasta_process / 2 < 4 ) {
 	num_threads_bcl2fastq_io = 4
 }
 
+/*
+** Convert each lane in params.bcl2fastq_tile_groups bcl2fastq tasks,
+** each with a group of tiles, so that the conversion runs on more
+** cpus and the demux of a tile group starts when its conversion ends.
+** The default of 0 converts the run in one bcl2fastq task. A tile
+** group with lane 0 and no tiles stands for the whole run.
+**
+** The read numbers of each tile group start at a multiple of
+** tile_group_read_number_stride so that they are unique in the lane
+** without knowing the numbers of reads in the other tile groups.
+*/
+def bcl2fastqTileGroups = ( params.bcl2fastq_tile_groups > 0 ) ? readTileGroups( params ) : [ [ 'lane': 0, 'group': 0, 'name': '', 'tiles': '' ] ]
+def tile_group_read_number_stride = 10000000000L
+def laneTileGroupCount = { lane -> ( params.bcl2fastq_tile_groups > 0 ) ? bcl2fastqTileGroups.count { it['lane'] == lane } : 1 }
+
 /*
 ** Report run parameter values.
 */
@@ -325,8 +468,13 @@ process make_fake_sample_sheet {
 **
 ** Notes:
 **   o  copy 'Reports' and 'Stats' directories to an accessible directory.
+**   o  there is one bcl2fastq task for each tile group. The outputs of
+**      a tile group task are published to the fastqs_bcl2fastq/<name>
+**      directory, where <name> is the tile group name. The tile group
+**      Stats.json files of each lane are merged by merge_bcl2fastq_stats.
 */
 makeFakeSampleSheetOutChannel
+    .combine( Channel.from( bcl2fastqTileGroups ) )
     .set { bcl2fastqInChannel }
 
 process bcl2fastq {
@@ -335,17 +483,18 @@ process bcl2fastq {
   cpus num_threads_bcl2fasta_process
   memory "$mem_bcl2fastq GB"    
 //  note: the following publishDir statement may be commented out in bbi_dmux. I want it to work for diagnostics during development.
-  publishDir path: "$demux_dir/fastqs_bcl2fastq", pattern: "Undetermined_S0_*.fastq.gz", mode: 'copy'
-  publishDir path: "$demux_dir/fastqs_bcl2fastq", pattern: "Stats/*", mode: 'copy'
-  publishDir path: "$demux_dir/fastqs_bcl2fastq", pattern: "Reports/*", mode: 'copy'
+  publishDir path: "$demux_dir/fastqs_bcl2fastq/${tile_group['name']}", pattern: "Undetermined_S0_*.fastq.gz", mode: 'copy'
+  publishDir path: "$demux_dir/fastqs_bcl2fastq/${tile_group['name']}", pattern: "Stats/*", mode: 'copy'
+  publishDir path: "$demux_dir/fastqs_bcl2fastq/${tile_group['name']}", pattern: "Reports/*", mode: 'copy'
 
   input:
-    file(inFile) from bcl2fastqInChannel
+    set file(inFile), val(tile_group) from bcl2fastqInChannel
 //    file(inFile) from makeFakeSampleSheetOutChannel
 
   output:
-    set file("Undetermined_S0_*_R1_001.fastq.gz"), file("Undetermined_S0_*_R2_001.fastq.gz") into bcl2fastq_fastqsOutChannel mode flatten
+    set val(tile_group), file("Undetermined_S0_*_001.fastq.gz") into bcl2fastq_fastqsOutChannel
     file("Stats/*") into  bcl2fastq_stats
+    set val(tile_group), file("Stats/Stats.json") into bcl2fastq_stats_json
     file("Reports/*") into bcl2fastq_reports
 
     /*
@@ -364,6 +513,7 @@ process bcl2fastq {
     **        --tiles [0–9][0–9][0–9]5
     */
     script:
+    tiles_option = ( tile_group['tiles'] ) ? "--tiles '${tile_group['tiles']}'" : ''
     """
     # bash watch for errors
     set -ueo pipefail
@@ -394,7 +544,9 @@ process bcl2fastq {
               --ignore-missing-positions \
               --ignore-missing-controls \
               --ignore-missing-filter \
-              --ignore-missing-bcls
+              --ignore-missing-bcls \
+              $bcl2fastq_index_reads_option \
+              $tiles_option
 
     $script_dir/json_extractor.py \
     -i Stats/Stats.json \
@@ -421,55 +573,217 @@ process bcl2fastq {
 --ignore-missing-positions \
 --ignore-missing-controls \
 --ignore-missing-filter \
---ignore-missing-bcls"
+--ignore-missing-bcls \
+$bcl2fastq_index_reads_option \
+$tiles_option"
     """
-    //               --tiles s_1 \
 }
 
+/*
+** Merge the bcl2fastq Stats.json files of the tile groups of each lane
+** into fastqs_bcl2fastq/L<lane>/Stats/Stats.json.
+**
+** Notes:
+**   o  runs only when params.bcl2fastq_tile_groups is set. Otherwise
+**      bcl2fastq writes one Stats.json file for the run.
+**   o  the UnknownBarcodes counts are sums of the per tile group lists
+**      of the most frequent unknown barcodes, so they are lower bounds.
+**      See merge_bcl2fastq_stats.py.
+*/
+bcl2fastq_stats_json
+  .filter { params.bcl2fastq_tile_groups > 0 }
+  .map { tile_group, stats_json -> [ groupKey( tile_group['lane'], laneTileGroupCount( tile_group['lane'] ) ), stats_json ] }
+  .groupTuple()
+  .set { lane_bcl2fastq_stats_json }
+
+process merge_bcl2fastq_stats {
+  cache 'lenient'
+  errorStrategy onError
+  publishDir path: "$demux_dir/fastqs_bcl2fastq", saveAs: { it.replace( '.Stats.json', '/Stats/Stats.json' ) }, pattern: "*.Stats.json", mode: 'copy'
+
+  input:
+    set val(lane), file('Stats_*.json') from lane_bcl2fastq_stats_json
+
+  output:
+    file("*.Stats.json") into merged_bcl2fastq_stats
+
+  script:
+  lane_name = String.format( "L%03d", lane.toString() as Integer )
+  """
+  # bash watch for errors
+  set -ueo pipefail
+
+  $script_dir/merge_bcl2fastq_stats.py --stats Stats_*.json --lane ${lane} -o ${lane_name}.Stats.json
+  """
+}
+
+
+/*
+** Make one (tile_group, R1, R2, index_fastqs, index_reads) tuple for
+** each lane. A tile group task converts the tiles of one lane so keep
+** only the files of that lane. index_fastqs is the I1 and I2 files when
+** params.demux_index_reads is set and bcl2fastq wrote both of them, in
+** which case index_reads is true, and is empty otherwise.
+*/
 bcl2fastq_fastqsOutChannel
+   .flatMap { tile_group, fastq_files ->
+     def fastq_list = ( fastq_files instanceof List ) ? fastq_files : [ fastq_files ]
+     def read_file = { r1, read -> fastq_list.find { it.getName() == r1.getName().replace( '_R1_001.', "_${read}_001." ) } }
+     fastq_list
+       .findAll { it.getName().contains( '_R1_001.' ) }
+       .sort { it.getName() }
+       .findAll { tile_group['lane'] == 0 || it.getName().contains( String.format( "_L%03d_", tile_group['lane'] ) ) }
+       .collect { r1 ->
+         def index_fastqs = params.demux_index_reads ? [ read_file( r1, 'I1' ), read_file( r1, 'I2' ) ].findAll { it != null } : []
+         def index_reads = index_fastqs.size() == 2
+         [ tile_group['group'], r1, read_file( r1, 'R2' ), index_reads ? index_fastqs : [], index_reads ] } }
    .into { bcl2fastq_fastqsOutChannelCopy01;
-           bcl2fastq_fastqsOutChannelCopy02 }
+           bcl2fastq_fastqsOutChannelCopy02;
+           bcl2fastq_fastqsOutChannelCopy03 }
+
+
+/*
+** Index the chunks of each lane for barcode_correct.
+**
+** Notes:
+**   o  fastq_chunker.py finds the record starts of the chunks in the
+**      gzip member (BGZF block) structure of the bcl2fastq fastq files
+**      so the chunks are read without recompressing the lane files.
+**   o  the I1 and I2 index read files, when there are index reads, are
+**      split at the same reads as the R1 and R2 files.
+**   o  the number of chunks is the R1 file size divided by
+**      params.demux_chunk_bytes, at most params.demux_max_chunks.
+**   o  a lane with one chunk, which is the default, is not indexed. See
+**      demux_single_chunk.
+*/
+process demux_chunk_index {
+  cache 'lenient'
+  errorStrategy onError
+
+  input:
+    set val(tile_group_id), file(R1), file(R2), file(index_fastqs), val(index_reads) from bcl2fastq_fastqsOutChannelCopy01.filter { !demux_single_chunk( it[1] ) }
+
+  output:
+    set val(lane_id), val(tile_group_id), file(R1), file(R2), file(index_fastqs), val(index_reads), file("*.chunks.json") into demux_chunk_index_out
+
+  script:
+  lane_id = R1.getName().split( '_' )[2]
+  index_reads_option = index_reads ? "--index_reads ${index_fastqs}" : ''
+  """
+  # bash watch for errors
+  set -ueo pipefail
+
+  $script_dir/fastq_chunker.py index \
+                       -1 $R1 \
+                       -2 $R2 \
+                       $index_reads_option \
+                       --chunk_bytes ${demux_chunk_bytes} \
+                       --max_chunks ${params.demux_max_chunks} \
+                       -o ${lane_id}.chunks.json
+  """
+}
+
+/*
+** Make one barcode_correct task for each lane chunk. The read number
+** offset of a chunk is the number of tile group reads before the chunk
+** plus the tile group read number offset. The chunk id is
+** <tile_group>_<chunk>. Each task also gets the number of chunks in
+** its tile group so that gather_demux_chunks can start as soon as the
+** chunks of a lane are done. A one chunk lane has no chunk index.
+*/
+bcl2fastq_fastqsOutChannelCopy03
+  .filter { tile_group_id, r1, r2, index_fastqs, index_reads -> demux_single_chunk( r1 ) }
+  .map { tile_group_id, r1, r2, index_fastqs, index_reads -> [ r1.getName().split( '_' )[2], tile_group_id, 1, r1, r2, index_fastqs, index_reads, [], "${tile_group_id}_0", 0, 0, true ] }
+  .set { demux_single_chunks }
+
+demux_chunk_index_out
+  .flatMap { lane_id, tile_group_id, r1, r2, index_fastqs, index_reads, chunk_index ->
+    def chunks = new groovy.json.JsonSlurper().parse( chunk_index.toFile() )['chunks']
+    chunks.collect { chunk -> [ lane_id, tile_group_id, chunks.size(), r1, r2, index_fastqs, index_reads, chunk_index, "${tile_group_id}_${chunk['chunk']}", chunk['chunk'], tile_group_id * tile_group_read_number_stride + chunk['first_record'] - 1, false ] } }
+  .mix( demux_single_chunks )
+  .set { demux_chunks }
 
 
 /*
-** Run bar code correction script (barcode_correct_sciatac.py).
+** Run bar code correction script (barcode_correct_sciatac.py) on a
+** lane chunk.
 **
 ** Notes:
 **   o  need to activate pypy environment and then deactivate when done
 **   o  copy 'out.*.correction_stats.json' to an accessible directory
-**   o  I suspect that splitting fastq files and combining them uses more
-**      time than one saves by distributing the barcode correction. I base
-**      this on the observation that the file compressions takes about the
-**      same amount of time as the barcode correction. I assume that the
-**      two scale similarly with file size.
+**   o  splitting a lane into chunks used to mean decompressing and
+**      recompressing the lane fastq files, which takes about as long as
+**      the barcode correction. The chunks are now read directly from the
+**      lane files by fastq_chunker.py and the chunk outputs are gathered
+**      by concatenating gzip members, so neither step recompresses.
 **   o  barcode_correct_sciatac.py uses pigz to compress fastq files. pigz is
 **      supposed to use all available processors to compress files.
-**   o  the barcode_stats_json output channel is a dummy channel. It appears
-**      that the files do not get copied by the publishDir
-**      directive if these files are not in a channel.
+**   o  the chunk outputs are written to the directory
+**      demux_chunk_<lane>_<chunk> and are published by gather_demux_chunks.
+**   o  a one chunk lane is read with zcat and its outputs are written to
+**      the task directory and published here, so there is no chunk
+**      index or gather task for the lane. The single_chunk_* output
+**      channels are mixed with the gather_demux_chunks output channels.
 */
 process barcode_correct {
   cache 'lenient'
   errorStrategy onError
-  publishDir    path: "${demux_dir}", saveAs: { qualifyFilename( it, "fastqs_barcode" ) }, pattern: "*.fastq.gz", mode: 'copy'
+  publishDir    path: "${demux_dir}", saveAs: { qualifyFilename( it, sample_fastq_subdir ) }, pattern: "*.fastq.gz", mode: 'copy'
+  publishDir    path: "${demux_dir}", saveAs: { qualifyFilename( it, sample_fastq_subdir ) }, pattern: "*.trim_stats.json", mode: 'copy'
+  publishDir    path: "${demux_dir}", saveAs: { qualifyFilename( it, sample_fastq_subdir ) }, pattern: "*.cell_counts*", mode: 'copy'
+  publishDir    path: "${demux_dir}", saveAs: { qualifyFilename( it, sample_fastq_subdir ) }, pattern: "*.hash*", mode: 'copy'
+  publishDir    path: "${demux_dir}", saveAs: { qualifyFilename( new File( it ).getName(), 'fastqs_' + new File( it ).getParent() ) }, pattern: "subsample_*/*.fastq.gz", mode: 'copy'
   publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.stats.json", mode: 'copy'
   publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.index_counts.csv", mode: 'copy'
   publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.tag_pair_counts.csv", mode: 'copy'
   publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.pcr_pair_counts.csv", mode: 'copy'
-  
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.pair_matrix.csv", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.unassigned_top.csv", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.barcodes.{bin,json}", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.rescue_stats.json", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.indel_stats.json", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.quality_stats.json", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.manifest.json", mode: 'copy'
+  publishDir    path: "${output_dir}/demux_qc", pattern: "*.qc.{json,tsv}", mode: 'copy'
+
   input:
-    // set file(R1), file(R2) from bcl2fastq_fastqsOutChannelCopy01.splitFastq(by: params.fastq_chunk_size, file: true, pe: true)
-    set file(R1), file(R2) from bcl2fastq_fastqsOutChannelCopy01
-    
+    set val(lane_id), val(tile_group_id), val(num_chunks), file(R1), file(R2), file(index_fastqs), val(index_reads), file(chunk_index), val(chunk_id), val(chunk_number), val(read_number_offset), val(single_chunk) from demux_chunks
+
   output:
-    file "*.fastq.gz" into barcode_fastqs mode flatten
-    file "*.stats.json" into barcode_stats_json mode flatten
-    file "*.index_counts.csv" into index_counts_csv mode flatten
-    file "*.tag_pair_counts.csv" into tag_pair_counts_csv mode flatten
-    file "*.pcr_pair_counts.csv" into pcr_pair_counts_csv mode flatten
-    file ("stop_flag") into bcl2fastq_fastqsStopFlagOutChannel
+    set val(lane_id), val(tile_group_id), val(num_chunks), file("demux_chunk_${lane_id}_${chunk_id}") optional true into barcode_chunks
+    file "*.fastq.gz" optional true into single_chunk_barcode_fastqs mode flatten
+    file "*.stats.json" optional true into single_chunk_barcode_stats_json mode flatten
+    file "*.index_counts.csv" optional true into single_chunk_index_counts_csv mode flatten
+    file "*.tag_pair_counts.csv" optional true into single_chunk_tag_pair_counts_csv mode flatten
+    file "*.pcr_pair_counts.csv" optional true into single_chunk_pcr_pair_counts_csv mode flatten
+    file "*.pair_matrix.csv" optional true into single_chunk_pair_matrix_csv mode flatten
+    file "*.unassigned_top.csv" optional true into single_chunk_unassigned_top_csv mode flatten
+    file "*.qc.{json,tsv}" optional true into single_chunk_barcode_qc_metrics mode flatten
+    file "*.trim_stats.json" optional true into single_chunk_barcode_trim_stats mode flatten
+    file "*.cell_counts*" optional true into single_chunk_barcode_cell_counts mode flatten
+    file "*.hash*" optional true into single_chunk_barcode_hash_counts mode flatten
+    file "subsample_*/*.fastq.gz" optional true into single_chunk_barcode_subsample_fastqs mode flatten
+    file "*.barcodes.{bin,json}" optional true into single_chunk_barcode_sidecar mode flatten
+    file "*.rescue_stats.json" optional true into single_chunk_barcode_rescue_stats mode flatten
+    file "*.indel_stats.json" optional true into single_chunk_barcode_indel_stats mode flatten
+    file "*.quality_stats.json" optional true into single_chunk_barcode_quality_stats mode flatten
+    file "*.manifest.json" optional true into single_chunk_barcode_manifest mode flatten
+    file ("stop_flag") optional true into single_chunk_stop_flag
 
   script:
+  if( single_chunk ) {
+    demux_out_dir = '.'
+    read_inputs = "-1 <(zcat $R1) -2 <(zcat $R2)"
+    index_reads_options = index_reads ? "--index1 <(zcat ${index_fastqs[0]}) --index2 <(zcat ${index_fastqs[1]})" : ''
+    manifest_log_option = '-J *.manifest.json'
+    stop_flag_command = 'touch stop_flag'
+  } else {
+    demux_out_dir = "demux_chunk_${lane_id}_${chunk_id}"
+    read_inputs = "-1 <($script_dir/fastq_chunker.py read --index $chunk_index --chunk $chunk_number --read 1) -2 <($script_dir/fastq_chunker.py read --index $chunk_index --chunk $chunk_number --read 2)"
+    index_reads_options = index_reads ? "--index1 <($script_dir/fastq_chunker.py read --index $chunk_index --chunk $chunk_number --read I1) --index2 <($script_dir/fastq_chunker.py read --index $chunk_index --chunk $chunk_number --read I2)" : ''
+    manifest_log_option = ''
+    stop_flag_command = ''
+  }
   """
   # bash watch for errors
   set -ueo pipefail
@@ -488,11 +802,12 @@ process barcode_correct {
   #
   pypy $script_dir/barcode_correct_sciatac.py \
                        --samplesheet $sample_sheet \
-                       -1 <(zcat $R1) \
-                       -2 <(zcat $R2) \
+                       $read_inputs \
+                       $index_reads_options \
                        --filename $R1 \
-                       --out_dir . \
+                       --out_dir $demux_out_dir \
                        --stats_out 1 \
+                       --read_number_offset ${read_number_offset} \
                        --num_pigz_threads ${task.ext.num_pigz_threads} \
                        --write_buffer_blocks ${demux_buffer_blocks} \
                        $options_barcode_correct \
@@ -508,24 +823,134 @@ process barcode_correct {
   -v 'echo "not available"' \
   -s \${START_TIME} \
   -e \${STOP_TIME} \
-  -f *.stats.json \
+  -f $demux_out_dir/*.stats.json \
+  $manifest_log_option \
   -d ${log_dir} \
   -c "pypy $script_dir/barcode_correct_sciatac.py \
 --samplesheet $sample_sheet \
--1 <(zcat $R1) \
--2 <(zcat $R2) \
+$read_inputs \
+$index_reads_options \
 --filename $R1 \
---out_dir . \
+--out_dir $demux_out_dir \
 --stats_out 1 \
+--read_number_offset ${read_number_offset} \
 --num_pigz_threads ${task.ext.num_pigz_threads} \
 --write_buffer_blocks ${demux_buffer_blocks} \
 $options_barcode_correct \
 $sequencer_flag"
 
+  $stop_flag_command
+  """
+}
+
+
+/*
+** Group the barcode_correct chunk directories by lane. The chunks are
+** grouped first by tile group, using the number of chunks in the tile
+** group, and then by lane, using the number of tile groups in the lane,
+** so that each lane is emitted as soon as its own chunks are done
+** rather than when all barcode_correct tasks end.
+*/
+barcode_chunks
+  .map { lane_id, tile_group_id, num_chunks, chunk_dir -> [ groupKey( "${lane_id}_${tile_group_id}", num_chunks ), lane_id, chunk_dir ] }
+  .groupTuple()
+  .map { tile_group_key, lane_ids, chunk_dirs -> [ groupKey( lane_ids[0], laneTileGroupCount( lane_ids[0][1..-1] as Integer ) ), lane_ids[0], chunk_dirs ] }
+  .groupTuple()
+  .map { lane_key, lane_ids, chunk_dirs -> [ lane_ids[0], chunk_dirs.collectMany { it } ] }
+  .set { lane_chunk_dirs }
+
+
+/*
+** Gather the barcode_correct chunk outputs of each lane that has more
+** than one chunk into the lane output files.
+**
+** Notes:
+**   o  gather_demux_chunks.py concatenates the gzip members of the
+**      sample fastq files and sums the stats JSON and count CSV files.
+**   o  the barcode_stats_json output channel is a dummy channel. It appears
+**      that the files do not get copied by the publishDir
+**      directive if these files are not in a channel.
+*/
+process gather_demux_chunks {
+  cache 'lenient'
+  errorStrategy onError
+  publishDir    path: "${demux_dir}", saveAs: { qualifyFilename( it, sample_fastq_subdir ) }, pattern: "*.fastq.gz", mode: 'copy'
+  publishDir    path: "${demux_dir}", saveAs: { qualifyFilename( it, sample_fastq_subdir ) }, pattern: "*.trim_stats.json", mode: 'copy'
+  publishDir    path: "${demux_dir}", saveAs: { qualifyFilename( it, sample_fastq_subdir ) }, pattern: "*.cell_counts*", mode: 'copy'
+  publishDir    path: "${demux_dir}", saveAs: { qualifyFilename( it, sample_fastq_subdir ) }, pattern: "*.hash*", mode: 'copy'
+  publishDir    path: "${demux_dir}", saveAs: { qualifyFilename( new File( it ).getName(), 'fastqs_' + new File( it ).getParent() ) }, pattern: "subsample_*/*.fastq.gz", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.stats.json", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.index_counts.csv", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.tag_pair_counts.csv", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.pcr_pair_counts.csv", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.pair_matrix.csv", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.unassigned_top.csv", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.barcodes.{bin,json}", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.rescue_stats.json", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.indel_stats.json", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.quality_stats.json", mode: 'copy'
+  publishDir    path: "${demux_dir}/fastqs_barcode", pattern: "*.manifest.json", mode: 'copy'
+  publishDir    path: "${output_dir}/demux_qc", pattern: "*.qc.{json,tsv}", mode: 'copy'
+
+  input:
+    set val(lane_id), file(chunk_dirs) from lane_chunk_dirs
+
+  output:
+    file "*.fastq.gz" into gathered_barcode_fastqs mode flatten
+    file "*.stats.json" into gathered_barcode_stats_json mode flatten
+    file "*.index_counts.csv" into gathered_index_counts_csv mode flatten
+    file "*.tag_pair_counts.csv" into gathered_tag_pair_counts_csv mode flatten
+    file "*.pcr_pair_counts.csv" into gathered_pcr_pair_counts_csv mode flatten
+    file "*.pair_matrix.csv" into pair_matrix_csv mode flatten
+    file "*.unassigned_top.csv" into unassigned_top_csv mode flatten
+    file "*.qc.{json,tsv}" optional true into barcode_qc_metrics mode flatten
+    file "*.trim_stats.json" optional true into barcode_trim_stats mode flatten
+    file "*.cell_counts*" optional true into barcode_cell_counts mode flatten
+    file "*.hash*" optional true into barcode_hash_counts mode flatten
+    file "subsample_*/*.fastq.gz" optional true into barcode_subsample_fastqs mode flatten
+    file "*.barcodes.{bin,json}" optional true into barcode_sidecar mode flatten
+    file "*.rescue_stats.json" optional true into barcode_rescue_stats mode flatten
+    file "*.indel_stats.json" optional true into barcode_indel_stats mode flatten
+    file "*.quality_stats.json" optional true into barcode_quality_stats mode flatten
+    file "*.manifest.json" into barcode_manifest mode flatten
+    file ("stop_flag") into gathered_stop_flag
+
+  script:
+  """
+  # bash watch for errors
+  set -ueo pipefail
+
+  PROCESS_BLOCK='gather_demux_chunks'
+  SAMPLE_NAME="lane"
+  START_TIME=`date '+%Y%m%d:%H%M%S'`
+
+  $script_dir/gather_demux_chunks.py --chunk_dirs ${chunk_dirs} --out_dir .
+
+  STOP_TIME=`date '+%Y%m%d:%H%M%S'`
+  $script_dir/pipeline_logger.py \
+  -r `cat ${tmp_dir}/nextflow_run_name.txt` \
+  -n  \${SAMPLE_NAME} \
+  -x ${lane_id} \
+  -p \${PROCESS_BLOCK} \
+  -v 'echo "not available"' \
+  -s \${START_TIME} \
+  -e \${STOP_TIME} \
+  -f *.stats.json \
+  -J *.manifest.json \
+  -d ${log_dir} \
+  -c "$script_dir/gather_demux_chunks.py --chunk_dirs ${chunk_dirs} --out_dir ."
+
   touch stop_flag
   """
 }
 
+single_chunk_barcode_fastqs.mix( gathered_barcode_fastqs ).set { barcode_fastqs }
+single_chunk_barcode_stats_json.mix( gathered_barcode_stats_json ).set { barcode_stats_json }
+single_chunk_index_counts_csv.mix( gathered_index_counts_csv ).set { index_counts_csv }
+single_chunk_tag_pair_counts_csv.mix( gathered_tag_pair_counts_csv ).set { tag_pair_counts_csv }
+single_chunk_pcr_pair_counts_csv.mix( gathered_pcr_pair_counts_csv ).set { pcr_pair_counts_csv }
+single_chunk_stop_flag.mix( gathered_stop_flag ).set { bcl2fastq_fastqsStopFlagOutChannel }
+
 
 /*
 ** This is the end of the 'fastq-producing' sciatac_pipeline processing steps.
@@ -534,14 +959,20 @@ $sequencer_flag"
 
 /*
 ** Run fastqc on bcl2fastq output (lanes) files.
+** Notes:
+**   o  skipped when params.bcl2fastq_tile_groups is set because the
+**      tile group fastq files of a lane have the same names.
 */
 process fastqc_lanes {
   cache 'lenient'
   errorStrategy onError
   publishDir path: "$output_dir", pattern: "fastqc_lanes", mode: 'copy'
 
+  when:
+    params.bcl2fastq_tile_groups == 0
+
   input:
-    file fastq from bcl2fastq_fastqsOutChannelCopy02.collect()
+    file fastq from bcl2fastq_fastqsOutChannelCopy02.map { it[1..2] }.collect()
 
   output:
     file fastqc_lanes into fastqcLanesOutChannel
@@ -581,12 +1012,18 @@ process fastqc_lanes {
 
 /*
 ** Run fastqc on barcode corrected fastq files by sample.
+** Notes:
+**   o  skipped when params.demux_qc_metrics is true because
+**      barcode_correct writes the metrics to demux_qc.
 */
 process fastqc_samples {
   cache 'lenient'
   errorStrategy onError
   publishDir path: "$output_dir", pattern: "fastqc_sample", mode: 'copy'
 
+  when:
+    !params.demux_qc_metrics
+
   input:
     file fastq from barcode_fastqs.collect()
 
@@ -807,6 +1244,21 @@ def writeHelp() {
     log.info '    params.max_mem_bcl2fastq = 40              The maximum number of GB of RAM to allocate for bcl2fastq run'
     log.info '    params.index_recipe = 0                    Set explicitly the index recipe. Default is 0 for implicit selection'
     log.info '    params.demux_buffer_blocks = 16            The number of 8K blocks to use for demux output buffer.'
+    log.info '    params.demux_qc_metrics = false            Collect sample fastq quality metrics during demux instead of running fastqc on the sample fastqs.'
+    log.info '    params.demux_qc_sample_interval = 100      Collect demux quality metrics from one in every demux_qc_sample_interval read pairs of each sample.'
+    log.info '    params.demux_trim_adapters = false         Trim Nextera adapters from the sample read pairs during demux.'
+    log.info '    params.demux_trim_quality = 0              Trim trailing bases below this quality during demux adapter trimming (0 disables).'
+    log.info '    params.demux_cell_counts = false           Write per-cell read counts and a knee plot summary for each sample during demux.'
+    log.info '    params.demux_barcode_sidecar = false       Write per-read corrected barcode indexes for re-splitting with resplit_sciatac.py.'
+    log.info '    params.demux_rescue = false                Rescue read pairs that fail barcode correction with a relaxed second pass.'
+    log.info '    params.demux_indel_correction = null       Comma-separated barcode types for which indexes that fail mismatch correction are corrected for single-base indels, for example \'pcr_i7,pcr_i5\'.'
+    log.info '    params.demux_index_reads = false           Write I1 and I2 index read fastqs in bcl2fastq and read the demux index sequences from them rather than from the R1 read names.'
+    log.info '    params.demux_quality_correction = null     Comma-separated barcode types for which indexes that fail mismatch correction are corrected using the index read base qualities, for example \'pcr_i7,pcr_i5\'. Requires params.demux_index_reads.'
+    log.info '    params.demux_hash_reads = false            Count sciPlex hash reads by cell during demux using the samplesheet hash_file. Every demuxed read pair is matched, so ATAC reads can give false hash hits.'
+    log.info '    params.demux_subsample = null              Comma-separated read pair fractions for subsampled sample fastqs written during demux, for example \'0.01,0.1\'.'
+    log.info '    params.demux_chunk_bytes = 0               Split each lane into chunks of about this many compressed R1 bytes for demux (0 makes one chunk per lane). Splitting decompresses the R1 file and then the R2 (and I1 and I2) files in parallel before demux starts.'
+    log.info '    params.demux_max_chunks = 64               Maximum number of demux chunks for each lane.'
+    log.info '    params.bcl2fastq_tile_groups = 0           Convert each lane in this many bcl2fastq tile group tasks (0 converts the run in one task). Cannot be used with demux_cell_counts, demux_hash_reads, or demux_qc_metrics.'
     log.info '    process.maxForks = 20                      The maximum number of processes to run at the same time on the cluster.'
     log.info '    process.queue = "trapnell-short.q"         The queue on the cluster where the jobs should be submitted. '
     log.info ''
@@ -837,6 +1289,18 @@ def reportRunParams( params, sampleSheetMap ) {
     s += String.format( "Maximum bcl2fastq cpus:        %d\n", params.bcl2fastq_cpus )
     s += String.format( "Maximum memory for bcl2fastq:  %d\n", params.max_mem_bcl2fastq )
     s += String.format( "Demux buffer blocks:           %d\n", params.demux_buffer_blocks )
+    s += String.format( "Demux QC metrics:              %b\n", params.demux_qc_metrics )
+    s += String.format( "Demux adapter trimming:        %b\n", params.demux_trim_adapters )
+    s += String.format( "Demux cell counts:             %b\n", params.demux_cell_counts )
+    s += String.format( "Demux barcode sidecar:         %b\n", params.demux_barcode_sidecar )
+    s += String.format( "Demux barcode rescue:          %b\n", params.demux_rescue )
+    s += String.format( "Demux indel correction:        %s\n", params.demux_indel_correction ?: 'none' )
+    s += String.format( "Demux index reads:             %b\n", params.demux_index_reads )
+    s += String.format( "Demux quality correction:      %s\n", params.demux_quality_correction ?: 'none' )
+    s += String.format( "Demux hash reads:              %b\n", params.demux_hash_reads )
+    s += String.format( "Demux subsample fractions:     %s\n", params.demux_subsample ?: 'none' )
+    s += String.format( "Demux chunk bytes:             %d\n", params.demux_chunk_bytes )
+    s += String.format( "bcl2fastq tile groups:         %d\n", params.bcl2fastq_tile_groups )
     s += String.format( "\n" )
     print( s )
 
@@ -985,6 +1449,23 @@ def makeSampleList(sampleData) {
 }
 
 
+def readTileGroups( params ) {
+    def command = "${script_dir}/tile_groups.py ${params.run_dir} --groups ${params.bcl2fastq_tile_groups}"
+    def strOut = new StringBuffer()
+    def strErr = new StringBuffer()
+    def proc = command.execute()
+    def jsonSlurper = new JsonSlurper()
+
+    proc.consumeProcessOutput(strOut, strErr)
+    proc.waitForProcessOutput()
+    if( proc.exitValue() != 0 ) {
+        System.err << strErr.toString()
+        System.exit( -1 )
+    }
+    return( jsonSlurper.parseText(strOut.toString()) )
+}
+
+
 def readIlluminaRunInfo( params ) {
     def command = "${script_dir}/read_run_info.py ${params.run_dir} ATAC-seq"
     def strOut = new StringBuffer()
@@ -17,6 +17,11 @@
 # Check the output with
 #   cat run_merge.log4 | grep '^Line' | awk '{if($7!=$9){print$7,$8,$9}}'
 #
+# Note: src/merge_demux_runs.py merges the fastqs_barcode and fastqs_trim
+# files of all samples without decompressing them, checks the R1/R2 record
+# counts, and writes a merged manifest. For example,
+#   python src/merge_demux_runs.py --demux_dirs ${src1_root_dir}/demux_out ${src2_root_dir}/demux_out --out_dir ${dst_root_dir}/demux_out
+#
 
 log_file='run_merge.log'
 
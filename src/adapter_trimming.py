@@ -0,0 +1,239 @@
+#
+# Adapter and quality trimming of read pairs in the demux loop.
+#
+# Notes:
+#   o  this replaces a separate Trimmomatic pass over the demuxed
+#      fastq files for Nextera libraries. The trimming follows the
+#      Trimmomatic palindrome convention: the adapter file entries
+#      with names ending in /1 and /2 are the adapter prefixes and
+#      their reverse complements appear at the 3' end of reads 1 and
+#      2 when the read runs through a short insert.
+#   o  an adapter is located in a read by searching for seed k-mers
+#      (str.find) and verifying the remainder of the overlap with a
+#      mismatch limit. A partial adapter at the 3' end of the read,
+#      shorter than the seed, must match exactly.
+#   o  a seeded adapter hit gives the insert length, which is the same
+#      for both reads of a pair, so both reads are trimmed to the
+#      shorter of the hits. A partial 3' hit trims only its own read.
+#   o  quality trimming removes trailing bases below a quality
+#      threshold, as Trimmomatic TRAILING does.
+#   o  pairs in which either read is shorter than min_length after
+#      trimming are dropped.
+#
+
+TRIM_SEED_LENGTH = 10
+TRIM_MIN_OVERLAP = 5
+TRIM_MAX_MISMATCH_RATE = 0.1
+TRIM_MIN_LENGTH = 20
+
+_complements = {'A': 'T', 'T': 'A', 'G': 'C', 'C': 'G', 'N': 'N'}
+
+
+def reverse_complement(x):
+    return ''.join([_complements[z] for z in x[::-1]])
+
+
+def read_adapter_fasta(file_name):
+    """
+    Read adapter sequences from a FASTA file.
+    Args:
+        file_name (str): FASTA file name
+    Returns:
+        list of (str, str): adapter (name, sequence) tuples in file order
+    """
+    adapters = []
+    name = None
+    seq_parts = []
+    with open(file_name, 'rt') as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            if line.startswith('>'):
+                if name is not None:
+                    adapters.append((name, ''.join(seq_parts).upper()))
+                name = line[1:].split()[0]
+                seq_parts = []
+            else:
+                seq_parts.append(line)
+    if name is not None:
+        adapters.append((name, ''.join(seq_parts).upper()))
+    return adapters
+
+
+def get_read_through_adapters(adapters):
+    """
+    Get the 3' read-through adapters for read 1 and read 2 from the
+    palindrome prefix adapters (names ending in /1 and /2).
+    Returns:
+        (list of str, list of str): distinct read 1 and read 2 adapters
+    """
+    r1_adapters = []
+    r2_adapters = []
+    for name, seq in adapters:
+        if name.endswith('/1'):
+            adapter = reverse_complement(seq)
+            if adapter not in r1_adapters:
+                r1_adapters.append(adapter)
+        elif name.endswith('/2'):
+            adapter = reverse_complement(seq)
+            if adapter not in r2_adapters:
+                r2_adapters.append(adapter)
+    if len(r1_adapters) == 0 or len(r2_adapters) == 0:
+        raise ValueError('Adapter file must have palindrome prefix adapters with names ending in /1 and /2.')
+    return r1_adapters, r2_adapters
+
+
+def new_trim_stats():
+    return {'input_pairs': 0,
+            'output_pairs': 0,
+            'dropped_short_pairs': 0,
+            'r1_adapter_trimmed': 0,
+            'r2_adapter_trimmed': 0,
+            'r1_quality_trimmed': 0,
+            'r2_quality_trimmed': 0,
+            'adapter_trimmed_bases': 0,
+            'quality_trimmed_bases': 0}
+
+
+class AdapterTrimmer:
+    def __init__(self, r1_adapters, r2_adapters, seed_length=TRIM_SEED_LENGTH, min_overlap=TRIM_MIN_OVERLAP, max_mismatch_rate=TRIM_MAX_MISMATCH_RATE, quality_threshold=0, min_length=TRIM_MIN_LENGTH, phred_offset=33):
+        if seed_length < 1 or min_overlap < 1:
+            raise ValueError('Adapter seed length and minimum overlap must be positive integers.')
+        self.seed_length = seed_length
+        self.min_overlap = min_overlap
+        self.max_mismatch_rate = max_mismatch_rate
+        self.quality_threshold = quality_threshold
+        self.quality_char = chr(quality_threshold + phred_offset)
+        self.min_length = min_length
+        self.r1_adapters = r1_adapters
+        self.r2_adapters = r2_adapters
+        self.r1_seeds = self._make_seeds(r1_adapters)
+        self.r2_seeds = self._make_seeds(r2_adapters)
+
+    def _make_seeds(self, adapters):
+        """
+        Seeds are adapter k-mers that tile the adapter, with the last one
+        aligned to the adapter end, so that one sequencing error in the
+        adapter is unlikely to hide it. Each seed is stored with its
+        offset in the adapter.
+        """
+        seeds = []
+        for adapter in adapters:
+            offsets = list(range(0, len(adapter) - self.seed_length + 1, self.seed_length))
+            if len(adapter) >= self.seed_length and offsets[-1] != len(adapter) - self.seed_length:
+                offsets.append(len(adapter) - self.seed_length)
+            for offset in offsets:
+                seeds.append((adapter[offset:offset + self.seed_length], offset, adapter))
+        return seeds
+
+    def _verify(self, seq, start, adapter):
+        overlap = min(len(seq) - start, len(adapter))
+        max_mismatches = int(self.max_mismatch_rate * overlap)
+        mismatches = 0
+        for i in range(overlap):
+            if seq[start + i] != adapter[i]:
+                mismatches += 1
+                if mismatches > max_mismatches:
+                    return False
+        return True
+
+    def find_adapter(self, seq, seeds, adapters):
+        """
+        Find the adapter start in a read.
+        Args:
+            seq (str): read sequence
+            seeds (list): adapter seeds from _make_seeds
+            adapters (list of str): adapter sequences
+        Returns:
+            (int, bool): adapter start or -1 if not found and True if the
+                         hit came from a seed (gives the insert length)
+        """
+        best = -1
+        for seed, offset, adapter in seeds:
+            pos = seq.find(seed)
+            while pos >= 0:
+                start = pos - offset
+                if best >= 0 and start >= best:
+                    break
+                if start >= 0 and self._verify(seq, start, adapter):
+                    best = start
+                    break
+                pos = seq.find(seed, pos + 1)
+        if best >= 0:
+            return best, True
+
+        # Partial adapter at the 3' end of the read.
+        seq_length = len(seq)
+        for adapter in adapters:
+            max_overlap = min(self.seed_length, len(adapter), seq_length) - 1
+            for overlap in range(max_overlap, self.min_overlap - 1, -1):
+                if seq.endswith(adapter[:overlap]):
+                    start = seq_length - overlap
+                    if best < 0 or start < best:
+                        best = start
+                    break
+        return best, False
+
+    def _quality_trim(self, qual, end):
+        quality_char = self.quality_char
+        while end > 0 and qual[end - 1] < quality_char:
+            end -= 1
+        return end
+
+    def trim_pair(self, r1_seq, r1_qual, r2_seq, r2_qual, stats):
+        """
+        Trim adapters and low quality trailing bases from a read pair.
+        Args:
+            r1_seq, r1_qual, r2_seq, r2_qual (str): read pair
+            stats (dict): trim statistics from new_trim_stats(), updated in place
+        Returns:
+            tuple: trimmed (r1_seq, r1_qual, r2_seq, r2_qual) or None if
+                   the pair is dropped
+        """
+        stats['input_pairs'] += 1
+        r1_length = len(r1_seq)
+        r2_length = len(r2_seq)
+
+        r1_start, r1_seeded = self.find_adapter(r1_seq, self.r1_seeds, self.r1_adapters)
+        r2_start, r2_seeded = self.find_adapter(r2_seq, self.r2_seeds, self.r2_adapters)
+
+        # A seeded hit in one read gives the insert length for both.
+        r1_end = r1_start if r1_start >= 0 else r1_length
+        r2_end = r2_start if r2_start >= 0 else r2_length
+        if r1_seeded or r2_seeded:
+            insert_length = min(r1_end if r1_seeded else r1_length, r2_end if r2_seeded else r2_length)
+            r1_end = min(r1_end, insert_length)
+            r2_end = min(r2_end, insert_length)
+
+        if r1_end < r1_length:
+            stats['r1_adapter_trimmed'] += 1
+            stats['adapter_trimmed_bases'] += r1_length - r1_end
+        if r2_end < r2_length:
+            stats['r2_adapter_trimmed'] += 1
+            stats['adapter_trimmed_bases'] += r2_length - r2_end
+
+        if self.quality_threshold > 0:
+            r1_qend = self._quality_trim(r1_qual, r1_end)
+            r2_qend = self._quality_trim(r2_qual, r2_end)
+            if r1_qend < r1_end:
+                stats['r1_quality_trimmed'] += 1
+                stats['quality_trimmed_bases'] += r1_end - r1_qend
+            if r2_qend < r2_end:
+                stats['r2_quality_trimmed'] += 1
+                stats['quality_trimmed_bases'] += r2_end - r2_qend
+            r1_end = r1_qend
+            r2_end = r2_qend
+
+        if r1_end < self.min_length or r2_end < self.min_length:
+            stats['dropped_short_pairs'] += 1
+            return None
+
+        stats['output_pairs'] += 1
+        if r1_end < r1_length:
+            r1_seq = r1_seq[:r1_end]
+            r1_qual = r1_qual[:r1_end]
+        if r2_end < r2_length:
+            r2_seq = r2_seq[:r2_end]
+            r2_qual = r2_qual[:r2_end]
+        return r1_seq, r1_qual, r2_seq, r2_qual
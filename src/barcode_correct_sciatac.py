@@ -1,7 +1,6 @@
 from __future__ import print_function
 from __future__ import division
 import argparse
-import subprocess
 import sys
 import os
 import gzip
@@ -12,9 +11,22 @@ import timeit
 import json
 import re
 import collections
+import copy
+import zlib
+import glob
 from Bio.SeqIO.QualityIO import FastqGeneralIterator
 import barcode_to_well
 import barcode_constants as bc
+import fastq_qc
+import adapter_trimming
+import heavy_hitters
+import cell_counts
+import barcode_sidecar
+import barcode_rescue
+import indel_correction
+import quality_correction
+import hash_reads
+import output_manifest
 
 #
 # Notes:
@@ -77,7 +89,7 @@ def load_std_index_to_well_indexed_tn5_dicts(args):
     return nex_two_level_indexed_tn5_to_well, pcr_two_level_indexed_tn5_to_well
 
 
-def set_index_flags(args):
+def set_index_flags(args, index_flags):
     if args.two_level_indexed_tn5:
         for i in range( 12, 384 ):
             index_flags[1][i] = -1
@@ -334,6 +346,59 @@ def choose_header_parser(args):
     return(header_parser)
 
 
+#
+# Header index layouts for indel correction. The value for each header
+# parser is the length of the index string at the end of the read name
+# and the ends of the tagmentation i7, PCR i7, PCR i5, and tagmentation
+# i5 sequences in it.
+#
+# Note: add new header parsers to header_parser_index_ends.
+#
+header_parser_index_ends = {
+  header_parser_01: (41, (10, 20, 31, 41)),
+  header_parser_02: (41, (10, 20, 41, 31)),
+  header_parser_03: (37, (8, 18, 29, 37)),
+  header_parser_04: (37, (8, 18, 37, 27)),
+  header_parser_05: (71, (10, 35, 71, 46))
+}
+
+
+def get_index_flanks(r1_name, index_ends):
+    """
+    Returns the bases that follow the index sequences in the index reads,
+    with None for an index sequence at the end of its index read.
+    Args:
+        r1_name (str): R1 read name
+        index_ends (tuple): header_parser_index_ends value
+    """
+    barcodes_length, ends = index_ends
+    barcodes = r1_name[-barcodes_length:]
+    flanks = []
+    for end in ends:
+        flank = barcodes[end] if end < barcodes_length else None
+        flanks.append(flank if flank in ('A', 'C', 'G', 'T', 'N') else None)
+    return flanks
+
+
+def get_index_read_names(index1_reads, index2_reads):
+    """
+    Yields the index string and index quality string of each read from
+    the I1 and I2 index reads, for runs converted with bcl2fastq
+    --create-fastq-for-index-reads.
+    Args:
+        index1_reads (iterator): I1 (i7 index read) fastq records
+        index2_reads (iterator): I2 (i5 index read) fastq records
+    Notes:
+      o  the index string is the I1 sequence, '+', and the I2
+         sequence, which is the bcl2fastq read name layout, so the
+         header parsers and get_index_flanks() find the index
+         sequences in it. The index quality string has the same layout
+         so the header parsers find the index base qualities in it.
+    """
+    for (i1_name, i1_seq, i1_qual), (i2_name, i2_seq, i2_qual) in zip(index1_reads, index2_reads):
+        yield i1_seq + '+' + i2_seq, i1_qual + '+' + i2_qual
+
+
 #
 # get_barcode_seqs is superseded by the header_parser functions
 # defined above.
@@ -402,7 +467,7 @@ def required_index(a):
     """
     return len(set(tuple(a_i) for a_i in a)) != 1
     
-def get_sample_lookup(samplesheet, no_mask, pcri7, tagi7, tagi5, pcri5):
+def get_sample_lookup(samplesheet, no_mask, pcri7, tagi7, tagi5, pcri5, index_mask=None):
     """
     Takes a samplesheet file handle and returns a list of True/False indicating whether index was used in lookup and a lookup of tuples of index combinations to sample names.
 
@@ -412,6 +477,7 @@ def get_sample_lookup(samplesheet, no_mask, pcri7, tagi7, tagi5, pcri5):
         pcri5 (list): list of pcr i5 indices
         pcri7 (list): list of pcr i7 indices
         tagi7 (list): list of tag/lig i7 indices
+        index_mask (list of bool): use this index mask rather than the mask calculated from the samplesheet (optional)
 
     Returns:
         (list of bool, dict of tuple to sample name, dict of valid tagmentation index pair tuples, dict of valid PCR index pair tuples): [use_pcri7, use_tagi7, use_tagi5, use_pcri5] where each entry indicates usage of that barcode in indexing and lookup of (tagi7,tagi5), for example.
@@ -494,7 +560,8 @@ def get_sample_lookup(samplesheet, no_mask, pcri7, tagi7, tagi5, pcri5):
       use_tagi5 = True
       use_pcri5 = True
 
-    index_mask = [use_pcri7, use_tagi7, use_tagi5, use_pcri5]
+    if index_mask is None:
+        index_mask = [use_pcri7, use_tagi7, use_tagi5, use_pcri5]
     index_whitelists = [pcri7, tagi7, tagi5, pcri5]
     index_lists = [pcri7_indices, tagi7_indices, tagi5_indices, pcri5_indices]
     index_flags = [barcode_to_well.index_lists_to_flags(pcri7_indices, 384),
@@ -530,65 +597,277 @@ def get_sample_lookup(samplesheet, no_mask, pcri7, tagi7, tagi5, pcri5):
     return index_mask, sample_lookup_table, tagi5_sample_list, tag_pairs_counts, pcr_pairs_counts, index_flags
 
 
-#
-# Notes:
-#   o  the -X option reverse complements the P5 index and swaps the
-#      locations of the PCR i5 and Ligation i5 sequences in the header
-#      sequence. See the get_barcode_seqs() function above. If a
-#      problem arises, with demuxing a new chemistry/machine, this may
-#      be worth examining.
-#
-if __name__ == '__main__':
+def write_index_counts_csv(file_name, index_counts, index_flags, tagi5_sample_list):
+    """
+    Write the tag and pcr index counts by tag/pcr well.
+    Args:
+        file_name (str): output CSV file name
+        index_counts (list): tagi7, pcri7, pcri5, and tagi5 count lists
+        index_flags (list): pcri7, tagi7, tagi5, and pcri5 flag lists from get_sample_lookup()
+        tagi5_sample_list (list): sample name for each tagi5 index
+    """
+    zero_pad_col = True
+    id_length = 2
+    with open(file_name,'wt') as f:
+        f.write('well_index,i7_well,tagi7_count,tagi7_flag,pcri7_count,pcri7_flag,i5_well,pcri5_count,pcri5_flag,tagi5_count,tagi5_flag,sample_name_tagi5\n')
+        for i, counts in enumerate(zip(*index_counts), start = 0):
+            f.write(''.join([str(i),',', \
+                             str(i+1),',', \
+                             barcode_to_well.get_well_id_384_to_96(i, True, zero_pad_col, id_length),',', \
+                             str(counts[0]),',', \
+                             str(index_flags[1][i]),',', \
+                             str(counts[1]),',', \
+                             str(index_flags[0][i]),',', \
+                             barcode_to_well.get_well_id_384_to_96(i, False, zero_pad_col, id_length),',', \
+                             str(counts[2]),',', \
+                             str(index_flags[3][i]),',', \
+                             str(counts[3]),',', \
+                             str(index_flags[2][i]),',', \
+                             tagi5_sample_list[i], \
+                             '\n']))
 
-    parser = argparse.ArgumentParser(description='A program to fix erroneous barcodes in scATAC data.')
-    parser.add_argument('-1', '--input1', nargs='?', type=argparse.FileType('r'), default=sys.stdin, required=True, help='Text piped in from stdin for R1.')
-    parser.add_argument('-2', '--input2', nargs='?', type=argparse.FileType('r'), default=sys.stdin, required=True, help='Text piped in from stdin for R2.')
-    parser.add_argument('--filename', required=True, help='The R1 file name.')
-    parser.add_argument('--samplesheet', required=True, help='Samplesheet describing the layout of the samples.')
-    parser.add_argument('--out_dir', required=True, help='Output directory.')
-    parser.add_argument('--num_pigz_threads', help='Number of processes used by pigz to compress fastq files.')
-    parser.add_argument('--stats_out', required=True, help='write JSON file with output stats about processed reads and correction rates (0=no;1=yes.')
-    parser.add_argument('--two_level_indexed_tn5', action='store_true', help='Flag to run assuming that the library is a two-level indexed-TN5 sample.')
-    parser.add_argument('--wells_384', action='store_true', help='Flag to run assuming that the known barcode set is the 384 well set.')
-    parser.add_argument('--well_ids', action='store_true', help='Flag to output cell IDs that are composed of well IDs rather than the actual sequences.')
-    parser.add_argument('-X', '--nextseq', help='NextSeq run indicator', dest='nextseq', action="store_true")
-    parser.add_argument('--no_mask', action='store_true', help='Use all four barcodes. By default, do not use (mask out) a barcode(s) when all samples have the same index set (flag).')
-    parser.add_argument('--write_buffer_blocks', type=int, default=16, help='Number of 8K blocks for fastq write buffers. Default is 16.')
-    parser.add_argument('--index_recipe', required=False, default=None, help='Select index map. The index_recipes are numbered from 1 to 5. Specifying an index_recipe overrides the recipe selected implicitly by the -two_level_indexed_tn5 and -nextseq arguments. Default is None, in which case the index_recipe is selected using the -two_level_indexed_tn5 and -nextseq arguments.')
 
-    args = parser.parse_args()
+def write_tag_pair_counts_csv(file_name, tag_pairs_counts, tagi5_sample_list):
+    zero_pad_col = True
+    id_length = 2
+    with open(file_name,'wt') as f:
+        f.write('tagi7_index,tagi7_well,tagi5_index,tagi5_well,tag_pair_count,sample_name_tagi5\n')
+        for i, pair_tuple in enumerate(tag_pairs_counts.keys()):
+            f.write(''.join([str(i),',',
+                             str(pair_tuple[0]+1),',',
+                             barcode_to_well.get_well_id_384_to_96(pair_tuple[0], True, zero_pad_col, id_length),',',
+                             str(pair_tuple[1]+1),',',
+                             barcode_to_well.get_well_id_384_to_96(pair_tuple[1], False, zero_pad_col, id_length),',',
+                             str(tag_pairs_counts[pair_tuple]),',',
+                             tagi5_sample_list[pair_tuple[1]],'\n']))
+
 
-    # Note: args.filename may include (leading) directory information.
-    lane_str = args.filename
-    lane_str = re.sub('.*Undetermined_S0_L','L',lane_str)
-    lane_str = lane_str.replace('_R1_001.fastq.gz', '')
-    lane_num = int(re.sub('L', '', lane_str))
+def write_pcr_pair_counts_csv(file_name, pcr_pairs_counts):
+    zero_pad_col = True
+    id_length = 2
+    with open(file_name,'wt') as f: 
+        f.write('pcri7_index,pcri7_well,pcri5_index,pcri5_well,pcr_pair_count\n')
+        for i, pair_tuple in enumerate(pcr_pairs_counts.keys()):
+            f.write(''.join([str(i),',',
+                             str(pair_tuple[0]+1),',',
+                             barcode_to_well.get_well_id_384_to_96(pair_tuple[0], True, zero_pad_col, id_length),',',
+                             str(pair_tuple[1]+1),',',
+                             barcode_to_well.get_well_id_384_to_96(pair_tuple[1], False, zero_pad_col, id_length),',',
+                             str(pcr_pairs_counts[pair_tuple]),'\n']))
 
-    if args.two_level_indexed_tn5 and args.wells_384:
-        raise ValueError('There is no 384 well barcode set for indexed Tn5, may not specify both --two_level_indexed_tn5 and --wells_384.')
+
+def compress_output_files(output_files, num_pigz_threads, base_dir='.'):
+    """
+    Close the sample fastq files and compress them with pigz.
+    Returns:
+        list of dict: output manifest entries for the compressed files
+    """
+    manifest_entries = []
+    for sample in output_files:
+        output_files[sample]['r1'].close()
+        output_files[sample]['r2'].close()
+        manifest_entries.append(output_manifest.compress_file(output_files[sample]['r1_name'], num_pigz_threads, base_dir, output_files[sample].get('records')))
+        manifest_entries.append(output_manifest.compress_file(output_files[sample]['r2_name'], num_pigz_threads, base_dir, output_files[sample].get('records')))
+    return manifest_entries
+
+
+def pair_counts_to_flags(pairs_counts, num_wells):
+    """
+    Make a flat flag list, indexed by i7_index * num_wells + i5_index, for
+    the index pairs in a pair counts dictionary.
+    """
+    pair_flags = bytearray(num_wells * num_wells)
+    for i7_index, i5_index in pairs_counts:
+        pair_flags[i7_index * num_wells + i5_index] = 1
+    return pair_flags
+
+
+def write_pair_matrix(file_name, prefix, pair_matrix, pair_flags, num_wells):
+    """
+    Write the non-zero counts of a flat i7 x i5 pair count list as a
+    sparse matrix in CSV format, one row per observed index pair.
+    Args:
+        file_name (str): output CSV file name
+        prefix (str): 'tag' or 'pcr' column name prefix
+        pair_matrix (list): pair counts indexed by i7_index * num_wells + i5_index
+        pair_flags (bytearray): samplesheet pair flags with the same indexing
+        num_wells (int): number of wells in each index set
+    """
+    zero_pad_col = True
+    id_length = 2
+    with open(file_name, 'wt') as f:
+        f.write('%si7_index,%si7_well,%si5_index,%si5_well,pair_count,in_samplesheet\n' % (prefix, prefix, prefix, prefix))
+        for i7_index in range(num_wells):
+            offset = i7_index * num_wells
+            i7_well = None
+            for i5_index in range(num_wells):
+                count = pair_matrix[offset + i5_index]
+                if count == 0:
+                    continue
+                if i7_well is None:
+                    i7_well = barcode_to_well.get_well_id_384_to_96(i7_index, True, zero_pad_col, id_length)
+                f.write(''.join([str(i7_index+1),',',
+                                 i7_well,',',
+                                 str(i5_index+1),',',
+                                 barcode_to_well.get_well_id_384_to_96(i5_index, False, zero_pad_col, id_length),',',
+                                 str(count),',',
+                                 str(pair_flags[offset + i5_index]),'\n']))
+
+
+def write_unassigned_top(file_name, top_n, failed_correction_top, not_in_samplesheet_top, correction_maps, to_index_dicts, index_lists):
+    """
+    Write the most frequent index combinations of unassigned reads.
+    Args:
+        file_name (str): output CSV file name
+        top_n (int): number of rows written for each category
+        failed_correction_top (SpaceSaving): raw index sequence tuples of reads that failed correction
+        not_in_samplesheet_top (SpaceSaving): whitelist index tuples of corrected reads not in the samplesheet
+        correction_maps (list): tagi7, pcri7, pcri5, and tagi5 mismatch to whitelist maps
+        to_index_dicts (list): tagi7, pcri7, pcri5, and tagi5 whitelist sequence to index dicts
+        index_lists (list): tagi7, pcri7, pcri5, and tagi5 index sequence lists
+    Notes:
+      o  the index order is tagi7, pcri7, pcri5, tagi5 throughout.
+      o  count is the Space-Saving estimate, which may over-count by at
+         most max_overcount. max_undercount is 0 here. It is set by
+         gather_demux_chunks.py for a combination that is missing from
+         the rows of some chunks.
+      o  for failed_correction rows, the sequences are the raw sequences
+         and the well is NA for each index that fails correction. For
+         not_in_samplesheet rows, the sequences are the whitelist
+         sequences.
+    """
+    zero_pad_col = True
+    id_length = 2
+    row_ordered = [True, True, False, False]
+    with open(file_name, 'wt') as f:
+        f.write('category,count,max_overcount,max_undercount,tagi7_seq,pcri7_seq,pcri5_seq,tagi5_seq,tagi7_well,pcri7_well,pcri5_well,tagi5_well\n')
+        for raw_barcodes, count, max_overcount in failed_correction_top.top(top_n):
+            wells = []
+            for i in range(4):
+                corrected_seq = correct_barcode(raw_barcodes[i], correction_maps[i])
+                if corrected_seq is None:
+                    wells.append('NA')
+                else:
+                    wells.append(barcode_to_well.get_well_id_384_to_96(to_index_dicts[i][corrected_seq], row_ordered[i], zero_pad_col, id_length))
+            f.write('%s\n' % ','.join(['failed_correction', str(count), str(max_overcount), '0'] + list(raw_barcodes) + wells))
+        for indexes, count, max_overcount in not_in_samplesheet_top.top(top_n):
+            seqs = [index_lists[i][indexes[i]] for i in range(4)]
+            wells = [barcode_to_well.get_well_id_384_to_96(indexes[i], row_ordered[i], zero_pad_col, id_length) for i in range(4)]
+            f.write('%s\n' % ','.join(['not_in_samplesheet', str(count), str(max_overcount), '0'] + seqs + wells))
+
+
+def load_samplesheets(samplesheet_files, no_mask, pcri7, tagi7, tagi5, pcri5):
+    """
+    Build the sample lookup for one or more samplesheets.
+    Args:
+        samplesheet_files (list of str): samplesheet JSON file names
+        no_mask, pcri7, tagi7, tagi5, pcri5: as for get_sample_lookup()
+    Returns:
+        the get_sample_lookup() return values followed by a list of
+        projects, which is None for a single samplesheet. Each project
+        is a dict with the project name, samplesheet file, and the
+        get_sample_lookup() tagi5_sample_list, tag_pairs_counts,
+        pcr_pairs_counts, and index_flags for its samplesheet.
+    Notes:
+      o  a single samplesheet is handled exactly as before.
+      o  for several samplesheets, the project name is the samplesheet
+         file name without the directory and extension, and the sample
+         lookup values are '<project>/<sample>' so that the sample
+         files are written to per-project directories.
+      o  the index mask is calculated from the samples of all of the
+         samplesheets so that it distinguishes the projects as well as
+         the samples. The lane-level index and pair flags are for the
+         samples of all of the samplesheets.
+      o  an index combination that is in more than one samplesheet is
+         an error.
+    """
+    if len(samplesheet_files) == 1:
+        return get_sample_lookup(open(samplesheet_files[0]), no_mask, pcri7, tagi7, tagi5, pcri5) + (None,)
+
+    samplesheets = []
+    project_names = []
+    for samplesheet_file in samplesheet_files:
+        project_name = os.path.splitext(os.path.basename(samplesheet_file))[0]
+        if project_name in project_names:
+            raise ValueError('Samplesheet file names must be distinct: \'%s\' is used more than once.' % project_name)
+        project_names.append(project_name)
+        with open(samplesheet_file) as fp:
+            samplesheets.append(json.load(fp))
+
+    combined_samplesheet = {'sample_index_list': [sample_indices for samplesheet in samplesheets for sample_indices in samplesheet['sample_index_list']]}
+    index_mask, combined_lookup, tagi5_sample_list, tag_pairs_counts, pcr_pairs_counts, index_flags = get_sample_lookup(io.StringIO(json.dumps(combined_samplesheet)), no_mask, pcri7, tagi7, tagi5, pcri5)
+
+    sample_lookup = {}
+    collisions = []
+    projects = []
+    for project_name, samplesheet_file, samplesheet in zip(project_names, samplesheet_files, samplesheets):
+        _, project_lookup, project_tagi5_sample_list, project_tag_pairs_counts, project_pcr_pairs_counts, project_index_flags = get_sample_lookup(io.StringIO(json.dumps(samplesheet)), no_mask, pcri7, tagi7, tagi5, pcri5, index_mask)
+        for combination, sample in project_lookup.items():
+            sample_key = '%s/%s' % (project_name, sample)
+            other_sample_key = sample_lookup.get(combination)
+            if other_sample_key is not None and other_sample_key.split('/')[0] != project_name:
+                collisions.append('%s and %s share index combination %s' % (other_sample_key, sample_key, ','.join(combination)))
+                continue
+            sample_lookup[combination] = sample_key
+        projects.append({'name': project_name,
+                         'samplesheet': samplesheet_file,
+                         'tagi5_sample_list': project_tagi5_sample_list,
+                         'tag_pairs_counts': project_tag_pairs_counts,
+                         'pcr_pairs_counts': project_pcr_pairs_counts,
+                         'index_flags': project_index_flags})
+
+    if len(collisions) > 0:
+        raise ValueError('Samplesheet index collisions (%d):\n  %s' % (len(collisions), '\n  '.join(collisions[0:20])))
+
+    return index_mask, sample_lookup, tagi5_sample_list, tag_pairs_counts, pcr_pairs_counts, index_flags, projects
+
+
+def open_fastq(file_name):
+    """
+    Open a fastq input file, which may be gzipped, a pipe, or '-' for
+    stdin.
+    """
+    if file_name == '-':
+        return sys.stdin
+    if file_name.endswith('.gz'):
+        return io.TextIOWrapper(io.BufferedReader(gzip.open(file_name, 'rb'), buffer_size=1048576))
+    return open(file_name, 'rt')
+
+
+def get_index_tables_key(args):
+    """
+    Returns the tuple of the arguments that determine the index tables.
+    """
+    return (args.two_level_indexed_tn5, args.wells_384, args.nextseq)
+
+
+def build_index_tables(args):
+    """
+    Build the index lists, index to well dicts, whitelists, and
+    correction maps for the index sets selected by args.
+    Returns:
+        dict: index tables keyed by variable name
+    Notes:
+      o  the tables depend only on the get_index_tables_key() arguments
+         and are not modified by run_demux() so they can be shared by
+         runs with the same key.
+    """
+    tables = {}
 
     # Load index sequence sets.
     # Note: replace this in order to read index sequences
     # from a file. The choose_header_parser() may need to
     # be expanded as well if the index locations change.
     tagi7, pcri7, pcri5, tagi5 = load_std_index_lists(args)
+    tables.update({'tagi7': tagi7, 'pcri7': pcri7, 'pcri5': pcri5, 'tagi5': tagi5})
 
     # Load index to well dictionaries.
     # Note: replace this in order to read index sequences
     # from a file.
     if(not args.two_level_indexed_tn5):
-      lig_i7_to_well, lig_i5_to_well, pcr_to_well = load_std_index_to_well_dicts(args)
+      tables['lig_i7_to_well'], tables['lig_i5_to_well'], tables['pcr_to_well'] = load_std_index_to_well_dicts(args)
     else:
-      nex_two_level_indexed_tn5_to_well, pcr_two_level_indexed_tn5_to_well = load_std_index_to_well_indexed_tn5_dicts(args)
-
-    # Build up sample mapping from indices to samples
-    index_mask, sample_lookup, tagi5_sample_list, tag_pairs_counts, pcr_pairs_counts, index_flags = get_sample_lookup(open(args.samplesheet), args.no_mask, pcri7, tagi7, tagi5, pcri5)
-
-
-    # Set index flags.
-    # Note: modify this if the numbers of index sequences
-    # change.
-    index_flag = set_index_flags(args)
+      tables['nex_two_level_indexed_tn5_to_well'], tables['pcr_two_level_indexed_tn5_to_well'] = load_std_index_to_well_indexed_tn5_dicts(args)
 
     # Set up index whitelist lists, and reverse complement
     # lists, if necessary.
@@ -601,12 +880,18 @@ if __name__ == '__main__':
         #       whitelists.
         p5_pcr_rc_map = {reverse_complement(k):k for k in pcri5}
         p5_tagmentation_rc_map = {reverse_complement(k):k for k in tagi5}
+        tables['p5_pcr_rc_map'] = p5_pcr_rc_map
+        tables['p5_tagmentation_rc_map'] = p5_tagmentation_rc_map
 
         pcr_i5_whitelist = set([reverse_complement(x) for x in pcri5])
         tagmentation_i5_whitelist = set([reverse_complement(x) for x in tagi5])
     else:
         pcr_i5_whitelist = pcri5
         tagmentation_i5_whitelist = tagi5
+    tables.update({'tagmentation_i7_whitelist': tagmentation_i7_whitelist,
+                   'pcr_i7_whitelist': pcr_i7_whitelist,
+                   'pcr_i5_whitelist': pcr_i5_whitelist,
+                   'tagmentation_i5_whitelist': tagmentation_i5_whitelist})
 
 
     # Notes:
@@ -615,28 +900,187 @@ if __name__ == '__main__':
     #      are the keys and the sequence list index is the value. We assume
     #      that the whitelists include all of the sequences in the index
     #      tables.
-    tagi7_to_index = barcode_to_well.barcode_index_dict( tagmentation_i7_whitelist )
-    pcri7_to_index = barcode_to_well.barcode_index_dict( pcr_i7_whitelist )
+    tables['tagi7_to_index'] = barcode_to_well.barcode_index_dict( tagmentation_i7_whitelist )
+    tables['pcri7_to_index'] = barcode_to_well.barcode_index_dict( pcr_i7_whitelist )
 
     # The set() function above does not preserve the index order so we use
     # p5_pcr_rc_map and p5_tagmentation_rc_map below (instead of pcr_i5_whitelist
     # and tagmentation_i5_whitelist).
     if(not args.nextseq):
-        pcri5_to_index = barcode_to_well.barcode_index_dict( pcr_i5_whitelist )
-        tagi5_to_index = barcode_to_well.barcode_index_dict( tagmentation_i5_whitelist )
+        tables['pcri5_to_index'] = barcode_to_well.barcode_index_dict( pcr_i5_whitelist )
+        tables['tagi5_to_index'] = barcode_to_well.barcode_index_dict( tagmentation_i5_whitelist )
+    else:
+        tables['pcri5_to_index'] = barcode_to_well.barcode_index_dict( p5_pcr_rc_map )
+        tables['tagi5_to_index'] = barcode_to_well.barcode_index_dict( p5_tagmentation_rc_map )
+
+    tables['tagmentation_i7_correction_map'] = construct_mismatch_to_whitelist_map(tagmentation_i7_whitelist, 2)
+    tables['pcr_i7_correction_map'] = construct_mismatch_to_whitelist_map(pcr_i7_whitelist, 2)
+    tables['pcr_i5_correction_map'] = construct_mismatch_to_whitelist_map(pcr_i5_whitelist, 2)
+    tables['tagmentation_i5_correction_map'] = construct_mismatch_to_whitelist_map(tagmentation_i5_whitelist, 2)
+    return tables
+
+
+def make_arg_parser():
+    parser = argparse.ArgumentParser(description='A program to fix erroneous barcodes in scATAC data.')
+    parser.add_argument('-1', '--input1', required=True, help='R1 fastq file, which may be gzipped or a pipe, for example <(zcat R1.fastq.gz). Use - for stdin.')
+    parser.add_argument('-2', '--input2', required=True, help='R2 fastq file, which may be gzipped or a pipe, for example <(zcat R2.fastq.gz). Use - for stdin.')
+    parser.add_argument('--index1', default=None, help='I1 (i7 index read) fastq file, which may be gzipped or a pipe. When given with --index2, the index sequences are read from the index reads rather than from the R1 read name. Default is None.')
+    parser.add_argument('--index2', default=None, help='I2 (i5 index read) fastq file, which may be gzipped or a pipe. Default is None.')
+    parser.add_argument('--filename', required=True, help='The R1 file name.')
+    parser.add_argument('--samplesheet', required=True, nargs='+', help='Samplesheet describing the layout of the samples. Several samplesheets may be given, in which case the samples of each samplesheet are written to a directory named for the samplesheet file.')
+    parser.add_argument('--out_dir', required=True, help='Output directory.')
+    parser.add_argument('--num_pigz_threads', help='Number of processes used by pigz to compress fastq files.')
+    parser.add_argument('--stats_out', required=True, help='write JSON file with output stats about processed reads and correction rates (0=no;1=yes.')
+    parser.add_argument('--two_level_indexed_tn5', action='store_true', help='Flag to run assuming that the library is a two-level indexed-TN5 sample.')
+    parser.add_argument('--wells_384', action='store_true', help='Flag to run assuming that the known barcode set is the 384 well set.')
+    parser.add_argument('--well_ids', action='store_true', help='Flag to output cell IDs that are composed of well IDs rather than the actual sequences.')
+    parser.add_argument('-X', '--nextseq', help='NextSeq run indicator', dest='nextseq', action="store_true")
+    parser.add_argument('--no_mask', action='store_true', help='Use all four barcodes. By default, do not use (mask out) a barcode(s) when all samples have the same index set (flag).')
+    parser.add_argument('--write_buffer_blocks', type=int, default=16, help='Number of 8K blocks for fastq write buffers. Default is 16.')
+    parser.add_argument('--qc_metrics', action='store_true', help='Collect FastQC-like quality metrics for the sample fastq files while demultiplexing (flag).')
+    parser.add_argument('--qc_sample_interval', type=int, default=100, help='Collect quality metrics from one in every qc_sample_interval read pairs written to each sample, starting with the first. Default is 100.')
+    parser.add_argument('--trim_adapters', action='store_true', help='Trim adapters and, optionally, low quality trailing bases from the sample read pairs before writing them (flag).')
+    parser.add_argument('--adapter_file', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Trimmomatic-0.36', 'adapters', 'NexteraPE-PE.fa'), help='FASTA file with palindrome prefix adapters named */1 and */2. Default is the Trimmomatic NexteraPE-PE.fa file.')
+    parser.add_argument('--trim_quality', type=int, default=0, help='Trim trailing bases with quality below trim_quality. Default is 0, which disables quality trimming.')
+    parser.add_argument('--trim_min_length', type=int, default=adapter_trimming.TRIM_MIN_LENGTH, help='Drop read pairs with a read shorter than trim_min_length after trimming. Default is %d.' % adapter_trimming.TRIM_MIN_LENGTH)
+    parser.add_argument('--trim_min_overlap', type=int, default=adapter_trimming.TRIM_MIN_OVERLAP, help='Minimum partial adapter length trimmed from the 3\' end of a read. Default is %d.' % adapter_trimming.TRIM_MIN_OVERLAP)
+    parser.add_argument('--unassigned_top_capacity', type=int, default=10000, help='Number of index combinations tracked for each category of unassigned reads. Default is 10000. Zero disables tracking.')
+    parser.add_argument('--unassigned_top_n', type=int, default=100, help='Number of most frequent index combinations reported for each category of unassigned reads. Default is 100.')
+    parser.add_argument('--cell_counts', action='store_true', help='Count the reads for each cell barcode in each sample and write the counts and a knee plot summary (flag).')
+    parser.add_argument('--cell_counts_max_entries', type=int, default=cell_counts.CELL_COUNTS_MAX_ENTRIES, help='Maximum number of cell barcodes held in memory for each sample before the counts are spilled to a temporary file. Default is %d.' % cell_counts.CELL_COUNTS_MAX_ENTRIES)
+    parser.add_argument('--cell_counts_tmp_dir', default=None, help='Directory for cell count spill files. Default is the output directory.')
+    parser.add_argument('--barcode_sidecar', action='store_true', help='Write a binary file with the corrected index numbers of every read, which resplit_sciatac.py uses to re-split the lane with a new samplesheet without repeating barcode correction (flag).')
+    parser.add_argument('--rescue', action='store_true', help='Spool read pairs that fail barcode correction and try to rescue them with a relaxed correction after the main pass (flag).')
+    parser.add_argument('--rescue_max_distance', type=int, default=barcode_rescue.RESCUE_MAX_DISTANCE, help='Maximum Hamming distance of a rescued index sequence. Default is %d.' % barcode_rescue.RESCUE_MAX_DISTANCE)
+    parser.add_argument('--rescue_min_margin', type=int, default=barcode_rescue.RESCUE_MIN_MARGIN, help='Minimum difference between the Hamming distances of the closest and next closest whitelist sequences for a rescue. Default is %d.' % barcode_rescue.RESCUE_MIN_MARGIN)
+    parser.add_argument('--indel_correction', nargs='+', choices=indel_correction.INDEL_BARCODE_TYPES, default=None, help='Barcode types for which index sequences that fail mismatch correction are corrected for a single-base insertion or deletion, for example pcr_i7 pcr_i5. The counts are written to RUN001_<lane>.indel_stats.json. Default is no indel correction.')
+    parser.add_argument('--indel_max_substitutions', type=int, default=indel_correction.INDEL_MAX_SUBSTITUTIONS, help='Reject an indel correction when the index sequence is within this many mismatches of another whitelist sequence, which suggests substitution errors rather than an indel. 0 turns the check off. Default is %d.' % indel_correction.INDEL_MAX_SUBSTITUTIONS)
+    parser.add_argument('--quality_correction', nargs='+', choices=quality_correction.QUALITY_BARCODE_TYPES, default=None, help='Barcode types for which index sequences that fail mismatch correction are corrected using the index read base qualities, for example pcr_i7 pcr_i5. Requires --index1 and --index2. The counts are written to RUN001_<lane>.quality_stats.json. Default is no quality correction.')
+    parser.add_argument('--quality_max_distance', type=int, default=quality_correction.QUALITY_MAX_DISTANCE, help='Maximum number of mismatches of the candidate whitelist sequences for quality correction. Default is %d.' % quality_correction.QUALITY_MAX_DISTANCE)
+    parser.add_argument('--quality_min_posterior', type=float, default=quality_correction.QUALITY_MIN_POSTERIOR, help='Minimum posterior probability of the best candidate whitelist sequence for quality correction. Default is %s.' % quality_correction.QUALITY_MIN_POSTERIOR)
+    parser.add_argument('--quality_min_likelihood', type=float, default=quality_correction.QUALITY_MIN_LIKELIHOOD, help='Minimum likelihood of the best candidate whitelist sequence relative to a perfect match for quality correction, so that mismatches at high quality bases are not corrected. Default is %s.' % quality_correction.QUALITY_MIN_LIKELIHOOD)
+    parser.add_argument('--hash_reads', action='store_true', help='Correct sciPlex hash sequences in the sample read pairs and write per-cell hash counts for each sample. Every read pair written to a sample is matched, so ATAC reads that happen to match a hash sequence are counted as hash reads (flag).')
+    parser.add_argument('--hash_file', default=None, help='sciPlex hash index file. Default is the hash_file given in the samplesheet.')
+    parser.add_argument('--hash_read', type=int, choices=[1, 2], default=2, help='Read that has the hash sequence. Default is 2.')
+    parser.add_argument('--hash_start', type=int, default=0, help='0-based start of the hash sequence in the hash read. Default is 0.')
+    parser.add_argument('--hash_edit_distance', type=int, default=1, help='Maximum number of mismatches corrected in hash sequences. Default is 1.')
+    parser.add_argument('--hash_umi_read', type=int, choices=[1, 2], default=1, help='Read that has the hash UMI. Default is 1.')
+    parser.add_argument('--hash_umi_start', type=int, default=0, help='0-based start of the hash UMI in the UMI read. Default is 0.')
+    parser.add_argument('--hash_umi_length', type=int, default=0, help='Length of the hash UMI. Default is 0, in which case hash reads rather than UMIs are counted.')
+    parser.add_argument('--subsample', default=None, help='Comma-separated list of fractions, for example 0.01,0.1. For each fraction, write sample fastq files with that fraction of the read pairs to the directory subsample_<fraction>. The read pairs are chosen by a hash of the read name so the subsets are reproducible and nested.')
+    parser.add_argument('--read_number_offset', type=int, default=0, help='Number added to the input read numbers used in the output read names. Set to the number of lane reads before the input when the input is a chunk of the lane. Default is 0.')
+    parser.add_argument('--index_recipe', required=False, default=None, help='Select index map. The index_recipes are numbered from 1 to 5. Specifying an index_recipe overrides the recipe selected implicitly by the -two_level_indexed_tn5 and -nextseq arguments. Default is None, in which case the index_recipe is selected using the -two_level_indexed_tn5 and -nextseq arguments.')
+    return parser
+
+
+#
+# Notes:
+#   o  the -X option reverse complements the P5 index and swaps the
+#      locations of the PCR i5 and Ligation i5 sequences in the header
+#      sequence. See the get_barcode_seqs() function above. If a
+#      problem arises, with demuxing a new chemistry/machine, this may
+#      be worth examining.
+#
+def run_demux(args, index_tables=None, samplesheet_cache=None):
+    """
+    Correct the barcodes of a lane and write the sample files.
+    Args:
+        args (argparse.Namespace): make_arg_parser() arguments
+        index_tables (dict): build_index_tables() tables for args, which
+                             are built when None
+        samplesheet_cache (dict): load_samplesheets() results keyed by
+                                  samplesheet files, modification times,
+                                  and flags, which is updated, or None
+    """
+    # Note: args.filename may include (leading) directory information.
+    lane_str = args.filename
+    lane_str = re.sub('.*Undetermined_S0_L','L',lane_str)
+    lane_str = lane_str.replace('_R1_001.fastq.gz', '')
+    lane_num = int(re.sub('L', '', lane_str))
+
+    if args.two_level_indexed_tn5 and args.wells_384:
+        raise ValueError('There is no 384 well barcode set for indexed Tn5, may not specify both --two_level_indexed_tn5 and --wells_384.')
+
+    if (args.index1 is None) != (args.index2 is None):
+        raise ValueError('--index1 and --index2 must be given together.')
+
+    if args.quality_correction and args.index1 is None:
+        raise ValueError('--quality_correction requires the index read qualities, which are read from --index1 and --index2.')
+
+    if args.qc_sample_interval < 1:
+        raise ValueError('--qc_sample_interval must be a positive integer.')
+
+    if args.cell_counts_max_entries < 1:
+        raise ValueError('--cell_counts_max_entries must be a positive integer.')
+
+    if args.unassigned_top_capacity < 0 or args.unassigned_top_n < 1:
+        raise ValueError('--unassigned_top_capacity must be a non-negative integer and --unassigned_top_n must be a positive integer.')
+
+    # Index lists, whitelists, and correction maps.
+    if index_tables is None:
+        index_tables = build_index_tables(args)
+    tagi7 = index_tables['tagi7']
+    pcri7 = index_tables['pcri7']
+    pcri5 = index_tables['pcri5']
+    tagi5 = index_tables['tagi5']
+    if(not args.two_level_indexed_tn5):
+      lig_i7_to_well = index_tables['lig_i7_to_well']
+      lig_i5_to_well = index_tables['lig_i5_to_well']
+      pcr_to_well = index_tables['pcr_to_well']
+    else:
+      nex_two_level_indexed_tn5_to_well = index_tables['nex_two_level_indexed_tn5_to_well']
+      pcr_two_level_indexed_tn5_to_well = index_tables['pcr_two_level_indexed_tn5_to_well']
+    if args.nextseq:
+        p5_pcr_rc_map = index_tables['p5_pcr_rc_map']
+        p5_tagmentation_rc_map = index_tables['p5_tagmentation_rc_map']
+    tagmentation_i7_whitelist = index_tables['tagmentation_i7_whitelist']
+    pcr_i7_whitelist = index_tables['pcr_i7_whitelist']
+    pcr_i5_whitelist = index_tables['pcr_i5_whitelist']
+    tagmentation_i5_whitelist = index_tables['tagmentation_i5_whitelist']
+    tagi7_to_index = index_tables['tagi7_to_index']
+    pcri7_to_index = index_tables['pcri7_to_index']
+    pcri5_to_index = index_tables['pcri5_to_index']
+    tagi5_to_index = index_tables['tagi5_to_index']
+    tagmentation_i7_correction_map = index_tables['tagmentation_i7_correction_map']
+    pcr_i7_correction_map = index_tables['pcr_i7_correction_map']
+    pcr_i5_correction_map = index_tables['pcr_i5_correction_map']
+    tagmentation_i5_correction_map = index_tables['tagmentation_i5_correction_map']
+
+    # Build up sample mapping from indices to samples
+    # Note: the pair count dicts and index flags are modified below so
+    #       a cached sample lookup is copied.
+    if samplesheet_cache is None:
+        index_mask, sample_lookup, tagi5_sample_list, tag_pairs_counts, pcr_pairs_counts, index_flags, projects = load_samplesheets(args.samplesheet, args.no_mask, pcri7, tagi7, tagi5, pcri5)
     else:
-        pcri5_to_index = barcode_to_well.barcode_index_dict( p5_pcr_rc_map )
-        tagi5_to_index = barcode_to_well.barcode_index_dict( p5_tagmentation_rc_map )
+        samplesheet_key = (tuple([(os.path.abspath(samplesheet_file), os.path.getmtime(samplesheet_file)) for samplesheet_file in args.samplesheet]), args.no_mask, get_index_tables_key(args))
+        if samplesheet_key not in samplesheet_cache:
+            samplesheet_cache[samplesheet_key] = load_samplesheets(args.samplesheet, args.no_mask, pcri7, tagi7, tagi5, pcri5)
+        index_mask, sample_lookup, tagi5_sample_list, tag_pairs_counts, pcr_pairs_counts, index_flags, projects = copy.deepcopy(samplesheet_cache[samplesheet_key])
 
-    tagmentation_i7_correction_map = construct_mismatch_to_whitelist_map(tagmentation_i7_whitelist, 2)
-    pcr_i7_correction_map = construct_mismatch_to_whitelist_map(pcr_i7_whitelist, 2)
-    pcr_i5_correction_map = construct_mismatch_to_whitelist_map(pcr_i5_whitelist, 2)
-    tagmentation_i5_correction_map = construct_mismatch_to_whitelist_map(tagmentation_i5_whitelist, 2)
+
+    # Set index flags.
+    # Note: modify this if the numbers of index sequences
+    # change.
+    index_flag = set_index_flags(args, index_flags)
+    if projects is not None:
+        for project in projects:
+            set_index_flags(args, project['index_flags'])
 
     # Set up all input/output files
     if( not os.path.exists(args.out_dir)):
         os.mkdir(args.out_dir)
 
+    # Per-project output directories and assigned read counts.
+    project_read_counts = None
+    if projects is not None:
+        project_read_counts = {}
+        for project in projects:
+            project_dir = os.path.join(args.out_dir, project['name'])
+            if( not os.path.exists(project_dir)):
+                os.mkdir(project_dir)
+            project_read_counts[project['name']] = 0
+        sample_project = {sample: sample.split('/')[0] for sample in set(sample_lookup.values())}
+
     output_files = {}
     buffer_size = args.write_buffer_blocks * 8192
     for sample in list(set(sample_lookup.values())):
@@ -647,17 +1091,165 @@ if __name__ == '__main__':
         output_files[sample]['r1_name'] = output_file_1
         output_files[sample]['r2'] = open(output_file_2, 'w', buffering=buffer_size)
         output_files[sample]['r2_name'] = output_file_2
+        output_files[sample]['records'] = 0
 
+    # Optional subsampled sample fastq files.
+    # Notes:
+    #   o  a read pair is written to the subsample files when the CRC-32
+    #      of its read name (without the comment) is less than the
+    #      fraction times 2^32 so the choice is the same in every run and
+    #      a smaller fraction is a subset of a larger fraction.
+    subsample_outputs = None
+    if args.subsample is not None:
+        subsample_outputs = []
+        for fraction_str in args.subsample.split(','):
+            fraction = float(fraction_str)
+            if fraction <= 0.0 or fraction > 1.0:
+                raise ValueError('--subsample fractions must be greater than 0 and at most 1, but %s found.' % fraction_str)
+            subsample_dir = os.path.join(args.out_dir, 'subsample_%s' % fraction_str.strip())
+            if( not os.path.exists(subsample_dir)):
+                os.mkdir(subsample_dir)
+            if projects is not None:
+                for project in projects:
+                    project_dir = os.path.join(subsample_dir, project['name'])
+                    if( not os.path.exists(project_dir)):
+                        os.mkdir(project_dir)
+            subsample_files = {}
+            for sample in output_files:
+                output_file_1 = os.path.join(subsample_dir, '%s-RUN001_%s_R1.fastq' % (sample, lane_str))
+                output_file_2 = os.path.join(subsample_dir, '%s-RUN001_%s_R2.fastq' % (sample, lane_str))
+                subsample_files[sample] = {}
+                subsample_files[sample]['r1'] = open(output_file_1, 'w', buffering=buffer_size)
+                subsample_files[sample]['r1_name'] = output_file_1
+                subsample_files[sample]['r2'] = open(output_file_2, 'w', buffering=buffer_size)
+                subsample_files[sample]['r2_name'] = output_file_2
+                subsample_files[sample]['records'] = 0
+            subsample_outputs.append((int(fraction * 4294967296.0), subsample_files))
+
+    # Optional quality metrics collectors, one pair for each sample.
+    # Note: qc_read_counts has the number of read pairs written to each
+    #       sample, which selects the pairs that are collected.
+    qc_collectors = None
+    qc_sample_interval = args.qc_sample_interval
+    if args.qc_metrics:
+        qc_collectors = {}
+        qc_read_counts = {}
+        for sample in output_files:
+            qc_collectors[sample] = {'r1': fastq_qc.FastqQcCollector(), 'r2': fastq_qc.FastqQcCollector()}
+            qc_read_counts[sample] = 0
+
+    # Optional adapter trimming.
+    trimmer = None
+    trim_stats = None
+    if args.trim_adapters:
+        r1_adapters, r2_adapters = adapter_trimming.get_read_through_adapters(adapter_trimming.read_adapter_fasta(args.adapter_file))
+        trimmer = adapter_trimming.AdapterTrimmer(r1_adapters, r2_adapters, min_overlap=args.trim_min_overlap, quality_threshold=args.trim_quality, min_length=args.trim_min_length)
+        trim_stats = {}
+        for sample in output_files:
+            trim_stats[sample] = adapter_trimming.new_trim_stats()
     
+    # Optional per-cell read counters, one for each sample.
+    cell_counters = None
+    if args.cell_counts:
+        cell_counts_tmp_dir = args.cell_counts_tmp_dir if args.cell_counts_tmp_dir is not None else args.out_dir
+        cell_counters = {}
+        for sample in output_files:
+            cell_counters[sample] = cell_counts.CellCounter(args.cell_counts_max_entries, cell_counts_tmp_dir)
+
+    # Optional per-read barcode sidecar.
+    sidecar = None
+    if args.barcode_sidecar:
+        output_file_sidecar = os.path.join(args.out_dir, 'RUN001_%s.barcodes.bin' % (lane_str))
+        output_file_sidecar_json = os.path.join(args.out_dir, 'RUN001_%s.barcodes.json' % (lane_str))
+        sidecar = open(output_file_sidecar, 'wb', buffering=buffer_size)
+        sidecar_pack = barcode_sidecar.SIDECAR_RECORD.pack
+        missing_index = barcode_sidecar.MISSING_INDEX
+
+    # Optional spool of read pairs that fail correction for the rescue pass.
+    failed_spool = None
+    if args.rescue:
+        failed_spool = barcode_rescue.FailedReadSpool(args.out_dir)
+
+    # Optional single-base indel correction of the index sequences that
+    # fail mismatch correction, for the selected barcode types.
+    indel_correcters = None
+    if args.indel_correction:
+        indel_correcters = []
+        for barcode_type, whitelist in zip(indel_correction.INDEL_BARCODE_TYPES, [tagmentation_i7_whitelist, pcr_i7_whitelist, pcr_i5_whitelist, tagmentation_i5_whitelist]):
+            indel_correcters.append(indel_correction.IndelCorrecter(whitelist, args.indel_max_substitutions) if barcode_type in args.indel_correction else None)
+        indel_stats = indel_correction.make_indel_stats([barcode_type for barcode_type in indel_correction.INDEL_BARCODE_TYPES if barcode_type in args.indel_correction])
+
+    # Optional correction of the index sequences that fail mismatch
+    # correction using the index read base qualities, for the selected
+    # barcode types.
+    quality_correcters = None
+    if args.quality_correction:
+        quality_correcters = []
+        for barcode_type, whitelist in zip(quality_correction.QUALITY_BARCODE_TYPES, [tagmentation_i7_whitelist, pcr_i7_whitelist, pcr_i5_whitelist, tagmentation_i5_whitelist]):
+            quality_correcters.append(quality_correction.QualityCorrecter(whitelist, args.quality_max_distance, args.quality_min_posterior, args.quality_min_likelihood) if barcode_type in args.quality_correction else None)
+        quality_stats = quality_correction.make_quality_stats([barcode_type for barcode_type in quality_correction.QUALITY_BARCODE_TYPES if barcode_type in args.quality_correction],
+                                                              args.quality_max_distance, args.quality_min_posterior, args.quality_min_likelihood)
+
+    # Optional sciPlex hash read counters, one for each sample.
+    hash_counters = None
+    if args.hash_reads:
+        hash_file = args.hash_file
+        if hash_file is None:
+            for samplesheet_file in args.samplesheet:
+                with open(samplesheet_file) as fp:
+                    hash_file = json.load(fp).get('hash_file')
+                if hash_file is not None:
+                    break
+        if hash_file is None:
+            raise ValueError('--hash_reads requires a hash index file given by --hash_file or by the samplesheet hash_file entry.')
+        hash_list = hash_reads.read_hash_file(hash_file)
+        hash_names = [name for name, seq in hash_list]
+        hash_to_index = barcode_to_well.barcode_index_dict([seq for name, seq in hash_list])
+        hash_correction_map = construct_mismatch_to_whitelist_map([seq for name, seq in hash_list], args.hash_edit_distance)
+        hash_start = args.hash_start
+        hash_end = hash_start + len(hash_list[0][1])
+        hash_umi_start = args.hash_umi_start
+        hash_umi_end = hash_umi_start + args.hash_umi_length
+        hash_counters = {}
+        for sample in output_files:
+            hash_counters[sample] = hash_reads.HashCounter()
+
+    # Track the most frequent index combinations in reads that fail
+    # correction (raw sequences) and in corrected reads that are not in
+    # the samplesheet (whitelist indexes).
+    failed_correction_top = None
+    not_in_samplesheet_top = None
+    if args.unassigned_top_capacity > 0:
+        failed_correction_top = heavy_hitters.SpaceSaving(args.unassigned_top_capacity)
+        not_in_samplesheet_top = heavy_hitters.SpaceSaving(args.unassigned_top_capacity)
+
     output_file_stats_json = os.path.join(args.out_dir, 'RUN001_%s.stats.json' % (lane_str))
     output_file_counts_indexes_csv = os.path.join(args.out_dir, 'RUN001_%s.index_counts.csv' % (lane_str))
     output_file_counts_tag_pair_csv = os.path.join(args.out_dir, 'RUN001_%s.tag_pair_counts.csv' % (lane_str))
     output_file_counts_pcr_pair_csv = os.path.join(args.out_dir, 'RUN001_%s.pcr_pair_counts.csv' % (lane_str))
-
-    if1 = FastqGeneralIterator(args.input1)
-    if2 = FastqGeneralIterator(args.input2)
-
-    totreads = 0
+    output_file_tag_pair_matrix_csv = os.path.join(args.out_dir, 'RUN001_%s.tag_pair_matrix.csv' % (lane_str))
+    output_file_pcr_pair_matrix_csv = os.path.join(args.out_dir, 'RUN001_%s.pcr_pair_matrix.csv' % (lane_str))
+    output_file_unassigned_top_csv = os.path.join(args.out_dir, 'RUN001_%s.unassigned_top.csv' % (lane_str))
+
+    input1 = open_fastq(args.input1)
+    input2 = open_fastq(args.input2)
+    if1 = FastqGeneralIterator(input1)
+    if2 = FastqGeneralIterator(input2)
+    input_files = [input1, input2]
+
+    # With index read files, the index sequences are read from the
+    # index reads and the R1 read names are not parsed.
+    index_read_names = None
+    if args.index1 is not None:
+        input_index1 = open_fastq(args.index1)
+        input_index2 = open_fastq(args.index2)
+        index_read_names = get_index_read_names(FastqGeneralIterator(input_index1), FastqGeneralIterator(input_index2))
+        input_files.extend([input_index1, input_index2])
+
+    # The read number in the read names is totreads, which starts at
+    # the read number offset so that the read names are unique in the
+    # lane when the lane is demultiplexed in chunks.
+    totreads = args.read_number_offset
     total_not_specified_in_samplesheet = 0
     validreads = {}
     validreads['Lane'] = 'Lane %d' % (lane_num)
@@ -678,23 +1270,114 @@ if __name__ == '__main__':
     pcr_i5_count = [0] * 384
     tagmentation_i5_count = [0] * 384
 
+    # Count every observed tagmentation and PCR index pair in flat
+    # 384 x 384 lists indexed by i7_index * 384 + i5_index. The pair
+    # flag lists mark the pairs in the samplesheet.
+    tag_pair_matrix = [0] * (384 * 384)
+    pcr_pair_matrix = [0] * (384 * 384)
+    tag_pair_flags = pair_counts_to_flags(tag_pairs_counts, 384)
+    pcr_pair_flags = pair_counts_to_flags(pcr_pairs_counts, 384)
+
     # demux run time
     start_time = timeit.default_timer()
 
     header_parser = choose_header_parser(args)
+    if indel_correcters is not None:
+        header_index_ends = header_parser_index_ends[header_parser]
+
+    def write_read_pair(sample, barcodes_string, record_number, r1_name, r1_seq, r1_qual, r2_seq, r2_qual, cell_indexes):
+        """
+        Write a read pair assigned to a sample to the sample fastq files
+        and count it in the optional outputs. The main and rescue passes
+        both write their read pairs here so that the subsample, hash,
+        quality, cell, and project counts agree with the fastq files.
+        Args:
+            sample (str): sample name
+            barcodes_string (str): cell barcode string of the read names
+            record_number (int): read number in the lane
+            r1_name (str): R1 read name, which selects the subsampled pairs
+            r1_seq, r1_qual, r2_seq, r2_qual (str): untrimmed reads
+            cell_indexes (tuple): tagi7, pcri7, pcri5, and tagi5 indexes
+        Returns:
+            bool: True when the read pair is written, False when
+                  adapter trimming drops it
+        """
+        if project_read_counts is not None:
+            project_read_counts[sample_project[sample]] += 1
+
+        # The hash sequence and UMI are read from the untrimmed reads
+        # and are counted only when the read pair is written.
+        hash_seq = None
+        if hash_counters is not None:
+            hash_seq = correct_barcode((r2_seq if args.hash_read == 2 else r1_seq)[hash_start:hash_end], hash_correction_map)
+            if hash_seq is not None:
+                hash_umi = (r2_seq if args.hash_umi_read == 2 else r1_seq)[hash_umi_start:hash_umi_end] if hash_umi_end > hash_umi_start else None
+
+        if trimmer is not None:
+            trimmed_pair = trimmer.trim_pair(r1_seq, r1_qual, r2_seq, r2_qual, trim_stats[sample])
+            if trimmed_pair is None:
+                return False
+            r1_seq, r1_qual, r2_seq, r2_qual = trimmed_pair
+
+        if cell_counters is not None or hash_seq is not None:
+            cell_key = cell_counts.encode_cell_key(*cell_indexes)
+        if hash_seq is not None:
+            hash_counters[sample].add(cell_key, hash_to_index[hash_seq], hash_umi)
+
+        r1_record = ''.join(['@', barcodes_string, ':', str(record_number), '\n', r1_seq, '\n+\n', r1_qual, '\n'])
+        r2_record = ''.join(['@', barcodes_string, ':', str(record_number), '\n', r2_seq, '\n+\n', r2_qual, '\n'])
+        output_files[sample]['r1'].write(r1_record)
+        output_files[sample]['r2'].write(r2_record)
+        output_files[sample]['records'] += 1
+
+        if subsample_outputs is not None:
+            read_hash = zlib.crc32(r1_name.partition(' ')[0].encode())
+            for subsample_threshold, subsample_files in subsample_outputs:
+                if read_hash < subsample_threshold:
+                    subsample_files[sample]['r1'].write(r1_record)
+                    subsample_files[sample]['r2'].write(r2_record)
+                    subsample_files[sample]['records'] += 1
+
+        if qc_collectors is not None:
+            if qc_read_counts[sample] % qc_sample_interval == 0:
+                qc_collectors[sample]['r1'].add_read(r1_seq, r1_qual)
+                qc_collectors[sample]['r2'].add_read(r2_seq, r2_qual)
+            qc_read_counts[sample] += 1
+
+        if cell_counters is not None:
+            cell_counters[sample].add(cell_key)
+        return True
 
     # Process reads from fastq file.
     for (r1_name, r1_seq, r1_qual),(r2_name, r2_seq, r2_qual) in zip(if1, if2):
 
         totreads += 1
 
+        if index_read_names is None:
+            index_name = r1_name
+        else:
+            index_name, index_qual = next(index_read_names, (None, None))
+            if index_name is None:
+                raise ValueError('Index fastq files have fewer reads than the R1 fastq file.')
+
         # Get barcodes and correct
-        tagmentation_i7_seq, pcr_i7_seq, pcr_i5_seq, tagmentation_i5_seq = header_parser(r1_name)
+        raw_barcodes = header_parser(index_name)
+        tagmentation_i7_seq, pcr_i7_seq, pcr_i5_seq, tagmentation_i5_seq = raw_barcodes
 
         tagmentation_i7_seq = correct_barcode(tagmentation_i7_seq, tagmentation_i7_correction_map)
         pcr_i7_seq = correct_barcode(pcr_i7_seq, pcr_i7_correction_map)
         pcr_i5_seq = correct_barcode(pcr_i5_seq, pcr_i5_correction_map)
         tagmentation_i5_seq = correct_barcode(tagmentation_i5_seq, tagmentation_i5_correction_map)
+
+        if quality_correcters is not None and (tagmentation_i7_seq is None or pcr_i7_seq is None or pcr_i5_seq is None or tagmentation_i5_seq is None):
+            tagmentation_i7_seq, pcr_i7_seq, pcr_i5_seq, tagmentation_i5_seq = quality_correction.correct_qualities([tagmentation_i7_seq, pcr_i7_seq, pcr_i5_seq, tagmentation_i5_seq],
+                                                                                                                    raw_barcodes, header_parser(index_qual),
+                                                                                                                    quality_correcters, quality_stats)
+
+        if indel_correcters is not None and (tagmentation_i7_seq is None or pcr_i7_seq is None or pcr_i5_seq is None or tagmentation_i5_seq is None):
+            tagmentation_i7_seq, pcr_i7_seq, pcr_i5_seq, tagmentation_i5_seq = indel_correction.correct_indels([tagmentation_i7_seq, pcr_i7_seq, pcr_i5_seq, tagmentation_i5_seq],
+                                                                                                                raw_barcodes, get_index_flanks(index_name, header_index_ends),
+                                                                                                                indel_correcters, indel_stats)
       
         # Skip invalid reads and track valid read count for error checking
         if tagmentation_i7_seq is not None:
@@ -707,9 +1390,10 @@ if __name__ == '__main__':
             tagmentation_i5_count[tagmentation_i5_index] += 1
         if tagmentation_i7_seq is not None and tagmentation_i5_seq is not None:
             validreads['tagmentation'] += 1
-            if tag_pairs_counts.get((tagmentation_i7_index, tagmentation_i5_index)) is not None:
+            pair_offset = tagmentation_i7_index * 384 + tagmentation_i5_index
+            tag_pair_matrix[pair_offset] += 1
+            if tag_pair_flags[pair_offset]:
                 validreads['tagmentation_match'] += 1
-                tag_pairs_counts[(tagmentation_i7_index, tagmentation_i5_index)] += 1
 
         if pcr_i7_seq is not None:
             validreads['pcr_i7'] += 1
@@ -722,11 +1406,23 @@ if __name__ == '__main__':
 
         if pcr_i7_seq is not None and pcr_i5_seq is not None:
             validreads['pcr'] += 1
-            if pcr_pairs_counts.get((pcr_i7_index, pcr_i5_index)) is not None:
+            pair_offset = pcr_i7_index * 384 + pcr_i5_index
+            pcr_pair_matrix[pair_offset] += 1
+            if pcr_pair_flags[pair_offset]:
                 validreads['pcr_match'] += 1
-                pcr_pairs_counts[(pcr_i7_index, pcr_i5_index)] += 1
         
+        if sidecar is not None:
+            sidecar.write(sidecar_pack(tagmentation_i7_index if tagmentation_i7_seq is not None else missing_index,
+                                       pcr_i7_index if pcr_i7_seq is not None else missing_index,
+                                       pcr_i5_index if pcr_i5_seq is not None else missing_index,
+                                       tagmentation_i5_index if tagmentation_i5_seq is not None else missing_index,
+                                       totreads))
+
         if tagmentation_i7_seq is None or pcr_i7_seq is None or pcr_i5_seq is None or tagmentation_i5_seq is None:
+            if failed_correction_top is not None:
+                failed_correction_top.add(raw_barcodes)
+            if failed_spool is not None:
+                failed_spool.add(totreads, r1_name, raw_barcodes, [tagmentation_i7_seq, pcr_i7_seq, pcr_i5_seq, tagmentation_i5_seq], r1_seq, r1_qual, r2_seq, r2_qual)
             continue
 
         validreads['all_barcodes'] += 1
@@ -749,9 +1445,96 @@ if __name__ == '__main__':
 
         if not sample:
             total_not_specified_in_samplesheet += 1
+            if not_in_samplesheet_top is not None:
+                not_in_samplesheet_top.add((tagmentation_i7_index, pcr_i7_index, pcr_i5_index, tagmentation_i5_index))
         else:
-            output_files[sample]['r1'].write(''.join(['@', barcodes_string, ':', str(totreads), '\n', r1_seq, '\n+\n', r1_qual, '\n']))
-            output_files[sample]['r2'].write(''.join(['@', barcodes_string, ':', str(totreads), '\n', r2_seq, '\n+\n', r2_qual, '\n']))
+            write_read_pair(sample, barcodes_string, totreads, r1_name, r1_seq, r1_qual, r2_seq, r2_qual,
+                            (tagmentation_i7_index, pcr_i7_index, pcr_i5_index, tagmentation_i5_index))
+
+    if index_read_names is not None and next(index_read_names, None) is not None:
+        raise ValueError('Index fastq files have more reads than the R1 fastq file.')
+
+    for input_file in input_files:
+        if input_file is not sys.stdin:
+            input_file.close()
+
+    # Rescue pass over the read pairs that failed correction.
+    # Notes:
+    #   o  an index that corrects in the main pass, including by quality
+    #      or indel correction, is not changed. The main pass corrected
+    #      sequences are spooled and only the failed indexes are rescued.
+    #   o  the lane statistics and count files describe the main pass.
+    #      The rescue results are written to a separate rescue_stats.json
+    #      file.
+    #   o  the barcode sidecar, when written, describes the main pass.
+    #   o  a rescued pair that is written is counted in the subsample,
+    #      hash, quality, and cell outputs like a main pass pair. The
+    #      project stats describe the main pass and have the number of
+    #      rescued pairs in the project samplesheet.
+    main_project_read_counts = dict(project_read_counts) if project_read_counts is not None else None
+    if failed_spool is not None:
+        rescuers = [barcode_rescue.BarcodeRescuer(whitelist, args.rescue_max_distance, args.rescue_min_margin) for whitelist in [tagmentation_i7_whitelist, pcr_i7_whitelist, pcr_i5_whitelist, tagmentation_i5_whitelist]]
+        rescue_stats = {'failed_pairs': failed_spool.num_pairs,
+                        'rescued_pairs': 0,
+                        'rescued_not_specified_in_samplesheet': 0,
+                        'rescued_pairs_written': 0,
+                        'rescued_tagmentation_i7': 0,
+                        'rescued_pcr_i7': 0,
+                        'rescued_pcr_i5': 0,
+                        'rescued_tagmentation_i5': 0,
+                        'parameters': {'rescue_max_distance': args.rescue_max_distance,
+                                       'rescue_min_margin': args.rescue_min_margin}}
+        rescue_keys = ['rescued_tagmentation_i7', 'rescued_pcr_i7', 'rescued_pcr_i5', 'rescued_tagmentation_i5']
+        for record_number, r1_name, raw_barcodes, main_barcodes, r1_seq, r1_qual, r2_seq, r2_qual in failed_spool:
+            corrected_barcodes = []
+            for i in range(4):
+                corrected_seq = main_barcodes[i]
+                if corrected_seq is None:
+                    corrected_seq = rescuers[i].rescue(raw_barcodes[i])
+                    if corrected_seq is None:
+                        break
+                    rescue_stats[rescue_keys[i]] += 1
+                corrected_barcodes.append(corrected_seq)
+            if len(corrected_barcodes) < 4:
+                continue
+
+            rescue_stats['rescued_pairs'] += 1
+            tagmentation_i7_seq, pcr_i7_seq, pcr_i5_seq, tagmentation_i5_seq = corrected_barcodes
+            tagmentation_i7_index = tagi7_to_index[tagmentation_i7_seq]
+            pcr_i7_index = pcri7_to_index[pcr_i7_seq]
+            pcr_i5_index = pcri5_to_index[pcr_i5_seq]
+            tagmentation_i5_index = tagi5_to_index[tagmentation_i5_seq]
+
+            if args.nextseq:
+                pcr_i5_seq = p5_pcr_rc_map[pcr_i5_seq]
+                tagmentation_i5_seq = p5_tagmentation_rc_map[tagmentation_i5_seq]
+
+            sample_index = tuple([index for use_index,index in zip(index_mask, [pcr_i7_seq, tagmentation_i7_seq, tagmentation_i5_seq, pcr_i5_seq]) if use_index])
+            sample = sample_lookup.get(sample_index, None)
+            if not sample:
+                rescue_stats['rescued_not_specified_in_samplesheet'] += 1
+                continue
+
+            if args.two_level_indexed_tn5:
+                barcodes_string = barcode_to_well.get_two_level_barcode_string(tagmentation_i7_seq, pcr_i7_seq, pcr_i5_seq, tagmentation_i5_seq, nex_two_level_indexed_tn5_to_well, pcr_two_level_indexed_tn5_to_well, args.well_ids)
+            else:
+                barcodes_string = barcode_to_well.get_barcode_string(tagmentation_i7_seq, pcr_i7_seq, pcr_i5_seq, tagmentation_i5_seq, lig_i7_to_well, lig_i5_to_well, pcr_to_well, args.well_ids)
+
+            if write_read_pair(sample, barcodes_string, record_number, r1_name, r1_seq, r1_qual, r2_seq, r2_qual,
+                               (tagmentation_i7_index, pcr_i7_index, pcr_i5_index, tagmentation_i5_index)):
+                rescue_stats['rescued_pairs_written'] += 1
+
+        failed_spool.remove()
+        with open(os.path.join(args.out_dir, 'RUN001_%s.rescue_stats.json' % (lane_str)), 'wt') as f:
+            f.write(json.dumps(rescue_stats, indent=4))
+
+    if indel_correcters is not None:
+        with open(os.path.join(args.out_dir, 'RUN001_%s.indel_stats.json' % (lane_str)), 'wt') as f:
+            f.write(json.dumps(indel_stats, indent=4))
+
+    if quality_correcters is not None:
+        with open(os.path.join(args.out_dir, 'RUN001_%s.quality_stats.json' % (lane_str)), 'wt') as f:
+            f.write(json.dumps(quality_stats, indent=4))
 
     # Write an empty file with an informational name.
     elapsed_time = timeit.default_timer() - start_time
@@ -759,73 +1542,141 @@ if __name__ == '__main__':
     fp = open(info_file_name, 'wt')
     fp.close()
 
-    if totreads == 0:
+    if totreads == args.read_number_offset:
         raise ValueError('No reads found in fastq input.')
 
     # Output basic stats
-    validreads['total_input_reads'] = totreads
+    validreads['total_input_reads'] = totreads - args.read_number_offset
     validreads['total_not_specified_in_samplesheet'] = total_not_specified_in_samplesheet
 
     with open(output_file_stats_json, 'wt') as f:
         f.write(json.dumps(validreads, indent=4))
+
+    if sidecar is not None:
+        sidecar.close()
+        barcode_sidecar.write_sidecar_metadata(output_file_sidecar_json, args, lane_str, totreads - args.read_number_offset)
             
     # write tag and pcr counts by tag/pcr well
-    zero_pad_col = True
-    id_length = 2
-    with open(output_file_counts_indexes_csv,'wt') as f:
-        f.write('well_index,i7_well,tagi7_count,tagi7_flag,pcri7_count,pcri7_flag,i5_well,pcri5_count,pcri5_flag,tagi5_count,tagi5_flag,sample_name_tagi5\n')
-        for i, counts in enumerate(zip(tagmentation_i7_count, pcr_i7_count, pcr_i5_count, tagmentation_i5_count), start = 0):
-            f.write(''.join([str(i),',', \
-                             str(i+1),',', \
-                             barcode_to_well.get_well_id_384_to_96(i, True, zero_pad_col, id_length),',', \
-                             str(counts[0]),',', \
-                             str(index_flags[1][i]),',', \
-                             str(counts[1]),',', \
-                             str(index_flags[0][i]),',', \
-                             barcode_to_well.get_well_id_384_to_96(i, False, zero_pad_col, id_length),',', \
-                             str(counts[2]),',', \
-                             str(index_flags[3][i]),',', \
-                             str(counts[3]),',', \
-                             str(index_flags[2][i]),',', \
-                             tagi5_sample_list[i], \
-                             '\n']))
-
-    # write tag pair counts by tag well
-    zero_pad_col = True
-    id_length = 2
-    with open(output_file_counts_tag_pair_csv,'wt') as f:
-        f.write('tagi7_index,tagi7_well,tagi5_index,tagi5_well,tag_pair_count,sample_name_tagi5\n')
-        for i, pair_tuple in enumerate(tag_pairs_counts.keys()):
-            f.write(''.join([str(i),',',
-                             str(pair_tuple[0]+1),',',
-                             barcode_to_well.get_well_id_384_to_96(pair_tuple[0], True, zero_pad_col, id_length),',',
-                             str(pair_tuple[1]+1),',',
-                             barcode_to_well.get_well_id_384_to_96(pair_tuple[1], False, zero_pad_col, id_length),',',
-                             str(tag_pairs_counts[pair_tuple]),',',
-                             tagi5_sample_list[pair_tuple[1]],'\n']))
+    write_index_counts_csv(output_file_counts_indexes_csv, [tagmentation_i7_count, pcr_i7_count, pcr_i5_count, tagmentation_i5_count], index_flags, tagi5_sample_list)
+
+    # Copy the samplesheet pair counts from the pair count lists.
+    for pair_tuple in tag_pairs_counts:
+        tag_pairs_counts[pair_tuple] = tag_pair_matrix[pair_tuple[0] * 384 + pair_tuple[1]]
+    for pair_tuple in pcr_pairs_counts:
+        pcr_pairs_counts[pair_tuple] = pcr_pair_matrix[pair_tuple[0] * 384 + pair_tuple[1]]
+
+    # write tag and pcr pair counts by tag and pcr well
+    write_tag_pair_counts_csv(output_file_counts_tag_pair_csv, tag_pairs_counts, tagi5_sample_list)
+    write_pcr_pair_counts_csv(output_file_counts_pcr_pair_csv, pcr_pairs_counts)
+
+    # write per-project stats and counts. The index and pair counts are
+    # the lane counts; the flags, matches, and samplesheet counts are
+    # for the project samplesheet.
+    if projects is not None:
+        for project in projects:
+            project_dir = os.path.join(args.out_dir, project['name'])
+            project_validreads = dict(validreads)
+            project_validreads['samplesheet'] = project['samplesheet']
+            project_validreads['tagmentation_match'] = sum([tag_pair_matrix[pair_tuple[0] * 384 + pair_tuple[1]] for pair_tuple in project['tag_pairs_counts']])
+            project_validreads['pcr_match'] = sum([pcr_pair_matrix[pair_tuple[0] * 384 + pair_tuple[1]] for pair_tuple in project['pcr_pairs_counts']])
+            project_validreads['total_not_specified_in_samplesheet'] = validreads['all_barcodes'] - main_project_read_counts[project['name']]
+            if failed_spool is not None:
+                project_validreads['rescued_pairs_in_samplesheet'] = project_read_counts[project['name']] - main_project_read_counts[project['name']]
+            with open(os.path.join(project_dir, 'RUN001_%s.stats.json' % (lane_str)), 'wt') as f:
+                f.write(json.dumps(project_validreads, indent=4))
+
+            write_index_counts_csv(os.path.join(project_dir, 'RUN001_%s.index_counts.csv' % (lane_str)), [tagmentation_i7_count, pcr_i7_count, pcr_i5_count, tagmentation_i5_count], project['index_flags'], project['tagi5_sample_list'])
+            for pair_tuple in project['tag_pairs_counts']:
+                project['tag_pairs_counts'][pair_tuple] = tag_pair_matrix[pair_tuple[0] * 384 + pair_tuple[1]]
+            for pair_tuple in project['pcr_pairs_counts']:
+                project['pcr_pairs_counts'][pair_tuple] = pcr_pair_matrix[pair_tuple[0] * 384 + pair_tuple[1]]
+            write_tag_pair_counts_csv(os.path.join(project_dir, 'RUN001_%s.tag_pair_counts.csv' % (lane_str)), project['tag_pairs_counts'], project['tagi5_sample_list'])
+            write_pcr_pair_counts_csv(os.path.join(project_dir, 'RUN001_%s.pcr_pair_counts.csv' % (lane_str)), project['pcr_pairs_counts'])
+
+    # write all observed tag and pcr pair counts
+    write_pair_matrix(output_file_tag_pair_matrix_csv, 'tag', tag_pair_matrix, tag_pair_flags, 384)
+    write_pair_matrix(output_file_pcr_pair_matrix_csv, 'pcr', pcr_pair_matrix, pcr_pair_flags, 384)
+
+    # write the most frequent index combinations of unassigned reads
+    if failed_correction_top is not None:
+        write_unassigned_top(output_file_unassigned_top_csv, args.unassigned_top_n, failed_correction_top, not_in_samplesheet_top,
+                             [tagmentation_i7_correction_map, pcr_i7_correction_map, pcr_i5_correction_map, tagmentation_i5_correction_map],
+                             [tagi7_to_index, pcri7_to_index, pcri5_to_index, tagi5_to_index],
+                             [tagi7, pcri7, pcri5, tagi5])
+
+    # write per-sample quality metrics
+    if qc_collectors is not None:
+        for sample in qc_collectors:
+            fastq_qc.write_qc_json(os.path.join(args.out_dir, '%s-RUN001_%s.qc.json' % (sample, lane_str)), sample, lane_str, qc_sample_interval, qc_collectors[sample])
+            fastq_qc.write_qc_tsv(os.path.join(args.out_dir, '%s-RUN001_%s_R1.qc.tsv' % (sample, lane_str)), qc_collectors[sample]['r1'])
+            fastq_qc.write_qc_tsv(os.path.join(args.out_dir, '%s-RUN001_%s_R2.qc.tsv' % (sample, lane_str)), qc_collectors[sample]['r2'])
+
+    # Convert cell index numbers to the cell barcode strings in the
+    # sample fastq read names.
+    if args.two_level_indexed_tn5:
+        cell_barcode_string = lambda tagi7_index, pcri7_index, pcri5_index, tagi5_index: barcode_to_well.get_two_level_barcode_string(tagi7[tagi7_index], pcri7[pcri7_index], pcri5[pcri5_index], tagi5[tagi5_index], nex_two_level_indexed_tn5_to_well, pcr_two_level_indexed_tn5_to_well, args.well_ids)
+    else:
+        cell_barcode_string = lambda tagi7_index, pcri7_index, pcri5_index, tagi5_index: barcode_to_well.get_barcode_string(tagi7[tagi7_index], pcri7[pcri7_index], pcri5[pcri5_index], tagi5[tagi5_index], lig_i7_to_well, lig_i5_to_well, pcr_to_well, args.well_ids)
+
+    # write per-sample cell read counts and knee plot summaries
+    if cell_counters is not None:
+        for sample in cell_counters:
+            count_histogram = cell_counts.write_cell_counts(os.path.join(args.out_dir, '%s-RUN001_%s.cell_counts.tsv.gz' % (sample, lane_str)), cell_counters[sample], cell_barcode_string)
+            cell_counts_summary = cell_counts.knee_summary(count_histogram)
+            cell_counts_summary['sample'] = sample
+            cell_counts_summary['lane'] = lane_str
+            with open(os.path.join(args.out_dir, '%s-RUN001_%s.cell_counts_summary.json' % (sample, lane_str)), 'wt') as f:
+                f.write(json.dumps(cell_counts_summary, indent=4))
+
+    # write per-sample hash count matrices
+    if hash_counters is not None:
+        for sample in hash_counters:
+            file_prefix = os.path.join(args.out_dir, '%s-RUN001_%s' % (sample, lane_str))
+            hash_stats = hash_counters[sample].write_matrix(file_prefix, hash_names, cell_barcode_string)
+            hash_stats['hash_file'] = hash_file
+            with open('%s.hash_stats.json' % file_prefix, 'wt') as f:
+                f.write(json.dumps(hash_stats, indent=4))
+
+    # write per-sample trimming statistics
+    if trim_stats is not None:
+        for sample in trim_stats:
+            with open(os.path.join(args.out_dir, '%s-RUN001_%s.trim_stats.json' % (sample, lane_str)), 'wt') as f:
+                f.write(json.dumps(trim_stats[sample], indent=4))
 
-    # write pcr pair counts by pcr well
-    zero_pad_col = True
-    id_length = 2
-    with open(output_file_counts_pcr_pair_csv,'wt') as f: 
-        f.write('pcri7_index,pcri7_well,pcri5_index,pcri5_well,pcr_pair_count\n')
-        for i, pair_tuple in enumerate(pcr_pairs_counts.keys()):
-            f.write(''.join([str(i),',',
-                             str(pair_tuple[0]+1),',',
-                             barcode_to_well.get_well_id_384_to_96(pair_tuple[0], True, zero_pad_col, id_length),',',
-                             str(pair_tuple[1]+1),',',
-                             barcode_to_well.get_well_id_384_to_96(pair_tuple[1], False, zero_pad_col, id_length),',',
-                             str(pcr_pairs_counts[pair_tuple]),'\n']))
-            
     # Error checking and compress output
     if validreads['all_barcodes'] < 0.05:
         raise ValueError('Warning, you had less than 5 percent of all reads pass index correction. Something may have gone wrong here w.r.t. index sets or the expected library configuration not matching the data...')
 
     print('Done correcting barcodes in %s minutes. Starting compression...' % ((time.time() - start) / 60.0))
     start = time.time()
-    for sample in output_files:
-        output_files[sample]['r1'].close()
-        output_files[sample]['r2'].close()
-        subprocess.check_call('pigz --processes %s %s' % ( args.num_pigz_threads, output_files[sample]['r1_name'] ), shell=True)
-        subprocess.check_call('pigz --processes %s %s' % ( args.num_pigz_threads, output_files[sample]['r2_name'] ), shell=True)
+    manifest_entries = compress_output_files(output_files, args.num_pigz_threads, args.out_dir)
+    if subsample_outputs is not None:
+        for subsample_threshold, subsample_files in subsample_outputs:
+            manifest_entries.extend(compress_output_files(subsample_files, args.num_pigz_threads, args.out_dir))
     print('Done compressing with pigz in %s minutes.' % ((time.time() - start) / 60.0))
+
+    # Write the output file manifest. The lane and per-sample files other
+    # than the sample fastq files have names that start with
+    # 'RUN001_<lane>.' and '<sample>-RUN001_<lane>.'.
+    output_file_manifest_json = os.path.join(args.out_dir, 'RUN001_%s.manifest.json' % (lane_str))
+    lane_file_dirs = [args.out_dir]
+    if projects is not None:
+        lane_file_dirs.extend([os.path.join(args.out_dir, project['name']) for project in projects])
+    other_file_names = []
+    for lane_file_dir in lane_file_dirs:
+        other_file_names.extend(glob.glob(os.path.join(lane_file_dir, 'RUN001_%s.*' % (lane_str))))
+    for sample in output_files:
+        other_file_names.extend(glob.glob(os.path.join(args.out_dir, '%s-RUN001_%s.*' % (sample, lane_str))))
+    for file_name in sorted(set(other_file_names)):
+        if os.path.abspath(file_name) != os.path.abspath(output_file_manifest_json):
+            manifest_entries.append(output_manifest.file_entry(file_name, args.out_dir))
+    output_manifest.write_manifest(output_file_manifest_json, lane_str, manifest_entries)
+
+
+def main(argv=None):
+    args = make_arg_parser().parse_args(argv)
+    run_demux(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#
+# Second-pass rescue of read pairs that fail barcode correction.
+#
+# Notes:
+#   o  the main demux pass corrects index sequences with a mismatch
+#      map that allows at most two mismatches. Read pairs with an index
+#      that fails correction are spooled to a temporary file by
+#      FailedReadSpool so that the main pass is not slowed, and the
+#      rescue pass reads only the spooled pairs. The main pass corrected
+#      sequences, which can come from quality or indel correction, are
+#      spooled with the raw sequences so that the rescue pass rescues
+#      only the indexes that failed the main pass. The rescue cost scales
+#      with the number of failed reads rather than with the lane size.
+#   o  BarcodeRescuer compares a failed index sequence to every
+#      whitelist sequence and accepts the closest whitelist sequence
+#      when its Hamming distance is at most max_distance and the next
+#      closest whitelist sequence is at least min_margin further away.
+#      An N in the read counts as a mismatch. The results are cached
+#      because failed sequences recur, in an LruCache of at most
+#      RESCUE_CACHE_SIZE entries.
+#
+
+import os
+import tempfile
+from lru_cache import LruCache
+
+
+RESCUE_MAX_DISTANCE = 3
+RESCUE_MIN_MARGIN = 2
+RESCUE_CACHE_SIZE = 100000
+
+
+class FailedReadSpool:
+    def __init__(self, tmp_dir=None):
+        fd, self.file_name = tempfile.mkstemp(prefix='failed_reads.', suffix='.tsv', dir=tmp_dir)
+        self.fp = os.fdopen(fd, 'wt')
+        self.num_pairs = 0
+
+    def add(self, record_number, r1_name, raw_barcodes, corrected_barcodes, r1_seq, r1_qual, r2_seq, r2_qual):
+        """
+        Spool a read pair. corrected_barcodes has the main pass corrected
+        sequences, with None for the failed indexes. The R1 read name is
+        spooled for the subsample choice.
+        """
+        self.num_pairs += 1
+        self.fp.write('\t'.join([str(record_number), r1_name] + list(raw_barcodes) + [barcode if barcode is not None else '' for barcode in corrected_barcodes] + [r1_seq, r1_qual, r2_seq, r2_qual]))
+        self.fp.write('\n')
+
+    def __iter__(self):
+        """
+        Yields (record_number, r1_name, raw_barcodes, corrected_barcodes,
+        r1_seq, r1_qual, r2_seq, r2_qual) tuples in spool order.
+        """
+        self.fp.close()
+        with open(self.file_name, 'rt') as fp:
+            for line in fp:
+                fields = line.rstrip('\n').split('\t')
+                yield int(fields[0]), fields[1], tuple(fields[2:6]), tuple([barcode if barcode else None for barcode in fields[6:10]]), fields[10], fields[11], fields[12], fields[13]
+
+    def remove(self):
+        if not self.fp.closed:
+            self.fp.close()
+        os.remove(self.file_name)
+
+
+class BarcodeRescuer:
+    def __init__(self, whitelist, max_distance=RESCUE_MAX_DISTANCE, min_margin=RESCUE_MIN_MARGIN, cache_size=RESCUE_CACHE_SIZE):
+        if min_margin < 1:
+            raise ValueError('BarcodeRescuer min_margin must be a positive integer, but %s found.' % min_margin)
+        self.whitelist = list(whitelist)
+        self.max_distance = max_distance
+        self.min_margin = min_margin
+        self.cache = LruCache(cache_size)
+
+    def rescue(self, sequence):
+        """
+        Returns the uniquely closest whitelist sequence or None.
+        """
+        if sequence in self.cache:
+            return self.cache[sequence]
+
+        best_distance = len(sequence) + 1
+        second_distance = len(sequence) + 1
+        best_barcode = None
+        limit = self.max_distance + self.min_margin
+        for barcode in self.whitelist:
+            if len(barcode) != len(sequence):
+                continue
+            distance = 0
+            for a, b in zip(sequence, barcode):
+                if a != b:
+                    distance += 1
+                    if distance >= limit:
+                        break
+            if distance < best_distance:
+                second_distance = best_distance
+                best_distance = distance
+                best_barcode = barcode
+            elif distance < second_distance:
+                second_distance = distance
+
+        if best_distance > self.max_distance or second_distance - best_distance < self.min_margin:
+            best_barcode = None
+        self.cache[sequence] = best_barcode
+        return best_barcode
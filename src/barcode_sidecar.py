@@ -0,0 +1,65 @@
+#
+# Per-read barcode sidecar files written by barcode_correct_sciatac.py
+# and read by resplit_sciatac.py.
+#
+# Notes:
+#   o  the sidecar has one fixed-size record for each input read pair,
+#      in input order. A record has the corrected whitelist indexes of
+#      the tagi7, pcri7, pcri5, and tagi5 sequences as unsigned 16-bit
+#      integers, with MISSING_INDEX for an index that fails correction,
+#      followed by the 1-based input record number as an unsigned
+#      64-bit integer. The record number is the read number used in
+#      the sample fastq read names.
+#   o  a JSON metadata file describes the index set and recipe used so
+#      that the sidecar can be interpreted without the original
+#      command line. These values and MISSING_INDEX are in its
+#      'parameters' object, which gather_demux_chunks.py copies rather
+#      than sums.
+#
+
+import json
+import struct
+
+
+SIDECAR_RECORD = struct.Struct('<4HQ')
+MISSING_INDEX = 0xFFFF
+SIDECAR_READ_RECORDS = 65536
+
+
+def write_sidecar_metadata(file_name, args, lane_str, total_reads):
+    metadata = {'lane': lane_str,
+                'record_format': SIDECAR_RECORD.format,
+                'total_reads': total_reads,
+                'parameters': {'missing_index': MISSING_INDEX,
+                               'two_level_indexed_tn5': args.two_level_indexed_tn5,
+                               'wells_384': args.wells_384,
+                               'well_ids': args.well_ids,
+                               'nextseq': args.nextseq,
+                               'index_recipe': args.index_recipe}}
+    with open(file_name, 'wt') as f:
+        f.write(json.dumps(metadata, indent=4))
+
+
+def read_sidecar_metadata(file_name):
+    with open(file_name, 'rt') as f:
+        metadata = json.load(f)
+    if metadata['record_format'] != SIDECAR_RECORD.format:
+        raise ValueError('Unsupported barcode sidecar record format \'%s\'.' % metadata['record_format'])
+    return metadata
+
+
+def read_sidecar(file_name):
+    """
+    Yields (tagi7_index, pcri7_index, pcri5_index, tagi5_index, record_number)
+    tuples from a sidecar file.
+    """
+    record_size = SIDECAR_RECORD.size
+    with open(file_name, 'rb') as f:
+        while True:
+            block = f.read(record_size * SIDECAR_READ_RECORDS)
+            if len(block) == 0:
+                break
+            if len(block) % record_size != 0:
+                raise ValueError('Truncated barcode sidecar file \'%s\'.' % file_name)
+            for record in SIDECAR_RECORD.iter_unpack(block):
+                yield record
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+import time
+import barcode_constants as bc
+import barcode_correct_sciatac as bcs
+import indel_correction
+
+#
+# Compare mismatch correction of index sequences with and without the
+# indel correction of the sequences that fail mismatch correction.
+#
+# Notes:
+#   o  the index sequences are from the --whitelist list, by default
+#      the 384 well tagmentation i7 list, and are read with one to three
+#      substitution errors, exactly three substitution errors, a
+#      single-base deletion, or a single-base insertion. A sequence read with an indel is shifted
+#      so that it has the same length as the index: after a deletion it
+#      ends with the first flank base and after an insertion its last
+#      base is pushed into the flank.
+#   o  the report has the throughput and the fraction of sequences that
+#      are corrected to the true index, or to another index, for each
+#      error type. Most three substitution sequences fail mismatch
+#      correction so the difference between the miscorrected fractions
+#      of mismatch and mismatch+indel correction is the indel false
+#      correction rate.
+#
+
+ERROR_TYPES = ['none', 'substitution', 'substitution_3', indel_correction.INDEL_DELETION, indel_correction.INDEL_INSERTION]
+WHITELISTS = ['lig_i7_list_384', 'pcr_i7_list', 'pcr_i5_list', 'lig_i5_list_384']
+
+
+def read_index(barcode, error_type, rng):
+    """
+    Returns the index sequence and flank read for an index.
+    """
+    template = list(barcode) + [rng.choice('ACGT') for i in range(2)]
+    position = rng.randrange(len(barcode))
+    if error_type in ('substitution', 'substitution_3'):
+        num_substitutions = 3 if error_type == 'substitution_3' else rng.choice([1, 1, 2, 3])
+        for position in rng.sample(range(len(barcode)), num_substitutions):
+            template[position] = rng.choice([base for base in 'ACGT' if base != template[position]])
+    elif error_type == indel_correction.INDEL_DELETION:
+        del template[position]
+    elif error_type == indel_correction.INDEL_INSERTION:
+        template.insert(position, rng.choice('ACGT'))
+    return ''.join(template[:len(barcode)]), template[len(barcode)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark indel correction of index sequences against mismatch correction.')
+    parser.add_argument('--num_seqs', type=int, default=200000, help='Number of index sequences for each error type.')
+    parser.add_argument('--no_flank', action='store_true', help='Do not use the flank bases (flag).')
+    parser.add_argument('--whitelist', choices=WHITELISTS, default='lig_i7_list_384', help='Index sequence list. Default is lig_i7_list_384.')
+    parser.add_argument('--max_substitutions', type=int, default=indel_correction.INDEL_MAX_SUBSTITUTIONS, help='Reject an indel candidate when the sequence is within this many mismatches of another whitelist sequence, or 0 for no check. Default is %d.' % indel_correction.INDEL_MAX_SUBSTITUTIONS)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    whitelist = getattr(bc, args.whitelist)
+    correction_map = bcs.construct_mismatch_to_whitelist_map(whitelist, 2)
+    correcter = indel_correction.IndelCorrecter(whitelist, args.max_substitutions)
+
+    for error_type in ERROR_TYPES:
+        barcodes = [rng.choice(whitelist) for i in range(args.num_seqs)]
+        reads = [read_index(barcode, error_type, rng) for barcode in barcodes]
+
+        start = time.time()
+        mismatch_corrected = [bcs.correct_barcode(sequence, correction_map) for sequence, flank in reads]
+        mismatch_seconds = time.time() - start
+
+        start = time.time()
+        indel_corrected = []
+        for (sequence, flank), corrected in zip(reads, mismatch_corrected):
+            if corrected is None:
+                corrected = correcter.correct(sequence, None if args.no_flank else flank)[0]
+            indel_corrected.append(corrected)
+        indel_seconds = time.time() - start
+
+        for label, corrected_list, seconds in [('mismatch', mismatch_corrected, mismatch_seconds), ('mismatch+indel', indel_corrected, mismatch_seconds + indel_seconds)]:
+            num_right = sum([1 for barcode, corrected in zip(barcodes, corrected_list) if corrected == barcode])
+            num_wrong = sum([1 for barcode, corrected in zip(barcodes, corrected_list) if corrected is not None and corrected != barcode])
+            print('%-14s  %-14s  corrected: %.4f  miscorrected: %.4f  %.0f seqs/s' % (error_type, label, num_right / args.num_seqs, num_wrong / args.num_seqs, args.num_seqs / seconds))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+import time
+import barcode_constants as bc
+import barcode_correct_sciatac as bcs
+import quality_correction
+
+#
+# Compare mismatch correction of index sequences with and without the
+# quality correction of the sequences that fail mismatch correction.
+#
+# Notes:
+#   o  the index sequences are from the 384 well tagmentation i7 list.
+#      Each base is given a quality from QUALITIES and is read with an
+#      error at the error probability of its quality, so the low
+#      quality bases have most of the errors.
+#   o  the report has the throughput and the fraction of sequences that
+#      are corrected to the true index, or to another index.
+#
+
+QUALITIES = [(2, 0.02), (12, 0.05), (25, 0.13), (37, 0.8)]
+
+
+def read_index(barcode, rng):
+    """
+    Returns the index sequence and base qualities read for an index.
+    """
+    bases = []
+    qualities = []
+    for base in barcode:
+        r = rng.random()
+        for quality, fraction in QUALITIES:
+            r -= fraction
+            if r < 0:
+                break
+        if rng.random() < 10.0 ** (-quality / 10.0):
+            base = rng.choice([other for other in 'ACGT' if other != base])
+        bases.append(base)
+        qualities.append(chr(quality + quality_correction.PHRED_OFFSET))
+    return ''.join(bases), ''.join(qualities)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark quality correction of index sequences against mismatch correction.')
+    parser.add_argument('--num_seqs', type=int, default=200000, help='Number of index sequences.')
+    parser.add_argument('--max_distance', type=int, default=quality_correction.QUALITY_MAX_DISTANCE, help='Maximum number of mismatches of the candidate whitelist sequences. Default is %d.' % quality_correction.QUALITY_MAX_DISTANCE)
+    parser.add_argument('--min_posterior', type=float, default=quality_correction.QUALITY_MIN_POSTERIOR, help='Minimum posterior probability of the best candidate. Default is %s.' % quality_correction.QUALITY_MIN_POSTERIOR)
+    parser.add_argument('--min_likelihood', type=float, default=quality_correction.QUALITY_MIN_LIKELIHOOD, help='Minimum likelihood of the best candidate relative to a perfect match. Default is %s.' % quality_correction.QUALITY_MIN_LIKELIHOOD)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    whitelist = bc.lig_i7_list_384
+    correction_map = bcs.construct_mismatch_to_whitelist_map(whitelist, 2)
+    correcter = quality_correction.QualityCorrecter(whitelist, args.max_distance, args.min_posterior, args.min_likelihood)
+
+    barcodes = [rng.choice(whitelist) for i in range(args.num_seqs)]
+    reads = [read_index(barcode, rng) for barcode in barcodes]
+
+    start = time.time()
+    mismatch_corrected = [bcs.correct_barcode(sequence, correction_map) for sequence, quality in reads]
+    mismatch_seconds = time.time() - start
+
+    start = time.time()
+    quality_corrected = []
+    for (sequence, quality), corrected in zip(reads, mismatch_corrected):
+        if corrected is None:
+            corrected = correcter.correct(sequence, quality)[0]
+        quality_corrected.append(corrected)
+    quality_seconds = time.time() - start
+
+    for label, corrected_list, seconds in [('mismatch', mismatch_corrected, mismatch_seconds), ('mismatch+quality', quality_corrected, mismatch_seconds + quality_seconds)]:
+        num_right = sum([1 for barcode, corrected in zip(barcodes, corrected_list) if corrected == barcode])
+        num_wrong = sum([1 for barcode, corrected in zip(barcodes, corrected_list) if corrected is not None and corrected != barcode])
+        print('%-16s  corrected: %.4f  miscorrected: %.5f  %.0f seqs/s' % (label, num_right / args.num_seqs, num_wrong / args.num_seqs, args.num_seqs / seconds))
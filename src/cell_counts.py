@@ -0,0 +1,223 @@
+#
+# Per-cell read counts collected during demultiplexing.
+#
+# Notes:
+#   o  a cell is identified by the integer encoded index tuple
+#        ((tagi7_index * 384 + pcri7_index) * 384 + pcri5_index) * 384 + tagi5_index
+#      which is less than 2^35.
+#   o  CellCounter counts the keys in an open addressing hash table
+#      with linear probing that is stored in two flat arrays (keys and
+#      counts) rather than in a dict. The table starts small and
+#      doubles when it is half full.
+#   o  memory is bounded by max_entries. When the table holds
+#      max_entries keys, the entries are sorted by key and written to a
+#      temporary run file, and the table is cleared. sorted_items()
+#      merges the run files and the table, summing the counts of equal
+#      keys, so the result is the same as for an unbounded table.
+#   o  write_cell_counts() writes the counts in key order and returns a
+#      histogram of the counts (count -> number of cells), from which
+#      the knee plot summary is calculated without sorting the cells by
+#      count.
+#
+
+import array
+import gzip
+import heapq
+import math
+import os
+import tempfile
+
+
+CELL_COUNTS_MAX_ENTRIES = 2000000
+CELL_COUNTS_INITIAL_SIZE = 1024
+CELL_COUNTS_TOP_N = [100, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000]
+
+
+def encode_cell_key(tagi7_index, pcri7_index, pcri5_index, tagi5_index):
+    return ((tagi7_index * 384 + pcri7_index) * 384 + pcri5_index) * 384 + tagi5_index
+
+
+def decode_cell_key(key):
+    """
+    Returns:
+        (int, int, int, int): tagi7, pcri7, pcri5, and tagi5 indexes
+    """
+    key, tagi5_index = divmod(key, 384)
+    key, pcri5_index = divmod(key, 384)
+    tagi7_index, pcri7_index = divmod(key, 384)
+    return tagi7_index, pcri7_index, pcri5_index, tagi5_index
+
+
+def _empty_keys(size):
+    return array.array('q', [-1]) * size
+
+
+class CellCounter:
+    def __init__(self, max_entries=CELL_COUNTS_MAX_ENTRIES, tmp_dir=None):
+        if max_entries < 1:
+            raise ValueError('CellCounter max_entries must be a positive integer, but %s found.' % max_entries)
+        self.max_entries = max_entries
+        self.tmp_dir = tmp_dir
+        self.run_files = []
+        self.total = 0
+        self._allocate(CELL_COUNTS_INITIAL_SIZE)
+
+    def _allocate(self, size):
+        self.size = size
+        self.mask = size - 1
+        self.num_entries = 0
+        self.keys = _empty_keys(size)
+        self.counts = array.array('q', [0]) * size
+
+    def add(self, key, count=1):
+        self.total += count
+        keys = self.keys
+        mask = self.mask
+        h = (key ^ (key >> 16)) * 0x45d9f3b
+        slot = (h ^ (h >> 16)) & mask
+        while True:
+            slot_key = keys[slot]
+            if slot_key == key:
+                self.counts[slot] += count
+                return
+            if slot_key == -1:
+                break
+            slot = (slot + 1) & mask
+
+        keys[slot] = key
+        self.counts[slot] = count
+        self.num_entries += 1
+        if self.num_entries >= self.max_entries:
+            self._spill()
+        elif 2 * self.num_entries > self.size:
+            self._grow()
+
+    def _grow(self):
+        old_keys = self.keys
+        old_counts = self.counts
+        self._allocate(2 * self.size)
+        total = self.total
+        for slot, key in enumerate(old_keys):
+            if key != -1:
+                self.add(key, old_counts[slot])
+        self.total = total
+
+    def _table_items(self):
+        counts = self.counts
+        return sorted([(key, counts[slot]) for slot, key in enumerate(self.keys) if key != -1])
+
+    def _spill(self):
+        fd, run_file = tempfile.mkstemp(prefix='cell_counts.', suffix='.run', dir=self.tmp_dir)
+        with os.fdopen(fd, 'wt') as f:
+            for key, count in self._table_items():
+                f.write('%d\t%d\n' % (key, count))
+        self.run_files.append(run_file)
+        self._allocate(self.size)
+
+    def sorted_items(self):
+        """
+        Yields (key, count) tuples in key order with the counts from the
+        run files and the table combined.
+        """
+        run_fps = [open(run_file, 'rt') for run_file in self.run_files]
+        try:
+            runs = [((int(key), int(count)) for key, count in (line.split('\t') for line in fp)) for fp in run_fps]
+            runs.append(iter(self._table_items()))
+            current_key = None
+            current_count = 0
+            for key, count in heapq.merge(*runs):
+                if key == current_key:
+                    current_count += count
+                    continue
+                if current_key is not None:
+                    yield current_key, current_count
+                current_key = key
+                current_count = count
+            if current_key is not None:
+                yield current_key, current_count
+        finally:
+            for fp in run_fps:
+                fp.close()
+
+    def remove_run_files(self):
+        for run_file in self.run_files:
+            os.remove(run_file)
+        self.run_files = []
+
+
+def write_cell_counts(file_name, counter, barcode_string_function):
+    """
+    Write the per-cell read counts as a gzipped TSV file in key order.
+    Args:
+        file_name (str): output file name
+        counter (CellCounter): cell counts
+        barcode_string_function (function): converts the four indexes
+                                            to the cell barcode string
+    Returns:
+        dict: histogram of cell read counts (count -> number of cells)
+    """
+    count_histogram = {}
+    with gzip.open(file_name, 'wt') as f:
+        f.write('cell_barcode\tread_count\n')
+        for key, count in counter.sorted_items():
+            f.write('%s\t%d\n' % (barcode_string_function(*decode_cell_key(key)), count))
+            count_histogram[count] = count_histogram.get(count, 0) + 1
+    counter.remove_run_files()
+    return count_histogram
+
+
+def knee_summary(count_histogram, top_n_list=CELL_COUNTS_TOP_N):
+    """
+    Summarize the cell read count distribution for a knee plot.
+    Args:
+        count_histogram (dict): count -> number of cells
+        top_n_list (list of int): report the reads in the top N cells
+    Returns:
+        dict: summary with the reads in the top N cells and the knee
+              point, which is the rank on the log10 rank versus log10
+              count curve that is furthest from the line joining the
+              curve ends
+    """
+    total_cells = sum(count_histogram.values())
+    total_reads = sum(count * num_cells for count, num_cells in count_histogram.items())
+
+    # (rank of last cell with this count, count) in decreasing count order
+    curve = []
+    rank = 0
+    for count in sorted(count_histogram, reverse=True):
+        rank += count_histogram[count]
+        curve.append((rank, count))
+
+    top_n_reads = []
+    for top_n in top_n_list:
+        reads = 0
+        previous_rank = 0
+        for rank, count in curve:
+            if previous_rank >= top_n:
+                break
+            reads += (min(rank, top_n) - previous_rank) * count
+            previous_rank = rank
+        top_n_reads.append({'top_n': top_n,
+                            'reads': reads,
+                            'fraction_of_reads': round(float(reads) / total_reads, 4) if total_reads > 0 else 0.0})
+
+    knee_rank = 0
+    knee_count = 0
+    if len(curve) > 2:
+        x0, y0 = math.log10(curve[0][0]), math.log10(curve[0][1])
+        x1, y1 = math.log10(curve[-1][0]), math.log10(curve[-1][1])
+        length = math.hypot(x1 - x0, y1 - y0)
+        max_distance = -1.0
+        for rank, count in curve:
+            x, y = math.log10(rank), math.log10(count)
+            distance = abs((y1 - y0) * x - (x1 - x0) * y + x1 * y0 - y1 * x0) / length if length > 0 else 0.0
+            if distance > max_distance:
+                max_distance = distance
+                knee_rank = rank
+                knee_count = count
+
+    return {'total_cells': total_cells,
+            'total_reads': total_reads,
+            'top_n_reads': top_n_reads,
+            'knee_rank': knee_rank,
+            'knee_read_count': knee_count}
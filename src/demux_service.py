@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import barcode_correct_sciatac as bcs
+
+#
+# Run barcode_correct_sciatac.py jobs in a long-running local service
+# that keeps the index tables and samplesheet lookups in memory.
+#
+# Notes:
+#   o  the serve command listens on a Unix socket. A request is one
+#      line of JSON with a 'command', which is 'demux', 'status', or
+#      'shutdown', and the response is one line of JSON with a 'status',
+#      which is 'ok' or 'error'. A demux request has the
+#      barcode_correct_sciatac.py arguments ('argv') and the client
+#      working directory ('cwd'). The response has the job output and,
+#      for an error, the error message.
+#   o  the jobs run in a pool of worker processes, one job at a time in
+#      each worker. A worker changes to the client working directory so
+#      relative paths are resolved as they are on the command line.
+#   o  the index tables (index lists, well dicts, whitelists, and
+#      correction maps) of the --preload index sets are built before
+#      the workers are started so the workers share them. The tables of
+#      other index sets are built and kept by a worker on first use.
+#      Each worker keeps the sample lookups of the most recently loaded
+#      samplesheets, keyed by file name and modification time.
+#   o  the submit command is a drop-in client for the
+#      barcode_correct_sciatac.py command line. The service process
+#      cannot read the client pipes, such as <(zcat R1.fastq.gz) or
+#      - for stdin, so the client copies them to named pipes in a
+#      temporary directory and sends the named pipe paths.
+#   o  the socket is created with the user's umask. Use a socket path
+#      in a directory that only the user can write.
+#
+
+SAMPLESHEET_CACHE_SIZE = 8
+PRELOAD_INDEX_SETS = {'standard': {'two_level_indexed_tn5': False, 'wells_384': False},
+                      'wells_384': {'two_level_indexed_tn5': False, 'wells_384': True},
+                      'two_level_indexed_tn5': {'two_level_indexed_tn5': True, 'wells_384': False}}
+PIPE_COPY_BLOCK_SIZE = 1048576
+
+# Worker process caches.
+index_tables_cache = {}
+samplesheet_cache = collections.OrderedDict()
+
+
+def preload_index_tables(index_set_names):
+    """
+    Build the index tables of the named index sets, for both the
+    standard and NextSeq (-X) orientations, into the worker cache.
+    """
+    for index_set_name in index_set_names:
+        for nextseq in [False, True]:
+            args = argparse.Namespace(nextseq=nextseq, **PRELOAD_INDEX_SETS[index_set_name])
+            index_tables_cache[bcs.get_index_tables_key(args)] = bcs.build_index_tables(args)
+
+
+def run_job(argv, cwd):
+    """
+    Run one barcode_correct_sciatac.py job in a worker process.
+    Args:
+        argv (list of str): barcode_correct_sciatac.py arguments
+        cwd (str): job working directory
+    Returns:
+        dict: response with the status, job output, error message, and
+              run time in seconds
+    """
+    start = time.time()
+    output = io.StringIO()
+    stdout = sys.stdout
+    stderr = sys.stderr
+    response = {'status': 'ok', 'output': None, 'error': None, 'seconds': None}
+    try:
+        sys.stdout = output
+        sys.stderr = output
+        os.chdir(cwd)
+        args = bcs.make_arg_parser().parse_args(argv)
+        index_tables_key = bcs.get_index_tables_key(args)
+        if index_tables_key not in index_tables_cache:
+            index_tables_cache[index_tables_key] = bcs.build_index_tables(args)
+        bcs.run_demux(args, index_tables_cache[index_tables_key], samplesheet_cache)
+    except SystemExit as error:
+        # argparse exits after writing the usage message to stderr.
+        if error.code not in (None, 0):
+            response['status'] = 'error'
+            response['error'] = 'Invalid barcode_correct_sciatac.py arguments.'
+    except Exception:
+        response['status'] = 'error'
+        response['error'] = traceback.format_exc()
+    finally:
+        sys.stdout = stdout
+        sys.stderr = stderr
+    while len(samplesheet_cache) > SAMPLESHEET_CACHE_SIZE:
+        samplesheet_cache.popitem(last=False)
+    response['output'] = output.getvalue()
+    response['seconds'] = time.time() - start
+    return response
+
+
+class DemuxRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            response = self.server.handle_request_dict(request)
+        except Exception:
+            response = {'status': 'error', 'error': traceback.format_exc()}
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class DemuxServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, num_workers):
+        socketserver.UnixStreamServer.__init__(self, socket_path, DemuxRequestHandler)
+        self.num_workers = num_workers
+        # The workers are forked so that they share the preloaded tables.
+        self.pool = multiprocessing.get_context('fork').Pool(num_workers)
+        self.lock = threading.Lock()
+        self.jobs_running = 0
+        self.jobs_done = 0
+        self.start_time = time.time()
+
+    def handle_request_dict(self, request):
+        command = request.get('command')
+        if command == 'demux':
+            with self.lock:
+                self.jobs_running += 1
+            try:
+                return self.pool.apply(run_job, (request['argv'], request['cwd']))
+            finally:
+                with self.lock:
+                    self.jobs_running -= 1
+                    self.jobs_done += 1
+        elif command == 'status':
+            with self.lock:
+                return {'status': 'ok',
+                        'pid': os.getpid(),
+                        'num_workers': self.num_workers,
+                        'jobs_running': self.jobs_running,
+                        'jobs_done': self.jobs_done,
+                        'preloaded_index_sets': [list(key) for key in sorted(index_tables_cache)],
+                        'uptime_seconds': time.time() - self.start_time}
+        elif command == 'shutdown':
+            threading.Thread(target=self.shutdown).start()
+            return {'status': 'ok'}
+        return {'status': 'error', 'error': 'Unknown command \'%s\'.' % command}
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.pool.close()
+        self.pool.join()
+
+
+def serve(socket_path, num_workers, preload):
+    if os.path.exists(socket_path):
+        try:
+            send_request(socket_path, {'command': 'status'})
+            raise ValueError('A demux service is already listening on socket \'%s\'.' % socket_path)
+        except socket.error:
+            os.remove(socket_path)
+    preload_index_tables(preload)
+    server = DemuxServer(socket_path, num_workers)
+    print('Demux service listening on %s with %d workers.' % (socket_path, num_workers))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def send_request(socket_path, request):
+    """
+    Send a request to the service and return the response.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        response = b''
+        while not response.endswith(b'\n'):
+            data = client.recv(65536)
+            if len(data) == 0:
+                raise ValueError('Demux service on socket \'%s\' closed the connection without a response.' % socket_path)
+            response += data
+    finally:
+        client.close()
+    return json.loads(response.decode('utf-8'))
+
+
+def copy_to_named_pipe(source_file, pipe_path):
+    with open(pipe_path, 'wb') as fout:
+        try:
+            shutil.copyfileobj(source_file, fout, PIPE_COPY_BLOCK_SIZE)
+        except BrokenPipeError:
+            pass
+
+
+def get_client_pipes(argv):
+    """
+    Returns the positions in argv of the -1, -2, --index1, and --index2
+    input values that the service cannot open because they are pipes of
+    the client process.
+    """
+    positions = []
+    for i, arg in enumerate(argv[:-1]):
+        if arg in ('-1', '--input1', '-2', '--input2', '--index1', '--index2'):
+            value = argv[i + 1]
+            if value == '-' or value.startswith('/dev/fd/') or value.startswith('/proc/self/fd/'):
+                positions.append(i + 1)
+    return positions
+
+
+def submit(socket_path, argv):
+    """
+    Submit a barcode_correct_sciatac.py job and return the response.
+    """
+    argv = list(argv)
+    pipe_dir = None
+    threads = []
+    try:
+        positions = get_client_pipes(argv)
+        if positions:
+            pipe_dir = tempfile.mkdtemp(prefix='demux_service_')
+        for position in positions:
+            pipe_path = os.path.join(pipe_dir, 'input_%d' % position)
+            os.mkfifo(pipe_path)
+            source_file = sys.stdin.buffer if argv[position] == '-' else open(argv[position], 'rb')
+            thread = threading.Thread(target=copy_to_named_pipe, args=(source_file, pipe_path))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+            argv[position] = pipe_path
+        return send_request(socket_path, {'command': 'demux', 'argv': argv, 'cwd': os.getcwd()})
+    finally:
+        if pipe_dir is not None:
+            shutil.rmtree(pipe_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='A program to run barcode_correct_sciatac.py jobs in a local service that keeps the barcode correction tables in memory.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    parser_serve = subparsers.add_parser('serve', help='Run the demux service.')
+    parser_serve.add_argument('--socket', required=True, help='Unix socket path.')
+    parser_serve.add_argument('--num_workers', type=int, default=2, help='Number of worker processes, which is the number of jobs that run at the same time. Default is 2.')
+    parser_serve.add_argument('--preload', nargs='*', choices=sorted(PRELOAD_INDEX_SETS), default=[], help='Index sets for which the index tables are built at start up.')
+
+    parser_submit = subparsers.add_parser('submit', help='Run a barcode_correct_sciatac.py job in the demux service. The arguments after the socket path are the barcode_correct_sciatac.py arguments.')
+    parser_submit.add_argument('--socket', required=True, help='Unix socket path.')
+    parser_submit.add_argument('demux_args', nargs=argparse.REMAINDER, help='barcode_correct_sciatac.py arguments.')
+
+    parser_status = subparsers.add_parser('status', help='Write the demux service status.')
+    parser_status.add_argument('--socket', required=True, help='Unix socket path.')
+
+    parser_shutdown = subparsers.add_parser('shutdown', help='Stop the demux service after the running jobs finish.')
+    parser_shutdown.add_argument('--socket', required=True, help='Unix socket path.')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        if args.num_workers < 1:
+            raise ValueError('--num_workers must be a positive integer.')
+        serve(args.socket, args.num_workers, args.preload)
+    elif args.command == 'submit':
+        demux_args = args.demux_args[1:] if args.demux_args[:1] == ['--'] else args.demux_args
+        response = submit(args.socket, demux_args)
+        sys.stdout.write(response.get('output') or '')
+        if response['status'] != 'ok':
+            sys.stderr.write('%s\n' % response['error'])
+            sys.exit(1)
+    elif args.command in ('status', 'shutdown'):
+        response = send_request(args.socket, {'command': args.command})
+        print(json.dumps(response, indent=4))
+        if response['status'] != 'ok':
+            sys.exit(1)
+    else:
+        parser.print_help()
+        sys.exit(1)
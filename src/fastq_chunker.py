@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import zlib
+
+#
+# Split a gzipped fastq file pair into chunks without recompression.
+#
+# Notes:
+#   o  bcl2fastq writes fastq files as a series of gzip members (BGZF
+#      blocks). A chunk starts at a record and is located by a virtual
+#      offset, which is the compressed offset of the gzip member that
+#      has the record start and the uncompressed offset of the record
+#      start within the member. A chunk is read by seeking to the
+#      member, decompressing, and skipping to the record start, so no
+#      chunk reader decompresses more than one member that it does not
+#      use.
+#   o  the index command decompresses the R1 and R2 files once, without
+#      writing the decompressed data, to find the chunk virtual offsets.
+#      The R1 chunks start at the first record after the first member
+#      boundary past each multiple of the chunk byte size and the R2
+#      chunks start at the same record numbers so that the chunks of
+#      the two files have the same read pairs.
+#   o  the R2, I1, and I2 files are scanned in parallel processes after
+#      the R1 file so the index command takes about as long as
+#      decompressing the R1 and R2 files, which is done before any
+#      chunk is demultiplexed.
+#   o  the I1 and I2 index read files of a run converted with bcl2fastq
+#      --create-fastq-for-index-reads are split at the same record
+#      numbers when they are given to the index command.
+#   o  a file that is a single gzip member can be read only from its
+#      start so it is not split.
+#   o  the read command writes one chunk of one file to stdout for the
+#      barcode_correct_sciatac.py -1, -2, --index1, and --index2 inputs. The chunk first
+#      record number, less one, is the barcode_correct_sciatac.py
+#      --read_number_offset so that the read numbers in the read names
+#      are unique in the lane.
+#
+
+CHUNK_READ_BLOCK_SIZE = 4194304
+
+
+def ceil_to_record(lines):
+    return ((lines + 3) // 4) * 4
+
+
+def nth_newline_end(data, n):
+    """
+    Returns the offset after the n-th newline in data.
+    """
+    pos = -1
+    for i in range(n):
+        pos = data.index(b'\n', pos + 1)
+    return pos + 1
+
+
+def scan_record_offsets(file_name, cut_bytes=None, cut_records=None):
+    """
+    Find the virtual offsets of chunk start records in a gzipped fastq
+    file.
+    Args:
+        file_name (str): gzipped fastq file name
+        cut_bytes (list of int): start a chunk at the first record after
+                                 the first gzip member boundary at or
+                                 past each of these compressed offsets
+        cut_records (list of int): start a chunk at each of these 1-based
+                                   record numbers
+    Returns:
+        list of (int, int, int): (record_number, member_offset, skip_bytes)
+                                 tuples for the chunk starts
+        int: total number of records in the file
+    """
+    if cut_records is not None:
+        target_lines = [(record_number - 1) * 4 for record_number in cut_records]
+    else:
+        target_lines = []
+    cut_bytes = list(cut_bytes) if cut_bytes is not None else []
+    next_cut = 0
+    target_line = target_lines.pop(0) if target_lines else None
+
+    offsets = []
+    lines = 0
+    member_offset = 0
+    member_bytes = 0
+    file_offset = 0
+    at_line_start = True
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    with open(file_name, 'rb') as f:
+        while True:
+            block = f.read(CHUNK_READ_BLOCK_SIZE)
+            if len(block) == 0:
+                break
+            file_offset += len(block)
+            while block:
+                piece = decompressor.decompress(block)
+                piece_lines = piece.count(b'\n')
+
+                if target_line is None and next_cut < len(cut_bytes) and member_offset >= cut_bytes[next_cut]:
+                    while next_cut < len(cut_bytes) and member_offset >= cut_bytes[next_cut]:
+                        next_cut += 1
+                    target_line = ceil_to_record(lines)
+
+                # A record that starts at the end of a piece is found at
+                # the start of the next non-empty piece.
+                while target_line is not None and len(piece) > 0:
+                    need = target_line - lines
+                    if need == 0:
+                        if not at_line_start:
+                            target_line += 4
+                            continue
+                        pos = 0
+                    elif need <= piece_lines:
+                        pos = nth_newline_end(piece, need)
+                        if pos == len(piece):
+                            break
+                    else:
+                        break
+                    offsets.append((target_line // 4 + 1, member_offset, member_bytes + pos))
+                    target_line = target_lines.pop(0) if target_lines else None
+
+                if len(piece) > 0:
+                    at_line_start = piece.endswith(b'\n')
+                lines += piece_lines
+                member_bytes += len(piece)
+                if decompressor.eof:
+                    block = decompressor.unused_data
+                    member_offset = file_offset - len(block)
+                    member_bytes = 0
+                    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                else:
+                    block = b''
+
+    if lines % 4 != 0:
+        raise ValueError('Fastq file \'%s\' has %d lines, which is not a multiple of four.' % (file_name, lines))
+    if cut_records is not None and len(offsets) != len(cut_records):
+        raise ValueError('Fastq file \'%s\' has %d records, which is fewer than the chunk start records.' % (file_name, lines // 4))
+    return offsets, lines // 4
+
+
+def scan_cut_records(task):
+    """
+    scan_record_offsets for a multiprocessing pool.
+    Args:
+        task (tuple): (file_name, cut_records)
+    Returns:
+        the scan_record_offsets offsets and number of records
+    """
+    file_name, cut_records = task
+    return scan_record_offsets(file_name, cut_records=cut_records)
+
+
+def make_chunk_index(r1_file, r2_file, chunk_bytes, max_chunks, index_files=None):
+    """
+    Returns the chunk index of a fastq file pair and, optionally, its
+    I1 and I2 index read files.
+    """
+    r1_bytes = os.path.getsize(r1_file)
+    num_chunks = 1
+    if chunk_bytes > 0:
+        num_chunks = max(1, min(max_chunks, (r1_bytes + chunk_bytes - 1) // chunk_bytes))
+
+    read_files = [('r1', r1_file), ('r2', r2_file)]
+    if index_files is not None:
+        read_files.extend([('i1', index_files[0]), ('i2', index_files[1])])
+
+    chunk_index = {}
+    for read_key, read_file in read_files:
+        chunk_index[read_key] = os.path.basename(read_file)
+    chunk_index['total_records'] = None
+    chunk_index['chunks'] = []
+    if num_chunks == 1:
+        chunk = {'chunk': 0, 'first_record': 1, 'num_records': None}
+        for read_key, read_file in read_files:
+            chunk[read_key] = [0, 0]
+        chunk_index['chunks'].append(chunk)
+        return chunk_index
+
+    cut_bytes = [r1_bytes * i // num_chunks for i in range(1, num_chunks)]
+    r1_offsets, r1_records = scan_record_offsets(r1_file, cut_bytes=cut_bytes)
+    cut_records = [record_number for record_number, member_offset, skip_bytes in r1_offsets]
+    read_offsets = {'r1': r1_offsets}
+    pool = multiprocessing.Pool(len(read_files) - 1)
+    scans = pool.map(scan_cut_records, [(read_file, cut_records) for read_key, read_file in read_files[1:]])
+    pool.close()
+    pool.join()
+    for (read_key, read_file), (offsets, records) in zip(read_files[1:], scans):
+        if records != r1_records:
+            raise ValueError('Fastq files \'%s\' and \'%s\' have different numbers of records: %d and %d.' % (r1_file, read_file, r1_records, records))
+        read_offsets[read_key] = offsets
+
+    first_records = [1] + cut_records
+    for i, first_record in enumerate(first_records):
+        next_record = first_records[i + 1] if i + 1 < len(first_records) else r1_records + 1
+        chunk = {'chunk': i,
+                 'first_record': first_record,
+                 'num_records': next_record - first_record}
+        for read_key, read_file in read_files:
+            chunk[read_key] = [0, 0] if i == 0 else list(read_offsets[read_key][i - 1][1:])
+        chunk_index['chunks'].append(chunk)
+    chunk_index['total_records'] = r1_records
+    return chunk_index
+
+
+def read_chunk(file_name, member_offset, skip_bytes, num_records, out):
+    """
+    Write the decompressed records of a chunk to out.
+    Args:
+        file_name (str): gzipped fastq file name
+        member_offset (int): compressed offset of the gzip member with the first record
+        skip_bytes (int): uncompressed offset of the first record in the member
+        num_records (int): number of records or None to read to the end of the file
+        out (file): binary output file
+    """
+    lines_left = num_records * 4 if num_records is not None else None
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    with open(file_name, 'rb') as f:
+        f.seek(member_offset)
+        while True:
+            block = f.read(CHUNK_READ_BLOCK_SIZE)
+            if len(block) == 0:
+                break
+            while block:
+                piece = decompressor.decompress(block)
+                if skip_bytes >= len(piece):
+                    skip_bytes -= len(piece)
+                    piece = b''
+                elif skip_bytes > 0:
+                    piece = piece[skip_bytes:]
+                    skip_bytes = 0
+                if lines_left is not None:
+                    piece_lines = piece.count(b'\n')
+                    if piece_lines >= lines_left:
+                        out.write(piece[:nth_newline_end(piece, lines_left)])
+                        return
+                    lines_left -= piece_lines
+                out.write(piece)
+                if decompressor.eof:
+                    block = decompressor.unused_data
+                    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                else:
+                    block = b''
+    if lines_left:
+        raise ValueError('Fastq file \'%s\' ends before the end of the chunk.' % file_name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='A program to split a gzipped fastq file pair into chunks without recompression.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    parser_index = subparsers.add_parser('index', help='Write the chunk index of a fastq file pair.')
+    parser_index.add_argument('-1', '--input1', required=True, help='Gzipped R1 fastq file.')
+    parser_index.add_argument('-2', '--input2', required=True, help='Gzipped R2 fastq file.')
+    parser_index.add_argument('--index_reads', nargs=2, default=None, metavar=('I1', 'I2'), help='Gzipped I1 and I2 index read fastq files, which are split with the R1 and R2 files. Default is None.')
+    parser_index.add_argument('--chunk_bytes', type=int, default=0, help='Approximate compressed R1 bytes in each chunk. Default is 0, which makes one chunk.')
+    parser_index.add_argument('--max_chunks', type=int, default=64, help='Maximum number of chunks. Default is 64.')
+    parser_index.add_argument('-o', '--output', required=True, help='Output chunk index JSON file.')
+
+    parser_read = subparsers.add_parser('read', help='Write one chunk of the R1, R2, I1, or I2 fastq file to stdout.')
+    parser_read.add_argument('--index', required=True, help='Chunk index JSON file written by the index command.')
+    parser_read.add_argument('--chunk', type=int, required=True, help='0-based chunk number.')
+    parser_read.add_argument('--read', choices=['1', '2', 'I1', 'I2'], required=True, help='Read file: 1 for R1, 2 for R2, or I1 or I2 for the index reads.')
+    parser_read.add_argument('--fastq_dir', default=None, help='Directory with the fastq files. Default is the directory of the index file.')
+    args = parser.parse_args()
+
+    if args.command == 'index':
+        chunk_index = make_chunk_index(args.input1, args.input2, args.chunk_bytes, args.max_chunks, args.index_reads)
+        with open(args.output, 'wt') as f:
+            f.write(json.dumps(chunk_index, indent=4))
+    elif args.command == 'read':
+        with open(args.index, 'rt') as f:
+            chunk_index = json.load(f)
+        chunk = chunk_index['chunks'][args.chunk]
+        fastq_dir = args.fastq_dir if args.fastq_dir is not None else os.path.dirname(args.index)
+        read_key = 'r%s' % args.read if args.read in ('1', '2') else args.read.lower()
+        if read_key not in chunk_index:
+            raise ValueError('Chunk index \'%s\' has no %s fastq file.' % (args.index, args.read))
+        member_offset, skip_bytes = chunk[read_key]
+        read_chunk(os.path.join(fastq_dir, chunk_index[read_key]), member_offset, skip_bytes, chunk['num_records'], sys.stdout.buffer)
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,229 @@
+#
+# Per-sample fastq quality metrics collected during demultiplexing.
+#
+# Notes:
+#   o  the metrics are the FastQC-like summaries that the fastqc_samples
+#      process otherwise computes by re-reading every demuxed fastq file:
+#      per-cycle quality and base composition, per-read mean quality,
+#      GC content, length distribution, N content, and an estimate of
+#      sequence duplication.
+#   o  each collector keeps fixed-size count lists so that memory does
+#      not depend on the number of reads.
+#   o  barcode_correct_sciatac.py passes only every qc_sample_interval-th
+#      read pair written to each sample to the collectors so that the
+#      demux loop cost stays small.
+#   o  the duplication estimate follows FastQC: the first
+#      duplicate_track_size distinct sequences (truncated to
+#      duplicate_prefix_length bases) are tracked and counted and the
+#      remaining sequences are counted only if they are already tracked.
+#
+
+import json
+
+
+QC_MAX_QUALITY = 45
+QC_MAX_LENGTH = 300
+QC_DUPLICATE_TRACK_SIZE = 100000
+QC_DUPLICATE_PREFIX_LENGTH = 50
+
+QC_BASES = 'ACGTN'
+_base_index = {'A': 0, 'C': 1, 'G': 2, 'T': 3, 'N': 4}
+
+
+class FastqQcCollector:
+    def __init__(self, max_length=QC_MAX_LENGTH, max_quality=QC_MAX_QUALITY, duplicate_track_size=QC_DUPLICATE_TRACK_SIZE, phred_offset=33):
+        self.max_length = max_length
+        self.max_quality = max_quality
+        self.duplicate_track_size = duplicate_track_size
+        self.phred_offset = phred_offset
+        self.num_quality = max_quality + 1
+
+        self.total_reads = 0
+        self.total_bases = 0
+        self.total_n = 0
+        self.max_observed_length = 0
+        self.quality_counts = [0] * (max_length * self.num_quality)
+        self.base_counts = [0] * (max_length * len(QC_BASES))
+        self.mean_quality_counts = [0] * self.num_quality
+        self.gc_counts = [0] * 101
+        self.length_counts = [0] * (max_length + 1)
+        self.duplicate_counts = {}
+        self.duplicate_tracked_reads = 0
+
+    def add_read(self, seq, qual):
+        """
+        Add one read to the metrics.
+        Args:
+            seq (str): read sequence
+            qual (str): read quality string
+        """
+        seq_length = len(seq)
+        length = seq_length if seq_length < self.max_length else self.max_length
+
+        self.total_reads += 1
+        self.total_bases += seq_length
+        self.length_counts[length] += 1
+        if length > self.max_observed_length:
+            self.max_observed_length = length
+
+        num_quality = self.num_quality
+        max_quality = self.max_quality
+        phred_offset = self.phred_offset
+        quality_counts = self.quality_counts
+        base_counts = self.base_counts
+        base_index = _base_index
+        quality_sum = 0
+        for i in range(length):
+            q = ord(qual[i]) - phred_offset
+            if q > max_quality:
+                q = max_quality
+            quality_counts[i * num_quality + q] += 1
+            quality_sum += q
+            base_counts[i * 5 + base_index.get(seq[i], 4)] += 1
+
+        if length > 0:
+            self.mean_quality_counts[quality_sum // length] += 1
+
+        num_n = seq.count('N')
+        self.total_n += num_n
+        if seq_length > num_n:
+            num_gc = seq.count('G') + seq.count('C')
+            self.gc_counts[int(round(100.0 * num_gc / (seq_length - num_n)))] += 1
+
+        key = seq[:QC_DUPLICATE_PREFIX_LENGTH]
+        count = self.duplicate_counts.get(key)
+        if count is not None:
+            self.duplicate_counts[key] = count + 1
+            self.duplicate_tracked_reads += 1
+        elif len(self.duplicate_counts) < self.duplicate_track_size:
+            self.duplicate_counts[key] = 1
+            self.duplicate_tracked_reads += 1
+
+    def _quality_quantile(self, cycle, total, fraction):
+        target = fraction * total
+        cumulative = 0
+        offset = cycle * self.num_quality
+        for q in range(self.num_quality):
+            cumulative += self.quality_counts[offset + q]
+            if cumulative >= target:
+                return q
+        return self.max_quality
+
+    def per_base_quality(self):
+        rows = []
+        for cycle in range(self.max_observed_length):
+            offset = cycle * self.num_quality
+            counts = self.quality_counts[offset:offset + self.num_quality]
+            total = sum(counts)
+            if total == 0:
+                continue
+            mean = sum(q * count for q, count in enumerate(counts)) / total
+            rows.append({'base': cycle + 1,
+                         'mean': round(mean, 3),
+                         'median': self._quality_quantile(cycle, total, 0.5),
+                         'lower_quartile': self._quality_quantile(cycle, total, 0.25),
+                         'upper_quartile': self._quality_quantile(cycle, total, 0.75),
+                         'percentile_10': self._quality_quantile(cycle, total, 0.1),
+                         'percentile_90': self._quality_quantile(cycle, total, 0.9)})
+        return rows
+
+    def per_base_content(self):
+        rows = []
+        for cycle in range(self.max_observed_length):
+            counts = self.base_counts[cycle * 5:cycle * 5 + 5]
+            total = sum(counts)
+            if total == 0:
+                continue
+            called = total - counts[4]
+            row = {'base': cycle + 1}
+            for i, base in enumerate(QC_BASES[0:4]):
+                row[base] = round(100.0 * counts[i] / called, 3) if called > 0 else 0.0
+            row['N'] = round(100.0 * counts[4] / total, 3)
+            rows.append(row)
+        return rows
+
+    def duplication_levels(self):
+        """
+        Returns the estimated percentage of reads remaining after
+        deduplication and a histogram of duplication levels among the
+        tracked sequences.
+        """
+        level_counts = {}
+        for count in self.duplicate_counts.values():
+            level = count if count < 10 else (10 if count < 50 else (50 if count < 100 else 100))
+            level_counts[level] = level_counts.get(level, 0) + count
+        if self.duplicate_tracked_reads > 0:
+            percent_deduplicated = 100.0 * len(self.duplicate_counts) / self.duplicate_tracked_reads
+        else:
+            percent_deduplicated = 100.0
+        levels = [{'duplication_level': level, 'reads': level_counts[level]} for level in sorted(level_counts)]
+        return round(percent_deduplicated, 3), levels
+
+    def to_dict(self):
+        percent_deduplicated, duplication_levels = self.duplication_levels()
+        return {'basic_statistics': {'total_sequences': self.total_reads,
+                                     'total_bases': self.total_bases,
+                                     'percent_n': round(100.0 * self.total_n / self.total_bases, 4) if self.total_bases > 0 else 0.0,
+                                     'percent_gc': self.percent_gc()},
+                'per_base_sequence_quality': self.per_base_quality(),
+                'per_sequence_quality_scores': [{'quality': q, 'count': count} for q, count in enumerate(self.mean_quality_counts) if count > 0],
+                'per_base_sequence_content': self.per_base_content(),
+                'per_sequence_gc_content': [{'gc_content': gc, 'count': count} for gc, count in enumerate(self.gc_counts)],
+                'sequence_length_distribution': [{'length': length, 'count': count} for length, count in enumerate(self.length_counts) if count > 0],
+                'total_deduplicated_percentage': percent_deduplicated,
+                'sequence_duplication_levels': duplication_levels}
+
+    def percent_gc(self):
+        num_gc = 0
+        num_called = 0
+        for cycle in range(self.max_observed_length):
+            counts = self.base_counts[cycle * 5:cycle * 5 + 5]
+            num_gc += counts[1] + counts[2]
+            num_called += counts[0] + counts[1] + counts[2] + counts[3]
+        return round(100.0 * num_gc / num_called, 3) if num_called > 0 else 0.0
+
+
+def write_qc_json(file_name, sample, lane_str, sample_interval, collectors):
+    """
+    Write the QC metrics for one sample as JSON.
+    Args:
+        file_name (str): output file name
+        sample (str): sample name
+        lane_str (str): lane identifier, for example L001
+        sample_interval (int): one read pair in sample_interval was collected
+        collectors (dict): read name ('r1', 'r2') to FastqQcCollector
+    """
+    qc_dict = {'sample': sample,
+               'lane': lane_str,
+               'sample_interval': sample_interval}
+    for read_name in sorted(collectors):
+        qc_dict[read_name] = collectors[read_name].to_dict()
+    with open(file_name, 'wt') as f:
+        f.write(json.dumps(qc_dict, indent=4))
+
+
+def write_qc_tsv(file_name, collector):
+    """
+    Write the QC metrics for one read file in the sectioned, tab-separated
+    layout of the FastQC fastqc_data.txt file.
+    """
+    qc_dict = collector.to_dict()
+    with open(file_name, 'wt') as f:
+        f.write('>>Basic Statistics\n#Measure\tValue\n')
+        for key, value in qc_dict['basic_statistics'].items():
+            f.write('%s\t%s\n' % (key, value))
+        f.write('>>END_MODULE\n')
+        sections = [('Per base sequence quality', 'per_base_sequence_quality', ['base', 'mean', 'median', 'lower_quartile', 'upper_quartile', 'percentile_10', 'percentile_90']),
+                    ('Per sequence quality scores', 'per_sequence_quality_scores', ['quality', 'count']),
+                    ('Per base sequence content', 'per_base_sequence_content', ['base', 'G', 'A', 'T', 'C', 'N']),
+                    ('Per sequence GC content', 'per_sequence_gc_content', ['gc_content', 'count']),
+                    ('Sequence Length Distribution', 'sequence_length_distribution', ['length', 'count']),
+                    ('Sequence Duplication Levels', 'sequence_duplication_levels', ['duplication_level', 'reads'])]
+        for title, key, columns in sections:
+            f.write('>>%s\n' % title)
+            if key == 'sequence_duplication_levels':
+                f.write('#Total Deduplicated Percentage\t%s\n' % qc_dict['total_deduplicated_percentage'])
+            f.write('#%s\n' % '\t'.join(columns))
+            for row in qc_dict[key]:
+                f.write('%s\n' % '\t'.join([str(row[column]) for column in columns]))
+            f.write('>>END_MODULE\n')
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import re
+import shutil
+import merge_demux_runs
+import output_manifest
+
+#
+# Gather the barcode_correct_sciatac.py outputs of the chunks of a lane
+# into the per-lane output files.
+#
+# Notes:
+#   o  each chunk output directory has the files that
+#      barcode_correct_sciatac.py writes for a lane. The chunks are
+#      gathered in the order given by the numbers at the end of the
+#      chunk directory names, for example demux_chunk_L001_2_5 for
+#      chunk 5 of bcl2fastq tile group 2, which must be the chunk order
+#      in the lane.
+#   o  the sample fastq files are gathered by concatenating their gzip
+#      members, so they are not recompressed, and the barcode sidecar
+#      files by concatenating their records. Rescued read pairs are
+#      at the end of each chunk rather than at the end of the lane.
+#   o  the numbers in the stats JSON files and the count CSV files are
+#      summed. The JSON 'parameters' objects and the values that are not
+#      numbers, such as the lane and flags, are copied and must be the
+#      same in all chunks. The CSV count columns are the columns with
+#      names that end in 'count'. The rows are matched on the other
+#      columns.
+#   o  the unassigned_top.csv counts are summed for the index
+#      combinations reported in any chunk. A chunk reports only its most
+#      frequent combinations, so a combination that is missing from a
+#      chunk that reports a full list may have up to the smallest count
+#      in that list. These counts are added to max_undercount, so the
+#      true count is at least count - max_overcount and at most
+#      count + max_undercount.
+#   o  the per-cell counts, hash counts, and quality metrics cannot be
+#      gathered from chunk files. These outputs require one chunk per
+#      lane.
+#   o  a new manifest is written for the gathered files.
+#
+
+GATHER_PARAMETERS_KEY = 'parameters'
+
+
+def chunk_number(chunk_dir):
+    """
+    Returns the tuple of '_'-separated numbers at the end of a chunk
+    directory name.
+    """
+    match = re.search(r'((?:_\d+)+)$', os.path.basename(os.path.normpath(chunk_dir)))
+    if match is None:
+        raise ValueError('Chunk directory name \'%s\' does not end in a chunk number.' % chunk_dir)
+    return tuple([int(number) for number in match.group(1).split('_')[1:]])
+
+
+def gather_json_values(key, values):
+    """
+    Sum the counts in a list of JSON values from chunk files.
+    """
+    first = values[0]
+    if key == GATHER_PARAMETERS_KEY:
+        for value in values[1:]:
+            if value != first:
+                raise ValueError('Chunk JSON parameters differ: %s and %s.' % (first, value))
+        return first
+    if isinstance(first, dict):
+        for value in values[1:]:
+            if list(value.keys()) != list(first.keys()):
+                raise ValueError('Chunk JSON objects for key \'%s\' have different keys.' % key)
+        return dict([(item_key, gather_json_values(item_key, [value[item_key] for value in values])) for item_key in first])
+    if isinstance(first, bool) or not isinstance(first, (int, float)):
+        for value in values[1:]:
+            if value != first:
+                raise ValueError('Chunk JSON values for key \'%s\' differ: %s and %s.' % (key, first, value))
+        return first
+    return sum(values)
+
+
+def gather_json(file_names, out_file):
+    values = []
+    for file_name in file_names:
+        with open(file_name, 'rt') as f:
+            values.append(json.load(f))
+    with open(out_file, 'wt') as f:
+        f.write(json.dumps(gather_json_values(None, values), indent=4))
+
+
+def gather_count_csv(file_names, out_file):
+    """
+    Sum the count columns of chunk CSV files.
+    """
+    base_name = os.path.basename(out_file)
+    unassigned_top = base_name.endswith('unassigned_top.csv')
+    header = None
+    rows = {}
+    category_rows = {}
+    file_keys = []
+    file_category_rows = []
+    file_category_min_counts = []
+    for file_name in file_names:
+        with open(file_name, 'rt') as f:
+            file_header = f.readline()
+            if header is None:
+                header = file_header
+                column_names = header.rstrip('\n').split(',')
+            elif file_header != header:
+                raise ValueError('Chunk CSV file \'%s\' has a different header.' % file_name)
+            keys = set()
+            num_category_rows = {}
+            category_min_counts = {}
+            for line in f:
+                fields = line.rstrip('\n').split(',')
+                # The rows of some files have a leading row number column
+                # without a header name.
+                offset = len(fields) - len(column_names)
+                count_columns = [i + offset for i, column_name in enumerate(column_names) if column_name.endswith('count')]
+                key = tuple([field for i, field in enumerate(fields) if i not in count_columns])
+                counts = [int(fields[i]) for i in count_columns]
+                if key in rows:
+                    rows[key][1] = [a + b for a, b in zip(rows[key][1], counts)]
+                else:
+                    rows[key] = [fields, counts, count_columns]
+                keys.add(key)
+                num_category_rows[fields[0]] = num_category_rows.get(fields[0], 0) + 1
+                if unassigned_top:
+                    category_min_counts[fields[0]] = min(category_min_counts.get(fields[0], counts[0]), counts[0])
+            for category, num_rows in num_category_rows.items():
+                category_rows[category] = max(category_rows.get(category, 0), num_rows)
+            file_keys.append(keys)
+            file_category_rows.append(num_category_rows)
+            file_category_min_counts.append(category_min_counts)
+
+    if unassigned_top:
+        # A row that is missing from a chunk with a full list of rows in
+        # its category may have up to the smallest count in the list.
+        count_names = [column_name for column_name in column_names if column_name.endswith('count')]
+        undercount_column = count_names.index('max_undercount')
+        for key, (fields, counts, count_columns) in rows.items():
+            category = fields[0]
+            for keys, num_category_rows, category_min_counts in zip(file_keys, file_category_rows, file_category_min_counts):
+                if key not in keys and num_category_rows.get(category, 0) == category_rows[category]:
+                    counts[undercount_column] += category_min_counts[category]
+
+    row_list = []
+    for fields, counts, count_columns in rows.values():
+        fields = list(fields)
+        for i, count in zip(count_columns, counts):
+            fields[i] = str(count)
+        row_list.append(fields)
+
+    if base_name.endswith('pair_matrix.csv'):
+        row_list.sort(key=lambda fields: (int(fields[0]), int(fields[2])))
+    elif unassigned_top:
+        categories = []
+        for fields in row_list:
+            if fields[0] not in categories:
+                categories.append(fields[0])
+        sorted_rows = []
+        for category in categories:
+            category_list = sorted([fields for fields in row_list if fields[0] == category], key=lambda fields: -int(fields[1]))
+            sorted_rows.extend(category_list[:category_rows[category]])
+        row_list = sorted_rows
+
+    with open(out_file, 'wt') as f:
+        f.write(header)
+        for fields in row_list:
+            f.write(','.join(fields))
+            f.write('\n')
+
+
+def concatenate_files(file_names, out_file):
+    with open(out_file, 'wb') as fout:
+        for file_name in file_names:
+            with open(file_name, 'rb') as fin:
+                shutil.copyfileobj(fin, fout, merge_demux_runs.MERGE_BLOCK_SIZE)
+
+
+def get_chunk_files(chunk_dir):
+    """
+    Returns the sorted relative names of the files in a chunk directory.
+    """
+    file_names = []
+    for dir_path, dir_names, dir_file_names in os.walk(chunk_dir):
+        for file_name in dir_file_names:
+            file_names.append(os.path.relpath(os.path.join(dir_path, file_name), chunk_dir))
+    return sorted(file_names)
+
+
+def gather_chunks(chunk_dirs, out_dir):
+    """
+    Gather the chunk output files into out_dir.
+    Returns:
+        str: gathered manifest file name
+    """
+    chunk_dirs = sorted(chunk_dirs, key=chunk_number)
+    file_names = get_chunk_files(chunk_dirs[0])
+    for chunk_dir in chunk_dirs[1:]:
+        if get_chunk_files(chunk_dir) != file_names:
+            raise ValueError('Chunk directories \'%s\' and \'%s\' have different files.' % (chunk_dirs[0], chunk_dir))
+
+    manifest_names = [file_name for file_name in file_names if file_name.endswith('.manifest.json')]
+    if len(manifest_names) != 1:
+        raise ValueError('Expected one manifest file in chunk directory \'%s\' but found %d.' % (chunk_dirs[0], len(manifest_names)))
+    with open(os.path.join(chunk_dirs[0], manifest_names[0]), 'rt') as f:
+        lane_str = json.load(f)['lane']
+    chunk_manifests = [output_manifest.read_manifest(os.path.join(chunk_dir, manifest_names[0])) for chunk_dir in chunk_dirs]
+
+    manifest_entries = []
+    for file_name in file_names:
+        if file_name in manifest_names:
+            continue
+        chunk_files = [os.path.join(chunk_dir, file_name) for chunk_dir in chunk_dirs]
+        out_file = os.path.join(out_dir, file_name)
+        if not os.path.exists(os.path.dirname(out_file)):
+            os.makedirs(os.path.dirname(out_file))
+        if file_name.endswith('.fastq.gz'):
+            md5, compressed_bytes = merge_demux_runs.concatenate_gzip_files(chunk_files, out_file)
+            chunk_entries = [chunk_manifest.get(file_name) for chunk_manifest in chunk_manifests]
+            if any([entry is None for entry in chunk_entries]):
+                raise ValueError('Chunk manifest is missing fastq file \'%s\'.' % file_name)
+            manifest_entries.append({'file': file_name,
+                                     'records': sum([entry['records'] for entry in chunk_entries]),
+                                     'uncompressed_bytes': sum([entry['uncompressed_bytes'] for entry in chunk_entries]),
+                                     'compressed_bytes': compressed_bytes,
+                                     'md5': md5})
+            continue
+        if file_name.endswith('.barcodes.bin'):
+            concatenate_files(chunk_files, out_file)
+        elif file_name.endswith('.json'):
+            gather_json(chunk_files, out_file)
+        elif file_name.endswith('.csv'):
+            gather_count_csv(chunk_files, out_file)
+        else:
+            raise ValueError('Cannot gather chunk file \'%s\'. Cell counts, hash counts, and quality metrics require one chunk per lane.' % file_name)
+        manifest_entries.append(output_manifest.file_entry(out_file, out_dir))
+
+    manifest_file = os.path.join(out_dir, manifest_names[0])
+    output_manifest.write_manifest(manifest_file, lane_str, manifest_entries)
+    return manifest_file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='A program to gather the barcode_correct_sciatac.py outputs of the chunks of a lane.')
+    parser.add_argument('--chunk_dirs', nargs='+', required=True, help='Chunk output directories. The directory names end in the chunk numbers.')
+    parser.add_argument('--out_dir', required=True, help='Output directory.')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+    gather_chunks(args.chunk_dirs, args.out_dir)
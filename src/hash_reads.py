@@ -0,0 +1,95 @@
+#
+# sciPlex hash read assignment during demultiplexing.
+#
+# Notes:
+#   o  the hash index file has one hash oligo per line with the hash
+#      name and sequence in the first two whitespace-separated columns.
+#      Blank lines and lines that start with '#' are skipped.
+#   o  the demux corrects the hash sequence of each read pair assigned
+#      to a sample using a mismatch-to-whitelist map, as for the index
+#      sequences. Read pairs with a hash sequence are counted by cell
+#      and hash; they are written to the sample fastq files as usual.
+#   o  when a UMI is given, the count is the number of distinct UMIs
+#      for the cell and hash; otherwise it is the number of reads.
+#   o  HashCounter.write_matrix() writes the counts as a Matrix Market
+#      coordinate file with hashes as rows and cells as columns, with
+#      the row and column names in separate files.
+#
+
+import cell_counts
+
+
+def read_hash_file(file_name):
+    """
+    Read a sciPlex hash index file.
+    Returns:
+        list of (str, str): hash (name, sequence) tuples in file order
+    """
+    hashes = []
+    with open(file_name, 'rt') as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            fields = line.split()
+            if len(fields) < 2:
+                raise ValueError('Hash index file \'%s\' line has fewer than two columns: \'%s\'.' % (file_name, line))
+            hashes.append((fields[0], fields[1].upper()))
+    if len(hashes) == 0:
+        raise ValueError('No hash sequences found in hash index file \'%s\'.' % file_name)
+    if len(set([len(seq) for name, seq in hashes])) != 1:
+        raise ValueError('Hash sequences in hash index file \'%s\' must have the same length.' % file_name)
+    return hashes
+
+
+class HashCounter:
+    def __init__(self):
+        self.counts = {}
+        self.umis = {}
+        self.hash_reads = 0
+
+    def add(self, cell_key, hash_index, umi=None):
+        self.hash_reads += 1
+        key = (cell_key, hash_index)
+        if umi is None:
+            self.counts[key] = self.counts.get(key, 0) + 1
+            return
+        umis = self.umis.get(key)
+        if umis is None:
+            self.umis[key] = set([umi])
+            self.counts[key] = 1
+        elif umi not in umis:
+            umis.add(umi)
+            self.counts[key] += 1
+
+    def write_matrix(self, file_prefix, hash_names, barcode_string_function):
+        """
+        Write the hash counts.
+        Args:
+            file_prefix (str): writes <file_prefix>.hash.mtx, <file_prefix>.hash_cells.txt,
+                               and <file_prefix>.hash_names.txt
+            hash_names (list of str): hash names in hash index order
+            barcode_string_function (function): converts the four indexes
+                                                to the cell barcode string
+        Returns:
+            dict: hash count statistics
+        """
+        cell_keys = sorted(set([cell_key for cell_key, hash_index in self.counts]))
+        cell_columns = {cell_key: column for column, cell_key in enumerate(cell_keys, start=1)}
+
+        with open('%s.hash_names.txt' % file_prefix, 'wt') as f:
+            for hash_name in hash_names:
+                f.write('%s\n' % hash_name)
+        with open('%s.hash_cells.txt' % file_prefix, 'wt') as f:
+            for cell_key in cell_keys:
+                f.write('%s\n' % barcode_string_function(*cell_counts.decode_cell_key(cell_key)))
+        with open('%s.hash.mtx' % file_prefix, 'wt') as f:
+            f.write('%%MatrixMarket matrix coordinate integer general\n')
+            f.write('%d %d %d\n' % (len(hash_names), len(cell_keys), len(self.counts)))
+            for (cell_key, hash_index), count in sorted(self.counts.items(), key=lambda item: (cell_columns[item[0][0]], item[0][1])):
+                f.write('%d %d %d\n' % (hash_index + 1, cell_columns[cell_key], count))
+
+        return {'hash_reads': self.hash_reads,
+                'hash_umis': sum(self.counts.values()),
+                'hash_cells': len(cell_keys),
+                'hash_matrix_entries': len(self.counts)}
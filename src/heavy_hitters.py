@@ -0,0 +1,73 @@
+#
+# Bounded memory tracking of the most frequent items in a stream.
+#
+# Notes:
+#   o  SpaceSaving implements the Space-Saving algorithm of Metwally,
+#      Agrawal, and El Abbadi (2005). At most 'capacity' items are
+#      counted. When a new item arrives and the table is full, the
+#      item with the smallest count is replaced and the new item
+#      inherits that count, which is recorded as its maximum
+#      over-count.
+#   o  any item with a true frequency greater than total / capacity
+#      is guaranteed to be in the table.
+#   o  the minimum count item is found with a heap that is updated
+#      lazily: a popped entry with an out-of-date count is pushed
+#      back with its current count. Each add() costs one dict update
+#      and evictions cost amortized O(log capacity).
+#
+
+import heapq
+
+
+class SpaceSaving:
+    def __init__(self, capacity):
+        if not isinstance(capacity, int) or capacity <= 0:
+            raise ValueError('SpaceSaving capacity must be a positive integer, but %s found.' % capacity)
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []
+        self.total = 0
+        self._serial = 0
+
+    def add(self, key):
+        self.total += 1
+        counts = self.counts
+        count = counts.get(key)
+        if count is not None:
+            counts[key] = count + 1
+            return
+
+        if len(counts) < self.capacity:
+            counts[key] = 1
+            self.errors[key] = 0
+            self._push(1, key)
+            return
+
+        # Replace the item with the smallest count.
+        heap = self.heap
+        while True:
+            min_count, serial, min_key = heapq.heappop(heap)
+            current = counts[min_key]
+            if current == min_count:
+                break
+            self._push(current, min_key)
+        del counts[min_key]
+        del self.errors[min_key]
+        counts[key] = min_count + 1
+        self.errors[key] = min_count
+        self._push(min_count + 1, key)
+
+    def _push(self, count, key):
+        self._serial += 1
+        heapq.heappush(self.heap, (count, self._serial, key))
+
+    def top(self, n=None):
+        """
+        Returns a list of (key, count, maximum over-count) tuples sorted
+        by decreasing count.
+        """
+        items = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        if n is not None:
+            items = items[0:n]
+        return [(key, count, self.errors[key]) for key, count in items]
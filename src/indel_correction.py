@@ -0,0 +1,171 @@
+#
+# Correct index sequences that have a single-base insertion or deletion.
+#
+# Notes:
+#   o  phasing and pre-phasing errors in the index reads make
+#      single-base insertions and deletions in the index sequences. The
+#      index sequence is read in a fixed number of cycles so an indel
+#      shifts the bases after it. After a deletion, the index sequence
+#      ends with the base that follows the index, and after an insertion
+#      the last index base is pushed out of the index sequence.
+#   o  IndelCorrecter uses precomputed indexes of the whitelist
+#      sequences (SymSpell). A deletion is found by looking up the
+#      sequence without its last base in an index of the single-base
+#      deletion variants of the whitelist sequences. An insertion is
+#      found by looking up each single-base deletion of the sequence in
+#      an index of the whitelist sequences without their last base. Each
+#      lookup is one dict access so a sequence of length L takes L + 1
+#      lookups.
+#   o  the base that follows the index sequence in the index read, the
+#      flank, is used when the read header has it. An insertion
+#      candidate must end with the flank, which is the base that was
+#      pushed out of the index sequence.
+#   o  a sequence is corrected only when one whitelist sequence is a
+#      candidate. IndelCorrecter is meant for the sequences that fail
+#      mismatch correction. The results are cached because failed
+#      sequences recur, in an LruCache of at most INDEL_CACHE_SIZE
+#      entries.
+#   o  a sequence with three substitutions can be a single-base indel
+#      of an unrelated whitelist sequence. In simulated reads of
+#      sequences with three substitutions, which fail mismatch
+#      correction, about 0.3% of pcr_i7 and 1.2% of lig_i7_384 sequences
+#      were corrected to the wrong whitelist sequence. A candidate is
+#      rejected, and the sequence counted as ambiguous, when the
+#      sequence is within max_substitutions mismatches of a whitelist
+#      sequence other than the candidate. The whitelist sequences
+#      within max_substitutions mismatches are found with a
+#      SegmentIndex.
+#   o  the check costs true corrections. With max_substitutions 3,
+#      which rejects all of the simulated false corrections, about 70%
+#      of the pcr_i7 and 25% of the lig_i7_384 indel corrections are
+#      kept. max_substitutions 0 turns the check off.
+#
+
+from lru_cache import LruCache
+from segment_index import SegmentIndex
+
+
+INDEL_DELETION = 'deletion'
+INDEL_INSERTION = 'insertion'
+INDEL_AMBIGUOUS = 'ambiguous'
+INDEL_BARCODE_TYPES = ['tagmentation_i7', 'pcr_i7', 'pcr_i5', 'tagmentation_i5']
+INDEL_MAX_SUBSTITUTIONS = 3
+INDEL_CACHE_SIZE = 100000
+
+
+class IndelCorrecter:
+    def __init__(self, whitelist, max_substitutions=INDEL_MAX_SUBSTITUTIONS, cache_size=INDEL_CACHE_SIZE):
+        if max_substitutions < 0:
+            raise ValueError('IndelCorrecter max_substitutions must be a non-negative integer, but %s found.' % max_substitutions)
+        self.whitelist = list(whitelist)
+        self.max_substitutions = max_substitutions
+        self.deletion_index = {}
+        self.prefix_index = {}
+        for barcode in self.whitelist:
+            for i in range(len(barcode)):
+                self.deletion_index.setdefault(barcode[:i] + barcode[i + 1:], set()).add(barcode)
+            self.prefix_index.setdefault(barcode[:-1], set()).add(barcode)
+
+        # There is no substitution check when max_substitutions is 0.
+        self.segment_index = SegmentIndex(self.whitelist, max_substitutions) if max_substitutions > 0 else None
+        self.cache = LruCache(cache_size)
+
+    def near_substitution(self, sequence, candidate):
+        """
+        Returns True when sequence is within max_substitutions mismatches
+        of a whitelist sequence other than candidate.
+        """
+        if self.segment_index is None:
+            return False
+        barcodes = self.segment_index.candidates(sequence)
+        barcodes.discard(candidate)
+        for barcode in barcodes:
+            distance = 0
+            for a, b in zip(sequence, barcode):
+                if a != b:
+                    distance += 1
+            if distance <= self.max_substitutions:
+                return True
+        return False
+
+    def correct(self, sequence, flank=None):
+        """
+        Correct a sequence with a single-base insertion or deletion.
+        Args:
+            sequence (str): index sequence
+            flank (str): base that follows the index sequence in the
+                         index read or None. An N flank is not used.
+        Returns:
+            tuple: whitelist sequence or None, and INDEL_DELETION,
+                   INDEL_INSERTION, INDEL_AMBIGUOUS, or None when there
+                   is no candidate
+        """
+        if flank == 'N':
+            flank = None
+        key = (sequence, flank)
+        if key in self.cache:
+            return self.cache[key]
+
+        candidates = {}
+        for barcode in self.deletion_index.get(sequence[:-1], ()):
+            candidates[barcode] = INDEL_DELETION
+        for i in range(len(sequence)):
+            for barcode in self.prefix_index.get(sequence[:i] + sequence[i + 1:], ()):
+                if flank is None or barcode[-1] == flank:
+                    candidates.setdefault(barcode, INDEL_INSERTION)
+
+        if len(candidates) == 1:
+            result = list(candidates.items())[0]
+            if self.near_substitution(sequence, result[0]):
+                result = (None, INDEL_AMBIGUOUS)
+        elif len(candidates) > 1:
+            result = (None, INDEL_AMBIGUOUS)
+        else:
+            result = (None, None)
+        self.cache[key] = result
+        return result
+
+
+def make_indel_stats(barcode_types):
+    """
+    Returns a dict of indel correction counts for the barcode types.
+    """
+    indel_stats = {'indel_correction': list(barcode_types),
+                   'indel_corrected_pairs': 0}
+    for barcode_type in barcode_types:
+        indel_stats[barcode_type] = {'failed': 0, INDEL_DELETION: 0, INDEL_INSERTION: 0, INDEL_AMBIGUOUS: 0}
+    return indel_stats
+
+
+def correct_indels(corrected_barcodes, raw_barcodes, flanks, indel_correcters, indel_stats):
+    """
+    Correct the index sequences that failed mismatch correction for
+    single-base indels.
+    Args:
+        corrected_barcodes (list): mismatch corrected sequences in
+                                   INDEL_BARCODE_TYPES order, with None
+                                   for failed sequences
+        raw_barcodes (tuple): index sequences from the read header
+        flanks (list): bases that follow the index sequences or None
+        indel_correcters (list): IndelCorrecter for each barcode type,
+                                 or None when the type is not corrected
+        indel_stats (dict): make_indel_stats() counts, which are updated
+    Returns:
+        list: corrected sequences
+    """
+    corrected_barcodes = list(corrected_barcodes)
+    indel_corrected = False
+    for i, indel_correcter in enumerate(indel_correcters):
+        if corrected_barcodes[i] is not None or indel_correcter is None:
+            continue
+        barcode_stats = indel_stats[INDEL_BARCODE_TYPES[i]]
+        barcode_stats['failed'] += 1
+        barcode, indel_type = indel_correcter.correct(raw_barcodes[i], flanks[i])
+        if indel_type is not None:
+            barcode_stats[indel_type] += 1
+        if barcode is not None:
+            corrected_barcodes[i] = barcode
+            indel_corrected = True
+    if indel_corrected and None not in corrected_barcodes:
+        indel_stats['indel_corrected_pairs'] += 1
+    return corrected_barcodes
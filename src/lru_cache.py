@@ -0,0 +1,42 @@
+#
+# A dict-like cache with a maximum number of entries.
+#
+# Notes:
+#   o  the barcode correcters cache their results for failed index
+#      sequences because failed sequences recur. A lane can have tens of
+#      millions of distinct junk index sequences, so an unbounded cache
+#      grows without limit. LruCache drops the least recently used
+#      entry when it is full.
+#   o  an entry is moved to the end of the OrderedDict when it is read
+#      so the first entry is the least recently used one.
+#   o  'key in cache' does not change the order, so the usual
+#      'if key in cache: return cache[key]' reads the entry once.
+#
+
+import collections
+
+
+class LruCache:
+    def __init__(self, max_entries):
+        if max_entries < 1:
+            raise ValueError('LruCache max_entries must be a positive integer, but %s found.' % max_entries)
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.entries:
+            del self.entries[key]
+        elif len(self.entries) >= self.max_entries:
+            self.entries.popitem(last=False)
+        self.entries[key] = value
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+
+#
+# Merge the bcl2fastq Stats/Stats.json files of the tile groups of a
+# lane into one Stats.json file for the lane.
+#
+# Notes:
+#   o  the ConversionResults counts (clusters, yields, read numbers,
+#      index mismatch counts, and read metrics) of the lane are summed.
+#      The demux results are matched on the SampleId, the index metrics
+#      on the IndexSequence, and the read metrics on the ReadNumber.
+#   o  the Flowcell, RunNumber, RunId, and ReadInfosForLanes values are
+#      taken from the first file.
+#   o  bcl2fastq reports only the most frequent unknown barcodes of a
+#      tile group, so the summed UnknownBarcodes counts are lower bounds
+#      for barcodes that are missing from the lists of some tile groups.
+#      The merged list is sorted by decreasing count.
+#   o  entries for other lanes in the tile group files are not used.
+#
+
+
+def add_counts(total, counts, skip_keys=()):
+    """
+    Add the numbers in the dict counts to those in the dict total.
+    """
+    for key, value in counts.items():
+        if key not in skip_keys:
+            total[key] = total.get(key, 0) + value
+
+
+def merge_read_metrics(total, read_metrics):
+    """
+    Add a ReadMetrics list to the ReadMetrics list total.
+    """
+    total_by_read = dict([(metric['ReadNumber'], metric) for metric in total])
+    for metric in read_metrics:
+        if metric['ReadNumber'] in total_by_read:
+            add_counts(total_by_read[metric['ReadNumber']], metric, skip_keys=('ReadNumber',))
+        else:
+            total.append(dict(metric))
+            total_by_read[metric['ReadNumber']] = total[-1]
+
+
+def merge_demux_result(total, result):
+    """
+    Add a DemuxResults entry or the Undetermined entry to total.
+    """
+    total['NumberReads'] = total.get('NumberReads', 0) + result.get('NumberReads', 0)
+    total['Yield'] = total.get('Yield', 0) + result.get('Yield', 0)
+    if 'IndexMetrics' in result:
+        index_metrics = dict([(metric['IndexSequence'], metric) for metric in total.setdefault('IndexMetrics', [])])
+        for metric in result['IndexMetrics']:
+            if metric['IndexSequence'] not in index_metrics:
+                index_metrics[metric['IndexSequence']] = {'IndexSequence': metric['IndexSequence'], 'MismatchCounts': {}}
+                total['IndexMetrics'].append(index_metrics[metric['IndexSequence']])
+            add_counts(index_metrics[metric['IndexSequence']]['MismatchCounts'], metric.get('MismatchCounts', {}))
+    merge_read_metrics(total.setdefault('ReadMetrics', []), result.get('ReadMetrics', []))
+
+
+def merge_conversion_results(total, results):
+    """
+    Add the ConversionResults entry of a lane to total.
+    """
+    for key in ['TotalClustersRaw', 'TotalClustersPF', 'Yield']:
+        total[key] = total.get(key, 0) + results.get(key, 0)
+    demux_results = dict([(result['SampleId'], result) for result in total.setdefault('DemuxResults', [])])
+    for result in results.get('DemuxResults', []):
+        if result['SampleId'] not in demux_results:
+            demux_results[result['SampleId']] = {'SampleId': result['SampleId'], 'SampleName': result.get('SampleName', result['SampleId'])}
+            total['DemuxResults'].append(demux_results[result['SampleId']])
+        merge_demux_result(demux_results[result['SampleId']], result)
+    if 'Undetermined' in results:
+        merge_demux_result(total.setdefault('Undetermined', {}), results['Undetermined'])
+
+
+def merge_stats(stats_list, lane):
+    """
+    Merge the bcl2fastq stats of the tile groups of a lane.
+    Args:
+        stats_list (list): Stats.json dicts
+        lane (int): lane number
+    Returns:
+        dict: Stats.json dict of the lane
+    """
+    merged = {}
+    for key in ['Flowcell', 'RunNumber', 'RunId']:
+        if key in stats_list[0]:
+            merged[key] = stats_list[0][key]
+    merged['ReadInfosForLanes'] = [read_infos for read_infos in stats_list[0].get('ReadInfosForLanes', []) if read_infos['LaneNumber'] == lane]
+
+    conversion_results = {'LaneNumber': lane}
+    unknown_barcodes = {}
+    for stats in stats_list:
+        for results in stats.get('ConversionResults', []):
+            if results['LaneNumber'] == lane:
+                merge_conversion_results(conversion_results, results)
+        for barcodes in stats.get('UnknownBarcodes', []):
+            if barcodes['Lane'] == lane:
+                add_counts(unknown_barcodes, barcodes['Barcodes'])
+    merged['ConversionResults'] = [conversion_results]
+    merged['UnknownBarcodes'] = [{'Lane': lane, 'Barcodes': dict(sorted(unknown_barcodes.items(), key=lambda item: (-item[1], item[0])))}]
+    return merged
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='A program to merge the bcl2fastq Stats.json files of the tile groups of a lane.')
+    parser.add_argument('--stats', nargs='+', required=True, help='Tile group Stats.json files.')
+    parser.add_argument('--lane', type=int, required=True, help='Lane number.')
+    parser.add_argument('-o', '--output', required=True, help='Output Stats.json file.')
+    args = parser.parse_args()
+
+    stats_list = []
+    for file_name in args.stats:
+        with open(file_name, 'rt') as f:
+            stats_list.append(json.load(f))
+    with open(args.output, 'wt') as f:
+        f.write(json.dumps(merge_stats(stats_list, args.lane), indent=2))
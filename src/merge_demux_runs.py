@@ -0,0 +1,202 @@
+from __future__ import print_function
+from __future__ import division
+import argparse
+import glob
+import hashlib
+import multiprocessing
+import os
+import time
+import zlib
+import output_manifest
+
+#
+# Merge the sample fastq files of two or more demux runs.
+#
+# Notes:
+#   o  the merged file is the concatenation of the source files. gzip
+#      allows member concatenation so the files are neither decompressed
+#      nor recompressed. The 28-byte BGZF end-of-file block is dropped
+#      from all but the last source file so that a merged BGZF file has
+#      a single end-of-file block.
+#   o  the R1 and R2 record counts of each source file pair must be
+#      equal. The record counts are taken from the demux manifest files
+#      (<demux_dir>/fastqs_barcode/RUN001_<lane>.manifest.json) when the
+#      manifest lists the file and its compressed size matches the file
+#      size; otherwise the newlines are counted with zlib.
+#   o  the samples are merged in parallel by a process pool. Each merge
+#      is sequential I/O so the run time is set by the disk speed.
+#   o  the merged manifest, merge.manifest.json, has the records and
+#      md5 checksums of the merged files. The md5 is calculated as the
+#      merged file is written.
+#
+
+BGZF_EOF = bytes(bytearray([0x1f, 0x8b, 0x08, 0x04, 0x00, 0x00, 0x00, 0x00,
+                            0x00, 0xff, 0x06, 0x00, 0x42, 0x43, 0x02, 0x00,
+                            0x1b, 0x00, 0x03, 0x00, 0x00, 0x00, 0x00, 0x00,
+                            0x00, 0x00, 0x00, 0x00]))
+MERGE_BLOCK_SIZE = 4194304
+
+
+def count_gzip_lines(file_name):
+    """
+    Count the newlines in a gzip file with one or more members.
+    """
+    lines = 0
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    with open(file_name, 'rb') as f:
+        while True:
+            block = f.read(MERGE_BLOCK_SIZE)
+            if len(block) == 0:
+                break
+            while block:
+                lines += decompressor.decompress(block).count(b'\n')
+                if decompressor.eof:
+                    block = decompressor.unused_data
+                    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                else:
+                    block = b''
+        lines += decompressor.flush().count(b'\n')
+    return lines
+
+
+def read_demux_manifests(demux_dir):
+    """
+    Returns a dict of the manifest entries of a demux run keyed by file
+    base name.
+    """
+    entries = {}
+    for manifest_file in sorted(glob.glob(os.path.join(demux_dir, 'fastqs_barcode', '*.manifest.json'))):
+        for file_name, entry in output_manifest.read_manifest(manifest_file).items():
+            entries[os.path.basename(file_name)] = entry
+    return entries
+
+
+def get_record_count(file_name, manifest_entries):
+    entry = manifest_entries.get(os.path.basename(file_name))
+    if entry is not None and entry['records'] is not None and entry['compressed_bytes'] == os.path.getsize(file_name):
+        return entry['records']
+    lines = count_gzip_lines(file_name)
+    if lines % 4 != 0:
+        raise ValueError('Fastq file \'%s\' has %d lines, which is not a multiple of four.' % (file_name, lines))
+    return lines // 4
+
+
+def concatenate_gzip_files(source_files, merged_file):
+    """
+    Concatenate gzip or BGZF files and return the md5 checksum and size
+    of the merged file.
+    """
+    md5 = hashlib.md5()
+    merged_bytes = 0
+    with open(merged_file, 'wb') as fout:
+        for i, source_file in enumerate(source_files):
+            source_bytes = os.path.getsize(source_file)
+            last_source = i == len(source_files) - 1
+            with open(source_file, 'rb') as fin:
+                if not last_source and source_bytes >= len(BGZF_EOF):
+                    fin.seek(source_bytes - len(BGZF_EOF))
+                    if fin.read(len(BGZF_EOF)) == BGZF_EOF:
+                        source_bytes -= len(BGZF_EOF)
+                    fin.seek(0)
+                while source_bytes > 0:
+                    block = fin.read(min(MERGE_BLOCK_SIZE, source_bytes))
+                    if len(block) == 0:
+                        raise ValueError('Unexpected end of file \'%s\'.' % source_file)
+                    source_bytes -= len(block)
+                    md5.update(block)
+                    merged_bytes += len(block)
+                    fout.write(block)
+    return md5.hexdigest(), merged_bytes
+
+
+def get_sample_fastq_names(demux_dirs, sample, fastq_subdir):
+    """
+    Returns the sorted fastq file base names of a sample, which must be
+    the same in every demux run, or None when the sample has no such
+    sub-directory.
+    """
+    file_lists = []
+    for demux_dir in demux_dirs:
+        file_lists.append(sorted([os.path.basename(file_name) for file_name in glob.glob(os.path.join(demux_dir, sample, fastq_subdir, '*.fastq.gz'))]))
+    if all([len(file_list) == 0 for file_list in file_lists]):
+        return None
+    for demux_dir, file_list in zip(demux_dirs[1:], file_lists[1:]):
+        if file_list != file_lists[0]:
+            raise ValueError('Sample \'%s\' %s fastq files differ in \'%s\' and \'%s\'.' % (sample, fastq_subdir, demux_dirs[0], demux_dir))
+    return file_lists[0]
+
+
+def merge_sample(task):
+    """
+    Merge the fastq files of one sample.
+    Args:
+        task (tuple): (demux_dirs, manifests, sample, fastq_subdirs, out_dir)
+    Returns:
+        list of dict: merged manifest entries
+    """
+    demux_dirs, manifests, sample, fastq_subdirs, out_dir = task
+    entries = []
+    for fastq_subdir in fastq_subdirs:
+        fastq_names = get_sample_fastq_names(demux_dirs, sample, fastq_subdir)
+        if fastq_names is None:
+            continue
+        merged_dir = os.path.join(out_dir, sample, fastq_subdir)
+        if not os.path.exists(merged_dir):
+            os.makedirs(merged_dir)
+        records = {}
+        for fastq_name in fastq_names:
+            source_files = [os.path.join(demux_dir, sample, fastq_subdir, fastq_name) for demux_dir in demux_dirs]
+            records[fastq_name] = [get_record_count(source_file, manifest) for source_file, manifest in zip(source_files, manifests)]
+        for fastq_name in fastq_names:
+            if not fastq_name.endswith('_R1.fastq.gz'):
+                continue
+            mate_name = fastq_name[:-len('_R1.fastq.gz')] + '_R2.fastq.gz'
+            if mate_name in records and records[fastq_name] != records[mate_name]:
+                raise ValueError('Sample \'%s\' read pair files \'%s\' and \'%s\' have different record counts: %s and %s.' % (sample, fastq_name, mate_name, records[fastq_name], records[mate_name]))
+        for fastq_name in fastq_names:
+            source_files = [os.path.join(demux_dir, sample, fastq_subdir, fastq_name) for demux_dir in demux_dirs]
+            merged_file = os.path.join(merged_dir, fastq_name)
+            md5, merged_bytes = concatenate_gzip_files(source_files, merged_file)
+            entries.append({'file': os.path.relpath(merged_file, out_dir),
+                            'records': sum(records[fastq_name]),
+                            'uncompressed_bytes': None,
+                            'compressed_bytes': merged_bytes,
+                            'md5': md5,
+                            'source_records': records[fastq_name]})
+    return entries
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='A program to merge the sample fastq files of two or more demux runs without recompression.')
+    parser.add_argument('--demux_dirs', nargs='+', required=True, help='Demux output directories (<run>/demux_out) to merge, in merge order.')
+    parser.add_argument('--out_dir', required=True, help='Merged demux output directory.')
+    parser.add_argument('--samples', nargs='+', default=None, help='Samples to merge. Default is the samples in the first demux directory.')
+    parser.add_argument('--fastq_subdirs', nargs='+', default=['fastqs_barcode', 'fastqs_trim'], help='Sample fastq sub-directories to merge. Default is fastqs_barcode and fastqs_trim.')
+    parser.add_argument('--num_processes', type=int, default=4, help='Number of samples to merge in parallel. Default is 4.')
+    args = parser.parse_args()
+
+    if len(args.demux_dirs) < 2:
+        raise ValueError('Specify at least two demux directories to merge.')
+
+    samples = args.samples
+    if samples is None:
+        samples = sorted([name for name in os.listdir(args.demux_dirs[0]) if any([os.path.isdir(os.path.join(args.demux_dirs[0], name, fastq_subdir)) for fastq_subdir in args.fastq_subdirs])])
+    if len(samples) == 0:
+        raise ValueError('No samples found in demux directory \'%s\'.' % args.demux_dirs[0])
+
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    start = time.time()
+    manifests = [read_demux_manifests(demux_dir) for demux_dir in args.demux_dirs]
+    tasks = [(args.demux_dirs, manifests, sample, args.fastq_subdirs, args.out_dir) for sample in samples]
+    pool = multiprocessing.Pool(max(1, min(args.num_processes, len(tasks))))
+    manifest_entries = []
+    for sample, entries in zip(samples, pool.imap(merge_sample, tasks)):
+        print('Merged %d files for sample %s.' % (len(entries), sample))
+        manifest_entries.extend(entries)
+    pool.close()
+    pool.join()
+
+    output_manifest.write_manifest(os.path.join(args.out_dir, 'merge.manifest.json'), 'merged', manifest_entries)
+    print('Done merging %d samples in %s minutes.' % (len(samples), (time.time() - start) / 60.0))
@@ -0,0 +1,95 @@
+#
+# Record counts, byte counts, and checksums of demux output files.
+#
+# Notes:
+#   o  the sample fastq files are compressed by streaming the pigz
+#      output through this process, which computes the md5 checksum and
+#      byte count of the compressed file as it writes it, so the files
+#      are never re-read to verify them.
+#   o  the record counts of the fastq files are counted by the demux as
+#      it writes the reads. The uncompressed byte count is the size of
+#      the uncompressed file before compression.
+#   o  the small stats and count files are checksummed after they are
+#      written.
+#
+
+import hashlib
+import json
+import os
+import subprocess
+
+
+MANIFEST_BLOCK_SIZE = 1048576
+
+
+def compress_file(file_name, num_pigz_threads, base_dir, records=None):
+    """
+    Compress a file with pigz, replacing it with file_name.gz, and
+    return its manifest entry.
+    Args:
+        file_name (str): uncompressed file name
+        num_pigz_threads (str or int): number of pigz processes
+        base_dir (str): manifest file names are relative to base_dir
+        records (int): number of fastq records in the file or None
+    Returns:
+        dict: manifest entry for the compressed file
+    """
+    uncompressed_bytes = os.path.getsize(file_name)
+    compressed_file_name = file_name + '.gz'
+    md5 = hashlib.md5()
+    compressed_bytes = 0
+    with open(file_name, 'rb') as fin, open(compressed_file_name, 'wb') as fout:
+        process = subprocess.Popen(['pigz', '-c', '--processes', str(num_pigz_threads)], stdin=fin, stdout=subprocess.PIPE)
+        while True:
+            block = process.stdout.read(MANIFEST_BLOCK_SIZE)
+            if len(block) == 0:
+                break
+            md5.update(block)
+            compressed_bytes += len(block)
+            fout.write(block)
+        process.stdout.close()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, 'pigz -c %s' % file_name)
+    os.remove(file_name)
+    return {'file': os.path.relpath(compressed_file_name, base_dir),
+            'records': records,
+            'uncompressed_bytes': uncompressed_bytes,
+            'compressed_bytes': compressed_bytes,
+            'md5': md5.hexdigest()}
+
+
+def file_entry(file_name, base_dir):
+    """
+    Returns the manifest entry for a file that is not compressed by the
+    demux. The uncompressed byte count is None for gzipped files.
+    """
+    md5 = hashlib.md5()
+    with open(file_name, 'rb') as f:
+        while True:
+            block = f.read(MANIFEST_BLOCK_SIZE)
+            if len(block) == 0:
+                break
+            md5.update(block)
+    file_bytes = os.path.getsize(file_name)
+    return {'file': os.path.relpath(file_name, base_dir),
+            'records': None,
+            'uncompressed_bytes': None if file_name.endswith('.gz') else file_bytes,
+            'compressed_bytes': file_bytes,
+            'md5': md5.hexdigest()}
+
+
+def write_manifest(file_name, lane_str, entries):
+    manifest = {'lane': lane_str,
+                'checksum': 'md5',
+                'files': sorted(entries, key=lambda entry: entry['file'])}
+    with open(file_name, 'wt') as f:
+        f.write(json.dumps(manifest, indent=4))
+
+
+def read_manifest(file_name):
+    """
+    Returns a dict of manifest entries keyed by file name.
+    """
+    with open(file_name, 'rt') as f:
+        manifest = json.load(f)
+    return {entry['file']: entry for entry in manifest['files']}
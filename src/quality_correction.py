@@ -0,0 +1,192 @@
+#
+# Correct index sequences that fail mismatch correction using the base
+# qualities of the index reads.
+#
+# Notes:
+#   o  the mismatch maps treat every mismatch position the same, so an
+#      index sequence that is the same number of mismatches from two
+#      whitelist sequences is a conflict and fails correction. The base
+#      qualities of the index reads, which are in the I1 and I2 index
+#      read fastq files, tell which mismatches are likely to be
+#      sequencing errors.
+#   o  QualityCorrecter finds the whitelist sequences within
+#      max_distance mismatches of a sequence, the candidates, with a
+#      SegmentIndex. The candidates and their mismatch positions are
+#      cached because failed sequences recur, in an LruCache of at most
+#      QUALITY_CACHE_SIZE entries.
+#   o  the likelihood of the observed bases given a candidate is the
+#      product of 1 - e for the matching bases and e / 3 for the
+#      mismatched bases, where e is the error probability of the base
+#      Phred quality. An N is equally likely for every candidate. The
+#      likelihood relative to a perfect match is the product of the
+#      PHRED_MISMATCH_WEIGHTS of the quality characters at the mismatch
+#      positions, so a candidate costs one table lookup for each
+#      mismatch.
+#   o  the posterior of a candidate is its likelihood divided by the
+#      sum of the candidate likelihoods, which assumes that the
+#      whitelist sequences are equally likely and that the sequence is
+#      within max_distance mismatches of its true whitelist sequence.
+#      The best candidate is accepted when its posterior is at least
+#      min_posterior.
+#   o  the posterior does not say whether the sequence is from any of
+#      the candidates, so a lone candidate has posterior 1 even when
+#      its mismatches are at high quality bases. The best candidate is
+#      also required to have a likelihood relative to a perfect match of
+#      at least min_likelihood. The default is about the likelihood of
+#      one mismatch at a quality 25 base, so a sequence with mismatches
+#      only at high quality bases is not corrected.
+#
+
+from lru_cache import LruCache
+from segment_index import SegmentIndex
+
+
+QUALITY_CORRECTED = 'corrected'
+QUALITY_LOW_POSTERIOR = 'low_posterior'
+QUALITY_LOW_LIKELIHOOD = 'low_likelihood'
+QUALITY_NO_CANDIDATE = 'no_candidate'
+QUALITY_BARCODE_TYPES = ['tagmentation_i7', 'pcr_i7', 'pcr_i5', 'tagmentation_i5']
+QUALITY_MAX_DISTANCE = 2
+QUALITY_MIN_POSTERIOR = 0.99
+QUALITY_MIN_LIKELIHOOD = 0.001
+QUALITY_CACHE_SIZE = 100000
+PHRED_OFFSET = 33
+
+
+def make_phred_mismatch_weights():
+    """
+    Returns the list of the mismatch likelihood ratios, (e / 3) / (1 - e),
+    indexed by the ordinal of the Phred+33 quality character. The error
+    probability is at most 0.75, which is a random base.
+    """
+    weights = []
+    for i in range(128):
+        error = min(10.0 ** (-max(i - PHRED_OFFSET, 0) / 10.0), 0.75)
+        weights.append((error / 3.0) / (1.0 - error))
+    return weights
+
+
+PHRED_MISMATCH_WEIGHTS = make_phred_mismatch_weights()
+
+
+class QualityCorrecter:
+    def __init__(self, whitelist, max_distance=QUALITY_MAX_DISTANCE, min_posterior=QUALITY_MIN_POSTERIOR, min_likelihood=QUALITY_MIN_LIKELIHOOD, cache_size=QUALITY_CACHE_SIZE):
+        if max_distance < 1:
+            raise ValueError('QualityCorrecter max_distance must be a positive integer, but %s found.' % max_distance)
+        if min_posterior <= 0.5 or min_posterior > 1.0:
+            raise ValueError('QualityCorrecter min_posterior must be greater than 0.5 and at most 1, but %s found.' % min_posterior)
+        if min_likelihood < 0.0 or min_likelihood > 1.0:
+            raise ValueError('QualityCorrecter min_likelihood must be at least 0 and at most 1, but %s found.' % min_likelihood)
+        self.whitelist = list(whitelist)
+        self.max_distance = max_distance
+        self.min_posterior = min_posterior
+        self.min_likelihood = min_likelihood
+
+        self.segment_index = SegmentIndex(self.whitelist, max_distance)
+        self.cache = LruCache(cache_size)
+
+    def get_candidates(self, sequence):
+        """
+        Returns the list of (whitelist sequence, mismatch positions)
+        tuples of the whitelist sequences within max_distance mismatches
+        of sequence. The mismatch positions exclude N bases.
+        """
+        if sequence in self.cache:
+            return self.cache[sequence]
+
+        candidates = []
+        for barcode in sorted(self.segment_index.candidates(sequence)):
+            distance = 0
+            positions = []
+            for position, (a, b) in enumerate(zip(sequence, barcode)):
+                if a != b:
+                    distance += 1
+                    if a != 'N':
+                        positions.append(position)
+            if distance <= self.max_distance:
+                candidates.append((barcode, tuple(positions)))
+        self.cache[sequence] = candidates
+        return candidates
+
+    def correct(self, sequence, quality):
+        """
+        Correct a sequence using its base qualities.
+        Args:
+            sequence (str): index sequence
+            quality (str): Phred+33 base qualities of the sequence
+        Returns:
+            tuple: whitelist sequence or None, and QUALITY_CORRECTED,
+                   QUALITY_LOW_POSTERIOR, QUALITY_LOW_LIKELIHOOD, or
+                   QUALITY_NO_CANDIDATE
+        """
+        candidates = self.get_candidates(sequence)
+        if not candidates:
+            return None, QUALITY_NO_CANDIDATE
+
+        weights = PHRED_MISMATCH_WEIGHTS
+        best_barcode = None
+        best_weight = 0.0
+        total_weight = 0.0
+        for barcode, positions in candidates:
+            weight = 1.0
+            for position in positions:
+                weight *= weights[ord(quality[position])]
+            total_weight += weight
+            if weight > best_weight:
+                best_weight = weight
+                best_barcode = barcode
+
+        if best_weight < self.min_posterior * total_weight:
+            return None, QUALITY_LOW_POSTERIOR
+        if best_weight < self.min_likelihood:
+            return None, QUALITY_LOW_LIKELIHOOD
+        return best_barcode, QUALITY_CORRECTED
+
+
+def make_quality_stats(barcode_types, max_distance, min_posterior, min_likelihood):
+    """
+    Returns a dict of quality correction counts for the barcode types.
+    """
+    quality_stats = {'quality_correction': list(barcode_types),
+                     'parameters': {'quality_max_distance': max_distance,
+                                    'quality_min_posterior': min_posterior,
+                                    'quality_min_likelihood': min_likelihood},
+                     'quality_corrected_pairs': 0}
+    for barcode_type in barcode_types:
+        quality_stats[barcode_type] = {'failed': 0, QUALITY_CORRECTED: 0, QUALITY_LOW_POSTERIOR: 0, QUALITY_LOW_LIKELIHOOD: 0, QUALITY_NO_CANDIDATE: 0}
+    return quality_stats
+
+
+def correct_qualities(corrected_barcodes, raw_barcodes, raw_qualities, quality_correcters, quality_stats):
+    """
+    Correct the index sequences that failed mismatch correction using
+    their base qualities.
+    Args:
+        corrected_barcodes (list): mismatch corrected sequences in
+                                   QUALITY_BARCODE_TYPES order, with
+                                   None for failed sequences
+        raw_barcodes (tuple): index sequences
+        raw_qualities (tuple): base qualities of the index sequences
+        quality_correcters (list): QualityCorrecter for each barcode
+                                   type, or None when the type is not
+                                   corrected
+        quality_stats (dict): make_quality_stats() counts, which are
+                              updated
+    Returns:
+        list: corrected sequences
+    """
+    corrected_barcodes = list(corrected_barcodes)
+    quality_corrected = False
+    for i, quality_correcter in enumerate(quality_correcters):
+        if corrected_barcodes[i] is not None or quality_correcter is None:
+            continue
+        barcode_stats = quality_stats[QUALITY_BARCODE_TYPES[i]]
+        barcode_stats['failed'] += 1
+        barcode, outcome = quality_correcter.correct(raw_barcodes[i], raw_qualities[i])
+        barcode_stats[outcome] += 1
+        if barcode is not None:
+            corrected_barcodes[i] = barcode
+            quality_corrected = True
+    if quality_corrected and None not in corrected_barcodes:
+        quality_stats['quality_corrected_pairs'] += 1
+    return corrected_barcodes
@@ -0,0 +1,244 @@
+from __future__ import print_function
+from __future__ import division
+import argparse
+import os
+import sys
+import time
+import json
+from Bio.SeqIO.QualityIO import FastqGeneralIterator
+import barcode_to_well
+import barcode_sidecar
+import output_manifest
+import barcode_correct_sciatac as bcs
+
+#
+# Re-split a demultiplexed lane with a new samplesheet using the barcode
+# sidecar written by barcode_correct_sciatac.py --barcode_sidecar.
+#
+# Notes:
+#   o  the sidecar has the corrected index numbers of every read so the
+#      index sequences are neither parsed nor corrected again.
+#   o  without the --input1 and --input2 fastq files, only the lane
+#      statistics and count files are written. These are calculated
+#      from the sidecar alone.
+#   o  with the fastq files, which must be the same files, in the same
+#      order, used to make the sidecar, the sample fastq files are
+#      written as well. The fastq files are read sequentially.
+#   o  the sidecar record numbers increase but are not consecutive when
+#      the lane was converted by bcl2fastq tile groups.
+#   o  the output files have the same names and formats as the
+#      barcode_correct_sciatac.py output files. Adapter trimming,
+#      quality metrics, and cell counts are not repeated.
+#
+
+def make_arg_parser():
+    parser = argparse.ArgumentParser(description='A program to re-split scATAC reads with a new samplesheet using a barcode sidecar file.')
+    parser.add_argument('--sidecar', required=True, help='Barcode sidecar file (RUN001_<lane>.barcodes.bin) written by barcode_correct_sciatac.py.')
+    parser.add_argument('--sidecar_json', required=False, default=None, help='Barcode sidecar metadata file. Default is the sidecar file name with the .bin suffix replaced by .json.')
+    parser.add_argument('--samplesheet', required=True, help='Samplesheet describing the layout of the samples.')
+    parser.add_argument('--out_dir', required=True, help='Output directory.')
+    parser.add_argument('-1', '--input1', default=None, help='R1 fastq file, which may be gzipped or a pipe. Use - for stdin. Omit to write statistics only.')
+    parser.add_argument('-2', '--input2', default=None, help='R2 fastq file, which may be gzipped or a pipe. Use - for stdin. Omit to write statistics only.')
+    parser.add_argument('--num_pigz_threads', default=1, help='Number of processes used by pigz to compress fastq files.')
+    parser.add_argument('--no_mask', action='store_true', help='Use all four barcodes. By default, do not use (mask out) a barcode(s) when all samples have the same index set (flag).')
+    parser.add_argument('--write_buffer_blocks', type=int, default=16, help='Number of 8K blocks for fastq write buffers. Default is 16.')
+    return parser
+
+
+def run_resplit(args):
+    """
+    Re-split a lane using its barcode sidecar and write the sample files.
+    Args:
+        args (argparse.Namespace): make_arg_parser() arguments
+    """
+    if (args.input1 is None) != (args.input2 is None):
+        raise ValueError('Specify both --input1 and --input2 or neither.')
+
+    sidecar_json = args.sidecar_json
+    if sidecar_json is None:
+        sidecar_json = os.path.splitext(args.sidecar)[0] + '.json'
+    metadata = barcode_sidecar.read_sidecar_metadata(sidecar_json)
+
+    # The index set arguments used to make the sidecar.
+    parameters = metadata['parameters']
+    index_args = argparse.Namespace(two_level_indexed_tn5=parameters['two_level_indexed_tn5'],
+                                    wells_384=parameters['wells_384'],
+                                    nextseq=parameters['nextseq'])
+    well_ids = parameters['well_ids']
+    lane_str = metadata['lane']
+    lane_num = int(lane_str.replace('L', ''))
+    missing_index = parameters['missing_index']
+
+    tagi7, pcri7, pcri5, tagi5 = bcs.load_std_index_lists(index_args)
+    if(not index_args.two_level_indexed_tn5):
+      lig_i7_to_well, lig_i5_to_well, pcr_to_well = bcs.load_std_index_to_well_dicts(index_args)
+    else:
+      nex_two_level_indexed_tn5_to_well, pcr_two_level_indexed_tn5_to_well = bcs.load_std_index_to_well_indexed_tn5_dicts(index_args)
+
+    index_mask, sample_lookup, tagi5_sample_list, tag_pairs_counts, pcr_pairs_counts, index_flags = bcs.get_sample_lookup(open(args.samplesheet), args.no_mask, pcri7, tagi7, tagi5, pcri5)
+    bcs.set_index_flags(index_args, index_flags)
+
+    if( not os.path.exists(args.out_dir)):
+        os.mkdir(args.out_dir)
+
+    write_fastqs = args.input1 is not None
+    output_files = {}
+    if write_fastqs:
+        buffer_size = args.write_buffer_blocks * 8192
+        for sample in list(set(sample_lookup.values())):
+            output_file_1 = os.path.join(args.out_dir, '%s-RUN001_%s_R1.fastq' % (sample, lane_str))
+            output_file_2 = os.path.join(args.out_dir, '%s-RUN001_%s_R2.fastq' % (sample, lane_str))
+            output_files[sample] = {}
+            output_files[sample]['r1'] = open(output_file_1, 'w', buffering=buffer_size)
+            output_files[sample]['r1_name'] = output_file_1
+            output_files[sample]['r2'] = open(output_file_2, 'w', buffering=buffer_size)
+            output_files[sample]['r2_name'] = output_file_2
+            output_files[sample]['records'] = 0
+        input_files = [bcs.open_fastq(args.input1), bcs.open_fastq(args.input2)]
+        reads = zip(FastqGeneralIterator(input_files[0]), FastqGeneralIterator(input_files[1]))
+
+    validreads = {}
+    validreads['Lane'] = 'Lane %d' % (lane_num)
+    validreads['pcr_i5'] = 0
+    validreads['pcr_i7'] = 0
+    validreads['pcr'] = 0
+    validreads['pcr_match'] = 0
+    validreads['tagmentation_i5'] = 0
+    validreads['tagmentation_i7'] = 0
+    validreads['tagmentation'] = 0
+    validreads['tagmentation_match'] = 0
+    validreads['all_barcodes'] = 0
+
+    tagmentation_i7_count = [0] * 384
+    pcr_i7_count = [0] * 384
+    pcr_i5_count = [0] * 384
+    tagmentation_i5_count = [0] * 384
+    tag_pair_matrix = [0] * (384 * 384)
+    pcr_pair_matrix = [0] * (384 * 384)
+    tag_pair_flags = bcs.pair_counts_to_flags(tag_pairs_counts, 384)
+    pcr_pair_flags = bcs.pair_counts_to_flags(pcr_pairs_counts, 384)
+
+    start = time.time()
+    totreads = 0
+    last_record_number = 0
+    total_not_specified_in_samplesheet = 0
+    for tagmentation_i7_index, pcr_i7_index, pcr_i5_index, tagmentation_i5_index, record_number in barcode_sidecar.read_sidecar(args.sidecar):
+        totreads += 1
+        if record_number <= last_record_number:
+            raise ValueError('Barcode sidecar record %d has record number %d, which follows record number %d.' % (totreads, record_number, last_record_number))
+        last_record_number = record_number
+
+        if write_fastqs:
+            try:
+                (r1_name, r1_seq, r1_qual), (r2_name, r2_seq, r2_qual) = next(reads)
+            except StopIteration:
+                raise ValueError('The fastq files have fewer reads than the barcode sidecar.')
+
+        tagmentation_i7_valid = tagmentation_i7_index != missing_index
+        pcr_i7_valid = pcr_i7_index != missing_index
+        pcr_i5_valid = pcr_i5_index != missing_index
+        tagmentation_i5_valid = tagmentation_i5_index != missing_index
+
+        if tagmentation_i7_valid:
+            validreads['tagmentation_i7'] += 1
+            tagmentation_i7_count[tagmentation_i7_index] += 1
+        if tagmentation_i5_valid:
+            validreads['tagmentation_i5'] += 1
+            tagmentation_i5_count[tagmentation_i5_index] += 1
+        if tagmentation_i7_valid and tagmentation_i5_valid:
+            validreads['tagmentation'] += 1
+            pair_offset = tagmentation_i7_index * 384 + tagmentation_i5_index
+            tag_pair_matrix[pair_offset] += 1
+            if tag_pair_flags[pair_offset]:
+                validreads['tagmentation_match'] += 1
+
+        if pcr_i7_valid:
+            validreads['pcr_i7'] += 1
+            pcr_i7_count[pcr_i7_index] += 1
+        if pcr_i5_valid:
+            validreads['pcr_i5'] += 1
+            pcr_i5_count[pcr_i5_index] += 1
+        if pcr_i7_valid and pcr_i5_valid:
+            validreads['pcr'] += 1
+            pair_offset = pcr_i7_index * 384 + pcr_i5_index
+            pcr_pair_matrix[pair_offset] += 1
+            if pcr_pair_flags[pair_offset]:
+                validreads['pcr_match'] += 1
+
+        if not (tagmentation_i7_valid and pcr_i7_valid and pcr_i5_valid and tagmentation_i5_valid):
+            continue
+
+        validreads['all_barcodes'] += 1
+
+        tagmentation_i7_seq = tagi7[tagmentation_i7_index]
+        pcr_i7_seq = pcri7[pcr_i7_index]
+        pcr_i5_seq = pcri5[pcr_i5_index]
+        tagmentation_i5_seq = tagi5[tagmentation_i5_index]
+
+        sample_index = tuple([index for use_index,index in zip(index_mask, [pcr_i7_seq, tagmentation_i7_seq, tagmentation_i5_seq, pcr_i5_seq]) if use_index])
+        sample = sample_lookup.get(sample_index, None)
+
+        if not sample:
+            total_not_specified_in_samplesheet += 1
+        elif write_fastqs:
+            if index_args.two_level_indexed_tn5:
+                barcodes_string = barcode_to_well.get_two_level_barcode_string(tagmentation_i7_seq, pcr_i7_seq, pcr_i5_seq, tagmentation_i5_seq, nex_two_level_indexed_tn5_to_well, pcr_two_level_indexed_tn5_to_well, well_ids)
+            else:
+                barcodes_string = barcode_to_well.get_barcode_string(tagmentation_i7_seq, pcr_i7_seq, pcr_i5_seq, tagmentation_i5_seq, lig_i7_to_well, lig_i5_to_well, pcr_to_well, well_ids)
+            output_files[sample]['r1'].write(''.join(['@', barcodes_string, ':', str(record_number), '\n', r1_seq, '\n+\n', r1_qual, '\n']))
+            output_files[sample]['r2'].write(''.join(['@', barcodes_string, ':', str(record_number), '\n', r2_seq, '\n+\n', r2_qual, '\n']))
+            output_files[sample]['records'] += 1
+
+    if write_fastqs:
+        if next(reads, None) is not None:
+            raise ValueError('The fastq files have more reads than the barcode sidecar.')
+        for input_file in input_files:
+            if input_file is not sys.stdin:
+                input_file.close()
+
+    if totreads != metadata['total_reads']:
+        raise ValueError('Barcode sidecar has %d reads but its metadata file has %d.' % (totreads, metadata['total_reads']))
+
+    if totreads == 0:
+        raise ValueError('No reads found in barcode sidecar.')
+
+    validreads['total_input_reads'] = totreads
+    validreads['total_not_specified_in_samplesheet'] = total_not_specified_in_samplesheet
+
+    with open(os.path.join(args.out_dir, 'RUN001_%s.stats.json' % (lane_str)), 'wt') as f:
+        f.write(json.dumps(validreads, indent=4))
+
+    bcs.write_index_counts_csv(os.path.join(args.out_dir, 'RUN001_%s.index_counts.csv' % (lane_str)), [tagmentation_i7_count, pcr_i7_count, pcr_i5_count, tagmentation_i5_count], index_flags, tagi5_sample_list)
+
+    for pair_tuple in tag_pairs_counts:
+        tag_pairs_counts[pair_tuple] = tag_pair_matrix[pair_tuple[0] * 384 + pair_tuple[1]]
+    for pair_tuple in pcr_pairs_counts:
+        pcr_pairs_counts[pair_tuple] = pcr_pair_matrix[pair_tuple[0] * 384 + pair_tuple[1]]
+
+    bcs.write_tag_pair_counts_csv(os.path.join(args.out_dir, 'RUN001_%s.tag_pair_counts.csv' % (lane_str)), tag_pairs_counts, tagi5_sample_list)
+    bcs.write_pcr_pair_counts_csv(os.path.join(args.out_dir, 'RUN001_%s.pcr_pair_counts.csv' % (lane_str)), pcr_pairs_counts)
+    bcs.write_pair_matrix(os.path.join(args.out_dir, 'RUN001_%s.tag_pair_matrix.csv' % (lane_str)), 'tag', tag_pair_matrix, tag_pair_flags, 384)
+    bcs.write_pair_matrix(os.path.join(args.out_dir, 'RUN001_%s.pcr_pair_matrix.csv' % (lane_str)), 'pcr', pcr_pair_matrix, pcr_pair_flags, 384)
+
+    print('Done re-splitting reads in %s minutes.' % ((time.time() - start) / 60.0))
+
+    if write_fastqs:
+        start = time.time()
+        manifest_entries = bcs.compress_output_files(output_files, args.num_pigz_threads, args.out_dir)
+        print('Done compressing with pigz in %s minutes.' % ((time.time() - start) / 60.0))
+    else:
+        manifest_entries = []
+
+    output_file_manifest_json = os.path.join(args.out_dir, 'RUN001_%s.manifest.json' % (lane_str))
+    for file_type in ['stats.json', 'index_counts.csv', 'tag_pair_counts.csv', 'pcr_pair_counts.csv', 'tag_pair_matrix.csv', 'pcr_pair_matrix.csv']:
+        manifest_entries.append(output_manifest.file_entry(os.path.join(args.out_dir, 'RUN001_%s.%s' % (lane_str, file_type)), args.out_dir))
+    output_manifest.write_manifest(output_file_manifest_json, lane_str, manifest_entries)
+
+
+def main(argv=None):
+    args = make_arg_parser().parse_args(argv)
+    run_resplit(args)
+
+
+if __name__ == '__main__':
+    main()
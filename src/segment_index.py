@@ -0,0 +1,50 @@
+#
+# An index of the whitelist sequences that share a segment with a
+# sequence, for finding the whitelist sequences within a number of
+# mismatches of the sequence.
+#
+# Notes:
+#   o  the whitelist sequences of each length are split into
+#      max_mismatches + 1 segments. A sequence within max_mismatches
+#      mismatches of a whitelist sequence matches at least one of its
+#      segments exactly, so the whitelist sequences that share a segment
+#      with the sequence include all of those within max_mismatches
+#      mismatches. The caller counts the mismatches of the candidates.
+#   o  a sequence no longer than max_mismatches has one segment for
+#      each base.
+#   o  barcodeutils.SplitSeedIndex uses the same segments. barcodeutils
+#      is installed as a separate package, which the scripts here do
+#      not import.
+#
+
+
+class SegmentIndex:
+    def __init__(self, whitelist, max_mismatches):
+        if max_mismatches < 0:
+            raise ValueError('SegmentIndex max_mismatches must be a non-negative integer, but %s found.' % max_mismatches)
+        self.max_mismatches = max_mismatches
+
+        # The segment bounds and segment indexes for each whitelist
+        # sequence length.
+        self.segment_indexes = {}
+        for barcode in whitelist:
+            length = len(barcode)
+            if length not in self.segment_indexes:
+                num_segments = min(max_mismatches + 1, length)
+                bounds = [(length * i // num_segments, length * (i + 1) // num_segments) for i in range(num_segments)]
+                self.segment_indexes[length] = (bounds, [{} for bound in bounds])
+            bounds, indexes = self.segment_indexes[length]
+            for (start, end), index in zip(bounds, indexes):
+                index.setdefault(barcode[start:end], set()).add(barcode)
+
+    def candidates(self, sequence):
+        """
+        Returns the set of whitelist sequences that have the length of
+        sequence and share at least one segment with it.
+        """
+        barcodes = set()
+        if len(sequence) in self.segment_indexes:
+            bounds, indexes = self.segment_indexes[len(sequence)]
+            for (start, end), index in zip(bounds, indexes):
+                barcodes.update(index.get(sequence[start:end], ()))
+        return barcodes
@@ -0,0 +1,55 @@
+import os
+from adapter_trimming import *
+
+ADAPTER = 'CTGTCTCTTATACACATCT'
+
+def make_trimmer(**kwargs):
+    return AdapterTrimmer([ADAPTER], [ADAPTER], **kwargs)
+
+def test_read_through_adapters():
+    adapter_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Trimmomatic-0.36', 'adapters', 'NexteraPE-PE.fa')
+    adapters = read_adapter_fasta(adapter_file)
+    assert adapters[0] == ('PrefixNX/1', 'AGATGTGTATAAGAGACAG')
+    r1_adapters, r2_adapters = get_read_through_adapters(adapters)
+    assert r1_adapters == [ADAPTER] and r2_adapters == [ADAPTER]
+
+def test_find_adapter():
+    trimmer = make_trimmer()
+    insert = 'ACGTTGCAAGGCTTAGCCAT'
+
+    # Full adapter
+    assert trimmer.find_adapter(insert + ADAPTER + 'GACG', trimmer.r1_seeds, trimmer.r1_adapters) == (20, True)
+
+    # One mismatch in the first seed is found by the second seed
+    assert trimmer.find_adapter(insert + 'CTGTCACTTATACACATCT', trimmer.r1_seeds, trimmer.r1_adapters) == (20, True)
+
+    # Partial adapter at the 3' end
+    assert trimmer.find_adapter(insert + 'CTGTCT', trimmer.r1_seeds, trimmer.r1_adapters) == (20, False)
+
+    # Too short to trim
+    assert trimmer.find_adapter(insert + 'CTGT', trimmer.r1_seeds, trimmer.r1_adapters) == (-1, False)
+
+def test_trim_pair():
+    trimmer = make_trimmer(min_length=10)
+    stats = new_trim_stats()
+    r1 = 'ACGTTGCAAGGCTTAGCCAT' + ADAPTER
+    r2 = 'ATGGCTAAGCCTTGCAACGT' + 'CTGTCTC'
+    qual = 'I' * 39
+
+    # The seeded read 1 hit trims read 2 to the same insert length
+    r1_seq, r1_qual, r2_seq, r2_qual = trimmer.trim_pair(r1, qual, r2, qual[:27], stats)
+    assert r1_seq == r1[:20] and r2_seq == r2[:20]
+    assert len(r1_qual) == 20 and len(r2_qual) == 20
+    assert stats['r1_adapter_trimmed'] == 1 and stats['r2_adapter_trimmed'] == 1
+    assert stats['adapter_trimmed_bases'] == 19 + 7
+
+    # Short inserts are dropped
+    assert trimmer.trim_pair('ACGTA' + ADAPTER, qual[:24], 'TACGT' + ADAPTER, qual[:24], stats) is None
+    assert stats['dropped_short_pairs'] == 1 and stats['input_pairs'] == 2 and stats['output_pairs'] == 1
+
+def test_quality_trim():
+    trimmer = make_trimmer(quality_threshold=20, min_length=1)
+    stats = new_trim_stats()
+    r1_seq, r1_qual, r2_seq, r2_qual = trimmer.trim_pair('ACGTACGT', 'IIIIII##', 'ACGTACGT', 'IIIIIIII', stats)
+    assert r1_seq == 'ACGTAC' and r2_seq == 'ACGTACGT'
+    assert stats['r1_quality_trimmed'] == 1 and stats['quality_trimmed_bases'] == 2
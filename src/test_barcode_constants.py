@@ -0,0 +1,19 @@
+import barcode_constants as bc
+import barcode_to_well
+
+def test_lazy_tables():
+    # The tables are built on first access and then cached.
+    pcr_to_well_384 = bc.pcr_to_well_384
+    assert 'pcr_to_well_384' in vars(bc)
+    assert bc.pcr_to_well_384 is pcr_to_well_384
+    assert pcr_to_well_384 == barcode_to_well.get_pcr_plate_dict(bc.pcr_i5_list_384, bc.pcr_i7_list_384)
+    assert len(pcr_to_well_384) == 96 * 96
+
+    assert bc.lig_i5 == set(bc.lig_i5_list)
+    assert 'nex_two_level_indexed_tn5_to_well' in dir(bc)
+
+    try:
+        bc.no_such_table
+        assert False
+    except AttributeError:
+        pass
@@ -0,0 +1,176 @@
+import json
+import random
+import shutil
+import pytest
+import barcode_constants as bc
+from barcode_correct_sciatac import *
+
+INDEX_LISTS = (bc.pcr_i7_list_384, bc.lig_i7_list_384, bc.lig_i5_list_384, bc.pcr_i5_list_384)
+
+# The read pairs of write_lane_fastqs() alternate between these samples.
+LANE_SAMPLES = [('S1', '1-96:1-4:1-16:1-48'), ('S2', '1-96:5-8:1-16:49-96')]
+
+# The demux compresses the sample fastq files with pigz.
+requires_pigz = pytest.mark.skipif(shutil.which('pigz') is None, reason='pigz is not installed')
+
+def write_samplesheet(tmpdir, name, samples):
+    file_name = str(tmpdir.join(name))
+    sample_index_list = [{'sample_id': sample, 'ranges': ranges} for sample, ranges in samples]
+    with open(file_name, 'wt') as f:
+        json.dump({'sample_index_list': sample_index_list}, f)
+    return file_name
+
+def write_lane_fastqs(tmpdir, num_reads, r2_prefix=''):
+    """
+    Write gzipped R1 and R2 fastq files with the index sequences in the
+    read names. Even read pairs are in LANE_SAMPLES S1 and odd read pairs
+    are in S2. The R2 sequences start with r2_prefix.
+    """
+    rng = random.Random(0)
+    file_names = [str(tmpdir.join('Undetermined_S0_L001_R%d_001.fastq.gz' % read)) for read in [1, 2]]
+    with gzip.open(file_names[0], 'wt') as f1, gzip.open(file_names[1], 'wt') as f2:
+        for r in range(num_reads):
+            sample = r % 2
+            i7 = bc.lig_i7_list_384[r % 96] + bc.pcr_i7_list_384[sample * 4 + (r // 2) % 4]
+            i5 = bc.pcr_i5_list_384[r % 16] + bc.lig_i5_list_384[sample * 48 + (r // 2) % 48]
+            for f, read in [(f1, 1), (f2, 2)]:
+                seq = ''.join([rng.choice('ACGT') for i in range(50)])
+                if read == 2:
+                    seq = r2_prefix + seq[len(r2_prefix):]
+                f.write('@A00:1:HXX:1:1101:%d:%d %d:N:0:%s+%s\n%s\n+\n%s\n' % (r, r, read, i7, i5, seq, 'F' * 50))
+    return file_names
+
+def run_lane_demux(tmpdir, monkeypatch, samplesheets, fastq_files, options=[]):
+    """
+    Demultiplex write_lane_fastqs() files into tmpdir/out and return the
+    output directory.
+    """
+    out_dir = str(tmpdir.join('out'))
+    monkeypatch.chdir(str(tmpdir))
+    main(['-1', fastq_files[0], '-2', fastq_files[1], '--filename', 'Undetermined_S0_L001_R1_001.fastq.gz',
+          '--samplesheet'] + samplesheets + ['--out_dir', out_dir, '--stats_out', '1', '--num_pigz_threads', '1',
+          '--wells_384', '--well_ids'] + options)
+    return out_dir
+
+def read_gzip_lines(file_name):
+    with gzip.open(file_name, 'rt') as f:
+        return f.readlines()
+
+def test_load_samplesheets_single(tmpdir):
+    samplesheet = write_samplesheet(tmpdir, 'run.json', [('S1', '1-96:1-4:1-16:1-48'), ('S2', '1-96:5-8:1-16:49-96')])
+    expected = get_sample_lookup(open(samplesheet), False, *INDEX_LISTS)
+    loaded = load_samplesheets([samplesheet], False, *INDEX_LISTS)
+    assert loaded[0:6] == expected and loaded[6] is None
+
+def test_load_samplesheets_projects(tmpdir):
+    project_a = write_samplesheet(tmpdir, 'projA.json', [('S1', '1-96:1-4:1-16:1-48')])
+    project_b = write_samplesheet(tmpdir, 'projB.json', [('S1', '1-96:5-8:1-16:49-96')])
+    index_mask, sample_lookup, tagi5_sample_list, tag_pairs_counts, pcr_pairs_counts, index_flags, projects = load_samplesheets([project_a, project_b], False, *INDEX_LISTS)
+
+    # The mask comes from both samplesheets although each has one sample.
+    assert index_mask == [True, False, True, False]
+    assert sorted(set(sample_lookup.values())) == ['projA/S1', 'projB/S1']
+    assert [project['name'] for project in projects] == ['projA', 'projB']
+    assert len(projects[0]['tag_pairs_counts']) == 96 * 48
+
+def test_load_samplesheets_collision(tmpdir):
+    project_a = write_samplesheet(tmpdir, 'projA.json', [('S1', '1-96:1-4:1-16:1-48')])
+    project_b = write_samplesheet(tmpdir, 'projB.json', [('S2', '1-2:4-5:1-2:40-50')])
+    try:
+        load_samplesheets([project_a, project_b], False, *INDEX_LISTS)
+        assert False
+    except ValueError as error:
+        assert 'projA/S1 and projB/S2' in str(error)
+
+def test_get_index_flanks():
+    r1_name = 'NB:1:FC:1:1:1:1 1:N:0:AAAAAAAAAACCCCCCCCCC+GGGGGGGGGTTTTTTTTTTN'
+    index_ends = header_parser_index_ends[header_parser_01]
+    assert header_parser_01(r1_name) == ('AAAAAAAAAA', 'CCCCCCCCCC', 'GGGGGGGGGT', 'TTTTTTTTTN')
+    assert get_index_flanks(r1_name, index_ends) == ['C', None, 'T', None]
+    for header_parser in [header_parser_01, header_parser_02, header_parser_03, header_parser_04, header_parser_05]:
+        assert header_parser in header_parser_index_ends
+
+
+def test_get_index_read_names():
+    r1_name = 'NB:1:FC:1:1:1:1 1:N:0:AAAAAAAAAACCCCCCCCCC+GGGGGGGGGTTTTTTTTTTN'
+    index1_reads = [('NB:1:FC:1:1:1:1 1:N:0', 'AAAAAAAAAACCCCCCCCCC', 'F' * 20)]
+    index2_reads = [('NB:1:FC:1:1:1:1 2:N:0', 'GGGGGGGGGTTTTTTTTTTN', 'F' * 20)]
+    index_names = list(get_index_read_names(iter(index1_reads), iter(index2_reads)))
+    assert index_names == [('AAAAAAAAAACCCCCCCCCC+GGGGGGGGGTTTTTTTTTTN', 'F' * 20 + '+' + 'F' * 20)]
+    assert header_parser_01(index_names[0][0]) == header_parser_01(r1_name)
+    assert header_parser_02(index_names[0][0]) == header_parser_02(r1_name)
+    assert header_parser_01(index_names[0][1]) == ('F' * 10, 'F' * 10, 'F' * 10, 'F' * 10)
+
+@requires_pigz
+def test_qc_sample_interval(tmpdir, monkeypatch):
+    # Each sample has 100 read pairs, of which pairs 1, 11, ..., 91 are
+    # collected.
+    fastq_files = write_lane_fastqs(tmpdir, 200)
+    samplesheet = write_samplesheet(tmpdir, 'run.json', LANE_SAMPLES)
+    out_dir = run_lane_demux(tmpdir, monkeypatch, [samplesheet], fastq_files, ['--qc_metrics', '--qc_sample_interval', '10'])
+    for sample in ['S1', 'S2']:
+        with open(os.path.join(out_dir, '%s-RUN001_L001.qc.json' % sample)) as f:
+            qc_dict = json.load(f)
+        assert qc_dict['r1']['basic_statistics']['total_sequences'] == 10
+        assert len(read_gzip_lines(os.path.join(out_dir, '%s-RUN001_L001_R1.fastq.gz' % sample))) == 400
+
+@requires_pigz
+def test_hash_reads_trimmed_pairs(tmpdir, monkeypatch):
+    hash_file = str(tmpdir.join('hash.txt'))
+    with open(hash_file, 'wt') as f:
+        f.write('hash1\tGGTGTCGTCG\n')
+    fastq_files = write_lane_fastqs(tmpdir, 200, r2_prefix='GGTGTCGTCG')
+    samplesheet = write_samplesheet(tmpdir, 'run.json', LANE_SAMPLES)
+    out_dir = run_lane_demux(tmpdir, monkeypatch, [samplesheet], fastq_files, ['--hash_reads', '--hash_file', hash_file])
+    with open(os.path.join(out_dir, 'S1-RUN001_L001.hash_stats.json')) as f:
+        assert json.load(f)['hash_reads'] == 100
+
+    # The 50 base reads are shorter than trim_min_length so every read
+    # pair is dropped, and its hash read is not counted.
+    out_dir = run_lane_demux(tmpdir, monkeypatch, [samplesheet], fastq_files, ['--hash_reads', '--hash_file', hash_file,
+                                                                               '--trim_adapters', '--trim_min_length', '60'])
+    with open(os.path.join(out_dir, 'S1-RUN001_L001.hash_stats.json')) as f:
+        assert json.load(f)['hash_reads'] == 0
+    assert read_gzip_lines(os.path.join(out_dir, 'S1-RUN001_L001_R1.fastq.gz')) == []
+
+@requires_pigz
+def test_subsample_projects(tmpdir, monkeypatch):
+    fastq_files = write_lane_fastqs(tmpdir, 200)
+    project_a = write_samplesheet(tmpdir, 'projA.json', LANE_SAMPLES[0:1])
+    project_b = write_samplesheet(tmpdir, 'projB.json', LANE_SAMPLES[1:2])
+    out_dir = run_lane_demux(tmpdir, monkeypatch, [project_a, project_b], fastq_files, ['--subsample', '0.1,1'])
+    for sample in ['projA/S1', 'projB/S2']:
+        sample_lines = read_gzip_lines(os.path.join(out_dir, '%s-RUN001_L001_R1.fastq.gz' % sample))
+        assert read_gzip_lines(os.path.join(out_dir, 'subsample_1', '%s-RUN001_L001_R1.fastq.gz' % sample)) == sample_lines
+        subsample_lines = read_gzip_lines(os.path.join(out_dir, 'subsample_0.1', '%s-RUN001_L001_R1.fastq.gz' % sample))
+        assert 0 < len(subsample_lines) < len(sample_lines)
+
+@requires_pigz
+def test_rescue_keeps_main_pass_corrections(tmpdir, monkeypatch):
+    # Read pair 0 has a pcr_i7 with its second base deleted, which indel
+    # correction fixes in the main pass, and a tagmentation_i7 with three
+    # substitutions, which only the rescue pass fixes.
+    fastq_files = write_lane_fastqs(tmpdir, 200)
+    i7 = bc.lig_i7_list_384[0] + bc.pcr_i7_list_384[0]
+    for file_name in fastq_files:
+        lines = read_gzip_lines(file_name)
+        assert i7 in lines[0]
+        lines[0] = lines[0].replace(i7, 'TCAGTCGCCC' + 'GATGCCTTGA')
+        with gzip.open(file_name, 'wt') as f:
+            f.writelines(lines)
+    samplesheet = write_samplesheet(tmpdir, 'run.json', LANE_SAMPLES)
+    out_dir = run_lane_demux(tmpdir, monkeypatch, [samplesheet], fastq_files, ['--indel_correction', 'pcr_i7', '--rescue', '--subsample', '1',
+                                                                              '--qc_metrics', '--qc_sample_interval', '1'])
+
+    with open(os.path.join(out_dir, 'RUN001_L001.rescue_stats.json')) as f:
+        rescue_stats = json.load(f)
+    assert rescue_stats['failed_pairs'] == 1
+    assert rescue_stats['rescued_tagmentation_i7'] == 1
+    assert rescue_stats['rescued_pcr_i7'] == 0
+    assert rescue_stats['rescued_pairs_written'] == 1
+    assert len(read_gzip_lines(os.path.join(out_dir, 'S1-RUN001_L001_R1.fastq.gz'))) == 400
+
+    # The rescued pair is in the subsample and quality outputs too.
+    assert read_gzip_lines(os.path.join(out_dir, 'subsample_1', 'S1-RUN001_L001_R1.fastq.gz')) == read_gzip_lines(os.path.join(out_dir, 'S1-RUN001_L001_R1.fastq.gz'))
+    with open(os.path.join(out_dir, 'S1-RUN001_L001.qc.json')) as f:
+        assert json.load(f)['r1']['basic_statistics']['total_sequences'] == 100
@@ -0,0 +1,34 @@
+from barcode_rescue import *
+
+WHITELIST = ['AAAAAAAAAA', 'CCCCCCCCCC', 'AAAAACCCCC']
+
+def test_rescue_unique_closest():
+    rescuer = BarcodeRescuer(WHITELIST, max_distance=3, min_margin=2)
+    # 3 mismatches from AAAAAAAAAA and 8 from AAAAACCCCC
+    assert rescuer.rescue('AAAGGGAAAA') == 'AAAAAAAAAA'
+    # 4 mismatches is too many
+    assert rescuer.rescue('AGGGGAAAAA') is None
+
+def test_rescue_ambiguous():
+    rescuer = BarcodeRescuer(WHITELIST, max_distance=3, min_margin=2)
+    # 2 mismatches from AAAAACCCCC and 3 from AAAAAAAAAA
+    assert rescuer.rescue('AAAAAACCCA') is None
+    assert BarcodeRescuer(WHITELIST, max_distance=3, min_margin=1).rescue('AAAAAACCCA') == 'AAAAACCCCC'
+    assert 'AAAAAACCCA' in rescuer.cache
+
+def test_failed_read_spool(tmpdir):
+    spool = FailedReadSpool(str(tmpdir))
+    spool.add(7, 'A00:1:HXX:1:1101:7:7 1:N:0:ACGT', ('A', 'C', 'G', 'T'), [None, 'C', 'G', 'T'], 'ACGT', 'IIII', 'TTGG', '####')
+    spool.add(9, 'A00:1:HXX:1:1101:9:9', ('N', 'C', 'G', 'T'), ['A', None, None, 'T'], 'AC', 'II', 'TT', '##')
+    assert spool.num_pairs == 2
+    assert list(spool) == [(7, 'A00:1:HXX:1:1101:7:7 1:N:0:ACGT', ('A', 'C', 'G', 'T'), (None, 'C', 'G', 'T'), 'ACGT', 'IIII', 'TTGG', '####'),
+                           (9, 'A00:1:HXX:1:1101:9:9', ('N', 'C', 'G', 'T'), ('A', None, None, 'T'), 'AC', 'II', 'TT', '##')]
+    spool.remove()
+    assert tmpdir.listdir() == []
+
+def test_rescue_cache_size():
+    rescuer = BarcodeRescuer(WHITELIST, max_distance=3, min_margin=2, cache_size=2)
+    for sequence in ['AAAGGGAAAA', 'AGGGGAAAAA', 'AAAAAACCCA']:
+        rescuer.rescue(sequence)
+    assert len(rescuer.cache) == 2 and 'AAAGGGAAAA' not in rescuer.cache
+    assert rescuer.rescue('AAAGGGAAAA') == 'AAAAAAAAAA'
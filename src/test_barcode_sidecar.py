@@ -0,0 +1,17 @@
+import argparse
+from barcode_sidecar import *
+
+def test_sidecar_round_trip(tmpdir):
+    sidecar_file = str(tmpdir.join('RUN001_L001.barcodes.bin'))
+    records = [(0, 1, 2, 383, 1), (MISSING_INDEX, 5, MISSING_INDEX, 7, 2)]
+    with open(sidecar_file, 'wb') as f:
+        for record in records:
+            f.write(SIDECAR_RECORD.pack(*record))
+    assert list(read_sidecar(sidecar_file)) == records
+
+def test_sidecar_metadata(tmpdir):
+    json_file = str(tmpdir.join('RUN001_L001.barcodes.json'))
+    args = argparse.Namespace(two_level_indexed_tn5=False, wells_384=True, well_ids=True, nextseq=False, index_recipe=None)
+    write_sidecar_metadata(json_file, args, 'L001', 2)
+    metadata = read_sidecar_metadata(json_file)
+    assert metadata['lane'] == 'L001' and metadata['total_reads'] == 2 and metadata['parameters']['wells_384']
@@ -0,0 +1,33 @@
+import random
+from cell_counts import *
+
+def test_cell_key_round_trip():
+    assert decode_cell_key(encode_cell_key(383, 0, 17, 200)) == (383, 0, 17, 200)
+    assert encode_cell_key(383, 383, 383, 383) < 2**35
+
+def test_cell_counter_matches_dict():
+    random.seed(1)
+    keys = [encode_cell_key(random.randrange(384), 3, 5, random.randrange(384)) for i in range(5000)]
+    expected = {}
+    for key in keys:
+        expected[key] = expected.get(key, 0) + 1
+    counter = CellCounter()
+    for key in keys:
+        counter.add(key)
+    assert counter.total == 5000
+    assert list(counter.sorted_items()) == sorted(expected.items())
+
+def test_cell_counter_spill(tmpdir):
+    counter = CellCounter(max_entries=3, tmp_dir=str(tmpdir))
+    for key in [5, 1, 2, 5, 7, 1, 9, 5, 2]:
+        counter.add(key)
+    assert len(counter.run_files) == 3
+    histogram = write_cell_counts(str(tmpdir.join('counts.tsv.gz')), counter, lambda a, b, c, d: '%d_%d_%d_%d' % (a, b, c, d))
+    assert counter.run_files == [] and len(tmpdir.listdir()) == 1
+    assert histogram == {2: 2, 3: 1, 1: 2}
+
+def test_knee_summary():
+    summary = knee_summary({100: 2, 10: 3, 1: 50}, top_n_list=[1, 4, 100])
+    assert summary['total_cells'] == 55 and summary['total_reads'] == 280
+    assert [row['reads'] for row in summary['top_n_reads']] == [100, 220, 280]
+    assert summary['knee_read_count'] == 10
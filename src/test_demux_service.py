@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+import time
+from demux_service import *
+
+def start_service(socket_path):
+    process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'demux_service.py'), 'serve', '--socket', socket_path, '--num_workers', '1'], stdout=subprocess.PIPE)
+    for i in range(100):
+        if os.path.exists(socket_path):
+            return process
+        time.sleep(0.1)
+    process.kill()
+    assert False
+
+def test_get_client_pipes():
+    argv = ['-1', '/dev/fd/63', '--input2', '-', '--filename', 'Undetermined_S0_L001_R1_001.fastq.gz', '--out_dir', '-']
+    assert get_client_pipes(argv) == [1, 3]
+    assert get_client_pipes(['-1', 'R1.fastq.gz', '-2', 'R2.fastq.gz']) == []
+    assert get_client_pipes(['-1', 'R1.fastq.gz', '--index1', '/dev/fd/62', '--index2', 'I2.fastq.gz']) == [3]
+
+def test_run_job_argument_error(tmpdir):
+    cwd = os.getcwd()
+    try:
+        response = run_job(['--out_dir', str(tmpdir)], str(tmpdir))
+    finally:
+        os.chdir(cwd)
+    assert response['status'] == 'error'
+    assert 'the following arguments are required' in response['output']
+
+def test_service(tmpdir):
+    socket_path = str(tmpdir.join('demux.sock'))
+    process = start_service(socket_path)
+    try:
+        response = send_request(socket_path, {'command': 'status'})
+        assert response['status'] == 'ok' and response['num_workers'] == 1 and response['jobs_done'] == 0
+
+        # The job fails on the missing samplesheet after the client
+        # pipe is copied to a named pipe.
+        response = submit(socket_path, ['-1', '/dev/fd/0', '-2', 'R2.fastq', '--filename', 'Undetermined_S0_L001_R1_001.fastq.gz', '--samplesheet', str(tmpdir.join('missing.json')), '--out_dir', str(tmpdir.join('out')), '--stats_out', '1'])
+        assert response['status'] == 'error'
+        assert 'missing.json' in response['error']
+
+        response = send_request(socket_path, {'command': 'unknown'})
+        assert response['status'] == 'error'
+        assert send_request(socket_path, {'command': 'status'})['jobs_done'] == 1
+        assert send_request(socket_path, {'command': 'shutdown'})['status'] == 'ok'
+        process.wait(timeout=30)
+        assert not os.path.exists(socket_path)
+    finally:
+        if process.poll() is None:
+            process.kill()
@@ -0,0 +1,62 @@
+import gzip
+import io
+import os
+from fastq_chunker import *
+
+
+def write_multi_member_fastq(file_name, num_records, member_bytes):
+    data = ''.join(['@read%d\nACGTACGT\n+\nFFFFFFFF\n' % i for i in range(num_records)]).encode()
+    with open(file_name, 'wb') as f:
+        for i in range(0, len(data), member_bytes):
+            f.write(gzip.compress(data[i:i + member_bytes]))
+    return data
+
+
+def test_nth_newline_end():
+    assert nth_newline_end(b'a\nb\nc\n', 0) == 0
+    assert nth_newline_end(b'a\nb\nc\n', 2) == 4
+
+
+def test_chunks_cover_file_pair(tmpdir):
+    r1_file = os.path.join(str(tmpdir), 'R1.fastq.gz')
+    r2_file = os.path.join(str(tmpdir), 'R2.fastq.gz')
+    r1_data = write_multi_member_fastq(r1_file, 500, 700)
+    r2_data = write_multi_member_fastq(r2_file, 500, 1100)
+    chunk_index = make_chunk_index(r1_file, r2_file, os.path.getsize(r1_file) // 4, 64)
+    chunks = chunk_index['chunks']
+    assert len(chunks) > 1
+    assert chunk_index['total_records'] == 500
+    assert sum([chunk['num_records'] for chunk in chunks]) == 500
+    for read_file, read_key, read_data in [(r1_file, 'r1', r1_data), (r2_file, 'r2', r2_data)]:
+        out = io.BytesIO()
+        for chunk in chunks:
+            chunk_out = io.BytesIO()
+            read_chunk(read_file, chunk[read_key][0], chunk[read_key][1], chunk['num_records'], chunk_out)
+            assert chunk_out.getvalue().startswith(b'@read%d\n' % (chunk['first_record'] - 1))
+            out.write(chunk_out.getvalue())
+        assert out.getvalue() == read_data
+
+
+def test_chunks_with_index_reads(tmpdir):
+    read_files = [os.path.join(str(tmpdir), '%s.fastq.gz' % read) for read in ['R1', 'R2', 'I1', 'I2']]
+    read_data = [write_multi_member_fastq(read_file, 300, member_bytes) for read_file, member_bytes in zip(read_files, [500, 900, 300, 1300])]
+    chunk_index = make_chunk_index(read_files[0], read_files[1], os.path.getsize(read_files[0]) // 3, 64, read_files[2:])
+    assert chunk_index['i1'] == 'I1.fastq.gz'
+    assert chunk_index['i2'] == 'I2.fastq.gz'
+    for read_file, read_key, data in zip(read_files, ['r1', 'r2', 'i1', 'i2'], read_data):
+        out = io.BytesIO()
+        for chunk in chunk_index['chunks']:
+            read_chunk(read_file, chunk[read_key][0], chunk[read_key][1], chunk['num_records'], out)
+        assert out.getvalue() == data
+
+
+def test_single_chunk(tmpdir):
+    r1_file = os.path.join(str(tmpdir), 'R1.fastq.gz')
+    r2_file = os.path.join(str(tmpdir), 'R2.fastq.gz')
+    r1_data = write_multi_member_fastq(r1_file, 10, 1000000)
+    write_multi_member_fastq(r2_file, 10, 1000000)
+    chunk_index = make_chunk_index(r1_file, r2_file, 1, 64)
+    assert len(chunk_index['chunks']) == 1
+    out = io.BytesIO()
+    read_chunk(r1_file, 0, 0, None, out)
+    assert out.getvalue() == r1_data
@@ -0,0 +1,47 @@
+from fastq_qc import *
+
+def test_fastq_qc_collector_counts():
+    collector = FastqQcCollector(max_length=10)
+    collector.add_read('ACGTN', 'IIII#')
+    collector.add_read('GGCC', '####')
+    collector.add_read('ACGTN', 'IIII#')
+
+    assert collector.total_reads == 3
+    assert collector.total_bases == 14
+    assert collector.total_n == 2
+    assert collector.length_counts[5] == 2 and collector.length_counts[4] == 1
+
+    # 'I' is Phred 40 and '#' is Phred 2 at offset 33
+    assert collector.quality_counts[0 * collector.num_quality + 40] == 2
+    assert collector.quality_counts[0 * collector.num_quality + 2] == 1
+    assert collector.base_counts[4 * 5 + 4] == 2
+
+    # GC percentages exclude N bases
+    assert collector.gc_counts[50] == 2 and collector.gc_counts[100] == 1
+
+def test_fastq_qc_collector_truncates_long_reads():
+    collector = FastqQcCollector(max_length=4)
+    collector.add_read('ACGTACGT', 'IIIIIIII')
+    assert collector.length_counts[4] == 1
+    assert collector.max_observed_length == 4
+    assert len(collector.per_base_quality()) == 4
+
+def test_fastq_qc_duplication():
+    collector = FastqQcCollector(duplicate_track_size=2)
+    for seq in ['AAAA', 'AAAA', 'CCCC', 'GGGG', 'CCCC']:
+        collector.add_read(seq, 'IIII')
+
+    # GGGG arrives after the tracking limit so it is not counted
+    percent_deduplicated, levels = collector.duplication_levels()
+    assert collector.duplicate_tracked_reads == 4
+    assert percent_deduplicated == 50.0
+    assert levels == [{'duplication_level': 2, 'reads': 4}]
+
+def test_fastq_qc_to_dict():
+    collector = FastqQcCollector()
+    collector.add_read('ACGT', 'IIII')
+    qc_dict = collector.to_dict()
+    assert qc_dict['basic_statistics']['total_sequences'] == 1
+    assert qc_dict['basic_statistics']['percent_gc'] == 50.0
+    assert qc_dict['per_base_sequence_quality'][0]['median'] == 40
+    assert qc_dict['per_base_sequence_content'][0]['A'] == 100.0
@@ -0,0 +1,67 @@
+import os
+from gather_demux_chunks import *
+
+
+def write_file(file_name, text):
+    with open(file_name, 'wt') as f:
+        f.write(text)
+
+
+def test_chunk_number():
+    assert chunk_number('work/demux_chunk_L001_12') == (12,)
+    assert chunk_number('demux_chunk_L001_3/') == (3,)
+    assert sorted(['demux_chunk_L001_1_0', 'demux_chunk_L001_0_10', 'demux_chunk_L001_0_2'], key=chunk_number) == ['demux_chunk_L001_0_2', 'demux_chunk_L001_0_10', 'demux_chunk_L001_1_0']
+
+
+def test_gather_json_values():
+    values = [{'Lane': 'Lane 1', 'all_barcodes': 3, 'parameters': {'rescue_max_distance': 3}, 'wells_384': True},
+              {'Lane': 'Lane 1', 'all_barcodes': 4, 'parameters': {'rescue_max_distance': 3}, 'wells_384': True}]
+    assert gather_json_values(None, values) == {'Lane': 'Lane 1', 'all_barcodes': 7, 'parameters': {'rescue_max_distance': 3}, 'wells_384': True}
+    try:
+        gather_json_values(None, [{'Lane': 'Lane 1'}, {'Lane': 'Lane 2'}])
+        assert False
+    except ValueError:
+        pass
+    try:
+        gather_json_values(None, [{'parameters': {'rescue_max_distance': 3}}, {'parameters': {'rescue_max_distance': 2}}])
+        assert False
+    except ValueError:
+        pass
+
+
+def test_gather_count_csv(tmpdir):
+    file_1 = os.path.join(str(tmpdir), 'a.csv')
+    file_2 = os.path.join(str(tmpdir), 'b.csv')
+    out_file = os.path.join(str(tmpdir), 'RUN001_L001.tag_pair_counts.csv')
+    write_file(file_1, 'tagi7_index,tagi7_well,tag_pair_count\n0,1,P1-A01,2\n1,2,P1-B01,0\n')
+    write_file(file_2, 'tagi7_index,tagi7_well,tag_pair_count\n0,1,P1-A01,5\n1,2,P1-B01,1\n')
+    gather_count_csv([file_1, file_2], out_file)
+    with open(out_file, 'rt') as f:
+        assert f.read() == 'tagi7_index,tagi7_well,tag_pair_count\n0,1,P1-A01,7\n1,2,P1-B01,1\n'
+
+
+def test_gather_pair_matrix_csv(tmpdir):
+    file_1 = os.path.join(str(tmpdir), 'a.csv')
+    file_2 = os.path.join(str(tmpdir), 'b.csv')
+    out_file = os.path.join(str(tmpdir), 'RUN001_L001.pcr_pair_matrix.csv')
+    header = 'pcri7_index,pcri7_well,pcri5_index,pcri5_well,pair_count,in_samplesheet\n'
+    write_file(file_1, header + '2,P1-B01,1,P1-A01,4,1\n')
+    write_file(file_2, header + '1,P1-A01,3,P1-C01,1,0\n2,P1-B01,1,P1-A01,2,1\n')
+    gather_count_csv([file_1, file_2], out_file)
+    with open(out_file, 'rt') as f:
+        assert f.read() == header + '1,P1-A01,3,P1-C01,1,0\n2,P1-B01,1,P1-A01,6,1\n'
+
+
+def test_gather_unassigned_top_csv(tmpdir):
+    file_1 = os.path.join(str(tmpdir), 'a.csv')
+    file_2 = os.path.join(str(tmpdir), 'b.csv')
+    out_file = os.path.join(str(tmpdir), 'RUN001_L001.unassigned_top.csv')
+    header = 'category,count,max_overcount,max_undercount,tagi7_seq\n'
+    write_file(file_1, header + 'failed_correction,9,0,0,AAAA\nfailed_correction,5,1,0,CCCC\nnot_in_samplesheet,4,0,0,GGGG\n')
+    write_file(file_2, header + 'failed_correction,8,0,0,CCCC\nfailed_correction,3,0,0,TTTT\n')
+    gather_count_csv([file_1, file_2], out_file)
+    # AAAA may have up to 3 reads in the second chunk. TTTT may have up
+    # to 5 reads in the first chunk. The second chunk has no
+    # not_in_samplesheet rows, so GGGG has no reads there.
+    with open(out_file, 'rt') as f:
+        assert f.read() == header + 'failed_correction,13,1,0,CCCC\nfailed_correction,9,0,3,AAAA\nnot_in_samplesheet,4,0,0,GGGG\n'
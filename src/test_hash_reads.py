@@ -0,0 +1,25 @@
+from hash_reads import *
+
+def test_read_hash_file(tmpdir):
+    hash_file = tmpdir.join('hashes.txt')
+    hash_file.write('# name sequence\nhash1\tacgtacgtac\taxis1\n\nhash2 TTTTGGGGCC\n')
+    assert read_hash_file(str(hash_file)) == [('hash1', 'ACGTACGTAC'), ('hash2', 'TTTTGGGGCC')]
+
+def test_hash_counter_umis():
+    counter = HashCounter()
+    counter.add(7, 0, 'AAAA')
+    counter.add(7, 0, 'AAAA')
+    counter.add(7, 0, 'CCCC')
+    counter.add(3, 1, 'AAAA')
+    assert counter.hash_reads == 4
+    assert counter.counts == {(7, 0): 2, (3, 1): 1}
+
+def test_hash_counter_matrix(tmpdir):
+    counter = HashCounter()
+    for cell_key, hash_index in [(7, 0), (7, 0), (3, 1)]:
+        counter.add(cell_key, hash_index)
+    prefix = str(tmpdir.join('S1-RUN001_L001'))
+    stats = counter.write_matrix(prefix, ['hash1', 'hash2'], lambda a, b, c, d: 'cell_%d' % d)
+    assert stats['hash_reads'] == 3 and stats['hash_umis'] == 3 and stats['hash_cells'] == 2
+    assert open(prefix + '.hash_cells.txt').read() == 'cell_3\ncell_7\n'
+    assert open(prefix + '.hash.mtx').read().split('\n')[1:4] == ['2 2 2', '2 1 1', '1 2 2']
@@ -0,0 +1,28 @@
+from heavy_hitters import *
+
+def test_space_saving_exact_under_capacity():
+    counter = SpaceSaving(4)
+    for key in ['a', 'b', 'a', 'c', 'a', 'b']:
+        counter.add(key)
+    assert counter.top() == [('a', 3, 0), ('b', 2, 0), ('c', 1, 0)]
+    assert counter.top(1) == [('a', 3, 0)]
+    assert counter.total == 6
+
+def test_space_saving_eviction():
+    counter = SpaceSaving(2)
+    for key in ['a', 'a', 'a', 'b', 'c', 'd']:
+        counter.add(key)
+
+    # 'c' replaces 'b' (count 1) and then 'd' replaces 'c' (count 2).
+    assert len(counter.counts) == 2
+    assert counter.top() == [('a', 3, 0), ('d', 3, 2)]
+
+def test_space_saving_heavy_hitter_kept():
+    counter = SpaceSaving(10)
+    for i in range(1000):
+        counter.add(('AAAA', i))
+        if i % 4 == 0:
+            counter.add(('CCCC', 0))
+    key, count, max_overcount = counter.top(1)[0]
+    assert key == ('CCCC', 0)
+    assert count - max_overcount <= 250 <= count
@@ -0,0 +1,59 @@
+from indel_correction import *
+
+WHITELIST = ['ACGTACGTAC', 'TTGGCCAATT', 'GATTACAGAT']
+
+def test_deletion():
+    correcter = IndelCorrecter(WHITELIST)
+    # ACGTACGTAC without the fourth base and followed by G
+    assert correcter.correct('ACGACGTACG') == ('ACGTACGTAC', INDEL_DELETION)
+    assert correcter.correct('TTGGCAATTC', 'A') == ('TTGGCCAATT', INDEL_DELETION)
+    assert ('TTGGCAATTC', 'A') in correcter.cache
+
+def test_insertion():
+    correcter = IndelCorrecter(WHITELIST)
+    # GATTACAGAT with a T inserted after the third base. The last base T
+    # is pushed out of the index sequence.
+    assert correcter.correct('GATTTACAGA') == ('GATTACAGAT', INDEL_INSERTION)
+    assert correcter.correct('GATTTACAGA', 'T') == ('GATTACAGAT', INDEL_INSERTION)
+    assert correcter.correct('GATTTACAGA', 'N') == ('GATTACAGAT', INDEL_INSERTION)
+    # The flank must be the pushed out base.
+    assert correcter.correct('GATTTACAGA', 'C') == (None, None)
+
+def test_ambiguous():
+    correcter = IndelCorrecter(['AAAACCCC', 'AAACCCCA'])
+    assert correcter.correct('AAACCCCG') == (None, INDEL_AMBIGUOUS)
+    assert correcter.correct('GGGGGGGG') == (None, None)
+
+def test_correct_indels():
+    correcters = [IndelCorrecter(WHITELIST), None, IndelCorrecter(WHITELIST), IndelCorrecter(WHITELIST)]
+    indel_stats = make_indel_stats(['tagmentation_i7', 'pcr_i5', 'tagmentation_i5'])
+    raw_barcodes = ('ACGACGTACG', 'TTTTTTTTTT', 'GATTTACAGA', 'GGGGGGGGGG')
+    corrected = correct_indels([None, 'TTGGCCAATT', None, 'TTGGCCAATT'], raw_barcodes, [None, None, 'T', None], correcters, indel_stats)
+    assert corrected == ['ACGTACGTAC', 'TTGGCCAATT', 'GATTACAGAT', 'TTGGCCAATT']
+    assert indel_stats['indel_corrected_pairs'] == 1
+    assert indel_stats['tagmentation_i7'] == {'failed': 1, 'deletion': 1, 'insertion': 0, 'ambiguous': 0}
+    assert indel_stats['pcr_i5'] == {'failed': 1, 'deletion': 0, 'insertion': 1, 'ambiguous': 0}
+    assert indel_stats['tagmentation_i5']['failed'] == 0
+
+    # A pair with an uncorrected index is not counted.
+    corrected = correct_indels(['ACGTACGTAC', None, 'GATTACAGAT', None], raw_barcodes, [None, None, None, None], correcters, indel_stats)
+    assert corrected == ['ACGTACGTAC', None, 'GATTACAGAT', None]
+    assert indel_stats['indel_corrected_pairs'] == 1
+    assert indel_stats['tagmentation_i5'] == {'failed': 1, 'deletion': 0, 'insertion': 0, 'ambiguous': 0}
+
+def test_near_substitution():
+    # AAAACCCCGG is AAACCCCGGT with an A inserted, and it is three
+    # substitutions from AAAAGCCTCG.
+    correcter = IndelCorrecter(['AAACCCCGGT', 'AAAAGCCTCG'], max_substitutions=0)
+    assert correcter.correct('AAAACCCCGG') == ('AAACCCCGGT', INDEL_INSERTION)
+    correcter = IndelCorrecter(['AAACCCCGGT', 'AAAAGCCTCG'])
+    assert correcter.correct('AAAACCCCGG') == (None, INDEL_AMBIGUOUS)
+    correcter = IndelCorrecter(['AAACCCCGGT', 'AAAAGCCTCG'], max_substitutions=2)
+    assert correcter.correct('AAAACCCCGG') == ('AAACCCCGGT', INDEL_INSERTION)
+
+def test_cache_size():
+    correcter = IndelCorrecter(WHITELIST, cache_size=1)
+    correcter.correct('ACGACGTACG')
+    correcter.correct('GATTTACAGA', 'T')
+    assert len(correcter.cache) == 1
+    assert ('GATTTACAGA', 'T') in correcter.cache
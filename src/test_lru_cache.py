@@ -0,0 +1,21 @@
+from lru_cache import *
+
+def test_lru_cache():
+    cache = LruCache(2)
+    cache['a'] = 1
+    cache['b'] = None
+    # Reading 'a' makes 'b' the least recently used entry.
+    assert cache['a'] == 1
+    cache['c'] = 3
+    assert 'a' in cache and 'b' not in cache and 'c' in cache
+    assert len(cache) == 2
+
+    # Replacing an entry does not drop another entry.
+    cache['c'] = 4
+    assert cache['c'] == 4 and 'a' in cache
+
+    try:
+        LruCache(0)
+        assert False
+    except ValueError:
+        pass
@@ -0,0 +1,44 @@
+from merge_bcl2fastq_stats import *
+
+
+def make_stats(lane, clusters, sample_reads, undetermined_reads, unknown_barcodes):
+    read_metrics = [{'ReadNumber': 1, 'Yield': clusters * 50, 'YieldQ30': clusters * 40, 'QualityScoreSum': clusters * 1800, 'TrimmedBases': 0}]
+    return {'Flowcell': 'FC',
+            'RunNumber': 7,
+            'RunId': 'RUN',
+            'ReadInfosForLanes': [{'LaneNumber': lane, 'ReadInfos': [{'Number': 1, 'NumCycles': 50, 'IsIndexedRead': False}]}],
+            'ConversionResults': [{'LaneNumber': lane,
+                                   'TotalClustersRaw': clusters + 10,
+                                   'TotalClustersPF': clusters,
+                                   'Yield': clusters * 50,
+                                   'DemuxResults': [{'SampleId': 'fake',
+                                                     'SampleName': 'fake',
+                                                     'IndexMetrics': [{'IndexSequence': 'NNNN', 'MismatchCounts': {'0': sample_reads}}],
+                                                     'NumberReads': sample_reads,
+                                                     'Yield': sample_reads * 50,
+                                                     'ReadMetrics': read_metrics}],
+                                   'Undetermined': {'NumberReads': undetermined_reads,
+                                                    'Yield': undetermined_reads * 50,
+                                                    'ReadMetrics': read_metrics}}],
+            'UnknownBarcodes': [{'Lane': lane, 'Barcodes': unknown_barcodes}]}
+
+
+def test_merge_stats():
+    stats_list = [make_stats(1, 100, 0, 100, {'AAAA': 60, 'CCCC': 40}),
+                  make_stats(1, 50, 0, 50, {'CCCC': 30, 'GGGG': 20}),
+                  make_stats(2, 1000, 0, 1000, {'TTTT': 1000})]
+    merged = merge_stats(stats_list, 1)
+    assert merged['RunId'] == 'RUN'
+    assert [read_infos['LaneNumber'] for read_infos in merged['ReadInfosForLanes']] == [1]
+    assert len(merged['ConversionResults']) == 1
+    results = merged['ConversionResults'][0]
+    assert results['LaneNumber'] == 1
+    assert results['TotalClustersRaw'] == 170
+    assert results['TotalClustersPF'] == 150
+    assert results['Yield'] == 7500
+    assert results['Undetermined']['NumberReads'] == 150
+    assert results['Undetermined']['ReadMetrics'] == [{'ReadNumber': 1, 'Yield': 7500, 'YieldQ30': 6000, 'QualityScoreSum': 270000, 'TrimmedBases': 0}]
+    assert len(results['DemuxResults']) == 1
+    assert results['DemuxResults'][0]['IndexMetrics'] == [{'IndexSequence': 'NNNN', 'MismatchCounts': {'0': 0}}]
+    assert merged['UnknownBarcodes'] == [{'Lane': 1, 'Barcodes': {'CCCC': 70, 'AAAA': 60, 'GGGG': 20}}]
+    assert list(merged['UnknownBarcodes'][0]['Barcodes']) == ['CCCC', 'AAAA', 'GGGG']
@@ -0,0 +1,67 @@
+import gzip
+import hashlib
+import os
+from merge_demux_runs import *
+
+
+def write_fastq_gz(file_name, read_names):
+    with gzip.open(file_name, 'wt') as f:
+        for read_name in read_names:
+            f.write('@%s\nACGT\n+\nFFFF\n' % read_name)
+
+
+def make_demux_dir(root_dir, read_names):
+    fastq_dir = os.path.join(root_dir, 'S1', 'fastqs_barcode')
+    os.makedirs(fastq_dir)
+    for read in ['R1', 'R2']:
+        write_fastq_gz(os.path.join(fastq_dir, 'S1-RUN001_L001_%s.fastq.gz' % read), read_names)
+    return root_dir
+
+
+def test_count_gzip_lines(tmpdir):
+    file_name = os.path.join(str(tmpdir), 'a.fastq.gz')
+    write_fastq_gz(file_name, ['r1', 'r2'])
+    with open(file_name, 'rb') as f:
+        member = f.read()
+    with open(file_name, 'ab') as f:
+        f.write(member)
+    assert count_gzip_lines(file_name) == 16
+
+
+def test_concatenate_gzip_files_drops_inner_bgzf_eof(tmpdir):
+    file_1 = os.path.join(str(tmpdir), 'a.gz')
+    file_2 = os.path.join(str(tmpdir), 'b.gz')
+    merged_file = os.path.join(str(tmpdir), 'c.gz')
+    with open(file_1, 'wb') as f:
+        f.write(gzip.compress(b'one\n') + BGZF_EOF)
+    with open(file_2, 'wb') as f:
+        f.write(gzip.compress(b'two\n') + BGZF_EOF)
+    md5, merged_bytes = concatenate_gzip_files([file_1, file_2], merged_file)
+    assert merged_bytes == os.path.getsize(file_1) + os.path.getsize(file_2) - len(BGZF_EOF)
+    with open(merged_file, 'rb') as f:
+        data = f.read()
+    assert data.count(BGZF_EOF) == 1
+    assert gzip.decompress(data) == b'one\ntwo\n'
+    assert md5 == hashlib.md5(data).hexdigest()
+
+
+def test_merge_sample(tmpdir):
+    demux_dir_1 = make_demux_dir(os.path.join(str(tmpdir), 'run1'), ['a', 'b'])
+    demux_dir_2 = make_demux_dir(os.path.join(str(tmpdir), 'run2'), ['c'])
+    out_dir = os.path.join(str(tmpdir), 'merged')
+    entries = merge_sample(([demux_dir_1, demux_dir_2], [{}, {}], 'S1', ['fastqs_barcode', 'fastqs_trim'], out_dir))
+    assert [entry['file'] for entry in entries] == ['S1/fastqs_barcode/S1-RUN001_L001_R1.fastq.gz', 'S1/fastqs_barcode/S1-RUN001_L001_R2.fastq.gz']
+    assert [entry['records'] for entry in entries] == [3, 3]
+    with gzip.open(os.path.join(out_dir, entries[0]['file']), 'rt') as f:
+        assert [line.strip() for line in f if line.startswith('@')] == ['@a', '@b', '@c']
+
+
+def test_merge_sample_record_parity(tmpdir):
+    demux_dir_1 = make_demux_dir(os.path.join(str(tmpdir), 'run1'), ['a', 'b'])
+    demux_dir_2 = make_demux_dir(os.path.join(str(tmpdir), 'run2'), ['c'])
+    write_fastq_gz(os.path.join(demux_dir_2, 'S1', 'fastqs_barcode', 'S1-RUN001_L001_R2.fastq.gz'), ['c', 'd'])
+    try:
+        merge_sample(([demux_dir_1, demux_dir_2], [{}, {}], 'S1', ['fastqs_barcode'], os.path.join(str(tmpdir), 'merged')))
+        assert False
+    except ValueError:
+        pass
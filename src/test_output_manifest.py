@@ -0,0 +1,26 @@
+import hashlib
+import os
+from output_manifest import *
+
+
+def test_file_entry(tmpdir):
+    file_name = os.path.join(str(tmpdir), 'RUN001_L001.stats.json')
+    with open(file_name, 'wt') as f:
+        f.write('{"total_input_reads": 10}\n')
+    entry = file_entry(file_name, str(tmpdir))
+    assert entry['file'] == 'RUN001_L001.stats.json'
+    assert entry['records'] is None
+    assert entry['uncompressed_bytes'] == 26
+    assert entry['compressed_bytes'] == 26
+    assert entry['md5'] == hashlib.md5(b'{"total_input_reads": 10}\n').hexdigest()
+
+
+def test_write_and_read_manifest(tmpdir):
+    manifest_file = os.path.join(str(tmpdir), 'RUN001_L001.manifest.json')
+    entries = [{'file': 'b.fastq.gz', 'records': 2, 'uncompressed_bytes': 40, 'compressed_bytes': 30, 'md5': 'x'},
+               {'file': 'a.fastq.gz', 'records': 1, 'uncompressed_bytes': 20, 'compressed_bytes': 25, 'md5': 'y'}]
+    write_manifest(manifest_file, 'L001', entries)
+    manifest = read_manifest(manifest_file)
+    assert sorted(manifest.keys()) == ['a.fastq.gz', 'b.fastq.gz']
+    assert manifest['b.fastq.gz']['records'] == 2
+    assert manifest['a.fastq.gz']['md5'] == 'y'
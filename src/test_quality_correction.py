@@ -0,0 +1,76 @@
+import itertools
+from quality_correction import *
+
+# AAAACCCCGG and AAAACCCCTT are two mismatches apart, so AAAACCCCGT is
+# one mismatch from both.
+WHITELIST = ['AAAACCCCGG', 'AAAACCCCTT', 'GGGGTTTTAA']
+
+def test_phred_mismatch_weights():
+    assert abs(PHRED_MISMATCH_WEIGHTS[ord('?')] - (0.001 / 3) / 0.999) < 1e-12
+    assert PHRED_MISMATCH_WEIGHTS[ord('!')] == 1.0
+    assert PHRED_MISMATCH_WEIGHTS[ord(',')] > PHRED_MISMATCH_WEIGHTS[ord('F')]
+
+def test_candidates():
+    correcter = QualityCorrecter(WHITELIST)
+    assert correcter.get_candidates('AAAACCCCGT') == [('AAAACCCCGG', (9,)), ('AAAACCCCTT', (8,))]
+    assert correcter.get_candidates('AAAACCCCGN') == [('AAAACCCCGG', ()), ('AAAACCCCTT', (8,))]
+    assert correcter.get_candidates('CCCCAAAAAA') == []
+    assert 'AAAACCCCGT' in correcter.cache
+
+    # The segment index finds every whitelist sequence within
+    # max_distance mismatches.
+    correcter = QualityCorrecter(['ACGTA', 'ACGTT', 'TTTTT', 'CAGTA'], max_distance=2)
+    for sequence in [''.join(bases) for bases in itertools.product('ACGT', repeat=5)]:
+        expected = [barcode for barcode in sorted(correcter.whitelist) if sum([a != b for a, b in zip(sequence, barcode)]) <= 2]
+        assert [barcode for barcode, positions in correcter.get_candidates(sequence)] == expected
+
+def test_correct():
+    correcter = QualityCorrecter(WHITELIST)
+    # The low quality base is the likely error.
+    assert correcter.correct('AAAACCCCGT', 'FFFFFFFFF#') == ('AAAACCCCGG', QUALITY_CORRECTED)
+    assert correcter.correct('AAAACCCCGT', 'FFFFFFFF#F') == ('AAAACCCCTT', QUALITY_CORRECTED)
+    assert correcter.correct('AAAACCCCGT', 'FFFFFFFFFF') == (None, QUALITY_LOW_POSTERIOR)
+    assert correcter.correct('CCCCAAAAAA', 'FFFFFFFFFF') == (None, QUALITY_NO_CANDIDATE)
+
+    # A lone candidate has posterior 1, so mismatches at high quality
+    # bases are rejected by the likelihood floor.
+    correcter = QualityCorrecter(['AAAAAAAAAA', 'CCCCCCCCCC'], max_distance=3)
+    assert correcter.correct('AAAAAAAGGG', 'FFFFFFFFFF') == (None, QUALITY_LOW_LIKELIHOOD)
+    assert correcter.correct('AAAAAAAGGG', 'FFFFFFF###') == ('AAAAAAAAAA', QUALITY_CORRECTED)
+    assert QualityCorrecter(['AAAAAAAAAA', 'CCCCCCCCCC'], max_distance=3, min_likelihood=0.0).correct('AAAAAAAGGG', 'FFFFFFFFFF') == ('AAAAAAAAAA', QUALITY_CORRECTED)
+
+    # A lower threshold accepts smaller quality differences.
+    assert QualityCorrecter(WHITELIST, min_posterior=0.9).correct('AAAACCCCGT', 'FFFFFFFF,F') == ('AAAACCCCTT', QUALITY_CORRECTED)
+    assert QualityCorrecter(WHITELIST, min_posterior=0.999).correct('AAAACCCCGT', 'FFFFFFFF,F') == (None, QUALITY_LOW_POSTERIOR)
+
+    for max_distance, min_posterior, min_likelihood in [(0, 0.99, 0.001), (2, 0.5, 0.001), (2, 1.5, 0.001), (2, 0.99, -1.0)]:
+        try:
+            QualityCorrecter(WHITELIST, max_distance, min_posterior, min_likelihood)
+            assert False
+        except ValueError:
+            pass
+
+def test_cache_size():
+    correcter = QualityCorrecter(WHITELIST, cache_size=1)
+    correcter.get_candidates('AAAACCCCGT')
+    correcter.get_candidates('AAAACCCCGN')
+    assert len(correcter.cache) == 1
+    assert 'AAAACCCCGN' in correcter.cache
+
+def test_correct_qualities():
+    correcters = [QualityCorrecter(WHITELIST), None, QualityCorrecter(WHITELIST), QualityCorrecter(WHITELIST)]
+    quality_stats = make_quality_stats(['tagmentation_i7', 'pcr_i5', 'tagmentation_i5'], 2, 0.99, 0.001)
+    raw_barcodes = ('AAAACCCCGT', 'TTTTTTTTTT', 'AAAACCCCGT', 'AAAACCCCGG')
+    raw_qualities = ('FFFFFFFFF#', 'FFFFFFFFFF', 'FFFFFFFF#F', 'FFFFFFFFFF')
+    corrected = correct_qualities([None, 'GGGGTTTTAA', None, 'AAAACCCCGG'], raw_barcodes, raw_qualities, correcters, quality_stats)
+    assert corrected == ['AAAACCCCGG', 'GGGGTTTTAA', 'AAAACCCCTT', 'AAAACCCCGG']
+    assert quality_stats['quality_corrected_pairs'] == 1
+    assert quality_stats['tagmentation_i7'] == {'failed': 1, 'corrected': 1, 'low_posterior': 0, 'low_likelihood': 0, 'no_candidate': 0}
+    assert quality_stats['pcr_i5'] == {'failed': 1, 'corrected': 1, 'low_posterior': 0, 'low_likelihood': 0, 'no_candidate': 0}
+    assert quality_stats['tagmentation_i5']['failed'] == 0
+
+    # A pair with an uncorrected index is not counted.
+    corrected = correct_qualities([None, None, 'AAAACCCCGG', 'AAAACCCCGG'], raw_barcodes, ('FFFFFFFFFF',) * 4, correcters, quality_stats)
+    assert corrected == [None, None, 'AAAACCCCGG', 'AAAACCCCGG']
+    assert quality_stats['quality_corrected_pairs'] == 1
+    assert quality_stats['tagmentation_i7']['low_posterior'] == 1
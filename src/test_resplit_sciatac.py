@@ -0,0 +1,24 @@
+import os
+import resplit_sciatac
+from test_barcode_correct_sciatac import LANE_SAMPLES, requires_pigz, write_samplesheet, write_lane_fastqs, run_lane_demux, read_gzip_lines
+
+@requires_pigz
+def test_resplit_same_samplesheet(tmpdir, monkeypatch):
+    # A resplit with the demux samplesheet reproduces the demux outputs.
+    fastq_files = write_lane_fastqs(tmpdir, 200)
+    samplesheet = write_samplesheet(tmpdir, 'run.json', LANE_SAMPLES)
+    demux_dir = run_lane_demux(tmpdir, monkeypatch, [samplesheet], fastq_files, ['--barcode_sidecar'])
+    resplit_dir = str(tmpdir.join('resplit'))
+    resplit_sciatac.main(['--sidecar', os.path.join(demux_dir, 'RUN001_L001.barcodes.bin'), '--samplesheet', samplesheet,
+                          '--out_dir', resplit_dir, '-1', fastq_files[0], '-2', fastq_files[1]])
+
+    for sample in ['S1', 'S2']:
+        for read in ['R1', 'R2']:
+            file_name = '%s-RUN001_L001_%s.fastq.gz' % (sample, read)
+            demux_lines = read_gzip_lines(os.path.join(demux_dir, file_name))
+            assert len(demux_lines) == 400
+            assert read_gzip_lines(os.path.join(resplit_dir, file_name)) == demux_lines
+    for file_type in ['stats.json', 'index_counts.csv', 'tag_pair_counts.csv', 'pcr_pair_counts.csv', 'tag_pair_matrix.csv', 'pcr_pair_matrix.csv']:
+        file_name = 'RUN001_L001.%s' % file_type
+        with open(os.path.join(demux_dir, file_name)) as demux_file, open(os.path.join(resplit_dir, file_name)) as resplit_file:
+            assert resplit_file.read() == demux_file.read()
@@ -0,0 +1,27 @@
+from segment_index import *
+
+WHITELIST = ['AAAACCCC', 'AAAAGGGG', 'TTTTGGGG', 'ACGT']
+
+def test_candidates():
+    index = SegmentIndex(WHITELIST, 1)
+    assert index.candidates('AAAATTTT') == set(['AAAACCCC', 'AAAAGGGG'])
+    assert index.candidates('CCCCGGGG') == set(['AAAAGGGG', 'TTTTGGGG'])
+    assert index.candidates('CCCCTTTT') == set()
+    assert index.candidates('ACGA') == set(['ACGT'])
+    assert index.candidates('ACG') == set()
+
+def test_all_mismatches_found():
+    # Every whitelist sequence within max_mismatches mismatches shares
+    # a segment with the sequence.
+    index = SegmentIndex(WHITELIST, 3)
+    assert 'AAAACCCC' in index.candidates('ATAACCGC')
+    assert 'TTTTGGGG' not in index.candidates('ATAACCGC')
+    assert index.candidates('TTTT') == set(['ACGT'])
+    assert index.candidates('TGCA') == set()
+
+def test_max_mismatches():
+    try:
+        SegmentIndex(WHITELIST, -1)
+        assert False
+    except ValueError:
+        pass
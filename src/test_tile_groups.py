@@ -0,0 +1,54 @@
+import os
+from tile_groups import *
+
+
+RUN_INFO_LAYOUT = '''<?xml version="1.0"?>
+<RunInfo Version="5">
+  <Run Id="RUN" Number="1">
+    <FlowcellLayout LaneCount="2" SurfaceCount="2" SwathCount="2" TileCount="3" />
+  </Run>
+</RunInfo>
+'''
+
+RUN_INFO_TILES = '''<?xml version="1.0"?>
+<RunInfo Version="5">
+  <Run Id="RUN" Number="1">
+    <FlowcellLayout LaneCount="1" SurfaceCount="1" SwathCount="2" TileCount="2">
+      <TileSet TileNamingConvention="FourDigit">
+        <Tiles>
+          <Tile>1_1101</Tile>
+          <Tile>1_1102</Tile>
+          <Tile>1_1201</Tile>
+          <Tile>1_1202</Tile>
+        </Tiles>
+      </TileSet>
+    </FlowcellLayout>
+  </Run>
+</RunInfo>
+'''
+
+
+def write_run_info(run_dir, text):
+    with open(os.path.join(run_dir, 'RunInfo.xml'), 'wt') as f:
+        f.write(text)
+
+
+def test_layout_tiles(tmpdir):
+    write_run_info(str(tmpdir), RUN_INFO_LAYOUT)
+    lane_tiles = read_run_info_tiles(str(tmpdir))
+    assert sorted(lane_tiles.keys()) == [1, 2]
+    assert lane_tiles[1] == ['1101', '1102', '1103', '1201', '1202', '1203', '2101', '2102', '2103', '2201', '2202', '2203']
+
+
+def test_tile_set_tiles(tmpdir):
+    write_run_info(str(tmpdir), RUN_INFO_TILES)
+    assert read_run_info_tiles(str(tmpdir)) == {1: ['1101', '1102', '1201', '1202']}
+
+
+def test_make_tile_groups(tmpdir):
+    write_run_info(str(tmpdir), RUN_INFO_LAYOUT)
+    tile_groups = make_tile_groups(read_run_info_tiles(str(tmpdir)), 2)
+    assert len(tile_groups) == 4
+    assert tile_groups[0] == {'lane': 1, 'group': 0, 'name': 'L001_tiles_00', 'num_tiles': 6, 'tiles': 's_1_11[0-9][0-9],s_1_12[0-9][0-9]'}
+    assert tile_groups[3]['tiles'] == 's_2_21[0-9][0-9],s_2_22[0-9][0-9]'
+    assert len(make_tile_groups(read_run_info_tiles(str(tmpdir)), 10)) == 8
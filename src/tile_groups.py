@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+#
+# Divide the tiles of each lane of an Illumina run into groups for
+# bcl2fastq --tiles conversion tasks.
+#
+# Notes:
+#   o  the tiles are read from the RunInfo.xml TileSet element when it
+#      exists. Otherwise the tile names are made from the FlowcellLayout
+#      surface, swath, section, and tile counts. Four-digit tile names
+#      are <surface><swath><tile> and five-digit tile names are
+#      <surface><swath><section><tile>, where <tile> has two digits.
+#   o  a group has whole swaths (or swath sections), which are the
+#      tile names without the last two digits, so that the bcl2fastq
+#      --tiles regular expressions are short. The swaths are assigned
+#      to groups in order so that the groups have about the same number
+#      of tiles.
+#   o  the output is a JSON list with one entry for each group, in lane
+#      and group order, with the lane number, the group number in the
+#      lane, a name for the group output directory, and the bcl2fastq
+#      --tiles value.
+#
+
+
+def get_layout_tiles(layout):
+    """
+    Returns a dict of tile name lists keyed by lane number.
+    """
+    lane_tiles = {}
+    tile_set = layout.find('TileSet')
+    if tile_set is not None and tile_set.find('Tiles') is not None:
+        for tile in tile_set.find('Tiles').findall('Tile'):
+            lane, tile_name = tile.text.strip().split('_')
+            lane_tiles.setdefault(int(lane), []).append(tile_name)
+        return lane_tiles
+
+    lane_count = int(layout.get('LaneCount'))
+    surface_count = int(layout.get('SurfaceCount'))
+    swath_count = int(layout.get('SwathCount'))
+    tile_count = int(layout.get('TileCount'))
+    section_count = int(layout.get('SectionPerLane', '0'))
+    naming_convention = tile_set.get('TileNamingConvention') if tile_set is not None else None
+    five_digit = naming_convention == 'FiveDigit' or (naming_convention is None and section_count > 0)
+    for lane in range(1, lane_count + 1):
+        tile_names = []
+        for surface in range(1, surface_count + 1):
+            for swath in range(1, swath_count + 1):
+                for section in range(1, max(section_count, 1) + 1):
+                    for tile in range(1, tile_count + 1):
+                        if five_digit:
+                            tile_names.append('%d%d%d%02d' % (surface, swath, section, tile))
+                        else:
+                            tile_names.append('%d%d%02d' % (surface, swath, tile))
+                    if not five_digit:
+                        break
+        lane_tiles[lane] = tile_names
+    return lane_tiles
+
+
+def read_run_info_tiles(run_dir):
+    tree = ET.parse(os.path.join(run_dir, 'RunInfo.xml'))
+    layout = tree.getroot().find('Run/FlowcellLayout')
+    if layout is None:
+        raise ValueError('RunInfo.xml in \'%s\' has no FlowcellLayout element.' % run_dir)
+    return get_layout_tiles(layout)
+
+
+def make_tile_groups(lane_tiles, num_groups):
+    """
+    Divide the tiles of each lane into at most num_groups groups of
+    whole swaths.
+    Returns:
+        list of dict: tile groups
+    """
+    tile_groups = []
+    for lane in sorted(lane_tiles):
+        swaths = []
+        swath_tiles = {}
+        for tile_name in lane_tiles[lane]:
+            swath = tile_name[:-2]
+            if swath not in swath_tiles:
+                swaths.append(swath)
+                swath_tiles[swath] = 0
+            swath_tiles[swath] += 1
+        lane_groups = min(num_groups, len(swaths))
+        total_tiles = len(lane_tiles[lane])
+        groups = [[] for i in range(lane_groups)]
+        tiles_assigned = 0
+        for swath in swaths:
+            group = min(lane_groups - 1, tiles_assigned * lane_groups // total_tiles)
+            groups[group].append(swath)
+            tiles_assigned += swath_tiles[swath]
+        for group, group_swaths in enumerate([group_swaths for group_swaths in groups if group_swaths]):
+            tile_groups.append({'lane': lane,
+                                'group': group,
+                                'name': 'L%03d_tiles_%02d' % (lane, group),
+                                'num_tiles': sum([swath_tiles[swath] for swath in group_swaths]),
+                                'tiles': ','.join(['s_%d_%s[0-9][0-9]' % (lane, swath) for swath in group_swaths])})
+    return tile_groups
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='A program to divide the tiles of each lane of an Illumina run into bcl2fastq --tiles groups.')
+    parser.add_argument('run_dir', help='Illumina run directory with the RunInfo.xml file.')
+    parser.add_argument('--groups', type=int, required=True, help='Maximum number of tile groups in each lane.')
+    args = parser.parse_args()
+
+    if args.groups < 1:
+        raise ValueError('The number of tile groups must be a positive integer, but %d found.' % args.groups)
+    # JsonSlurper.parseText() in main.nf reads the output so do not indent it.
+    json.dump(make_tile_groups(read_run_info_tiles(args.run_dir), args.groups), sys.stdout)
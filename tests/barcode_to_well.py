@@ -161,7 +161,9 @@ def get_pcr_plate_dict(p5_pcr_plate, p7_pcr_plate, zero_pad_col=True):
                 row_col_string = '-row%s-col%s' % (p7_plate_map[k_p7], p5_plate_map[k_p5])
                 row_col_layout_mapping_final[k] = '%s%s' % (v, row_col_string)
 
-            full_layout_mapping = merge_dicts(full_layout_mapping, row_col_layout_mapping_final)
+            # Update in place: merging into a copy for each block is
+            # quadratic in the number of wells.
+            full_layout_mapping.update(row_col_layout_mapping_final)
         
     return full_layout_mapping
 